@@ -0,0 +1,215 @@
+import json
+import time
+import asyncio
+import threading
+from pathlib import Path
+from datetime import datetime
+
+import pipeline_settings
+
+'''
+Адаптивный предел одновременных запросов (AIMD) на пару (провайдер, ключ).
+Этапы запускают до max воркеров на ключ, а сколько запросов реально уходит одновременно,
+решает предел ключа:
+    - успешный ответ без роста задержки - аддитивное увеличение: +increase за "окно"
+      (за каждые limit успешных ответов), как в TCP congestion avoidance;
+    - 429, таймаут или перегрузка (503) - мультипликативное уменьшение: limit * decrease_ratio.
+      Запросы, ушедшие до последнего уменьшения, предел повторно не режут;
+    - задержка выше latency_tolerance x средней задержки ключа - предел не растет.
+Так каждый этап сам приходит к наибольшей безопасной параллельности ключа.
+
+Предел общий для процесса: воркеры общего цикла событий и синхронных этапов в своих
+asyncio.run() делят слоты одного ключа (ожидающие будятся в своем цикле событий).
+
+Метрики: каждое изменение предела дописывается строкой в concurrency_metrics_dir/YYYY-MM-DD.jsonl
+(время, ключ, предел, запросов в полете, причина), текущие значения - concurrency_snapshot(),
+спаны llm.* получают атрибуты concurrency_limit и in_flight.
+
+Настройки в pipeline_config.json:
+    "concurrency_limits": {"default": {"initial": 2, "min": 1, "max": 8},
+                           "grok": {"max": 16}}          - запись провайдера дополняет default
+    "concurrency_increase": 1
+    "concurrency_decrease_ratio": 0.5
+    "concurrency_latency_tolerance": 2.0
+    "concurrency_metrics_dir": "metrics/concurrency"     - пустая строка отключает запись изменений
+'''
+
+DEFAULT_SETTINGS = {
+    'concurrency_limits': {'default': {'initial': 2, 'min': 1, 'max': 8}},
+    'concurrency_increase': 1,
+    'concurrency_decrease_ratio': 0.5,
+    'concurrency_latency_tolerance': 2.0,
+    'concurrency_metrics_dir': 'metrics/concurrency',
+}
+DEFAULT_LIMITS = {'initial': 2, 'min': 1, 'max': 8}
+LATENCY_EWMA_ALPHA = 0.1
+OVERLOAD_ERRORS = ('DeadlineExceeded', 'ServiceUnavailable', 'APITimeoutError', 'ReadTimeout', 'ConnectTimeout',
+                   'TimeoutException', 'TimeoutError')
+
+_limiters = {}
+_registry_lock = threading.Lock()
+_metrics_lock = threading.Lock()
+
+
+def load_settings() -> dict:
+    return pipeline_settings.load_settings(DEFAULT_SETTINGS)
+
+
+def provider_limits(provider: str) -> dict:
+    configured = load_settings()['concurrency_limits']
+    return {**DEFAULT_LIMITS, **configured.get('default', {}), **configured.get(provider, {})}
+
+
+def max_in_flight(provider: str) -> int:
+    """Верхний предел ключа провайдера: столько воркеров на ключ имеет смысл запускать."""
+    return int(provider_limits(provider)['max'])
+
+
+def is_overloaded(error: BaseException) -> bool:
+    """Таймаут или 503: сервис не справляется, параллельность надо снижать."""
+    if isinstance(error, (asyncio.TimeoutError, TimeoutError)) or type(error).__name__ in OVERLOAD_ERRORS:
+        return True
+    response = getattr(error, 'response', None)
+    return 503 in (getattr(error, 'code', None), getattr(error, 'status_code', None),
+                   getattr(response, 'status_code', None))
+
+
+def _write_metric(record: dict):
+    directory = load_settings()['concurrency_metrics_dir']
+    if not directory:
+        return
+    path = Path(directory) / f"{datetime.now().strftime('%Y-%m-%d')}.jsonl"
+    line = json.dumps(record, ensure_ascii=False)
+    try:
+        with _metrics_lock:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            with open(path, 'a', encoding='utf-8') as f:
+                f.write(line + "\n")
+    except OSError as e:
+        print(f"     [WARNING] Не удалось записать метрику параллельности: {e}")
+
+
+class AdaptiveLimiter:
+    """Слоты одного ключа с AIMD-пределом. Безопасен для нескольких потоков и циклов событий."""
+
+    def __init__(self, name: str, limits: dict, settings: dict):
+        self.name = name
+        self.min_limit = max(1, limits['min'])
+        self.max_limit = max(self.min_limit, limits['max'])
+        self.limit = float(min(max(limits['initial'], self.min_limit), self.max_limit))
+        self.increase = settings['concurrency_increase']
+        self.decrease_ratio = settings['concurrency_decrease_ratio']
+        self.latency_tolerance = settings['concurrency_latency_tolerance']
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.latency_ewma = None
+        self.last_decrease_at = 0.0
+        self.increases = 0
+        self.decreases = 0
+        self._waiters = []
+        self._lock = threading.Lock()
+
+    # --- Слоты ---
+
+    async def acquire(self) -> float:
+        """Занимает слот (ждет, если все заняты). Возвращает момент старта для release()."""
+        loop = asyncio.get_running_loop()
+        while True:
+            with self._lock:
+                if self.in_flight < int(self.limit):
+                    self.in_flight += 1
+                    self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+                    return time.monotonic()
+                waiter = loop.create_future()
+                self._waiters.append((loop, waiter))
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                with self._lock:
+                    if (loop, waiter) in self._waiters:
+                        self._waiters.remove((loop, waiter))
+                    else:
+                        self._wake()  # пробуждение уже было выдано этой задаче - передаем его следующей
+                raise
+
+    def _wake(self):
+        """
+        Будит столько ожидающих, сколько освободилось слотов (под self._lock).
+        Отмененные (future уже done) пропускаются, не расходуя слот: иначе слот простаивал бы
+        при живых ожидающих.
+        """
+        free = int(self.limit) - self.in_flight
+        while free > 0 and self._waiters:
+            loop, waiter = self._waiters.pop(0)
+            if waiter.done():
+                continue
+            try:
+                loop.call_soon_threadsafe(_resolve, waiter)
+            except RuntimeError:
+                continue  # цикл ожидающего уже закрыт
+            free -= 1
+
+    def release(self, started_at: float, outcome: str):
+        """
+        Освобождает слот и корректирует предел.
+        outcome: 'ok' - ответ получен, 'overload' - 429/таймаут/503, 'error' - прочая ошибка (предел не меняется).
+        """
+        latency = time.monotonic() - started_at
+        change = None
+        with self._lock:
+            self.in_flight -= 1
+            previous = self.limit
+            if outcome == 'overload':
+                # Запросы, ушедшие до последнего уменьшения, уже учтены в нем
+                if started_at >= self.last_decrease_at:
+                    self.limit = max(self.min_limit, self.limit * self.decrease_ratio)
+                    self.last_decrease_at = time.monotonic()
+                    self.decreases += 1
+                    change = 'decrease'
+            elif outcome == 'ok':
+                stable = self.latency_ewma is None or latency <= self.latency_ewma * self.latency_tolerance
+                self.latency_ewma = latency if self.latency_ewma is None else \
+                    self.latency_ewma + LATENCY_EWMA_ALPHA * (latency - self.latency_ewma)
+                # Рост только если слоты действительно заняты: иначе предел раздувается без проверки
+                if stable and self.in_flight + 1 >= int(self.limit) and self.limit < self.max_limit:
+                    self.limit = min(self.max_limit, self.limit + self.increase / self.limit)
+                    if int(self.limit) > int(previous):
+                        self.increases += 1
+                        change = 'increase'
+            self._wake()
+            limit, in_flight = self.limit, self.in_flight
+        if change:
+            _write_metric({'ts': datetime.now().isoformat(timespec='milliseconds'), 'limiter': self.name,
+                           'limit': int(limit), 'previous': int(previous), 'in_flight': in_flight,
+                           'reason': change, 'latency_ms': round(latency * 1000)})
+            if change == 'decrease':
+                print(f"     [WARNING] [{self.name}] Перегрузка: параллельность {int(previous)} -> {int(limit)}")
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {'limit': int(self.limit), 'in_flight': self.in_flight, 'peak_in_flight': self.peak_in_flight,
+                    'increases': self.increases, 'decreases': self.decreases,
+                    'latency_ewma_ms': round(self.latency_ewma * 1000) if self.latency_ewma is not None else None}
+
+
+def _resolve(waiter: asyncio.Future):
+    if not waiter.done():
+        waiter.set_result(None)
+
+
+def key_concurrency(provider: str, api_key: str | None) -> AdaptiveLimiter:
+    """Предел пары (провайдер, ключ), один на процесс."""
+    with _registry_lock:
+        limiter = _limiters.get((provider, api_key))
+        if limiter is None:
+            name = f"{provider} ...{api_key[-4:]}" if api_key else provider
+            limiter = AdaptiveLimiter(name, provider_limits(provider), load_settings())
+            _limiters[(provider, api_key)] = limiter
+        return limiter
+
+
+def concurrency_snapshot() -> dict:
+    """Текущие пределы и пики по ключам: {имя: {...}}."""
+    with _registry_lock:
+        limiters = list(_limiters.values())
+    return {limiter.name: limiter.snapshot() for limiter in limiters}
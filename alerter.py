@@ -1,28 +1,29 @@
 import os
-import requests
 from dotenv import load_dotenv
 
-load_dotenv()
-
-BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
-ADMIN_ID = os.getenv("ADMIN_TELEGRAM_ID")
-
 """
 Модуль для отправки экстренных уведомлений администратору проекта в Telegram.
+Ключи из .env и requests загружаются при отправке, а не при импорте: модуль импортируют
+почти все этапы, и импорт не должен замедлять старт конвейера.
 """
 
 def send_admin_alert(message: str):
     """Отправляет уведомление об ошибке администратору."""
-    if not BOT_TOKEN or not ADMIN_ID:
+    import requests
+
+    load_dotenv()
+    bot_token = os.getenv("TELEGRAM_BOT_TOKEN")
+    admin_id = os.getenv("ADMIN_TELEGRAM_ID")
+    if not bot_token or not admin_id:
         print("ПРЕДУПРЕЖДЕНИЕ: Не могу отправить алерт. BOT_TOKEN или ADMIN_ID не найдены в .env")
         return
 
     # Формируем URL для запроса к Telegram Bot API
-    url = f"https://api.telegram.org/bot{BOT_TOKEN}/sendMessage"
+    url = f"https://api.telegram.org/bot{bot_token}/sendMessage"
 
     # Формируем данные для отправки
     payload = {
-        'chat_id': ADMIN_ID,
+        'chat_id': admin_id,
         'text': message,
         'parse_mode': 'Markdown'
     }
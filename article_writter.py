@@ -1,19 +1,19 @@
 import os
 import asyncio
 from pathlib import Path
-from typing import Dict, Any, List
+from typing import Dict, Any, Callable, List
 from collections import defaultdict
 
-# Импорты для разных AI клиентов
-import google.generativeai as genai
-from openai import AsyncOpenAI  # Используем асинхронный клиент
 from dotenv import load_dotenv
 
-from database_manager import (
-    get_generation_tasks,
-    save_generated_article,
-    update_topic_status
-)
+import async_db
+from database_manager import save_generated_articles_many
+from write_buffer import WriteBehindBuffer, WriteBufferError
+from provider_clients import provider_session
+from llm_gateway import generate
+from adaptive_concurrency import max_in_flight
+from key_pool import NoHealthyKeyError, available_keys, key_worker, run_key_workers
+from tracing import traced
 
 '''
 Модуль асинхронной генерации статей.
@@ -25,40 +25,30 @@ from database_manager import (
 PROMPT_FILE = os.path.join('Prompts', 'article_writer_prompt.txt')
 ENV_FILE = '.env'
 
-# Ключи для асинхронных воркеров
+# Ключи для асинхронных воркеров: по воркеру на каждый найденный ключ
 API_KEYS = {
     "gemini": ["GEMINI_API_KEY_5", "GEMINI_API_KEY_6", "GEMINI_API_KEY_11"],
     "grok": ["GROK_API_KEY"],
     "openai": ["OPENAI_API_KEY"]
 }
+MODELS = {'gemini': 'gemini-2.5-pro', 'grok': 'grok-3', 'openai': 'gpt-4.1-mini-2025-04-14'}
 
 
-# --- "Фабрика" AI клиентов и генераторов ---
-
-async def generate_with_gemini(api_key: str, model_name: str, user_prompt: str) -> str:
-    """Асинхронный вызов Gemini."""
-    genai.configure(api_key=api_key)
-    model = genai.GenerativeModel(model_name)
-    response = await model.generate_content_async(user_prompt)
-    return response.text
-
+# --- Асинхронная логика ---
 
-async def generate_with_openai_compatible(client: AsyncOpenAI, model_name: str, user_prompt: str) -> str:
-    """Асинхронный вызов для OpenAI-совместимых API (Grok, OpenAI)."""
-    completion = await client.chat.completions.create(
-        model=model_name,
-        messages=[
-            {"role": "user", "content": user_prompt},
-        ],
-    )
-    return completion.choices[0].message.content
+def save_articles_batch(batch: List[Dict]) -> Dict[int, int]:
+    """
+    Сбрасывает пачку статей из буфера: сохраняет их и переводит темы в 'article_generated'.
+    Возвращает {topic_id: generated_article_id} сохраненных статей.
+    """
+    return save_generated_articles_many(batch, raise_errors=True)
 
 
-# --- Асинхронная логика ---
-
-async def generate_single_article(task: Dict[str, Any], prompt_template: str, client: Any):
+async def generate_single_article(task: Dict[str, Any], prompt_template: str, api_key: str,
+                                  buffer: WriteBehindBuffer):
     """
-    Асинхронно генерирует и сохраняет одну статью, используя предоставленный AI клиент.
+    Асинхронно генерирует одну статью у провайдера темы с ключом воркера
+    и отправляет ее в буфер записи.
     """
     topic_id = task['topic_id']
     provider = task['provider_name']
@@ -68,103 +58,95 @@ async def generate_single_article(task: Dict[str, Any], prompt_template: str, cl
     full_user_prompt = f"{prompt_template}\n\nWrite an in-depth, 700-1000 word article on a topic: '{task['title']}'\n\nBase your article on the following news summary:\n{task['source_news_text']}"
 
     try:
-        # 2. Вызываем нужный AI
-        generated_content = ""
-        if provider == 'gemini':
-            # Для Gemini мы передаем ключ напрямую
-            generated_content = await generate_with_gemini(
-                api_key=client,  # ИСПРАВЛЕНИЕ: client здесь - это и есть api_key
-                model_name="gemini-2.5-pro",
-                user_prompt=full_user_prompt
-            )
-        elif provider in ['grok', 'openai']:
-            model_map = {'grok': 'grok-3', 'openai': 'gpt-4.1-mini-2025-04-14'}
-            generated_content = await generate_with_openai_compatible(
-                client=client, model_name=model_map[provider],
-                user_prompt=full_user_prompt
-            )
-        else:
+        # 2. Вызываем нужный AI (клиент ключа берется из реестра)
+        if provider not in MODELS:
             raise ValueError(f"Неизвестный провайдер: {provider}")
+        generated_content = await generate(provider, MODELS[provider], full_user_prompt,
+                                           api_key=api_key, stage='article_writer', topic_id=topic_id)
 
-        # 3. Сохраняем результат в БД
+        # 3. Отправляем результат в буфер записи (статья и смена статуса темы - одной транзакцией)
         if generated_content:
-            save_generated_article(
-                topic_id=topic_id, user_id=task['assigned_user_id'],
-                persona_id=task['assigned_persona_id'], title=task['title'],
-                content=generated_content
-            )
-            update_topic_status(topic_id, 'article_generated')
-            print(f"     [SUCCESS] Статья для темы ID {topic_id} ({provider}) сгенерирована и сохранена.")
+            await buffer.put({
+                'topic_id': topic_id, 'user_id': task['assigned_user_id'],
+                'persona_id': task['assigned_persona_id'], 'title': task['title'],
+                'content': generated_content
+            })
+            print(f"     [SUCCESS] Статья для темы ID {topic_id} ({provider}) сгенерирована.")
         else:
             raise ValueError("AI вернул пустой ответ.")
 
+    except NoHealthyKeyError:
+        raise  # ключ исчерпал квоту - тема не провалена, ее возьмет воркер другого ключа
     except Exception as e:
         print(f"     [ERROR] Ошибка при генерации статьи для темы ID {topic_id}: {e}")
-        update_topic_status(topic_id, 'article_generation_failed')
+        await async_db.update_topic_status(topic_id, 'article_generation_failed')
 
 
 # --- Главная функция ---
 
-async def async_run_writer(tasks: List[Dict], prompt_template: str):
-    """Управляет асинхронным выполнением задач по генерации статей."""
+async def async_run_writer(tasks: List[Dict], prompt_template: str, on_saved: Callable | None = None):
+    """
+    Управляет асинхронным выполнением задач по генерации статей.
+    on_saved(пачка, {topic_id: article_id}) - корутина, вызывается после коммита каждой пачки статей.
+    """
     load_dotenv(ENV_FILE)
 
     tasks_by_provider = defaultdict(list)
     for task in tasks:
         tasks_by_provider[task['provider_name']].append(task)
 
-    all_workers = []
+    workers_by_provider = {}
+    queues = {}
+    buffer = WriteBehindBuffer('article_writer', save_articles_batch, on_flushed=on_saved)
 
     # --- Создаем воркеров для каждого провайдера ---
-    provider_clients = {}
-    # Инициализируем клиентов для OpenAI и Grok
-    grok_key = os.getenv(API_KEYS['grok'][0])
-    if grok_key:
-        provider_clients['grok'] = AsyncOpenAI(api_key=grok_key, base_url="https://api.x.ai/v1")
-
-    openai_key = os.getenv(API_KEYS['openai'][0])
-    if openai_key:
-        provider_clients['openai'] = AsyncOpenAI(api_key=openai_key)
-
-    async def worker(worker_id: int, provider: str, task_queue: asyncio.Queue, api_key: str = None):
-        client = provider_clients.get(provider)  # Используем уже созданный клиент
-        while not task_queue.empty():
+    def worker(worker_id: str, provider: str, task_queue: asyncio.Queue, buffer: WriteBehindBuffer,
+               api_key: str):
+        async def process(task: Dict[str, Any]):
             try:
-                task = task_queue.get_nowait()
                 print(f"     [{provider.capitalize()} Worker {worker_id}] Взял в работу тему ID: {task['topic_id']}...")
-                # Для Gemini передаем ключ, для остальных - готовый клиент
-                await generate_single_article(task, prompt_template, client or api_key)
-            except asyncio.QueueEmpty:
-                break
+                await generate_single_article(task, prompt_template, api_key, buffer)
+            except NoHealthyKeyError:
+                raise  # тему вернет в очередь key_worker
             except Exception as e:
                 print(f"     [CRITICAL_WORKER_ERROR] Worker {worker_id} ({provider}) упал: {e}")
+        return key_worker(f"{provider.capitalize()} {worker_id}", task_queue, process)
 
     # Запускаем воркеров
     for provider, provider_tasks in tasks_by_provider.items():
         keys = [os.getenv(key_name) for key_name in API_KEYS.get(provider, []) if os.getenv(key_name)]
-        if not keys and provider not in provider_clients:
-            print(
-                f"     [WARNING] Нет ключей или клиентов для провайдера {provider}. Пропускаем {len(provider_tasks)} задач.")
+        keys = available_keys(provider, MODELS.get(provider, ''), keys)  # без исчерпанных за день
+        if not keys:
+            print(f"     [WARNING] Нет ключей для провайдера {provider}. Пропускаем {len(provider_tasks)} задач.")
             continue
 
-        task_queue = asyncio.Queue()
+        task_queue = queues[provider] = asyncio.Queue()
         for task in provider_tasks:
             await task_queue.put(task)
 
-        # Для Gemini и других, у кого может быть много ключей
-        for i, key in enumerate(keys):
-            all_workers.append(worker(i + 1, provider, task_queue, api_key=key))
-
-        # Для OpenAI/Grok, где клиент один
-        if provider in provider_clients and not keys:
-            all_workers.append(worker(1, provider, task_queue))
-
-    if all_workers:
-        await asyncio.gather(*all_workers)
-
-
-def run_article_writer() -> bool:
-    """Основная синхронная обертка для запуска модуля."""
+        # На ключ - до max_in_flight воркеров; одновременных запросов - по адаптивному пределу ключа
+        workers_by_provider[provider] = [
+            worker(f"{i + 1}.{slot + 1}", provider, task_queue, buffer, api_key=key)
+            for i, key in enumerate(keys) for slot in range(max_in_flight(provider))
+        ]
+
+    if not workers_by_provider:
+        return
+    async with buffer:
+        left_by_provider = await asyncio.gather(*(run_key_workers(queues[provider], workers)
+                                                  for provider, workers in workers_by_provider.items()))
+    for provider, left in zip(workers_by_provider, left_by_provider):
+        if left:
+            print(f"     [WARNING] Нет доступных ключей {provider}: {len(left)} тем остались "
+                  f"в 'planned_for_generation' до следующего запуска.")
+
+
+@traced()
+async def run_article_writer_async(on_saved: Callable | None = None) -> bool:
+    """
+    Этап целиком в текущем цикле событий (общий асинхронный режим daily_pipeline).
+    on_saved - см. async_run_writer (потоковая передача статей в content_stream.py).
+    """
     print("  -> Запуск article_writer.py...")
 
     try:
@@ -173,19 +155,29 @@ def run_article_writer() -> bool:
         print(f"     [ERROR] Файл с промптом {PROMPT_FILE} не найден.")
         return False
 
-    tasks = get_generation_tasks()
+    tasks = await async_db.get_generation_tasks()
     if not tasks:
         print("     [INFO] Нет задач на генерацию статей.")
         return True
 
     print(f"     Найдено {len(tasks)} статей для генерации. Запуск...")
 
-    asyncio.run(async_run_writer(tasks, prompt_template))
+    try:
+        async with provider_session():
+            await async_run_writer(tasks, prompt_template, on_saved)
+    except WriteBufferError as e:
+        print(f"     [DB_ERROR] Статьи не сохранены: {e}")
+        return False
 
     print("     Генерация статей завершена.")
     return True
 
 
+def run_article_writer() -> bool:
+    """Основная синхронная обертка для запуска модуля: свой цикл событий и свои клиенты."""
+    return asyncio.run(run_article_writer_async())
+
+
 if __name__ == '__main__':
     if run_article_writer():
         print("\n--- Модуль Article Writer успешно завершил работу ---")
@@ -0,0 +1,68 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+import database_manager
+from tracing import run_in_context
+
+'''
+Асинхронный фасад над database_manager для асинхронных этапов конвейера.
+Все обращения к SQLite выполняются в одном выделенном потоке с очередью запросов,
+поэтому коммит или медленный запрос не останавливает цикл событий и параллельные запросы к LLM.
+
+Использование:
+    import async_db
+    tasks = await async_db.get_generation_tasks()
+'''
+
+# Один поток: запросы выполняются строго по очереди, как и запись в SQLite.
+# Пул не привязан к циклу событий и переживает несколько вызовов asyncio.run().
+_DB_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix='neuro-db')
+
+
+async def run_in_db_thread(func, *args, **kwargs):
+    """
+    Выполняет синхронную функцию работы с БД в потоке БД и возвращает ее результат.
+    Контекст вызывающей задачи переносится в поток, чтобы спаны БД попали в ее трассу.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_DB_EXECUTOR, run_in_context(functools.partial(func, *args, **kwargs)))
+
+
+def _awaitable(func):
+    """Делает из синхронного хелпера database_manager его awaitable-версию с тем же именем и сигнатурой."""
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await run_in_db_thread(func, *args, **kwargs)
+    return wrapper
+
+
+# --- Этап генерации статей ---
+get_generation_tasks = _awaitable(database_manager.get_generation_tasks)
+save_generated_article = _awaitable(database_manager.save_generated_article)
+save_generated_articles_many = _awaitable(database_manager.save_generated_articles_many)
+
+# --- Темы ---
+get_topics_by_status = _awaitable(database_manager.get_topics_by_status)
+get_last_published_titles = _awaitable(database_manager.get_last_published_titles)
+update_topic_with_title = _awaitable(database_manager.update_topic_with_title)
+update_topic_status = _awaitable(database_manager.update_topic_status)
+transition_topics = _awaitable(database_manager.transition_topics)
+
+# --- Персоны ---
+get_all_personas = _awaitable(database_manager.get_all_personas)
+update_persona_image_style = _awaitable(database_manager.update_persona_image_style)
+
+# --- Изображения и токены ---
+get_image_generation_tasks = _awaitable(database_manager.get_image_generation_tasks)
+update_article_image_path = _awaitable(database_manager.update_article_image_path)
+set_image_paths_many = _awaitable(database_manager.set_image_paths_many)
+set_article_tokens_many = _awaitable(database_manager.set_article_tokens_many)
+
+# --- Полнотекстовый поиск ---
+search_articles = _awaitable(database_manager.search_articles)
+search_topics = _awaitable(database_manager.search_topics)
+find_covered_topics = _awaitable(database_manager.find_covered_topics)
+
+# --- Доставка ---
+get_articles_for_delivery = _awaitable(database_manager.get_articles_for_delivery)
@@ -0,0 +1,239 @@
+import json
+import argparse
+import importlib
+import contextlib
+import multiprocessing
+from pathlib import Path
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from concurrent.futures import ProcessPoolExecutor
+
+from tracing import span, current_trace_context, continue_trace
+from pipeline_dag import (Stage, StageRun, OK, FAILED, DONE, WARN, STATUS_ICONS, run_stage_graph,
+                          print_run_summary)
+from database_manager import start_pipeline_run, get_completed_stages, record_stage_run, finish_pipeline_run
+
+'''
+Догрузка пропущенных дней (backfill): этапы, зависящие только от целевой даты
+(news_summarizer -> topic_categorizer -> topic_rebalancer), выполняются для диапазона дат
+параллельно в пуле процессов.
+
+Ограничения API-ключей общие для всех процессов: этапы, которые используют один и тот же ключ
+(имена ключей берутся из конфигов этапов), выстраиваются в цепочку зависимостей - одновременно
+ключом пользуются не больше "backfill_per_key_concurrency" этапов (по умолчанию 1), поэтому
+паузы между запросами внутри модулей продолжают соблюдать лимиты ключа.
+topic_rebalancer выполняется строго по порядку дат: сверка с уже освещенными сюжетами
+должна видеть темы предыдущих дней.
+
+Запись в БД: каждый процесс открывает свой пул соединений, конкурентную запись разводит
+WAL-журнал SQLite и busy_timeout (database_config.json); повтор темы отсекается по topics.source_key.
+Результаты этапов записываются в чекпоинты прогона за дату (stage_runs), поэтому
+daily_pipeline --resume --date D потом не повторяет уже догруженные этапы.
+Вывод каждого этапа пишется в backfill_logs/<дата>_<этап>.log.
+
+Запуск:
+    python backfill.py --from 2025-07-01 --to 2025-07-05
+    python backfill.py --from 2025-07-01 --processes 4 --resume
+    python backfill.py --from 2025-07-01 --to 2025-07-03 --stages topic_rebalancer
+'''
+
+PIPELINE_CONFIG_FILE = 'pipeline_config.json'
+LOG_DIR = 'backfill_logs'
+DEFAULT_PROCESSES = 3
+DEFAULT_PER_KEY_CONCURRENCY = 1
+
+# Этапы за дату в порядке выполнения: (имя в stage_runs, модуль, функция, конфиг с именами ключей, по порядку дат)
+DATE_STAGES = [
+    ('news_summarizer', 'news_summarizer', 'run_news_summarizer', 'summarizer_config.json', False),
+    ('topic_categorizer', 'topic_categorizer', 'run_topic_categorizer', 'topic_categorizer_config.json', False),
+    ('topic_rebalancer', 'topic_rebalancer', 'run_topic_rebalancer', 'rebalancer_config.json', True),
+]
+
+
+def load_pipeline_config() -> dict:
+    try:
+        with open(PIPELINE_CONFIG_FILE, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError) as e:
+        print(f"     [WARNING] Не удалось прочитать {PIPELINE_CONFIG_FILE}: {e}. Используются значения по умолчанию.")
+        return {}
+
+
+def load_api_key_names(config_path: str) -> list[str]:
+    """Имена API-ключей, которыми пользуется этап (поле api_key_names или gemini_api_key_name)."""
+    try:
+        with open(config_path, 'r', encoding='utf-8') as f:
+            config = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError) as e:
+        print(f"     [WARNING] Не удалось прочитать {config_path}: {e}. Ключи этапа неизвестны.")
+        return []
+    if config.get('api_key_names'):
+        return list(config['api_key_names'])
+    return [config['gemini_api_key_name']] if config.get('gemini_api_key_name') else []
+
+
+def date_range(start: str, end: str) -> list[str]:
+    first = datetime.strptime(start, '%Y-%m-%d').date()
+    last = datetime.strptime(end, '%Y-%m-%d').date()
+    return [(first + timedelta(days=offset)).strftime('%Y-%m-%d') for offset in range((last - first).days + 1)]
+
+
+def run_stage_for_date(module_name: str, func_name: str, target_date: str, trace_context: dict | None,
+                       log_path: str):
+    """Выполняется в процессе пула: запускает этап за дату, вывод этапа пишется в его лог-файл."""
+    with open(log_path, 'w', encoding='utf-8') as log, contextlib.redirect_stdout(log), \
+            continue_trace(trace_context):
+        module = importlib.import_module(module_name)
+        return getattr(module, func_name)(target_date)
+
+
+def build_backfill_stages(dates: list[str], stage_defs: list[tuple], pool: ProcessPoolExecutor, runs: dict,
+                          per_key_concurrency: int) -> list[Stage]:
+    """
+    Граф этапов backfill. Зависимости трех видов: предыдущий этап той же даты (данные),
+    тот же этап предыдущей даты (для этапов "по порядку дат") и предыдущие пользователи
+    тех же API-ключей (не больше per_key_concurrency этапов на ключ одновременно).
+    """
+    key_names = {name: load_api_key_names(config_path) for name, _, _, config_path, _ in stage_defs}
+    key_users = defaultdict(list)
+    last_by_stage = {}
+    stages = []
+
+    for target_date in dates:
+        previous = None
+        for name, module_name, func_name, _, ordered in stage_defs:
+            stage_name = f"{name}@{target_date}"
+            depends_on = [previous] if previous else []
+            if ordered and name in last_by_stage:
+                depends_on.append(last_by_stage[name])
+            for key in key_names[name]:
+                users = key_users[key]
+                if len(users) >= per_key_concurrency:
+                    depends_on.append(users[-per_key_concurrency])
+                users.append(stage_name)
+
+            job = make_stage_job(pool, module_name, func_name, target_date, previous, runs,
+                                 log_path=str(Path(LOG_DIR) / f"{target_date}_{name}.log"))
+            # WARN: сбой одной даты не останавливает остальные, этапы этой даты пропускаются внутри job
+            stages.append(Stage(stage_name, job, depends_on=tuple(dict.fromkeys(depends_on)), policy=WARN))
+            last_by_stage[name] = stage_name
+            previous = stage_name
+    return stages
+
+
+def make_stage_job(pool: ProcessPoolExecutor, module_name: str, func_name: str, target_date: str,
+                   data_dependency: str | None, runs: dict, log_path: str):
+    def job():
+        # Зависимость по ключу могла завершиться со сбоем - это не мешает, а сбой этапа-источника данных мешает
+        if data_dependency and runs[data_dependency].status not in (OK, DONE):
+            return False, f"пропущен: {data_dependency} не выполнен"
+        future = pool.submit(run_stage_for_date, module_name, func_name, target_date,
+                             current_trace_context(), log_path)
+        return future.result()
+    return job
+
+
+def make_checkpoint_recorder(run_ids: dict):
+    """Сохраняет результат этапа в чекпоинты прогона за его дату."""
+    def record(run: StageRun):
+        name, target_date = run.stage.name.split('@')
+        if not run_ids.get(target_date):
+            return
+        finished = datetime.now()
+        started = finished - timedelta(seconds=run.duration)
+        # Сбой пишется как failed, а не warning: иначе daily_pipeline --resume счел бы этап завершенным
+        record_stage_run(
+            run_ids[target_date], name, OK if run.status == OK else FAILED,
+            started.strftime('%Y-%m-%d %H:%M:%S'), finished.strftime('%Y-%m-%d %H:%M:%S'),
+            round(run.duration, 3), run.error
+        )
+    return record
+
+
+def print_dates_table(dates: list[str], stage_names: list[str], runs: dict):
+    print("\n  Итог по датам:")
+    print(f"     {'Дата':<12} " + " ".join(f"{name:<20}" for name in stage_names))
+    for target_date in dates:
+        cells = []
+        for name in stage_names:
+            run = runs[f"{name}@{target_date}"]
+            cells.append(f"{STATUS_ICONS[run.status]} {run.status:<17}")
+        print(f"     {target_date:<12} " + " ".join(cells))
+
+
+def run_backfill(start: str, end: str, processes: int | None = None, stage_names: list[str] | None = None,
+                 resume: bool = False) -> bool:
+    config = load_pipeline_config()
+    processes = processes or config.get('backfill_processes', DEFAULT_PROCESSES)
+    per_key_concurrency = max(1, config.get('backfill_per_key_concurrency', DEFAULT_PER_KEY_CONCURRENCY))
+    stage_defs = [stage_def for stage_def in DATE_STAGES if not stage_names or stage_def[0] in stage_names]
+    selected = [stage_def[0] for stage_def in stage_defs]
+    dates = date_range(start, end)
+
+    print("=" * 50)
+    print(f"🚀 BACKFILL {start} … {end}: {len(dates)} дн., этапы: {', '.join(selected)}")
+    print(f"⚙️ Процессов: {processes}, этапов на один API-ключ одновременно: {per_key_concurrency}")
+    print("=" * 50)
+
+    # resume=True у start_pipeline_run: чекпоинты остальных этапов ежедневного прогона не трогаем
+    run_ids = {target_date: start_pipeline_run(target_date, resume=True) for target_date in dates}
+    completed = {}
+    if resume:
+        for target_date, run_id in run_ids.items():
+            if run_id:
+                completed.update({f"{name}@{target_date}": result
+                                  for name, result in get_completed_stages(run_id).items() if name in selected})
+        print(f"↩️ Завершено ранее: {len(completed)} из {len(dates) * len(selected)} этапов.")
+
+    Path(LOG_DIR).mkdir(exist_ok=True)
+    runs = {}
+    # spawn: дочерний процесс не наследует открытые соединения SQLite и файлы трасс родителя
+    with span('backfill', kind='run', start=start, end=end, processes=processes, stages=selected) as run_span, \
+            ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context('spawn')) as pool:
+        stages = build_backfill_stages(dates, stage_defs, pool, runs, per_key_concurrency)
+        # Потоки графа только ждут результатов процессов, поэтому слотов столько же, сколько процессов
+        run_stage_graph(stages, max_parallel=processes, runs=runs, completed=completed,
+                        on_finish=make_checkpoint_recorder(run_ids))
+
+        succeeded = all(run.status in (OK, DONE) for run in runs.values())
+        if not succeeded:
+            run_span.fail("есть даты со сбоем")
+
+    for target_date, run_id in run_ids.items():
+        if run_id:
+            date_ok = all(runs[f"{name}@{target_date}"].status in (OK, DONE) for name in selected)
+            finish_pipeline_run(run_id, 'backfilled' if date_ok else 'failed')
+
+    print_run_summary(runs)
+    print_dates_table(dates, selected, runs)
+    print(f"\n  Логи этапов: {LOG_DIR}/<дата>_<этап>.log")
+    if not succeeded:
+        print(f"  Повторить только несделанное: python backfill.py --from {start} --to {end} --resume")
+    return succeeded
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Догрузка пропущенных дней по этапам, зависящим от даты.")
+    parser.add_argument('--from', dest='start', required=True, help="первая дата YYYY-MM-DD")
+    parser.add_argument('--to', dest='end', help="последняя дата YYYY-MM-DD включительно (по умолчанию - вчера)")
+    parser.add_argument('--processes', type=int, help="размер пула процессов (по умолчанию backfill_processes)")
+    parser.add_argument('--stages', help="этапы через запятую: " + ", ".join(d[0] for d in DATE_STAGES))
+    parser.add_argument('--resume', action='store_true', help="пропустить этапы, уже завершенные за эти даты")
+    args = parser.parse_args()
+
+    end = args.end or (date.today() - timedelta(days=1)).strftime('%Y-%m-%d')
+    for value in (args.start, end):
+        try:
+            datetime.strptime(value, '%Y-%m-%d')
+        except ValueError:
+            parser.error(f"Неверный формат даты: {value}, ожидается YYYY-MM-DD")
+    if args.start > end:
+        parser.error(f"Начало диапазона {args.start} позже конца {end}")
+    stage_names = [name.strip() for name in args.stages.split(',')] if args.stages else None
+    unknown = set(stage_names or []) - {d[0] for d in DATE_STAGES}
+    if unknown:
+        parser.error(f"Неизвестные этапы: {', '.join(sorted(unknown))}")
+    if args.processes is not None and args.processes < 1:
+        parser.error("--processes должен быть не меньше 1")
+
+    run_backfill(args.start, end, processes=args.processes, stage_names=stage_names, resume=args.resume)
@@ -6,6 +6,7 @@ from datetime import datetime, date
 from dotenv import load_dotenv
 
 from database_manager import get_db_connection
+from tracing import traced
 
 """
 Модуль для парсинга статей с образовательного портала Bybit.
@@ -97,6 +98,7 @@ def make_request(session, url, params, proxy=None):
 
 
 # --- Основная функция парсера ---
+@traced()
 def parse_bybit_articles() -> tuple[bool, str]:
     print("  -> Запуск bybit_parser.py...")
     session = requests.Session()
@@ -0,0 +1,321 @@
+import os
+import ssl
+import time
+import asyncio
+import argparse
+import tempfile
+import threading
+import subprocess
+import statistics
+
+'''
+Бенчмарк: сколько времени съедает установка соединений, когда каждый этап
+запускает свой asyncio.run() и создает клиентов заново, по сравнению с одним циклом
+событий и общими клиентами на весь прогон (асинхронный режим daily_pipeline).
+
+Сеть не нужна: локальный HTTPS-сервер (самоподписанный сертификат через openssl) стоит
+за прокси, который задерживает каждый пакет на половину RTT в каждую сторону. Поэтому
+TCP- и TLS-рукопожатия стоят реальных круговых задержек, как до API провайдеров.
+
+Режимы клиента:
+    per_call  - новое соединение на каждый запрос (genai.configure() и InferenceClient на каждый вызов);
+    per_stage - свой цикл событий и пул соединений на этап, keep-alive внутри этапа;
+    shared    - один цикл событий и один пул на все этапы.
+
+Отдельно замеряется создание самих SDK-клиентов (AsyncOpenAI, gRPC-клиент Gemini,
+InferenceClient) и цикла событий - если пакеты установлены.
+
+Запуск:
+    python client_benchmark.py
+    python client_benchmark.py --stages 7 --requests 40 --concurrency 3 --rtt-ms 80 --server-ms 20
+'''
+
+
+# --- Тестовый сервер ---
+
+def make_self_signed_cert(directory: str) -> tuple[str, str] | None:
+    cert_path = os.path.join(directory, 'cert.pem')
+    key_path = os.path.join(directory, 'key.pem')
+    try:
+        subprocess.run(
+            ['openssl', 'req', '-x509', '-newkey', 'ec', '-pkeyopt', 'ec_paramgen_curve:prime256v1',
+             '-nodes', '-keyout', key_path, '-out', cert_path, '-days', '1', '-subj', '/CN=localhost'],
+            check=True, capture_output=True
+        )
+    except (OSError, subprocess.CalledProcessError) as e:
+        print(f"     [WARNING] Не удалось создать сертификат через openssl ({e}). Замер без TLS.")
+        return None
+    return cert_path, key_path
+
+
+async def handle_http(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, server_delay: float):
+    """Минимальный HTTP/1.1 с keep-alive: на каждый запрос - ответ после server_delay."""
+    try:
+        while True:
+            head = await reader.readuntil(b'\r\n\r\n')
+            length = 0
+            for line in head.split(b'\r\n'):
+                if line.lower().startswith(b'content-length:'):
+                    length = int(line.split(b':', 1)[1])
+            if length:
+                await reader.readexactly(length)
+            await asyncio.sleep(server_delay)
+            body = b'{"ok": true}'
+            writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n'
+                         b'Content-Length: %d\r\n\r\n%s' % (len(body), body))
+            await writer.drain()
+    except (asyncio.IncompleteReadError, ConnectionError, ssl.SSLError):
+        pass
+    finally:
+        writer.close()
+
+
+async def pipe_with_delay(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, delay: float):
+    """Пересылает поток байтов, доставляя каждый кусок через delay секунд (порядок сохраняется)."""
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+
+    async def receive():
+        while True:
+            data = await reader.read(65536)
+            await queue.put((loop.time() + delay, data))
+            if not data:
+                return
+
+    receiver = asyncio.create_task(receive())
+    try:
+        while True:
+            due, data = await queue.get()
+            await asyncio.sleep(max(0.0, due - loop.time()))
+            if not data:
+                break
+            writer.write(data)
+            await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        receiver.cancel()
+        writer.close()
+
+
+class LatencyServer:
+    """HTTPS-сервер и прокси с задержкой в отдельном потоке со своим циклом событий."""
+
+    def __init__(self, rtt: float, server_delay: float, cert: tuple[str, str] | None):
+        self.rtt = rtt
+        self.server_delay = server_delay
+        self.cert = cert
+        self.port = None
+        self.connections = 0
+        self._servers = []
+        self._loop = asyncio.new_event_loop()
+        self._ready = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True, name='latency-server')
+
+    def _run(self):
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_until_complete(self._start())
+        self._ready.set()
+        self._loop.run_forever()
+
+    async def _start(self):
+        ssl_context = None
+        if self.cert:
+            ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            ssl_context.load_cert_chain(*self.cert)
+        backend = await asyncio.start_server(
+            lambda r, w: handle_http(r, w, self.server_delay), '127.0.0.1', 0, ssl=ssl_context)
+        backend_port = backend.sockets[0].getsockname()[1]
+
+        async def proxy(client_reader, client_writer):
+            self.connections += 1
+            await asyncio.sleep(self.rtt)  # SYN / SYN-ACK
+            upstream_reader, upstream_writer = await asyncio.open_connection('127.0.0.1', backend_port)
+            await asyncio.gather(
+                pipe_with_delay(client_reader, upstream_writer, self.rtt / 2),
+                pipe_with_delay(upstream_reader, client_writer, self.rtt / 2),
+            )
+
+        front = await asyncio.start_server(proxy, '127.0.0.1', 0)
+        self.port = front.sockets[0].getsockname()[1]
+        self._servers = [front, backend]
+
+    async def _shutdown(self):
+        for server in self._servers:
+            server.close()
+        tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def start(self):
+        self._thread.start()
+        self._ready.wait()
+        return self
+
+    def stop(self):
+        asyncio.run_coroutine_threadsafe(self._shutdown(), self._loop).result(timeout=10)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+
+
+# --- Клиент ---
+
+class ConnectionPool:
+    """Пул keep-alive соединений, как у httpx/gRPC-клиента SDK. Соединение открывается по требованию."""
+
+    def __init__(self, port: int, ssl_context: ssl.SSLContext | None, reuse: bool = True):
+        self.port = port
+        self.ssl_context = ssl_context
+        self.reuse = reuse
+        self._idle = []
+        self.handshake_times = []
+
+    async def _open(self):
+        start = time.perf_counter()
+        connection = await asyncio.open_connection(
+            '127.0.0.1', self.port, ssl=self.ssl_context,
+            server_hostname='localhost' if self.ssl_context else None)
+        self.handshake_times.append(time.perf_counter() - start)
+        return connection
+
+    async def request(self, payload: bytes = b'{"prompt": "..."}') -> bytes:
+        reader, writer = self._idle.pop() if self._idle else await self._open()
+        writer.write(b'POST /v1/generate HTTP/1.1\r\nHost: localhost\r\nContent-Type: application/json\r\n'
+                     b'Content-Length: %d\r\n\r\n%s' % (len(payload), payload))
+        await writer.drain()
+        head = await reader.readuntil(b'\r\n\r\n')
+        length = int(head.lower().split(b'content-length:', 1)[1].split(b'\r\n', 1)[0])
+        body = await reader.readexactly(length)
+        if self.reuse:
+            self._idle.append((reader, writer))
+        else:
+            writer.close()
+        return body
+
+    async def aclose(self):
+        for _, writer in self._idle:
+            writer.close()
+        self._idle.clear()
+
+
+async def run_stage(pool: ConnectionPool, requests: int, concurrency: int):
+    """Этап: requests запросов, не больше concurrency одновременно (по числу API-ключей)."""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with semaphore:
+            await pool.request()
+
+    await asyncio.gather(*(one() for _ in range(requests)))
+
+
+def run_mode(mode: str, port: int, ssl_context, stages: int, requests: int, concurrency: int) -> dict:
+    handshakes = []
+    start = time.perf_counter()
+
+    if mode == 'shared':
+        async def whole_run():
+            pool = ConnectionPool(port, ssl_context)
+            for _ in range(stages):
+                await run_stage(pool, requests, concurrency)
+            await pool.aclose()
+            handshakes.extend(pool.handshake_times)
+        asyncio.run(whole_run())
+    else:
+        async def one_stage():
+            pool = ConnectionPool(port, ssl_context, reuse=(mode == 'per_stage'))
+            await run_stage(pool, requests, concurrency)
+            await pool.aclose()
+            handshakes.extend(pool.handshake_times)
+        for _ in range(stages):
+            asyncio.run(one_stage())
+
+    return {
+        'mode': mode,
+        'total': time.perf_counter() - start,
+        'connections': len(handshakes),
+        'handshake_ms': statistics.mean(handshakes) * 1000 if handshakes else 0.0,
+        'handshake_total': sum(handshakes),
+    }
+
+
+# --- Создание SDK-клиентов ---
+
+def time_call(func, repeats: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeats):
+        func()
+    return (time.perf_counter() - start) / repeats * 1000
+
+
+def measure_client_construction(repeats: int = 20):
+    print("\n  Создание объектов (без сети), мс на штуку:")
+    print(f"     {'asyncio.run() пустой корутины':<40} {time_call(lambda: asyncio.run(asyncio.sleep(0)), repeats):8.2f}")
+
+    factories = []
+    try:
+        from openai import AsyncOpenAI
+        factories.append(('AsyncOpenAI', lambda: AsyncOpenAI(api_key='bench')))
+    except ImportError:
+        print("     [INFO] openai не установлен - пропускаем AsyncOpenAI.")
+    try:
+        from google.ai import generativelanguage as glm
+        from google.api_core.client_options import ClientOptions
+
+        async def make_gemini():
+            client = glm.GenerativeServiceAsyncClient(client_options=ClientOptions(api_key='bench'))
+            await client.transport.close()
+        factories.append(('GenerativeServiceAsyncClient', lambda: asyncio.run(make_gemini())))
+    except ImportError:
+        print("     [INFO] google-ai-generativelanguage не установлен - пропускаем клиент Gemini.")
+    try:
+        from huggingface_hub import InferenceClient
+        factories.append(('InferenceClient', lambda: InferenceClient(provider='hf-inference', api_key='bench')))
+    except ImportError:
+        print("     [INFO] huggingface_hub не установлен - пропускаем InferenceClient.")
+
+    for name, factory in factories:
+        print(f"     {name:<40} {time_call(factory, repeats):8.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк установки соединений: отдельные циклы событий против общего.")
+    parser.add_argument('--stages', type=int, default=7, help="число асинхронных этапов (вызовов asyncio.run)")
+    parser.add_argument('--requests', type=int, default=40, help="запросов к API на этап")
+    parser.add_argument('--concurrency', type=int, default=3, help="одновременных запросов (API-ключей)")
+    parser.add_argument('--rtt-ms', type=float, default=80, help="круговая задержка до API")
+    parser.add_argument('--server-ms', type=float, default=20, help="время ответа сервера")
+    parser.add_argument('--no-tls', action='store_true', help="замер без TLS")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        cert = None if args.no_tls else make_self_signed_cert(tmp)
+        ssl_context = ssl.create_default_context(cafile=cert[0]) if cert else None
+        server = LatencyServer(args.rtt_ms / 1000, args.server_ms / 1000, cert).start()
+
+        print(f"  Этапов: {args.stages}, запросов на этап: {args.requests}, параллельно: {args.concurrency}, "
+              f"RTT: {args.rtt_ms:.0f} мс, ответ сервера: {args.server_ms:.0f} мс, TLS: {'да' if cert else 'нет'}")
+        results = [run_mode(mode, server.port, ssl_context, args.stages, args.requests, args.concurrency)
+                   for mode in ('per_call', 'per_stage', 'shared')]
+        server.stop()
+
+    print(f"\n     {'Режим':<10} {'Всего, с':>9} {'Соединений':>11} {'Рукопожатие, мс':>16} {'На рукопожатия, с':>18}")
+    for r in results:
+        print(f"     {r['mode']:<10} {r['total']:9.2f} {r['connections']:11d} "
+              f"{r['handshake_ms']:16.1f} {r['handshake_total']:18.2f}")
+
+    by_mode = {r['mode']: r for r in results}
+    shared = by_mode['shared']
+    for mode in ('per_call', 'per_stage'):
+        saved = by_mode[mode]['total'] - shared['total']
+        print(f"\n  Общий цикл событий против {mode}: экономия {saved:.2f} сек "
+              f"({saved / by_mode[mode]['total'] * 100:.0f}%), "
+              f"соединений {by_mode[mode]['connections']} -> {shared['connections']}.")
+
+    measure_client_construction()
+
+
+if __name__ == '__main__':
+    main()
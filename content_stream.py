@@ -0,0 +1,356 @@
+import os
+import json
+import time
+import random
+import asyncio
+import argparse
+from pathlib import Path
+from typing import Any, Awaitable, Callable
+
+from tracing import traced
+
+'''
+Потоковая фабрика контента: статья передается генератору картинок и подбору токенов
+сразу после коммита своей пачки, а не после того, как article_writer допишет все статьи.
+Каждому потребителю соответствует ограниченная очередь: если картинки не успевают,
+передача следующей пачки статей ждет свободного места (backpressure), и память не растет.
+
+Статьи, оставшиеся без картинок или токенов с прошлых запусков, ставятся в очереди в начале,
+поэтому потоковый режим покрывает и продолжение после сбоя (daily_pipeline --resume).
+
+В daily_pipeline включается ключом "streaming_content" в pipeline_config.json: этапы
+article_writer, picture_generator и token_matcher заменяются одним этапом content_factory.
+
+Запуск:
+    python content_stream.py                 # потоковая фабрика на реальных данных
+    python content_stream.py benchmark       # сравнение времени с последовательными этапами (без сети)
+'''
+
+PIPELINE_CONFIG_FILE = 'pipeline_config.json'
+DEFAULT_QUEUE_SIZE = 10
+DEFAULT_TOKEN_WORKERS = 4
+
+_DONE = object()  # сигнал воркеру: новых элементов не будет
+
+
+class Consumer:
+    """Потребитель очереди: по одному воркеру на обработчик (например, на API-ключ)."""
+
+    def __init__(self, name: str, handlers: list[Callable[[Any], Awaitable[Any]]]):
+        self.name = name
+        self.handlers = handlers
+        self.queue = None
+        self.processed = 0
+        self.failed = 0
+        self.deferred = 0  # элементы, отложенные до следующего запуска (ключ недоступен)
+        self.max_depth = 0
+        self.first_item_at = None
+        self.finished_at = None
+
+
+async def stream_through(produce: Callable[[Callable], Awaitable[Any]], consumers: list[Consumer],
+                         queue_size: int = DEFAULT_QUEUE_SIZE, backlog: dict | None = None):
+    """
+    Запускает производителя и потребителей одновременно. produce(emit) вызывает
+    `await emit(item)` для каждого готового элемента - он попадает в очереди всех потребителей.
+    backlog - {имя потребителя: [элементы]}, которые ставятся в его очередь до новых.
+    Возвращает результат produce.
+    """
+    origin = time.perf_counter()
+    for consumer in consumers:
+        consumer.queue = asyncio.Queue(maxsize=queue_size)
+
+    async def put(consumer: Consumer, item):
+        await consumer.queue.put(item)
+        consumer.max_depth = max(consumer.max_depth, consumer.queue.qsize())
+
+    async def emit(item):
+        for consumer in consumers:
+            await put(consumer, item)
+
+    async def worker(consumer: Consumer, handler):
+        while True:
+            item = await consumer.queue.get()
+            if item is _DONE:
+                return
+            if consumer.first_item_at is None:
+                consumer.first_item_at = time.perf_counter() - origin
+            try:
+                await handler(item)
+                consumer.processed += 1
+            except Exception as e:
+                consumer.failed += 1
+                print(f"     [CRITICAL_WORKER_ERROR] {consumer.name}: {e}")
+
+    async def feed_backlog(consumer: Consumer, items: list):
+        for item in items:
+            await put(consumer, item)
+
+    async def drain(consumer: Consumer, workers: list):
+        await asyncio.gather(*workers)
+        consumer.finished_at = time.perf_counter() - origin
+
+    drains = [
+        asyncio.create_task(drain(consumer, [asyncio.create_task(worker(consumer, handler))
+                                             for handler in consumer.handlers]))
+        for consumer in consumers
+    ]
+    try:
+        feeders = [feed_backlog(c, (backlog or {}).get(c.name, [])) for c in consumers]
+        result, *_ = await asyncio.gather(produce(emit), *feeders)
+    finally:
+        # Производитель закончил (или упал): воркеры дорабатывают очередь и выходят
+        for consumer in consumers:
+            for _ in consumer.handlers:
+                await consumer.queue.put(_DONE)
+        await asyncio.gather(*drains)
+    return result
+
+
+def print_stream_stats(consumers: list[Consumer]):
+    for c in consumers:
+        started = f"{c.first_item_at:.1f}" if c.first_item_at is not None else "-"
+        finished = f"{c.finished_at:.1f}" if c.finished_at is not None else "-"
+        deferred = f", отложено {c.deferred}" if c.deferred else ""
+        print(f"     [STREAM] {c.name}: обработано {c.processed}, ошибок {c.failed}{deferred}, "
+              f"воркеров {len(c.handlers)}, макс. очередь {c.max_depth}, первый элемент +{started} сек, "
+              f"завершение +{finished} сек")
+
+
+def load_stream_settings() -> dict:
+    try:
+        with open(PIPELINE_CONFIG_FILE, 'r', encoding='utf-8') as f:
+            config = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        config = {}
+    return {
+        'queue_size': config.get('stream_queue_size', DEFAULT_QUEUE_SIZE),
+        'token_workers': config.get('stream_token_workers', DEFAULT_TOKEN_WORKERS),
+    }
+
+
+# --- Реальная фабрика контента ---
+# Элемент очереди - статья: {'id', 'title', 'content', 'image_prompt_style'}.
+# Каждый потребитель читает только нужные ему поля.
+# Модули этапов импортируются внутри функций: бенчмарк ниже должен запускаться без SDK провайдеров.
+
+def picture_consumer() -> Consumer | None:
+    """Генерация картинок: воркер на HF-ключ, как в picture_generator."""
+    from picture_generator import API_KEY_NAMES, generate_single_image
+
+    api_keys = [os.getenv(key) for key in API_KEY_NAMES if os.getenv(key)]
+    if not api_keys:
+        print("     [WARNING] API-ключи для генерации изображений не найдены - картинки в потоке не генерируются.")
+        return None
+
+    def handler_for(api_key: str):
+        async def handle(article: dict):
+            task = {'generated_article_id': article['id'], 'title': article['title'],
+                    'image_prompt_style': article['image_prompt_style']}
+            await generate_single_image(task, api_key)
+        return handle
+
+    return Consumer('picture_generator', [handler_for(key) for key in api_keys])
+
+
+def token_consumer(buffer, workers: int) -> Consumer | None:
+    """Подбор токенов: workers одновременных запросов, результаты пишутся пачками через buffer."""
+    from token_matcher import API_KEY_NAME, PROMPT_FILE, TOKEN_LIST_FILE, match_tokens_for_article
+    from key_pool import NoHealthyKeyError
+
+    api_key = os.getenv(API_KEY_NAME)
+    if not api_key:
+        print(f"     [WARNING] API-ключ {API_KEY_NAME} не найден - токены в потоке не подбираются.")
+        return None
+    try:
+        prompt_template = Path(PROMPT_FILE).read_text(encoding='utf-8')
+        token_list_str = Path(TOKEN_LIST_FILE).read_text(encoding='utf-8')
+    except FileNotFoundError as e:
+        print(f"     [WARNING] Не найден файл для подбора токенов: {e} - токены в потоке не подбираются.")
+        return None
+
+    async def handle(article: dict):
+        task = {'id': article['id'], 'content': article['content']}
+        try:
+            tokens = await match_tokens_for_article(task, prompt_template, token_list_str, api_key)
+        except NoHealthyKeyError as e:
+            # Без записи в БД: статья останется в очереди токенов следующего запуска (load_backlog)
+            if not consumer.deferred:
+                print(f"     [WARNING] Подбор токенов отложен до следующего запуска: {e}")
+            consumer.deferred += 1
+            return
+        await buffer.put((article['id'], tokens))
+        print(f"     [SUCCESS] Для статьи ID {article['id']} подобраны токены: {tokens}")
+
+    consumer = Consumer('token_matcher', [handle] * workers)
+    return consumer
+
+
+async def load_backlog() -> dict:
+    """Статьи прошлых запусков, которые еще ждут картинку или токены."""
+    import async_db
+    from token_matcher import get_token_matching_tasks
+
+    image_tasks = await async_db.get_image_generation_tasks()
+    token_tasks = await async_db.run_in_db_thread(get_token_matching_tasks)
+    return {
+        'picture_generator': [
+            {'id': t['generated_article_id'], 'title': t['title'], 'image_prompt_style': t['image_prompt_style']}
+            for t in image_tasks
+        ],
+        'token_matcher': [{'id': t['id'], 'content': t['content']} for t in token_tasks],
+    }
+
+
+@traced()
+async def run_content_factory_async() -> bool:
+    """Статьи, картинки и токены одним этапом: потребители работают параллельно с генерацией статей."""
+    import async_db
+    from dotenv import load_dotenv
+    from article_writter import ENV_FILE, run_article_writer_async
+    from token_matcher import save_tokens_batch
+    from provider_clients import provider_session
+    from write_buffer import WriteBehindBuffer, WriteBufferError
+
+    print("  -> Запуск потоковой фабрики контента (статьи -> картинки и токены)...")
+    load_dotenv(ENV_FILE)
+    settings = load_stream_settings()
+    styles = {p['id']: p.get('image_prompt_style') for p in await async_db.get_all_personas()}
+    backlog = await load_backlog()
+
+    try:
+        async with provider_session(), WriteBehindBuffer('token_matcher', save_tokens_batch) as token_buffer:
+            consumers = [c for c in (picture_consumer(), token_consumer(token_buffer, settings['token_workers'])) if c]
+            if backlog['picture_generator'] or backlog['token_matcher']:
+                print(f"     В очередях с прошлых запусков: картинок {len(backlog['picture_generator'])}, "
+                      f"токенов {len(backlog['token_matcher'])}.")
+
+            async def produce(emit):
+                async def on_saved(batch: list, saved: dict):
+                    for article in batch:
+                        article_id = (saved or {}).get(article['topic_id'])
+                        if article_id is not None:
+                            await emit({'id': article_id, 'title': article['title'], 'content': article['content'],
+                                        'image_prompt_style': styles.get(article['persona_id'])})
+                return await run_article_writer_async(on_saved=on_saved)
+
+            writer_ok = await stream_through(produce, consumers, settings['queue_size'], backlog)
+    except WriteBufferError as e:
+        print(f"     [DB_ERROR] Токены не сохранены: {e}")
+        writer_ok = False
+
+    print_stream_stats(consumers)
+    return writer_ok
+
+
+def run_content_factory() -> bool:
+    return asyncio.run(run_content_factory_async())
+
+
+# --- Бенчмарк без сети ---
+
+def fake_latency(mean_ms: float, rng: random.Random) -> float:
+    """Задержка вызова API: +-30% вокруг среднего."""
+    return mean_ms / 1000 * rng.uniform(0.7, 1.3)
+
+
+async def simulate(streaming: bool, args, seed: int = 42) -> float:
+    """
+    Один прогон фабрики на подделках: writers воркеров пишут статьи, пачки коммитятся
+    как в WriteBehindBuffer (по batch_size штук), картинки и токены - с заданными задержками.
+    streaming=False повторяет текущий порядок: потребители стартуют после последней статьи.
+    """
+    rng = random.Random(seed)
+    start = time.perf_counter()
+
+    async def produce(emit):
+        queue = asyncio.Queue()
+        for article_id in range(1, args.articles + 1):
+            queue.put_nowait(article_id)
+        pending = []
+
+        async def writer():
+            while not queue.empty():
+                article_id = queue.get_nowait()
+                await asyncio.sleep(fake_latency(args.write_ms, rng))
+                pending.append({'id': article_id, 'title': f"Статья {article_id}", 'content': "...",
+                                'image_prompt_style': None})
+                if len(pending) >= args.batch_size:
+                    batch = pending[:]
+                    pending.clear()
+                    for article in batch:
+                        await emit(article)
+
+        await asyncio.gather(*(writer() for _ in range(args.writers)))
+        for article in pending:
+            await emit(article)
+
+    async def image(article):
+        await asyncio.sleep(fake_latency(args.image_ms, rng))
+
+    async def tokens(article):
+        await asyncio.sleep(fake_latency(args.token_ms, rng))
+
+    def make_consumers():
+        return [Consumer('picture_generator', [image] * args.image_workers),
+                Consumer('token_matcher', [tokens] * args.token_workers)]
+
+    if streaming:
+        consumers = make_consumers()
+        await stream_through(produce, consumers, args.queue_size)
+    else:
+        collected = []
+
+        async def collect(article):
+            collected.append(article)
+        await produce(collect)
+
+        async def replay(emit):
+            for article in collected:
+                await emit(article)
+        consumers = make_consumers()
+        await stream_through(replay, consumers, args.queue_size)
+
+    elapsed = time.perf_counter() - start
+    print(f"\n  {'Потоковый' if streaming else 'Последовательный'} режим: {elapsed:.2f} сек")
+    print_stream_stats(consumers)
+    return elapsed
+
+
+def run_benchmark(args):
+    print(f"  Статей: {args.articles}, писателей: {args.writers} ({args.write_ms:.0f} мс), "
+          f"картинок: {args.image_workers} воркер(а) ({args.image_ms:.0f} мс), "
+          f"токенов: {args.token_workers} воркер(а) ({args.token_ms:.0f} мс), "
+          f"пачка {args.batch_size}, очередь {args.queue_size}")
+    sequential = asyncio.run(simulate(False, args))
+    streaming = asyncio.run(simulate(True, args))
+    saved = sequential - streaming
+    print(f"\n  Сквозное время: {sequential:.2f} -> {streaming:.2f} сек "
+          f"(экономия {saved:.2f} сек, {saved / sequential * 100:.0f}%).")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Потоковая фабрика контента.")
+    subparsers = parser.add_subparsers(dest='command')
+    bench = subparsers.add_parser('benchmark', help="сравнить потоковый и последовательный режимы на подделках")
+    bench.add_argument('--articles', type=int, default=30)
+    bench.add_argument('--writers', type=int, default=5, help="воркеров article_writer (ключей всех провайдеров)")
+    bench.add_argument('--write-ms', type=float, default=400, help="генерация одной статьи")
+    bench.add_argument('--image-workers', type=int, default=1, help="HF-ключей")
+    bench.add_argument('--image-ms', type=float, default=250, help="картинка вместе с паузой от rate limit")
+    bench.add_argument('--token-workers', type=int, default=DEFAULT_TOKEN_WORKERS)
+    bench.add_argument('--token-ms', type=float, default=150)
+    bench.add_argument('--batch-size', type=int, default=5, help="статей в пачке буфера записи")
+    bench.add_argument('--queue-size', type=int, default=DEFAULT_QUEUE_SIZE)
+    args = parser.parse_args()
+
+    if args.command == 'benchmark':
+        run_benchmark(args)
+    elif run_content_factory():
+        print("\n--- Потоковая фабрика контента успешно завершила работу ---")
+    else:
+        print("\n--- Работа потоковой фабрики контента завершилась с ошибкой ---")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,109 +1,351 @@
 import os
+import json
+import zipfile
+import argparse
 import asyncio
 from datetime import datetime, date, timedelta
 from dotenv import load_dotenv
 
-# --- Импорты всех наших модулей в порядке их вызова ---
-from tokens import update_token_list
-from vpn_manager import connect_vpn, disconnect_vpn
-from bybit_parser import parse_bybit_articles
-from telegram_channel_scraper import main as run_telegram_scraper
-from news_summarizer import run_news_summarizer
-from topic_categorizer import run_topic_categorizer
-from topic_rebalancer import run_topic_rebalancer
-from title_formatter import run_title_formatter
-from daily_planner import run_daily_planner
-from image_prompt_generator import run_image_prompt_generator
-from article_writter import run_article_writer
-from picture_generator import run_picture_generator
-from token_matcher import run_token_matcher
-from doc_zipper import run_doc_zipper
+# Модули этапов здесь не импортируются: каждый загружается при запуске своего этапа
+# (lazy_func в build_daily_stages), поэтому старт и --status не тянут SDK провайдеров
 from alerter import send_admin_alert
-from telegram.ext import Application
-from telegram_bot import send_digest_to_user
+from provider_clients import provider_session
+from tracing import span, traced
+from stage_profiler import resolve_request as resolve_profiling, profile_stages
+from database_manager import (start_pipeline_run, get_completed_stages, record_stage_run, finish_pipeline_run,
+                              get_pipeline_run, get_delivered_users, log_deliveries)
+from pipeline_dag import (Stage, StageRun, OK, WARN, run_stage_graph, run_stage_graph_async,
+                          print_run_summary, pipeline_succeeded, lazy_func, lazy_async_func)
 
 '''
 Главный скрипт-оркестратор (дирижер) всего ежедневного цикла.
+Этапы описаны графом зависимостей (build_daily_stages) и выполняются pipeline_dag:
+независимые этапы идут параллельно, сбой обрабатывается по политике этапа.
+
+Асинхронный режим (ключ "async_mode" в pipeline_config.json или флаг --async) выполняет
+весь прогон в одном цикле событий: клиенты Gemini/OpenAI/Grok/Hugging Face и Telegram-бота
+создаются один раз (provider_clients.py) и переиспользуются всеми этапами.
+
+Потоковый режим фабрики контента (ключ "streaming_content"): картинки и токены для статьи
+подбираются сразу после ее сохранения, параллельно с генерацией остальных статей (content_stream.py).
+
+Каждый прогон записывает чекпоинты в БД (pipeline_runs/stage_runs по целевой дате): статус,
+время и результат каждого этапа. С --resume завершенные этапы не перезапускаются, а незавершенные
+берут из БД только необработанные элементы (темы без заголовков, статьи без картинок и т.д.).
+
+Прогон пишет трассу (tracing.py): спаны этапов, вызовов LLM, запросов к БД и записи файлов.
+Разбор по времени - python tracing.py waterfall, сравнение этапов по дням - python tracing.py compare.
+
+Медленный этап можно профилировать точечно (stage_profiler.py): --profile с именами этапов
+или переменная PIPELINE_PROFILE дают .pstats cProfile, стеки для flamegraph и топ выделений памяти.
+
+Запуск:
+    python daily_pipeline.py                              # режим из pipeline_config.json
+    python daily_pipeline.py --async                      # один цикл событий на весь прогон
+    python daily_pipeline.py --resume                     # продолжить вчерашний прогон с места сбоя
+    python daily_pipeline.py --resume --date 2025-07-01   # продолжить прогон за указанную дату
+    python daily_pipeline.py --status --date 2025-07-01   # состояние этапов прогона
+    python daily_pipeline.py --profile topic_rebalancer,title_formatter --profile-modes cpu,stacks
 '''
 
+PIPELINE_CONFIG_FILE = 'pipeline_config.json'
+
+
+async def deliver_zips(application, zips_to_deliver: dict) -> dict:
+    """Отправляет архивы параллельно через Application бота. Возвращает {user_id: доставлено ли}."""
+    from telegram_bot import send_digest_to_user
 
-async def deliver_zips(application: Application, zips_to_deliver: dict):
     tasks = [send_digest_to_user(application, user_id, zip_path) for user_id, zip_path in zips_to_deliver.items()]
-    await asyncio.gather(*tasks)
+    return dict(zip(zips_to_deliver, await asyncio.gather(*tasks)))
 
 
-def run_daily_tasks():
-    print("=" * 50)
-    print(f"🚀 ЗАПУСК ЕЖЕДНЕВНОГО ЦИКЛА: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-    print("=" * 50)
+def count_zip_articles(zip_path: str) -> int:
+    try:
+        with zipfile.ZipFile(zip_path) as archive:
+            return sum(1 for name in archive.namelist() if name.endswith('.docx'))
+    except (OSError, zipfile.BadZipFile):
+        return 0
 
-    target_date_str = (date.today() - timedelta(days=1)).strftime('%Y-%m-%d')
-    print(f"🎯 Целевая дата для обработки: {target_date_str}")
 
-    # --- ЭТАП 0: ПОДГОТОВКА ---
-    print("\n[0/5] 🔧 Подготовка окружения...")
-    if not update_token_list():
-        send_admin_alert("⚠️ *Сбой в tokens.py:*\nНе удалось обновить список токенов.")
+@traced()
+async def deliver_digests_async(zips_to_deliver: dict, delivery_date: str | None = None,
+                                skip_delivered: bool = False):
+    """
+    Отправляет готовые ZIP-дайджесты пользователям через Telegram-бота и пишет delivery_log.
+    skip_delivered - не отправлять тем, кому дайджест за delivery_date уже доставлен (--resume).
+    """
+    delivery_date = delivery_date or date.today().strftime('%Y-%m-%d')
+    if skip_delivered and zips_to_deliver:
+        delivered = get_delivered_users(delivery_date)
+        zips_to_deliver = {user_id: path for user_id, path in zips_to_deliver.items() if user_id not in delivered}
+        if delivered:
+            print(f"     [INFO] Уже доставлено прошлой попыткой: {len(delivered)} пользователям.")
+    if not zips_to_deliver:
+        print("     [INFO] Нет готовых дайджестов для доставки.")
+        return True
+    print("     Инициализация Telegram-бота для отправки...")
+    load_dotenv()
+    bot_token = os.getenv("TELEGRAM_BOT_TOKEN")
+    if not bot_token:
+        print("     [ERROR] TELEGRAM_BOT_TOKEN не найден.")
+        return False
+    async with provider_session() as clients:
+        application = await clients.telegram_application(bot_token)
+        outcome = await deliver_zips(application, zips_to_deliver)
+
+    log_deliveries(delivery_date, [
+        (user_id, count_zip_articles(zips_to_deliver[user_id]),
+         count_zip_articles(zips_to_deliver[user_id]) if sent else 0, 'delivered' if sent else 'failed')
+        for user_id, sent in outcome.items()
+    ])
+    failed = [user_id for user_id, sent in outcome.items() if not sent]
+    if failed:
+        return False, f"не доставлено {len(failed)} из {len(outcome)} дайджестов"
+    return True
 
-    if not connect_vpn():
-        send_admin_alert("🔥 *Критический сбой VPN:*\nНе удалось подключиться. Пайплайн ОСТАНОВЛЕН.")
-        return
 
-    # --- ЭТАП 1: СБОР И ОБРАБОТКА НОВОСТЕЙ ---
-    print("\n[1/5] 📰 Сбор и обработка новостей...")
+def deliver_digests(zips_to_deliver: dict, delivery_date: str | None = None, skip_delivered: bool = False):
+    return asyncio.run(deliver_digests_async(zips_to_deliver, delivery_date, skip_delivered))
+
+
+def load_pipeline_config() -> dict:
     try:
-        success, message = parse_bybit_articles()
-        if not success: send_admin_alert(f"⚠️ *Сбой в bybit_parser:*\n`{message}`")
-    except Exception as e:
-        send_admin_alert(f"🔥 *Критический сбой в bybit_parser:*\n`{e}`")
+        with open(PIPELINE_CONFIG_FILE, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError) as e:
+        print(f"     [WARNING] Не удалось прочитать {PIPELINE_CONFIG_FILE}: {e}. Используются значения по умолчанию.")
+        return {}
+
+
+def content_stages(streaming: bool) -> list[Stage]:
+    """
+    Фабрика контента: три этапа друг за другом или, при streaming, один потоковый этап,
+    в котором картинки и токены подбираются по мере сохранения статей (content_stream.py).
+    """
+    if streaming:
+        return [
+            Stage('content_factory', lazy_func('content_stream', 'run_content_factory'),
+                  depends_on=('daily_planner', 'image_prompt_generator', 'tokens'),
+                  async_func=lazy_async_func('content_stream', 'run_content_factory_async')),
+        ]
+    return [
+        Stage('article_writer', lazy_func('article_writter', 'run_article_writer'), depends_on=('daily_planner',),
+              async_func=lazy_async_func('article_writter', 'run_article_writer_async')),
+        Stage('picture_generator', lazy_func('picture_generator', 'run_picture_generator'),
+              depends_on=('article_writer', 'image_prompt_generator'),
+              async_func=lazy_async_func('picture_generator', 'run_picture_generator_async')),
+        Stage('token_matcher', lazy_func('token_matcher', 'run_token_matcher'), depends_on=('article_writer', 'tokens'),
+              policy=WARN, async_func=lazy_async_func('token_matcher', 'run_token_matcher_async')),
+    ]
+
+
+def build_daily_stages(target_date_str: str, results: dict, resume: bool = False,
+                       streaming: bool = False) -> list[Stage]:
+    """
+    Граф этапов ежедневного цикла. results - словарь прогонов, который заполняет
+    run_stage_graph (доставка берет из него ZIP-архивы, собранные doc_zipper).
+    """
+    content = content_stages(streaming)
+    content_done = ('content_factory',) if streaming else ('picture_generator', 'token_matcher')
+    # Скрапер возвращает путь к файлу сводки - он сохраняется как результат этапа
+    def run_telegram_scraper_sync():
+        from telegram_channel_scraper import main as run_telegram_scraper
+        return asyncio.run(run_telegram_scraper())
+
+    def zips_for_delivery() -> dict:
+        # Из чекпоинта словарь приходит через JSON - ключи user_id становятся строками
+        return {int(user_id): path for user_id, path in (results['doc_zipper'].result or {}).items()}
+
+    def run_delivery():
+        return deliver_digests(zips_for_delivery(), target_date_str, skip_delivered=resume)
+
+    async def run_delivery_async():
+        return await deliver_digests_async(zips_for_delivery(), target_date_str, skip_delivered=resume)
 
+    return [
+        # --- ЭТАП 0: ПОДГОТОВКА ---
+        Stage('vpn', lazy_func('vpn_manager', 'connect_vpn'), checkpoint=False,
+              alert="🔥 *Критический сбой VPN:*\nНе удалось подключиться. Пайплайн ОСТАНОВЛЕН."),
+        # Список токенов берется с Bybit - как и парсер, только через VPN
+        Stage('tokens', lazy_func('tokens', 'update_token_list'), depends_on=('vpn',), policy=WARN,
+              alert="⚠️ *Сбой в tokens.py:*\nНе удалось обновить список токенов."),
+
+        # --- ЭТАП 1: СБОР И ОБРАБОТКА НОВОСТЕЙ ---
+        Stage('bybit_parser', lazy_func('bybit_parser', 'parse_bybit_articles'), depends_on=('vpn',), policy=WARN,
+              alert="⚠️ *Сбой в bybit_parser:*\n`{error}`"),
+        Stage('telegram_scraper', run_telegram_scraper_sync, depends_on=('vpn',),
+              async_func=lazy_async_func('telegram_channel_scraper', 'main'),
+              alert="🔥 *Критический сбой в telegram_scraper:*\n`{error}`\n_Пайплайн ОСТАНОВЛЕН._"),
+        Stage('news_summarizer', lazy_func('news_summarizer', 'run_news_summarizer', target_date=target_date_str),
+              depends_on=('telegram_scraper',)),
+        Stage('topic_categorizer', lazy_func('topic_categorizer', 'run_topic_categorizer', target_date=target_date_str),
+              depends_on=('news_summarizer',)),
+        Stage('topic_rebalancer', lazy_func('topic_rebalancer', 'run_topic_rebalancer', target_date=target_date_str),
+              depends_on=('topic_categorizer',),
+              async_func=lazy_async_func('topic_rebalancer', 'run_topic_rebalancer_async',
+                                         target_date=target_date_str)),
+        # Заголовки Bybit служат примерами для title_formatter
+        Stage('title_formatter', lazy_func('title_formatter', 'run_title_formatter'),
+              depends_on=('topic_rebalancer', 'bybit_parser'),
+              async_func=lazy_async_func('title_formatter', 'run_title_formatter_async')),
+
+        # --- ЭТАП 2: ПЛАНИРОВАНИЕ И ГЕНЕРАЦИЯ ---
+        Stage('image_prompt_generator', lazy_func('image_prompt_generator', 'run_image_prompt_generator'),
+              depends_on=('vpn',), policy=WARN),
+        Stage('daily_planner', lazy_func('daily_planner', 'run_daily_planner'), depends_on=('title_formatter',)),
+
+        # --- ЭТАП 3: ФАБРИКА КОНТЕНТА ---
+        *content,
+
+        # --- ЭТАП 4-5: СБОРКА И ДОСТАВКА ---
+        Stage('doc_zipper', lazy_func('doc_zipper', 'run_doc_zipper'), depends_on=content_done),
+        # Сбой доставки не отменяет собранные дайджесты: недоставленным пользователям
+        # их отправит повторный запуск (--resume, см. delivery_log)
+        Stage('delivery', run_delivery, depends_on=('doc_zipper',), async_func=run_delivery_async, policy=WARN,
+              alert="⚠️ *Сбой доставки дайджестов:*\n`{error}`"),
+    ]
+
+
+# --- Чекпоинты ---
+
+def artifact_to_json(result) -> str | None:
+    """Результат этапа для stage_runs: флаги успеха не сохраняются, несериализуемое - тоже."""
+    if result is None or isinstance(result, (bool, tuple)):
+        return None
     try:
-        asyncio.run(run_telegram_scraper())
-    except Exception as e:
-        send_admin_alert(f"🔥 *Критический сбой в telegram_scraper:*\n`{e}`\n_Пайплайн ОСТАНОВЛЕН._")
-        disconnect_vpn()
+        return json.dumps(result, ensure_ascii=False)
+    except (TypeError, ValueError):
+        return None
+
+
+def make_checkpoint_recorder(run_id: int):
+    """Возвращает on_finish для pipeline_dag: сохраняет состояние этапа сразу после его завершения."""
+    def record(run: StageRun):
+        finished = datetime.now()
+        started = finished - timedelta(seconds=run.duration)
+        record_stage_run(
+            run_id, run.stage.name, run.status,
+            started.strftime('%Y-%m-%d %H:%M:%S'), finished.strftime('%Y-%m-%d %H:%M:%S'),
+            round(run.duration, 3), run.error, artifact_to_json(run.result)
+        )
+    return record
+
+
+def print_pipeline_status(target_date_str: str):
+    pipeline_run = get_pipeline_run(target_date_str)
+    if not pipeline_run:
+        print(f"     Прогонов за {target_date_str} не было.")
         return
+    print(f"  Прогон за {target_date_str}: {pipeline_run['status']}, попыток: {pipeline_run['attempts']}, "
+          f"начат {pipeline_run['started_at']}, завершен {pipeline_run['finished_at'] or '-'}")
+    print(f"     {'Этап':<26} {'Статус':<9} {'Попытка':>7} {'Завершен':<20} {'Длит., с':>9}  Ошибка")
+    for stage in pipeline_run['stages']:
+        print(f"     {stage['stage']:<26} {stage['status']:<9} {stage['attempt']:>7} {stage['finished_at']:<20} "
+              f"{stage['duration_sec']:9.1f}  {stage['error'] or ''}")
 
-    if not run_news_summarizer(target_date=target_date_str): disconnect_vpn(); return
-    if not run_topic_categorizer(target_date=target_date_str): disconnect_vpn(); return
-    if not run_topic_rebalancer(target_date=target_date_str): disconnect_vpn(); return
-    if not run_title_formatter(): disconnect_vpn(); return
 
-    # --- ЭТАП 2: ПЛАНИРОВАНИЕ И ГЕНЕРАЦИЯ ---
-    print("\n[2/5] 📅 Стратегия и планирование...")
-    if not run_image_prompt_generator(): print("     [WARNING] Не удалось обновить стили изображений.")
-    if not run_daily_planner(): disconnect_vpn(); return
+async def run_stage_graph_shared(stages: list[Stage], max_parallel: int, runs: dict,
+                                 completed: dict, on_finish):
+    """Весь граф в одном цикле событий с общим на прогон реестром клиентов."""
+    async with provider_session():
+        await run_stage_graph_async(stages, max_parallel=max_parallel, alert_func=send_admin_alert, runs=runs,
+                                    completed=completed, on_finish=on_finish)
 
-    # --- ЭТАП 3: ФАБРИКА КОНТЕНТА ---
-    print("\n[3/5] 🏭 Фабрика контента...")
-    if not run_article_writer(): disconnect_vpn(); return
-    if not run_picture_generator(): disconnect_vpn(); return
-    if not run_token_matcher(): print("     [WARNING] Не удалось подобрать токены.")
 
-    # --- ЭТАП 4: СБОРКА ---
-    print("\n[4/5] 📦 Сборка...")
-    zips_to_deliver = run_doc_zipper()
+def run_daily_tasks(async_mode: bool | None = None, resume: bool = False, target_date_str: str | None = None,
+                    profile: str | None = None, profile_modes: str | None = None):
+    print("=" * 50)
+    print(f"🚀 ЗАПУСК ЕЖЕДНЕВНОГО ЦИКЛА: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    print("=" * 50)
 
-    # --- ЭТАП 5: ДОСТАВКА И ЗАВЕРШЕНИЕ ---
-    print("\n[5/5] 🚚 Доставка и завершение...")
-    if not zips_to_deliver:
-        print("     [INFO] Нет готовых дайджестов для доставки.")
-    else:
-        print("     Инициализация Telegram-бота для отправки...")
-        load_dotenv()
-        bot_token = os.getenv("TELEGRAM_BOT_TOKEN")
-        if not bot_token:
-            print("     [ERROR] TELEGRAM_BOT_TOKEN не найден.")
-        else:
-            application = Application.builder().token(bot_token).build()
-            asyncio.run(deliver_zips(application, zips_to_deliver))
+    target_date_str = target_date_str or (date.today() - timedelta(days=1)).strftime('%Y-%m-%d')
+    print(f"🎯 Целевая дата для обработки: {target_date_str}")
+
+    config = load_pipeline_config()
+    if async_mode is None:
+        async_mode = config.get('async_mode', False)
+    max_parallel = config.get('max_parallel_stages', 3)
+    print(f"⚙️ Режим: {'один цикл событий на весь прогон' if async_mode else 'отдельный цикл событий на этап'}")
 
-    disconnect_vpn()
+    run_id = start_pipeline_run(target_date_str, resume=resume)
+    completed = get_completed_stages(run_id) if resume and run_id else {}
+    on_finish = make_checkpoint_recorder(run_id) if run_id else None
+    if resume:
+        print(f"↩️ Продолжение прогона: завершено ранее {len(completed)} этапов.")
 
+    results = {}
+    stages = build_daily_stages(target_date_str, results, resume=resume,
+                                streaming=config.get('streaming_content', False))
+    # Без --profile и PIPELINE_PROFILE этапы не оборачиваются: профилирование ничего не стоит
+    profiling = resolve_profiling(profile, profile_modes)
+    if profiling:
+        profile_stages(stages, *profiling, target_date_str)
+    # Корневой спан прогона: этапы, вызовы LLM, запросы к БД и записи файлов становятся его потомками
+    with span('daily_pipeline', kind='run', target_date=target_date_str, run_id=run_id,
+              async_mode=bool(async_mode), resume=resume) as run_span:
+        try:
+            if async_mode:
+                asyncio.run(run_stage_graph_shared(stages, max_parallel, results, completed, on_finish))
+            else:
+                run_stage_graph(stages, max_parallel=max_parallel, alert_func=send_admin_alert, runs=results,
+                                completed=completed, on_finish=on_finish)
+        finally:
+            if 'vpn' in results and results['vpn'].status == OK:
+                from vpn_manager import disconnect_vpn
+                disconnect_vpn()
+
+        succeeded = pipeline_succeeded(results)
+        if not succeeded:
+            run_span.fail("есть этапы со сбоем")
+    if run_id:
+        finish_pipeline_run(run_id, 'ok' if succeeded else 'failed')
+
+    print_run_summary(results)
+    from llm_cache import session_summary
+    cache_summary = session_summary()
+    if cache_summary:
+        print(f"     [CACHE] LLM-кэш за прогон: {cache_summary}")
+    from adaptive_concurrency import concurrency_snapshot
+    for name, state in concurrency_snapshot().items():
+        print(f"     [INFO] Параллельность {name}: предел {state['limit']}, пик {state['peak_in_flight']}, "
+              f"+{state['increases']}/-{state['decreases']}")
     print("\n" + "=" * 50)
-    print(f"🏁 ЕЖЕДНЕВНЫЙ ЦИКЛ УСПЕШНО ЗАВЕРШЕН: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    if succeeded:
+        print(f"🏁 ЕЖЕДНЕВНЫЙ ЦИКЛ УСПЕШНО ЗАВЕРШЕН: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    else:
+        print(f"🛑 ЕЖЕДНЕВНЫЙ ЦИКЛ ОСТАНОВЛЕН: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+        print(f"   Продолжить с места сбоя: python daily_pipeline.py --resume --date {target_date_str}")
+    if run_span.trace_id:
+        print(f"   Трасса прогона: python tracing.py waterfall --trace {run_span.trace_id} "
+              f"--date {run_span.day}")
     print("=" * 50)
 
 
 if __name__ == '__main__':
-    run_daily_tasks()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Ежедневный цикл конвейера.")
+    parser.add_argument('--async', dest='async_mode', action='store_true', default=None,
+                        help="выполнить весь прогон в одном цикле событий с общими клиентами")
+    parser.add_argument('--resume', action='store_true',
+                        help="пропустить этапы, завершенные в прошлой попытке за эту дату")
+    parser.add_argument('--date', help="целевая дата YYYY-MM-DD (по умолчанию - вчера)")
+    parser.add_argument('--status', action='store_true', help="показать состояние прогона и выйти")
+    parser.add_argument('--profile', nargs='?', const='all', metavar='STAGES',
+                        help="профилировать этапы (через запятую, без значения - все); иначе PIPELINE_PROFILE")
+    parser.add_argument('--profile-modes', metavar='MODES',
+                        help="cpu,stacks,memory (по умолчанию все); иначе PIPELINE_PROFILE_MODES")
+    args = parser.parse_args()
+
+    if args.date:
+        try:
+            datetime.strptime(args.date, '%Y-%m-%d')
+        except ValueError:
+            parser.error(f"Неверный формат даты: {args.date}, ожидается YYYY-MM-DD")
+    try:
+        resolve_profiling(args.profile, args.profile_modes)
+    except ValueError as e:
+        parser.error(str(e))
+    if args.status:
+        print_pipeline_status(args.date or (date.today() - timedelta(days=1)).strftime('%Y-%m-%d'))
+    else:
+        run_daily_tasks(async_mode=args.async_mode, resume=args.resume, target_date_str=args.date,
+                        profile=args.profile, profile_modes=args.profile_modes)
\ No newline at end of file
@@ -1,11 +1,11 @@
-import sqlite3
 import json
 from datetime import date, timedelta
 from collections import defaultdict
 from typing import Dict, List
 
-from database_manager import get_db_connection
+from database_manager import AVAILABLE_TOPICS_SQL, USER_SUBSCRIPTIONS_SQL, get_db_connection, transition_topics
 from alerter import send_admin_alert
+from tracing import traced
 
 '''
 Модуль ежедневного тактического планирования.
@@ -21,7 +21,7 @@ def get_user_subscriptions() -> Dict[int, List[int]]:
     conn = get_db_connection()
     subscriptions = defaultdict(list)
     try:
-        cursor = conn.execute("SELECT id, subscribed_persona_id FROM users WHERE subscribed_persona_id IS NOT NULL")
+        cursor = conn.execute(USER_SUBSCRIPTIONS_SQL)
         for row in cursor.fetchall():
             subscriptions[row['subscribed_persona_id']].append(row['id'])
         return subscriptions
@@ -52,7 +52,7 @@ def get_available_topics_by_category() -> Dict[str, List[Dict]]:
     conn = get_db_connection()
     available_topics = defaultdict(list)
     try:
-        cursor = conn.execute("SELECT * FROM topics WHERE status = 'ready_for_planning' ORDER BY creation_date ASC")
+        cursor = conn.execute(AVAILABLE_TOPICS_SQL)
         for row in cursor.fetchall():
             available_topics[row['category']].append(dict(row))
         return available_topics
@@ -62,30 +62,23 @@ def get_available_topics_by_category() -> Dict[str, List[Dict]]:
 
 
 def assign_topics_in_db(assignments: List[Dict]) -> int:
-    """Обновляет статус и назначает темы в БД. Возвращает количество обновленных строк."""
-    if not assignments:
-        return 0
-    to_update = [
-        ('planned_for_generation', item['user_id'], item['persona_id'], item['topic_id'])
+    """
+    Обновляет статус и назначает темы в БД одной транзакцией.
+    Темы, которые уже забрал другой запуск планировщика, пропускаются.
+    Возвращает количество обновленных строк.
+    """
+    transitions = [
+        (item['topic_id'], 'planned_for_generation',
+         {'assigned_user_id': item['user_id'], 'assigned_persona_id': item['persona_id']})
         for item in assignments
     ]
-    conn = get_db_connection()
-    try:
-        cursor = conn.cursor()
-        sql = "UPDATE topics SET status = ?, assigned_user_id = ?, assigned_persona_id = ? WHERE id = ?"
-        cursor.executemany(sql, to_update)
-        conn.commit()
-        return cursor.rowcount
-    except sqlite3.Error as e:
-        print(f"     [DB_ERROR] Ошибка при назначении тем: {e}")
-        return 0
-    finally:
-        if conn:
-            conn.close()
+    assigned = transition_topics(transitions, expected_status='ready_for_planning')
+    return len(assigned)
 
 
 # --- Основная логика ---
 
+@traced()
 def run_daily_planner() -> bool:
     print("  -> Запуск daily_planner.py...")
 
@@ -1,6 +1,12 @@
+import re
+import json
 import sqlite3
+from contextlib import contextmanager
 from collections import defaultdict
 
+from db_pool import get_pool
+from tracing import span
+
 DB_NAME = 'neuro_crypto.db'
 
 '''
@@ -13,9 +19,120 @@ def get_db_connection():
     """Устанавливает соединение с БД и возвращает объект соединения."""
     conn = sqlite3.connect(DB_NAME)
     conn.row_factory = sqlite3.Row
+    # Триггеры FTS вызывают nc_unpack(), поэтому она нужна на любом соединении, которое пишет в БД
+    get_pool(DB_NAME).codec.register_sql_functions(conn)
     return conn
 
 
+@contextmanager
+def db_connection(name: str = 'query', write: bool = False):
+    """
+    Выдает соединение из пула (см. db_pool.py) вместо открытия нового.
+    name - имя вызывающей функции для спана db.<name>.
+    write=True - соединение-писатель внутри одной транзакции (коммит при выходе из блока).
+    Закрывать соединение не нужно: оно возвращается в пул.
+    Внутри трассы (прогон, этап) использование соединения пишет спан вида db (см. tracing.py);
+    в длительность входит и ожидание писателя.
+    """
+    pool = get_pool(DB_NAME)
+    with span(f"db.{name}", kind='db', write=write):
+        with (pool.writer() if write else pool.reader()) as conn:
+            yield conn
+
+
+# --- СЖАТИЕ ТЕКСТОВ (см. db_compression.py) ---
+
+def pack_text(text: str | None):
+    """Готовит большой текст к записи: сжимает его, если сжатие включено в database_config.json."""
+    return get_pool(DB_NAME).codec.pack(text)
+
+
+def unpack_text(value) -> str | None:
+    """Возвращает исходный текст для значения из БД (сжатого или обычного)."""
+    return get_pool(DB_NAME).codec.unpack(value)
+
+
+def _unpack_rows(rows: list[dict], *columns: str) -> list[dict]:
+    codec = get_pool(DB_NAME).codec
+    for row in rows:
+        for column in columns:
+            row[column] = codec.unpack(row[column])
+    return rows
+
+
+# --- ГОРЯЧИЕ ЗАПРОСЫ ---
+# Запросы ежедневного пайплайна. Их планы на большой БД проверяет db_benchmark.py plans
+# (и тест tests/test_query_plans.py): правка запроса здесь сразу попадает в проверку.
+
+GENERATION_TASKS_SQL = """
+SELECT
+    t.id AS topic_id,
+    t.title,
+    t.source_news_text,
+    t.assigned_user_id,
+    t.assigned_persona_id,
+    p.persona_code,
+    p.provider_name
+FROM topics t
+JOIN personas p ON t.assigned_persona_id = p.id
+WHERE t.status = 'planned_for_generation'
+"""
+
+TOPICS_BY_STATUS_SQL = "SELECT * FROM topics WHERE status = ?"
+
+AVAILABLE_TOPICS_SQL = "SELECT * FROM topics WHERE status = 'ready_for_planning' ORDER BY creation_date ASC"
+
+LAST_PUBLISHED_TITLES_SQL = "SELECT title FROM source_articles WHERE bybit_category_id = ? ORDER BY id DESC LIMIT ?"
+
+IMAGE_GENERATION_TASKS_SQL = """
+SELECT
+    ga.id AS generated_article_id,
+    ga.title,
+    p.image_prompt_style
+FROM generated_articles ga
+JOIN personas p ON ga.persona_id = p.id
+WHERE ga.image_path IS NULL
+"""
+
+TOKEN_MATCHING_TASKS_SQL = "SELECT id, content FROM generated_articles WHERE matched_tokens IS NULL"
+
+# {placeholders} - по "?" на каждый id пачки
+TOKENS_FOR_ARTICLES_SQL = (
+    "SELECT article_id, token FROM article_tokens WHERE article_id IN ({placeholders}) "
+    "ORDER BY article_id, position"
+)
+
+# {period_filter} - ARTICLES_BY_TOKEN_PERIOD_FILTER или пустая строка (за все время);
+# порядок индекса (token, article_id): сортировка не нужна
+ARTICLES_BY_TOKEN_SQL = """
+SELECT ga.id, ga.user_id, ga.persona_id, ga.title, ga.image_path, ga.generation_date
+FROM article_tokens at
+JOIN generated_articles ga ON ga.id = at.article_id
+WHERE at.token = ? {period_filter}
+ORDER BY at.article_id DESC LIMIT ?
+"""
+ARTICLES_BY_TOKEN_PERIOD_FILTER = "AND ga.generation_date >= datetime('now', ?)"
+
+ARTICLES_FOR_DELIVERY_SQL = """
+SELECT
+    ga.id,
+    ga.user_id,
+    ga.title,
+    ga.content,
+    ga.image_path,
+    ga.matched_tokens,
+    t.category,
+    u.username
+FROM generated_articles ga
+JOIN topics t ON ga.topic_id = t.id
+JOIN users u ON ga.user_id = u.id
+WHERE ga.generation_date >= date('now')
+ORDER BY ga.user_id, ga.id
+"""
+
+USER_SUBSCRIPTIONS_SQL = "SELECT id, subscribed_persona_id FROM users WHERE subscribed_persona_id IS NOT NULL"
+
+
 # --- ФУНКЦИИ ДЛЯ ЭТАПА ГЕНЕРАЦИИ ---
 
 def get_generation_tasks() -> list:
@@ -23,74 +140,47 @@ def get_generation_tasks() -> list:
     Возвращает список тем, запланированных для генерации,
     объединяя данные из таблиц topics и personas.
     """
-    conn = get_db_connection()
     try:
         # Используем JOIN, чтобы сразу получить всю нужную информацию
-        sql = """
-        SELECT
-            t.id AS topic_id,
-            t.title,
-            t.source_news_text,
-            t.assigned_user_id,
-            t.assigned_persona_id,
-            p.persona_code,
-            p.provider_name
-        FROM topics t
-        JOIN personas p ON t.assigned_persona_id = p.id
-        WHERE t.status = 'planned_for_generation'
-        """
-        cursor = conn.execute(sql)
-        return [dict(row) for row in cursor.fetchall()]
+        with db_connection('get_generation_tasks') as conn:
+            cursor = conn.execute(GENERATION_TASKS_SQL)
+            return _unpack_rows([dict(row) for row in cursor.fetchall()], 'source_news_text')
     except sqlite3.Error as e:
         print(f"     [DB_ERROR] Ошибка при получении задач на генерацию: {e}")
         return []
-    finally:
-        if conn:
-            conn.close()
 
 def save_generated_article(topic_id: int, user_id: int, persona_id: int, title: str, content: str) -> bool:
     """Сохраняет готовую сгенерированную статью в базу данных."""
-    conn = get_db_connection()
     try:
         sql = """
         INSERT INTO generated_articles (topic_id, user_id, persona_id, title, content)
         VALUES (?, ?, ?, ?, ?)
         """
-        conn.execute(sql, (topic_id, user_id, persona_id, title, content))
-        conn.commit()
+        with db_connection('save_generated_article', write=True) as conn:
+            conn.execute(sql, (topic_id, user_id, persona_id, title, pack_text(content)))
         return True
     except sqlite3.Error as e:
         print(f"     [DB_ERROR] Ошибка при сохранении сгенерированной статьи для topic_id {topic_id}: {e}")
         return False
-    finally:
-        if conn:
-            conn.close()
 
 def get_all_personas() -> list:
     """Возвращает список всех персон из БД."""
-    conn = get_db_connection()
     try:
-        cursor = conn.execute("SELECT * FROM personas")
-        return [dict(row) for row in cursor.fetchall()]
+        with db_connection('get_all_personas') as conn:
+            cursor = conn.execute("SELECT * FROM personas")
+            return [dict(row) for row in cursor.fetchall()]
     except sqlite3.Error as e:
         print(f"     [DB_ERROR] Ошибка при получении списка персон: {e}")
         return []
-    finally:
-        if conn:
-            conn.close()
 
 def update_persona_image_style(persona_id: int, new_style: str):
     """Обновляет стиль для генерации изображений для указанной персоны."""
-    conn = get_db_connection()
     try:
         sql = "UPDATE personas SET image_prompt_style = ? WHERE id = ?"
-        conn.execute(sql, (new_style, persona_id))
-        conn.commit()
+        with db_connection('update_persona_image_style', write=True) as conn:
+            conn.execute(sql, (new_style, persona_id))
     except sqlite3.Error as e:
         print(f"     [DB_ERROR] Ошибка при обновлении стиля изображения для persona_id {persona_id}: {e}")
-    finally:
-        if conn:
-            conn.close()
 
 
 def initialize_database():
@@ -100,6 +190,7 @@ def initialize_database():
     """
     print(f"Проверка и инициализация базы данных '{DB_NAME}'...")
     conn = None
+    base_schema_ready = False
     try:
         conn = sqlite3.connect(DB_NAME)
         cursor = conn.cursor()
@@ -213,6 +304,7 @@ def initialize_database():
 
         conn.commit()
         print("Инициализация базы данных успешно завершена. Все таблицы созданы согласно схеме 2.1.")
+        base_schema_ready = True
 
     except sqlite3.Error as e:
         print(f"Ошибка при инициализации SQLite: {e}")
@@ -222,43 +314,39 @@ def initialize_database():
         if conn:
             conn.close()
 
+    if base_schema_ready:
+        # Все, что появилось после схемы 2.1 (колонки, индексы), добавляют миграции
+        from db_migrations import run_migrations
+        run_migrations()
+
 # --- НОВЫЕ ФУНКЦИИ ДЛЯ РАБОТЫ С ТЕМАМИ ---
 
 def get_topics_by_status(status: str) -> list:
     """Возвращает список тем с указанным статусом."""
-    conn = get_db_connection()
     try:
-        cursor = conn.execute("SELECT * FROM topics WHERE status = ?", (status,))
-        # Преобразуем результат в список словарей для удобства
-        return [dict(row) for row in cursor.fetchall()]
+        with db_connection('get_topics_by_status') as conn:
+            cursor = conn.execute(TOPICS_BY_STATUS_SQL, (status,))
+            # Преобразуем результат в список словарей для удобства
+            return _unpack_rows([dict(row) for row in cursor.fetchall()], 'source_news_text')
     except sqlite3.Error as e:
         print(f"     [DB_ERROR] Ошибка при получении тем по статусу '{status}': {e}")
         return []
-    finally:
-        if conn:
-            conn.close()
 
 def get_last_published_titles(category: str, limit: int = 10) -> list[str]:
     """
     Возвращает список последних заголовков для указанной категории
     из таблицы source_articles (статьи с Bybit).
     """
-    conn = get_db_connection()
     try:
         # ПРИМЕЧАНИЕ: Мы ищем по bybit_category_id, а не по нашему внутреннему 'category'.
         # Это может потребовать доработки, если ID категорий не совпадают.
         # Пока оставляем так, как было в MVP.
-        cursor = conn.execute(
-            "SELECT title FROM source_articles WHERE bybit_category_id = ? ORDER BY id DESC LIMIT ?",
-            (category, limit)
-        )
-        return [row['title'] for row in cursor.fetchall()]
+        with db_connection('get_last_published_titles') as conn:
+            cursor = conn.execute(LAST_PUBLISHED_TITLES_SQL, (category, limit))
+            return [row['title'] for row in cursor.fetchall()]
     except sqlite3.Error as e:
         print(f"     [DB_ERROR] Ошибка при получении заголовков из source_articles: {e}")
         return []
-    finally:
-        if conn:
-            conn.close()
 
 # --- ФУНКЦИИ ДЛЯ ГЕНЕРАЦИИ ИЗОБРАЖЕНИЙ ---
 
@@ -267,67 +355,419 @@ def get_image_generation_tasks() -> list:
     Возвращает список статей, для которых нужно сгенерировать изображение.
     Ищет статьи, где image_path еще не установлен.
     """
-    conn = get_db_connection()
     try:
         # Используем JOIN, чтобы сразу получить и стиль для промпта
-        sql = """
-        SELECT
-            ga.id AS generated_article_id,
-            ga.title,
-            p.image_prompt_style
-        FROM generated_articles ga
-        JOIN personas p ON ga.persona_id = p.id
-        WHERE ga.image_path IS NULL
-        """
-        cursor = conn.execute(sql)
-        return [dict(row) for row in cursor.fetchall()]
+        with db_connection('get_image_generation_tasks') as conn:
+            cursor = conn.execute(IMAGE_GENERATION_TASKS_SQL)
+            return [dict(row) for row in cursor.fetchall()]
     except sqlite3.Error as e:
         print(f"     [DB_ERROR] Ошибка при получении задач на генерацию изображений: {e}")
         return []
-    finally:
-        if conn:
-            conn.close()
 
 def update_article_image_path(generated_article_id: int, image_path: str):
     """Обновляет путь к изображению для сгенерированной статьи."""
-    conn = get_db_connection()
     try:
         sql = "UPDATE generated_articles SET image_path = ? WHERE id = ?"
-        conn.execute(sql, (image_path, generated_article_id))
-        conn.commit()
+        with db_connection('update_article_image_path', write=True) as conn:
+            conn.execute(sql, (image_path, generated_article_id))
     except sqlite3.Error as e:
         print(f"     [DB_ERROR] Ошибка при обновлении пути к изображению для статьи ID {generated_article_id}: {e}")
-    finally:
-        if conn:
-            conn.close()
 
 
 def update_topic_with_title(topic_id: int, new_title: str):
     """Обновляет тему, добавляя ей заголовок и меняя статус на 'ready_for_planning'."""
-    conn = get_db_connection()
     try:
-        conn.execute(
-            "UPDATE topics SET title = ?, status = 'ready_for_planning' WHERE id = ?",
-            (new_title, topic_id)
-        )
-        conn.commit()
+        with db_connection('update_topic_with_title', write=True) as conn:
+            conn.execute(
+                "UPDATE topics SET title = ?, status = 'ready_for_planning' WHERE id = ?",
+                (new_title, topic_id)
+            )
     except sqlite3.Error as e:
         print(f"     [DB_ERROR] Ошибка при обновлении темы {topic_id}: {e}")
-    finally:
-        if conn:
-            conn.close()
 
 def update_topic_status(topic_id: int, new_status: str):
     """Универсальная функция для обновления статуса темы (например, при ошибке)."""
-    conn = get_db_connection()
     try:
-        conn.execute("UPDATE topics SET status = ? WHERE id = ?", (new_status, topic_id))
-        conn.commit()
+        with db_connection('update_topic_status', write=True) as conn:
+            conn.execute("UPDATE topics SET status = ? WHERE id = ?", (new_status, topic_id))
     except sqlite3.Error as e:
         print(f"     [DB_ERROR] Ошибка при обновлении статуса темы {topic_id}: {e}")
-    finally:
-        if conn:
-            conn.close()
+
+# --- ПАКЕТНЫЕ ПЕРЕХОДЫ СОСТОЯНИЙ ---
+# Каждая функция применяет весь список в одной транзакции (executemany) и
+# трогает только строки, которые все еще в ожидаемом состоянии. Поэтому два
+# параллельных запуска этапа не обработают одну и ту же тему дважды.
+
+# Колонки topics, которые можно передать в payload при смене статуса
+TOPIC_PAYLOAD_COLUMNS = ('title', 'assigned_user_id', 'assigned_persona_id')
+
+# Лимит переменных в одном запросе для старых сборок SQLite - 999
+SQL_CHUNK_SIZE = 500
+
+
+def _chunks(items: list, size: int = SQL_CHUNK_SIZE):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def _select_ids_in_state(conn: sqlite3.Connection, table: str, ids: list, condition: str, params: tuple = ()) -> set:
+    """Возвращает подмножество ids, строки которых удовлетворяют condition."""
+    found = set()
+    for chunk in _chunks(ids):
+        placeholders = ", ".join("?" * len(chunk))
+        cursor = conn.execute(
+            f"SELECT id FROM {table} WHERE {condition} AND id IN ({placeholders})",
+            (*params, *chunk)
+        )
+        found.update(row['id'] for row in cursor.fetchall())
+    return found
+
+
+def transition_topics(transitions: list, expected_status: str | None = None, raise_errors: bool = False) -> list[int]:
+    """
+    Пакетно меняет статус тем.
+    transitions - список (topic_id, new_status, payload), где payload - словарь
+    с колонками из TOPIC_PAYLOAD_COLUMNS или None.
+    Если задан expected_status, меняются только темы, которые сейчас в этом статусе.
+    Возвращает список id тем, к которым переход был применен.
+    raise_errors=True - ошибка БД пробрасывается (для WriteBehindBuffer: он повторит пачку).
+    """
+    if not transitions:
+        return []
+
+    # Повторные записи для одной темы отбрасываем: применяется первая
+    unique = {}
+    for topic_id, new_status, payload in transitions:
+        unique.setdefault(topic_id, (new_status, payload or {}))
+
+    for new_status, payload in unique.values():
+        unknown = set(payload) - set(TOPIC_PAYLOAD_COLUMNS)
+        if unknown:
+            raise ValueError(f"Недопустимые колонки в payload для topics: {sorted(unknown)}")
+
+    try:
+        with db_connection('transition_topics', write=True) as conn:
+            if expected_status is not None:
+                applicable = _select_ids_in_state(conn, 'topics', list(unique), "status = ?", (expected_status,))
+            else:
+                applicable = _select_ids_in_state(conn, 'topics', list(unique), "1 = 1")
+
+            # Группируем по набору колонок payload, чтобы на группу был один executemany
+            groups = defaultdict(list)
+            for topic_id, (new_status, payload) in unique.items():
+                if topic_id not in applicable:
+                    continue
+                columns = tuple(sorted(payload))
+                groups[columns].append((new_status, *(payload[c] for c in columns), topic_id))
+
+            for columns, rows in groups.items():
+                set_clause = "".join(f", {column} = ?" for column in columns)
+                sql = f"UPDATE topics SET status = ?{set_clause} WHERE id = ?"
+                conn.executemany(sql, rows)
+        return [topic_id for topic_id in unique if topic_id in applicable]
+    except sqlite3.Error as e:
+        print(f"     [DB_ERROR] Ошибка при пакетной смене статуса {len(unique)} тем: {e}")
+        if raise_errors:
+            raise
+        return []
+
+
+def save_generated_articles_many(articles: list, raise_errors: bool = False) -> dict:
+    """
+    Пакетно сохраняет сгенерированные статьи и переводит их темы в 'article_generated'.
+    articles - список словарей с ключами topic_id, user_id, persona_id, title, content.
+    Сохраняются только статьи, чьи темы все еще в статусе 'planned_for_generation'.
+    Возвращает словарь {topic_id: generated_article_id} для сохраненных статей.
+    raise_errors=True - ошибка БД пробрасывается (см. transition_topics).
+    """
+    if not articles:
+        return {}
+    try:
+        with db_connection('save_generated_articles_many', write=True) as conn:
+            pending = _select_ids_in_state(
+                conn, 'topics', [a['topic_id'] for a in articles], "status = 'planned_for_generation'"
+            )
+            to_insert = []
+            for article in articles:
+                if article['topic_id'] in pending:
+                    pending.discard(article['topic_id'])  # одна статья на тему
+                    to_insert.append(article)
+            if not to_insert:
+                return {}
+
+            conn.executemany(
+                """
+                INSERT INTO generated_articles (topic_id, user_id, persona_id, title, content)
+                VALUES (:topic_id, :user_id, :persona_id, :title, :content)
+                """,
+                ({**article, 'content': pack_text(article['content'])} for article in to_insert)
+            )
+            topic_ids = [a['topic_id'] for a in to_insert]
+            conn.executemany(
+                "UPDATE topics SET status = 'article_generated' WHERE id = ?",
+                ((topic_id,) for topic_id in topic_ids)
+            )
+
+            saved = {}
+            for chunk in _chunks(topic_ids):
+                placeholders = ", ".join("?" * len(chunk))
+                cursor = conn.execute(
+                    f"SELECT topic_id, MAX(id) AS id FROM generated_articles "
+                    f"WHERE topic_id IN ({placeholders}) GROUP BY topic_id",
+                    chunk
+                )
+                saved.update({row['topic_id']: row['id'] for row in cursor.fetchall()})
+        return saved
+    except sqlite3.Error as e:
+        print(f"     [DB_ERROR] Ошибка при пакетном сохранении {len(articles)} статей: {e}")
+        if raise_errors:
+            raise
+        return {}
+
+
+def set_image_paths_many(image_paths: list) -> int:
+    """
+    Пакетно проставляет пути к изображениям: список (generated_article_id, image_path).
+    Уже заполненные image_path не перезаписываются. Возвращает количество обновленных статей.
+    """
+    if not image_paths:
+        return 0
+    try:
+        with db_connection('set_image_paths_many', write=True) as conn:
+            cursor = conn.executemany(
+                "UPDATE generated_articles SET image_path = ? WHERE id = ? AND image_path IS NULL",
+                ((path, article_id) for article_id, path in image_paths)
+            )
+            return cursor.rowcount
+    except sqlite3.Error as e:
+        print(f"     [DB_ERROR] Ошибка при пакетном обновлении {len(image_paths)} путей к изображениям: {e}")
+        return 0
+
+
+def set_article_tokens_many(article_tokens: list, raise_errors: bool = False) -> int:
+    """
+    Пакетно сохраняет подобранные токены: список (generated_article_id, [токены]).
+    Токены пишутся в article_tokens; matched_tokens получает JSON-копию списка - это отметка
+    "токены подобраны" для очереди token_matcher и копия, которая уходит в архив вместе со статьей.
+    Статьи, для которых токены уже подобраны, пропускаются. Возвращает количество обновленных статей.
+    raise_errors=True - ошибка БД пробрасывается (см. transition_topics).
+    """
+    if not article_tokens:
+        return 0
+    try:
+        with db_connection('set_article_tokens_many', write=True) as conn:
+            pending = _select_ids_in_state(
+                conn, 'generated_articles', [article_id for article_id, _ in article_tokens], "matched_tokens IS NULL"
+            )
+            updated = 0
+            for article_id, tokens in article_tokens:
+                if article_id not in pending:
+                    continue
+                pending.discard(article_id)
+                normalized = normalize_tokens(tokens)
+                conn.execute("UPDATE generated_articles SET matched_tokens = ? WHERE id = ?",
+                             (json.dumps(normalized), article_id))
+                conn.executemany(
+                    "INSERT OR IGNORE INTO article_tokens (article_id, token, position) VALUES (?, ?, ?)",
+                    ((article_id, token, position) for position, token in enumerate(normalized))
+                )
+                updated += 1
+            return updated
+    except sqlite3.Error as e:
+        print(f"     [DB_ERROR] Ошибка при пакетном сохранении токенов для {len(article_tokens)} статей: {e}")
+        if raise_errors:
+            raise
+        return 0
+
+# --- СВЯЗЬ СТАТЬЯ-ТОКЕН (таблица article_tokens, см. миграцию 006) ---
+
+def normalize_tokens(tokens: list) -> list[str]:
+    """Приводит тикеры к верхнему регистру, убирает пустые значения и повторы, сохраняя порядок."""
+    return list(dict.fromkeys(str(t).strip().upper() for t in tokens if str(t).strip()))
+
+
+def _fetch_tokens(conn: sqlite3.Connection, article_ids: list) -> dict:
+    tokens = defaultdict(list)
+    for chunk in _chunks(list(article_ids)):
+        placeholders = ", ".join("?" * len(chunk))
+        cursor = conn.execute(TOKENS_FOR_ARTICLES_SQL.format(placeholders=placeholders), chunk)
+        for row in cursor.fetchall():
+            tokens[row['article_id']].append(row['token'])
+    return tokens
+
+
+def get_tokens_for_articles(article_ids: list) -> dict:
+    """Возвращает {article_id: [токены в порядке подбора]} для переданных статей."""
+    try:
+        with db_connection('get_tokens_for_articles') as conn:
+            return dict(_fetch_tokens(conn, article_ids))
+    except sqlite3.Error as e:
+        print(f"     [DB_ERROR] Ошибка при получении токенов для {len(article_ids)} статей: {e}")
+        return {}
+
+
+def get_article_tokens(article_id: int) -> list[str]:
+    """Возвращает токены одной статьи."""
+    return get_tokens_for_articles([article_id]).get(article_id, [])
+
+
+def get_articles_by_token(token: str, days: int | None = 7, limit: int = 100) -> list:
+    """
+    Статьи, в которых упоминается токен ("все статьи про SOL за неделю"), новые первыми.
+    days=None - за все время (в пределах основной БД; архивные статьи -
+    db_archive.get_articles_history(..., token=...)).
+    """
+    params = [token.strip().upper()]
+    period_filter = ''
+    if days is not None:
+        period_filter = ARTICLES_BY_TOKEN_PERIOD_FILTER
+        params.append(f"-{days} days")
+    sql = ARTICLES_BY_TOKEN_SQL.format(period_filter=period_filter)
+    params.append(limit)
+    try:
+        with db_connection('get_articles_by_token') as conn:
+            return [dict(row) for row in conn.execute(sql, params).fetchall()]
+    except sqlite3.Error as e:
+        print(f"     [DB_ERROR] Ошибка при поиске статей по токену '{token}': {e}")
+        return []
+
+
+def get_token_mention_counts(days: int = 7, limit: int = 20) -> list:
+    """Самые упоминаемые токены за последние days дней: [(токен, число статей), ...]."""
+    sql = """
+    SELECT at.token, COUNT(*) AS articles
+    FROM generated_articles ga
+    JOIN article_tokens at ON at.article_id = ga.id
+    WHERE ga.generation_date >= datetime('now', ?)
+    GROUP BY at.token
+    ORDER BY articles DESC, at.token
+    LIMIT ?
+    """
+    try:
+        with db_connection('get_token_mention_counts') as conn:
+            return [(row['token'], row['articles']) for row in conn.execute(sql, (f"-{days} days", limit))]
+    except sqlite3.Error as e:
+        print(f"     [DB_ERROR] Ошибка при подсчете упоминаний токенов: {e}")
+        return []
+
+# --- ПОЛНОТЕКСТОВЫЙ ПОИСК (FTS5, см. миграцию 004 в db_migrations.py) ---
+
+WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def _significant_words(text: str, min_length: int = 4) -> set:
+    """Множество значимых слов текста (в нижнем регистре, без коротких служебных слов)."""
+    return {w for w in WORD_RE.findall(text.lower()) if len(w) >= min_length}
+
+
+def build_fts_query(text: str, operator: str = 'AND') -> str:
+    """
+    Превращает произвольный текст в безопасный запрос FTS5: каждое слово берется
+    в кавычки (синтаксис FTS внутри текста игнорируется) и соединяется через operator.
+    """
+    words = list(dict.fromkeys(WORD_RE.findall(text.lower())))
+    return f" {operator} ".join(f'"{w}"' for w in words)
+
+
+def _fts_search(fts_table: str, select_sql: str, query: str, page: int, page_size: int, raw: bool) -> dict:
+    fts_query = query if raw else build_fts_query(query)
+    result = {'query': fts_query, 'page': page, 'page_size': page_size, 'total': 0, 'results': []}
+    if not fts_query:
+        return result
+    try:
+        with db_connection('_fts_search') as conn:
+            result['total'] = conn.execute(
+                f"SELECT COUNT(*) FROM {fts_table} WHERE {fts_table} MATCH ?", (fts_query,)
+            ).fetchone()[0]
+            cursor = conn.execute(select_sql, (fts_query, page_size, (page - 1) * page_size))
+            result['results'] = [dict(row) for row in cursor.fetchall()]
+    except sqlite3.Error as e:
+        print(f"     [DB_ERROR] Ошибка полнотекстового поиска по {fts_table} ('{fts_query}'): {e}")
+    return result
+
+
+def search_articles(query: str, page: int = 1, page_size: int = 20, raw: bool = False) -> dict:
+    """
+    Ищет по заголовкам и текстам сгенерированных статей.
+    Результаты отсортированы по релевантности (bm25, совпадение в заголовке весит больше)
+    и содержат фрагмент текста с подсвеченными [совпадениями].
+    raw=True - query передается в FTS5 как есть (фразы "...", NEAR, OR, префиксы*).
+    Возвращает {'query', 'page', 'page_size', 'total', 'results': [...]}.
+    """
+    sql = """
+    SELECT
+        ga.id,
+        ga.title,
+        ga.user_id,
+        ga.persona_id,
+        ga.generation_date,
+        snippet(generated_articles_fts, 1, '[', ']', '…', 16) AS snippet,
+        bm25(generated_articles_fts, 5.0, 1.0) AS rank
+    FROM generated_articles_fts
+    JOIN generated_articles ga ON ga.id = generated_articles_fts.rowid
+    WHERE generated_articles_fts MATCH ?
+    ORDER BY rank
+    LIMIT ? OFFSET ?
+    """
+    return _fts_search('generated_articles_fts', sql, query, page, page_size, raw)
+
+
+def search_topics(query: str, page: int = 1, page_size: int = 20, raw: bool = False) -> dict:
+    """Ищет по заголовкам и исходным текстам новостей в topics. Формат ответа как у search_articles."""
+    sql = """
+    SELECT
+        t.id,
+        t.title,
+        t.category,
+        t.status,
+        t.creation_date,
+        snippet(topics_fts, 1, '[', ']', '…', 16) AS snippet,
+        bm25(topics_fts, 5.0, 1.0) AS rank
+    FROM topics_fts
+    JOIN topics t ON t.id = topics_fts.rowid
+    WHERE topics_fts MATCH ?
+    ORDER BY rank
+    LIMIT ? OFFSET ?
+    """
+    return _fts_search('topics_fts', sql, query, page, page_size, raw)
+
+
+def find_covered_topics(news_text: str, days: int = 14, min_similarity: float = 0.6,
+                        candidates: int = 20) -> list:
+    """
+    Быстрая проверка "эта история уже была?".
+    FTS5 отбирает кандидатов среди тем за последние days дней по самым длинным словам новости,
+    затем для каждого кандидата считается сходство Жаккара по множествам значимых слов.
+    Возвращает темы со сходством >= min_similarity, самые похожие первыми.
+    """
+    words = _significant_words(news_text)
+    if not words:
+        return []
+    fts_query = build_fts_query(" ".join(sorted(words, key=len, reverse=True)[:16]), operator='OR')
+    sql = """
+    SELECT t.id, t.title, t.category, t.status, t.source_news_text, t.creation_date
+    FROM topics_fts
+    JOIN topics t ON t.id = topics_fts.rowid
+    WHERE topics_fts MATCH ? AND t.creation_date >= datetime('now', ?)
+    ORDER BY bm25(topics_fts)
+    LIMIT ?
+    """
+    try:
+        with db_connection('find_covered_topics') as conn:
+            rows = [dict(row) for row in conn.execute(sql, (fts_query, f"-{days} days", candidates)).fetchall()]
+    except sqlite3.Error as e:
+        print(f"     [DB_ERROR] Ошибка при поиске похожих тем: {e}")
+        return []
+
+    covered = []
+    for row in rows:
+        candidate_words = _significant_words(unpack_text(row.pop('source_news_text')) or "")
+        similarity = len(words & candidate_words) / len(words | candidate_words)
+        if similarity >= min_similarity:
+            row['similarity'] = round(similarity, 3)
+            covered.append(row)
+    covered.sort(key=lambda r: r['similarity'], reverse=True)
+    return covered
 
 # --- НОВАЯ ФУНКЦИЯ ДЛЯ СБОРКИ ДОКУМЕНТОВ ---
 
@@ -336,36 +776,266 @@ def get_articles_for_delivery() -> dict:
     Возвращает словарь {user_id: [article_1, article_2, ...]}
     для всех статей, сгенерированных сегодня.
     """
-    conn = get_db_connection()
     articles_by_user = defaultdict(list)
     try:
         # Ищем статьи, сгенерированные за последние 24 часа
-        sql = """
-        SELECT
-            ga.id,
-            ga.user_id,
-            ga.title,
-            ga.content,
-            ga.image_path,
-            ga.matched_tokens,
-            t.category,
-            u.username
-        FROM generated_articles ga
-        JOIN topics t ON ga.topic_id = t.id
-        JOIN users u ON ga.user_id = u.id
-        WHERE ga.generation_date >= date('now')
-        ORDER BY ga.user_id, ga.id
-        """
-        cursor = conn.execute(sql)
-        for row in cursor.fetchall():
-            articles_by_user[row['user_id']].append(dict(row))
+        with db_connection('get_articles_for_delivery') as conn:
+            articles = [dict(row) for row in conn.execute(ARTICLES_FOR_DELIVERY_SQL).fetchall()]
+            tokens = _fetch_tokens(conn, [a['id'] for a in articles])
+        for article in articles:
+            article['content'] = unpack_text(article['content'])
+            # Список токенов; None - токены для статьи еще не подбирались
+            article['matched_tokens'] = tokens.get(article['id'], []) if article['matched_tokens'] is not None else None
+            articles_by_user[article['user_id']].append(article)
         return dict(articles_by_user)
     except sqlite3.Error as e:
         print(f"     [DB_ERROR] Ошибка при получении статей для доставки: {e}")
         return {}
-    finally:
-        if conn:
-            conn.close()
+
+# --- ЧЕКПОИНТЫ ЕЖЕДНЕВНОГО КОНВЕЙЕРА ---
+# Один прогон (pipeline_runs) на целевую дату, по строке stage_runs на этап.
+# Ошибки записи чекпоинтов не останавливают конвейер: он просто не сможет продолжиться с места сбоя.
+
+def start_pipeline_run(target_date: str, resume: bool = False) -> int | None:
+    """
+    Открывает прогон на целевую дату и возвращает его id. Без resume состояние этапов
+    прошлых попыток сбрасывается, с resume - сохраняется для пропуска завершенных этапов.
+    """
+    try:
+        with db_connection('start_pipeline_run', write=True) as conn:
+            conn.execute("""
+                INSERT INTO pipeline_runs (target_date, status, attempts, started_at)
+                VALUES (?, 'running', 1, CURRENT_TIMESTAMP)
+                ON CONFLICT (target_date) DO UPDATE SET
+                    status = 'running', attempts = attempts + 1,
+                    started_at = CURRENT_TIMESTAMP, finished_at = NULL
+            """, (target_date,))
+            run_id = conn.execute("SELECT id FROM pipeline_runs WHERE target_date = ?", (target_date,)).fetchone()['id']
+            if not resume:
+                conn.execute("DELETE FROM stage_runs WHERE run_id = ?", (run_id,))
+            return run_id
+    except sqlite3.Error as e:
+        print(f"     [DB_ERROR] Не удалось открыть прогон конвейера за {target_date}: {e}")
+        return None
+
+
+def get_completed_stages(run_id: int) -> dict:
+    """Возвращает {этап: артефакт} для этапов прогона, завершившихся успешно или с предупреждением."""
+    try:
+        with db_connection('get_completed_stages') as conn:
+            rows = conn.execute(
+                "SELECT stage, artifact FROM stage_runs WHERE run_id = ? AND status IN ('ok', 'warning')",
+                (run_id,)
+            ).fetchall()
+        return {row['stage']: json.loads(row['artifact']) if row['artifact'] else None for row in rows}
+    except (sqlite3.Error, json.JSONDecodeError) as e:
+        print(f"     [DB_ERROR] Ошибка при чтении чекпоинтов прогона {run_id}: {e}")
+        return {}
+
+
+def record_stage_run(run_id: int, stage: str, status: str, started_at: str, finished_at: str,
+                     duration_sec: float, error: str | None = None, artifact: str | None = None):
+    """Сохраняет результат этапа (artifact - JSON результата). Повторная попытка перезаписывает прошлую."""
+    try:
+        with db_connection('record_stage_run', write=True) as conn:
+            conn.execute("""
+                INSERT INTO stage_runs (run_id, stage, status, attempt, started_at, finished_at, duration_sec, error, artifact)
+                VALUES (?, ?, ?, (SELECT attempts FROM pipeline_runs WHERE id = ?), ?, ?, ?, ?, ?)
+                ON CONFLICT (run_id, stage) DO UPDATE SET
+                    status = excluded.status, attempt = excluded.attempt,
+                    started_at = excluded.started_at, finished_at = excluded.finished_at,
+                    duration_sec = excluded.duration_sec, error = excluded.error, artifact = excluded.artifact
+            """, (run_id, stage, status, run_id, started_at, finished_at, duration_sec, error or None, artifact))
+    except sqlite3.Error as e:
+        print(f"     [DB_ERROR] Не удалось сохранить чекпоинт этапа {stage}: {e}")
+
+
+def finish_pipeline_run(run_id: int, status: str):
+    try:
+        with db_connection('finish_pipeline_run', write=True) as conn:
+            conn.execute("UPDATE pipeline_runs SET status = ?, finished_at = CURRENT_TIMESTAMP WHERE id = ?",
+                         (status, run_id))
+    except sqlite3.Error as e:
+        print(f"     [DB_ERROR] Не удалось закрыть прогон конвейера {run_id}: {e}")
+
+
+def get_pipeline_run(target_date: str) -> dict | None:
+    """Прогон на целевую дату вместе с этапами (для просмотра состояния перед --resume)."""
+    try:
+        with db_connection('get_pipeline_run') as conn:
+            run = conn.execute("SELECT * FROM pipeline_runs WHERE target_date = ?", (target_date,)).fetchone()
+            if run is None:
+                return None
+            stages = conn.execute(
+                "SELECT * FROM stage_runs WHERE run_id = ? ORDER BY started_at", (run['id'],)
+            ).fetchall()
+        return {**dict(run), 'stages': [dict(row) for row in stages]}
+    except sqlite3.Error as e:
+        print(f"     [DB_ERROR] Ошибка при чтении прогона за {target_date}: {e}")
+        return None
+
+
+def get_delivered_users(delivery_date: str) -> set:
+    """Пользователи, которым дайджест за delivery_date уже успешно отправлен."""
+    try:
+        with db_connection('get_delivered_users') as conn:
+            cursor = conn.execute(
+                "SELECT DISTINCT user_id FROM delivery_log WHERE delivery_date = ? AND status = 'delivered'",
+                (delivery_date,)
+            )
+            return {row['user_id'] for row in cursor.fetchall()}
+    except sqlite3.Error as e:
+        print(f"     [DB_ERROR] Ошибка при чтении журнала доставки за {delivery_date}: {e}")
+        return set()
+
+
+def log_deliveries(delivery_date: str, deliveries: list) -> int:
+    """Пакетно пишет журнал доставки: список (user_id, planned_count, actual_count, status)."""
+    if not deliveries:
+        return 0
+    try:
+        with db_connection('log_deliveries', write=True) as conn:
+            cursor = conn.executemany(
+                "INSERT INTO delivery_log (delivery_date, user_id, planned_count, actual_count, status) "
+                "VALUES (?, ?, ?, ?, ?)",
+                ((delivery_date, *delivery) for delivery in deliveries)
+            )
+            return cursor.rowcount
+    except sqlite3.Error as e:
+        print(f"     [DB_ERROR] Ошибка при записи журнала доставки: {e}")
+        return 0
+
+
+def get_existing_source_keys(source_keys: list) -> set:
+    """Какие из ключей исходных новостей уже есть в topics (повторный запуск topic_rebalancer)."""
+    found = set()
+    try:
+        with db_connection('get_existing_source_keys') as conn:
+            for chunk in _chunks(list(source_keys)):
+                placeholders = ", ".join("?" * len(chunk))
+                cursor = conn.execute(f"SELECT source_key FROM topics WHERE source_key IN ({placeholders})", chunk)
+                found.update(row['source_key'] for row in cursor.fetchall())
+        return found
+    except sqlite3.Error as e:
+        print(f"     [DB_ERROR] Ошибка при проверке уже сохраненных тем: {e}")
+        return found
+
+
+def delete_unprocessed_topics(source_keys: list) -> int:
+    """
+    Удаляет темы с указанными ключами, которые еще ждут заголовка (status = 'needs_title'),
+    чтобы topic_rebalancer создал их заново. Темы, ушедшие дальше по конвейеру, не трогаются.
+    """
+    deleted = 0
+    try:
+        with db_connection('delete_unprocessed_topics', write=True) as conn:
+            for chunk in _chunks(list(source_keys)):
+                placeholders = ", ".join("?" * len(chunk))
+                cursor = conn.execute(
+                    f"DELETE FROM topics WHERE status = 'needs_title' AND source_key IN ({placeholders})", chunk)
+                deleted += cursor.rowcount
+        return deleted
+    except sqlite3.Error as e:
+        print(f"     [DB_ERROR] Ошибка при удалении устаревших тем: {e}")
+        return deleted
+
+
+# --- КЭШ РЕЗУЛЬТАТОВ ЭТАПОВ (таблица stage_cache, см. миграцию 008 и stage_cache.py) ---
+
+def get_stage_cache_entry(stage: str, input_hash: str) -> dict | None:
+    try:
+        with db_connection('get_stage_cache_entry') as conn:
+            row = conn.execute("SELECT * FROM stage_cache WHERE stage = ? AND input_hash = ?",
+                               (stage, input_hash)).fetchone()
+        return dict(row) if row else None
+    except sqlite3.Error as e:
+        print(f"     [DB_ERROR] Ошибка при чтении кэша этапа {stage}: {e}")
+        return None
+
+
+def get_latest_stage_cache_entry(stage: str, target_date: str) -> dict | None:
+    """Последний сохраненный результат этапа за дату (с любым хешем входов)."""
+    try:
+        with db_connection('get_latest_stage_cache_entry') as conn:
+            row = conn.execute(
+                "SELECT * FROM stage_cache WHERE stage = ? AND target_date = ? ORDER BY created_at DESC LIMIT 1",
+                (stage, target_date)
+            ).fetchone()
+        return dict(row) if row else None
+    except sqlite3.Error as e:
+        print(f"     [DB_ERROR] Ошибка при чтении кэша этапа {stage}: {e}")
+        return None
+
+
+def save_stage_cache_entry(stage: str, input_hash: str, target_date: str | None, output_hash: str,
+                           output_path: str | None):
+    try:
+        with db_connection('save_stage_cache_entry', write=True) as conn:
+            conn.execute("""
+                INSERT INTO stage_cache (stage, input_hash, target_date, output_hash, output_path)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (stage, input_hash) DO UPDATE SET
+                    target_date = excluded.target_date, output_hash = excluded.output_hash,
+                    output_path = excluded.output_path, created_at = CURRENT_TIMESTAMP
+            """, (stage, input_hash, target_date, output_hash, output_path))
+    except sqlite3.Error as e:
+        print(f"     [DB_ERROR] Не удалось сохранить кэш этапа {stage}: {e}")
+
+
+def mark_stage_cache_hit(stage: str, input_hash: str):
+    try:
+        with db_connection('mark_stage_cache_hit', write=True) as conn:
+            conn.execute(
+                "UPDATE stage_cache SET hits = hits + 1, last_hit_at = CURRENT_TIMESTAMP "
+                "WHERE stage = ? AND input_hash = ?", (stage, input_hash))
+    except sqlite3.Error as e:
+        print(f"     [DB_ERROR] Ошибка при обновлении кэша этапа {stage}: {e}")
+
+
+def delete_stage_cache_entries(stage: str | None = None, target_date: str | None = None) -> list[str]:
+    """Удаляет записи кэша (все или по этапу/дате). Возвращает хеши результатов удаленных записей."""
+    conditions, params = [], []
+    if stage:
+        conditions.append("stage = ?")
+        params.append(stage)
+    if target_date:
+        conditions.append("target_date = ?")
+        params.append(target_date)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    try:
+        with db_connection('delete_stage_cache_entries', write=True) as conn:
+            hashes = [row['output_hash'] for row in
+                      conn.execute(f"SELECT output_hash FROM stage_cache {where}", params).fetchall()]
+            conn.execute(f"DELETE FROM stage_cache {where}", params)
+        return hashes
+    except sqlite3.Error as e:
+        print(f"     [DB_ERROR] Ошибка при очистке кэша этапов: {e}")
+        return []
+
+
+def get_stage_cache_stats() -> list[dict]:
+    """Число записей и попаданий кэша по этапам."""
+    try:
+        with db_connection('get_stage_cache_stats') as conn:
+            rows = conn.execute("""
+                SELECT stage, COUNT(*) AS entries, SUM(hits) AS hits, MAX(created_at) AS last_saved,
+                       MAX(last_hit_at) AS last_hit
+                FROM stage_cache GROUP BY stage ORDER BY stage
+            """).fetchall()
+        return [dict(row) for row in rows]
+    except sqlite3.Error as e:
+        print(f"     [DB_ERROR] Ошибка при чтении статистики кэша этапов: {e}")
+        return []
+
+
+def get_stage_cache_output_hashes() -> set:
+    try:
+        with db_connection('get_stage_cache_output_hashes') as conn:
+            return {row['output_hash'] for row in conn.execute("SELECT output_hash FROM stage_cache").fetchall()}
+    except sqlite3.Error as e:
+        print(f"     [DB_ERROR] Ошибка при чтении кэша этапов: {e}")
+        return set()
+
 
 if __name__ == "__main__":
     initialize_database()
\ No newline at end of file
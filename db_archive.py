@@ -0,0 +1,404 @@
+import os
+import json
+import time
+import sqlite3
+import argparse
+from collections import defaultdict
+from contextlib import contextmanager
+
+import database_manager
+from db_pool import DB_CONFIG_FILE, get_pool
+from db_migrations import open_migration_connection, load_migration_settings
+
+'''
+Архивация "холодных" данных: строки старше max_age_days переносятся из topics,
+generated_articles и delivery_log основной БД в помесячные архивные файлы
+(archive/neuro_crypto_2025_01.db и т.д.). Основная БД остается маленькой,
+а запросы этапов конвейера не проходят по накопленной за годы истории.
+
+Перенос идет пачками и в два шага: сначала строки копируются в архив (INSERT OR IGNORE)
+и архив коммитится, затем из основной БД удаляются только те id, которые уже есть в архиве.
+Прерванный запуск можно безопасно повторить.
+Вместе со статьями в тот же архив копируются их строки article_tokens (DEPENDENT_TABLES):
+в основной БД их удаляет ON DELETE CASCADE. В архивах, созданных до этого, связи
+восстанавливаются из JSON generated_articles.matched_tokens при следующем запуске run.
+
+Исторические запросы: attached_archives() подключает нужные архивы через ATTACH и создает
+временные представления all_topics / all_generated_articles / all_delivery_log / all_article_tokens
+(основная БД + архивы).
+Полнотекстовый поиск (FTS) работает только по основной БД.
+
+Запуск:
+    python db_archive.py run [--days 90] [--dry-run]   # перенести старые строки и освободить место
+    python db_archive.py list                          # список архивов
+    python db_archive.py history --from 2025-01-01 --to 2025-03-31 [--user 123] [--token SOL]
+'''
+
+DEFAULT_ARCHIVE_SETTINGS = {
+    "directory": "archive",
+    "max_age_days": 90,
+    "vacuum": "incremental",          # incremental | full | none
+    "incremental_vacuum_pages": 2000  # страниц за один шаг incremental_vacuum
+}
+
+ACTIVE_TOPIC_STATUSES = ('needs_title', 'ready_for_planning', 'planned_for_generation')
+
+# Таблица -> колонка с датой, по которой строка попадает в месячный архив
+ARCHIVED_TABLES = {
+    'generated_articles': 'generation_date',
+    'topics': 'creation_date',
+    'delivery_log': 'delivery_date',
+}
+# Таблица -> {зависимая таблица: колонка-ссылка}: строки, которые удалит ON DELETE CASCADE,
+# копируются в архив вместе с родительскими
+DEPENDENT_TABLES = {
+    'generated_articles': {'article_tokens': 'article_id'},
+}
+# Ключ строки в архиве (для INSERT OR IGNORE при повторном запуске), по умолчанию - id
+ARCHIVE_KEYS = {
+    'article_tokens': ('article_id', 'token'),
+}
+
+
+def load_archive_settings() -> dict:
+    settings = dict(DEFAULT_ARCHIVE_SETTINGS)
+    try:
+        with open(DB_CONFIG_FILE, 'r', encoding='utf-8') as f:
+            settings.update(json.load(f).get('archive', {}))
+    except (FileNotFoundError, json.JSONDecodeError):
+        pass
+    if settings['vacuum'] not in ('incremental', 'full', 'none'):
+        raise ValueError(f"Недопустимое значение archive.vacuum: {settings['vacuum']}")
+    return settings
+
+
+def archive_path(month: str, settings: dict | None = None) -> str:
+    settings = settings or load_archive_settings()
+    base_name = os.path.splitext(os.path.basename(database_manager.DB_NAME))[0]
+    return os.path.join(settings['directory'], f"{base_name}_{month}.db")
+
+
+def list_archives() -> dict:
+    """Возвращает {'2025_01': путь, ...} для существующих архивов, по возрастанию месяца."""
+    settings = load_archive_settings()
+    directory = settings['directory']
+    prefix = os.path.splitext(os.path.basename(database_manager.DB_NAME))[0] + "_"
+    if not os.path.isdir(directory):
+        return {}
+    archives = {}
+    for filename in sorted(os.listdir(directory)):
+        if filename.startswith(prefix) and filename.endswith('.db'):
+            archives[filename[len(prefix):-3]] = os.path.join(directory, filename)
+    return archives
+
+
+def file_size(path: str) -> int:
+    """Размер БД вместе с WAL-файлом."""
+    return sum(os.path.getsize(p) for p in (path, path + '-wal') if os.path.exists(p))
+
+
+# --- Перенос строк ---
+
+def get_columns(conn: sqlite3.Connection, schema: str, table: str) -> list[str]:
+    return [row[1] for row in conn.execute(f"PRAGMA {schema}.table_info({table})")]
+
+
+def ensure_archive_table(conn: sqlite3.Connection, table: str):
+    """Создает таблицу в архиве по образцу основной и добавляет колонки, появившиеся после миграций."""
+    key = ARCHIVE_KEYS.get(table, ('id',))
+    conn.execute(f"CREATE TABLE IF NOT EXISTS arch.{table} AS SELECT * FROM main.{table} WHERE 0")
+    conn.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS arch.idx_{table}_{'_'.join(key)} ON {table} ({', '.join(key)})")
+    archived_columns = set(get_columns(conn, 'arch', table))
+    for column in get_columns(conn, 'main', table):
+        if column not in archived_columns:
+            conn.execute(f"ALTER TABLE arch.{table} ADD COLUMN {column}")
+
+
+def select_candidates(conn: sqlite3.Connection, table: str, cutoff: str) -> dict:
+    """Возвращает {месяц: [id, ...]} строк таблицы, которые пора архивировать."""
+    date_column = ARCHIVED_TABLES[table]
+    sql = f"SELECT id, strftime('%Y_%m', {date_column}) AS month FROM {table} WHERE {date_column} < ?"
+    params = [cutoff]
+    if table == 'topics':
+        # Тема уходит в архив, только если она не в работе и все ее статьи уже в архиве
+        # (иначе ON DELETE CASCADE удалил бы оставшиеся статьи)
+        placeholders = ", ".join("?" * len(ACTIVE_TOPIC_STATUSES))
+        sql += (f" AND status NOT IN ({placeholders})"
+                f" AND NOT EXISTS (SELECT 1 FROM generated_articles ga WHERE ga.topic_id = topics.id)")
+        params += ACTIVE_TOPIC_STATUSES
+    by_month = defaultdict(list)
+    for row in conn.execute(sql, params):
+        by_month[row['month'] or 'unknown'].append(row['id'])
+    return by_month
+
+
+def move_batch(conn: sqlite3.Connection, table: str, ids: list) -> int:
+    """Копирует строки в подключенный архив, затем удаляет из основной БД те, что точно скопированы."""
+    columns = ", ".join(get_columns(conn, 'main', table))
+    placeholders = ", ".join("?" * len(ids))
+
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute(f"INSERT OR IGNORE INTO arch.{table} ({columns}) "
+                     f"SELECT {columns} FROM main.{table} WHERE id IN ({placeholders})", ids)
+        # Зависимые строки - в той же транзакции: к удалению строка готова, только когда скопировано все
+        for dependent, reference in DEPENDENT_TABLES.get(table, {}).items():
+            dependent_columns = ", ".join(get_columns(conn, 'main', dependent))
+            conn.execute(f"INSERT OR IGNORE INTO arch.{dependent} ({dependent_columns}) "
+                         f"SELECT {dependent_columns} FROM main.{dependent} WHERE {reference} IN ({placeholders})", ids)
+        conn.execute("COMMIT")
+    except sqlite3.Error:
+        conn.execute("ROLLBACK")
+        raise
+
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        cursor = conn.execute(
+            f"DELETE FROM main.{table} WHERE id IN ({placeholders}) "
+            f"AND id IN (SELECT id FROM arch.{table} WHERE id IN ({placeholders}))", ids + ids
+        )
+        conn.execute("COMMIT")
+    except sqlite3.Error:
+        conn.execute("ROLLBACK")
+        raise
+    return cursor.rowcount
+
+
+def restore_archived_tokens(conn: sqlite3.Connection) -> int:
+    """
+    Архивы, созданные до копирования article_tokens, потеряли связи статья-токен (их удалил каскад).
+    Связи восстанавливаются из JSON generated_articles.matched_tokens, как в миграции 006.
+    """
+    if not get_columns(conn, 'arch', 'generated_articles'):
+        return 0
+    if 'matched_tokens' not in get_columns(conn, 'arch', 'generated_articles'):
+        return 0
+    ensure_archive_table(conn, 'article_tokens')
+    cursor = conn.execute("""
+        INSERT OR IGNORE INTO arch.article_tokens (article_id, token, position)
+        SELECT ga.id, upper(trim(je.value)), je.key
+        FROM arch.generated_articles ga, json_each(ga.matched_tokens) je
+        WHERE ga.matched_tokens IS NOT NULL
+          AND json_valid(ga.matched_tokens)
+          AND trim(je.value) != ''
+          AND NOT EXISTS (SELECT 1 FROM arch.article_tokens at WHERE at.article_id = ga.id)
+    """)
+    conn.commit()
+    return cursor.rowcount
+
+
+def copy_dictionaries(conn: sqlite3.Connection):
+    """Архив должен читаться сам по себе, поэтому словари сжатия копируются вместе с данными."""
+    conn.execute("CREATE TABLE IF NOT EXISTS arch.compression_dictionaries AS "
+                 "SELECT * FROM main.compression_dictionaries WHERE 0")
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS arch.idx_compression_dictionaries_id "
+                 "ON compression_dictionaries (id)")
+    conn.execute("INSERT OR IGNORE INTO arch.compression_dictionaries SELECT * FROM main.compression_dictionaries")
+
+
+def reclaim_space(conn: sqlite3.Connection, mode: str, pages_per_step: int) -> str:
+    """Возвращает освобожденные страницы файлу: incremental_vacuum по шагам или полный VACUUM."""
+    if mode == 'none':
+        return "пропущено"
+    auto_vacuum = conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+    if mode == 'full' or auto_vacuum != 2:
+        if mode == 'incremental':
+            # auto_vacuum меняется только полным VACUUM - это разовая операция
+            print("     [INFO] Включаем auto_vacuum=INCREMENTAL (разовый полный VACUUM)...")
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        start = time.perf_counter()
+        conn.execute("VACUUM")
+        return f"VACUUM за {time.perf_counter() - start:.1f} сек"
+
+    steps = 0
+    start = time.perf_counter()
+    while conn.execute("PRAGMA freelist_count").fetchone()[0] > 0:
+        # Через execute() PRAGMA освобождает одну страницу за шаг курсора; executescript доводит ее до конца
+        conn.executescript(f"PRAGMA incremental_vacuum({pages_per_step})")
+        steps += 1
+        time.sleep(load_migration_settings()['pause_between_batches_ms'] / 1000)
+    return f"incremental_vacuum: {steps} шагов за {time.perf_counter() - start:.1f} сек"
+
+
+def run_archival(max_age_days: int | None = None, dry_run: bool = False) -> bool:
+    """Переносит старые строки в помесячные архивы и печатает отчет об освобожденном месте."""
+    settings = load_archive_settings()
+    max_age_days = max_age_days or settings['max_age_days']
+    batch_size = load_migration_settings()['batch_size']
+    db_path = database_manager.DB_NAME
+    print(f"  -> Архивация строк старше {max_age_days} дней из '{db_path}'...")
+
+    conn = open_migration_connection()
+    conn.execute("PRAGMA foreign_keys = ON")
+    size_before = file_size(db_path)
+    cutoff = conn.execute("SELECT datetime('now', ?)", (f"-{max_age_days} days",)).fetchone()[0]
+    report = defaultdict(dict)
+    try:
+        # Порядок важен: сначала статьи, затем их темы
+        for table in ARCHIVED_TABLES:
+            for month, ids in sorted(select_candidates(conn, table, cutoff).items()):
+                if dry_run:
+                    report[month][table] = len(ids)
+                    continue
+                os.makedirs(settings['directory'], exist_ok=True)
+                conn.execute("ATTACH DATABASE ? AS arch", (archive_path(month, settings),))
+                try:
+                    ensure_archive_table(conn, table)
+                    for dependent in DEPENDENT_TABLES.get(table, {}):
+                        ensure_archive_table(conn, dependent)
+                    copy_dictionaries(conn)
+                    moved = 0
+                    for i in range(0, len(ids), batch_size):
+                        moved += move_batch(conn, table, ids[i:i + batch_size])
+                finally:
+                    conn.execute("DETACH DATABASE arch")
+                report[month][table] = moved
+
+        if not dry_run:
+            for month, path in list_archives().items():
+                conn.execute("ATTACH DATABASE ? AS arch", (path,))
+                try:
+                    restored = restore_archived_tokens(conn)
+                finally:
+                    conn.execute("DETACH DATABASE arch")
+                if restored:
+                    print(f"     [INFO] Архив {month}: восстановлено {restored} связей статья-токен.")
+
+        vacuum_details = "пробный запуск" if dry_run else reclaim_space(
+            conn, settings['vacuum'], settings['incremental_vacuum_pages'])
+        if not dry_run:
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    except sqlite3.Error as e:
+        print(f"     [DB_ERROR] Ошибка при архивации: {e}")
+        return False
+    finally:
+        conn.close()
+
+    print_archival_report(report, size_before, file_size(db_path), vacuum_details, dry_run)
+    return True
+
+
+def print_archival_report(report: dict, size_before: int, size_after: int, vacuum_details: str, dry_run: bool):
+    if not report:
+        print("     Нет строк для архивации.")
+        return
+    verb = "к переносу" if dry_run else "перенесено"
+    print(f"\n     Отчет по архивации ({verb}):")
+    print(f"     {'Месяц':<10} " + " ".join(f"{table:>20}" for table in ARCHIVED_TABLES) + f" {'Архив, МБ':>10}")
+    for month, counts in sorted(report.items()):
+        path = archive_path(month)
+        archive_mb = file_size(path) / 1024 / 1024 if os.path.exists(path) else 0
+        print(f"     {month:<10} " + " ".join(f"{counts.get(table, 0):>20}" for table in ARCHIVED_TABLES)
+              + f" {archive_mb:>10.1f}")
+    print(f"     Освобождение места: {vacuum_details}")
+    reclaimed = (size_before - size_after) / 1024 / 1024
+    print(f"     Размер основной БД: {size_before / 1024 / 1024:.1f} МБ -> {size_after / 1024 / 1024:.1f} МБ "
+          f"(освобождено {reclaimed:.1f} МБ)")
+
+
+# --- Чтение истории ---
+
+def months_between(start_date: str, end_date: str) -> list[str]:
+    """'2025-01-15', '2025-03-02' -> ['2025_01', '2025_02', '2025_03']"""
+    year, month = int(start_date[:4]), int(start_date[5:7])
+    end = (int(end_date[:4]), int(end_date[5:7]))
+    months = []
+    while (year, month) <= end:
+        months.append(f"{year:04d}_{month:02d}")
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return months
+
+
+@contextmanager
+def attached_archives(months: list[str] | None = None):
+    """
+    Соединение только для чтения с основной БД и подключенными архивами за months
+    (по умолчанию - все). Создает временные представления all_<таблица>, объединяющие
+    основную БД и архивы; колонки, которых нет в старых архивах, возвращаются как NULL.
+    """
+    archives = list_archives()
+    if months is not None:
+        archives = {month: path for month, path in archives.items() if month in months}
+
+    conn = sqlite3.connect(database_manager.DB_NAME)
+    conn.row_factory = sqlite3.Row
+    get_pool(database_manager.DB_NAME).codec.register_sql_functions(conn)
+    try:
+        limit = conn.getlimit(sqlite3.SQLITE_LIMIT_ATTACHED)
+        if len(archives) > limit:
+            raise ValueError(f"Запрошено {len(archives)} архивов, SQLite позволяет подключить не больше {limit}. "
+                             f"Сузьте диапазон месяцев.")
+        schemas = []
+        for month, path in archives.items():
+            schema = f"a_{month}"
+            conn.execute(f"ATTACH DATABASE ? AS {schema}", (path,))
+            schemas.append(schema)
+
+        for table in (*ARCHIVED_TABLES, *{t for deps in DEPENDENT_TABLES.values() for t in deps}):
+            main_columns = get_columns(conn, 'main', table)
+            selects = [f"SELECT {', '.join(main_columns)} FROM main.{table}"]
+            for schema in schemas:
+                archived = set(get_columns(conn, schema, table))
+                if not archived:
+                    continue
+                column_list = ", ".join(c if c in archived else f"NULL AS {c}" for c in main_columns)
+                selects.append(f"SELECT {column_list} FROM {schema}.{table}")
+            conn.execute(f"CREATE TEMP VIEW all_{table} AS " + " UNION ALL ".join(selects))
+        conn.execute("PRAGMA query_only = ON")
+        yield conn
+    finally:
+        conn.close()
+
+
+def get_articles_history(start_date: str, end_date: str, user_id: int | None = None,
+                         token: str | None = None) -> list:
+    """Статьи за период (включая архивные) с распакованным текстом; token - только статьи про токен."""
+    sql = """
+    SELECT ga.id, ga.user_id, ga.title, ga.content, ga.image_path, ga.generation_date
+    FROM all_generated_articles ga
+    WHERE ga.generation_date >= ? AND ga.generation_date < date(?, '+1 day')
+    """
+    params = [start_date, end_date]
+    if user_id is not None:
+        sql += " AND ga.user_id = ?"
+        params.append(user_id)
+    if token is not None:
+        sql += " AND ga.id IN (SELECT at.article_id FROM all_article_tokens at WHERE at.token = ?)"
+        params.append(token.strip().upper())
+    sql += " ORDER BY ga.generation_date, ga.id"
+    try:
+        with attached_archives(months_between(start_date, end_date)) as conn:
+            articles = [dict(row) for row in conn.execute(sql, params)]
+        for article in articles:
+            article['content'] = database_manager.unpack_text(article['content'])
+        return articles
+    except (sqlite3.Error, ValueError) as e:
+        print(f"     [DB_ERROR] Ошибка при чтении истории статей: {e}")
+        return []
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Архивация старых данных БД neuro_crypto.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser('run', help="Перенести старые строки в помесячные архивы.")
+    run_parser.add_argument('--days', type=int, help="Возраст строк в днях (по умолчанию из database_config.json).")
+    run_parser.add_argument('--dry-run', action='store_true', help="Только посчитать строки к переносу.")
+
+    subparsers.add_parser('list', help="Показать существующие архивы.")
+
+    history_parser = subparsers.add_parser('history', help="Статьи за период, включая архивные.")
+    history_parser.add_argument('--from', dest='start_date', required=True)
+    history_parser.add_argument('--to', dest='end_date', required=True)
+    history_parser.add_argument('--user', type=int)
+    history_parser.add_argument('--token', help="Только статьи, в которых упоминается токен.")
+
+    args = parser.parse_args()
+    if args.command == 'run':
+        run_archival(args.days, args.dry_run)
+    elif args.command == 'list':
+        for month, path in list_archives().items():
+            print(f"  {month}  {path}  {file_size(path) / 1024 / 1024:.1f} МБ")
+    elif args.command == 'history':
+        for article in get_articles_history(args.start_date, args.end_date, args.user, args.token):
+            print(f"  [{article['generation_date']}] user {article['user_id']}: {article['title']}")
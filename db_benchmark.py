@@ -0,0 +1,528 @@
+import os
+import json
+import re
+import sys
+import time
+import random
+import statistics
+import sqlite3
+import argparse
+import itertools
+import tempfile
+
+import database_manager
+from db_pool import close_all_pools, get_pool
+from db_compression import DEFAULT_COMPRESSION_SETTINGS, TextCodec, train_dictionary, zstandard
+
+'''
+Бенчмарки слоя работы с БД.
+Каждый сценарий создает временную базу с синтетическими данными,
+поэтому рабочий neuro_crypto.db не затрагивается.
+
+Пример запуска:
+    python db_benchmark.py pool --updates 10000
+    python db_benchmark.py bulk --topics 1000
+    python db_benchmark.py plans --rows 1000000
+    python db_benchmark.py fts --articles 500000
+    python db_benchmark.py compress --articles 20000
+'''
+
+
+# --- Вспомогательные функции ---
+
+def prepare_database(db_path: str, topics_count: int):
+    """Создает схему во временной БД и заполняет ее темами со статусом 'needs_title'."""
+    database_manager.DB_NAME = db_path
+    database_manager.initialize_database()
+    conn = database_manager.get_db_connection()
+    conn.executemany(
+        "INSERT INTO topics (category, status, source_news_text) VALUES (?, 'needs_title', ?)",
+        ((f"cat_{i % 6}", f"Синтетическая новость #{i}") for i in range(topics_count))
+    )
+    conn.commit()
+    conn.close()
+
+
+def print_result(label: str, elapsed: float, operations: int):
+    print(f"  {label:<32} {elapsed:8.2f} сек   {operations / elapsed:10.0f} оп/сек")
+
+
+# --- Сценарии ---
+
+def bench_per_call_connect(db_path: str, updates: int) -> float:
+    """Старое поведение: новое соединение, одна команда, commit и close на каждый вызов."""
+    start = time.perf_counter()
+    for i in range(updates):
+        conn = sqlite3.connect(db_path)
+        conn.row_factory = sqlite3.Row
+        try:
+            conn.execute("UPDATE topics SET status = ? WHERE id = ?", ('ready_for_planning', i + 1))
+            conn.commit()
+        finally:
+            conn.close()
+    return time.perf_counter() - start
+
+
+def bench_pooled(db_path: str, updates: int) -> float:
+    """Новое поведение: update_topic_status через пул соединений (WAL + PRAGMA из конфига)."""
+    database_manager.DB_NAME = db_path
+    start = time.perf_counter()
+    for i in range(updates):
+        database_manager.update_topic_status(i + 1, 'ready_for_planning')
+    elapsed = time.perf_counter() - start
+    close_all_pools()
+    return elapsed
+
+
+def run_pool_benchmark(updates: int):
+    print(f"\n--- Бенчмарк пула соединений: {updates} обновлений статуса ---")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        plain_db = os.path.join(tmp_dir, 'per_call.db')
+        pooled_db = os.path.join(tmp_dir, 'pooled.db')
+        prepare_database(plain_db, updates)
+        prepare_database(pooled_db, updates)
+
+        per_call = bench_per_call_connect(plain_db, updates)
+        pooled = bench_pooled(pooled_db, updates)
+
+    print_result("connect() на каждый вызов", per_call, updates)
+    print_result("пул соединений", pooled, updates)
+    print(f"  Ускорение: x{per_call / pooled:.1f}")
+
+
+def run_bulk_benchmark(topics_count: int):
+    print(f"\n--- Бенчмарк пакетных переходов: {topics_count} тем получают заголовок ---")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        results = {}
+        for variant in ('per_call', 'per_row', 'bulk'):
+            db_path = os.path.join(tmp_dir, f'{variant}.db')
+            prepare_database(db_path, topics_count)
+            database_manager.DB_NAME = db_path
+            start = time.perf_counter()
+            if variant == 'per_call':
+                for i in range(topics_count):
+                    conn = database_manager.get_db_connection()
+                    conn.execute("UPDATE topics SET title = ?, status = 'ready_for_planning' WHERE id = ?",
+                                 (f"Title {i}", i + 1))
+                    conn.commit()
+                    conn.close()
+            elif variant == 'per_row':
+                for i in range(topics_count):
+                    database_manager.update_topic_with_title(i + 1, f"Title {i}")
+            else:
+                database_manager.transition_topics(
+                    [(i + 1, 'ready_for_planning', {'title': f"Title {i}"}) for i in range(topics_count)],
+                    expected_status='needs_title'
+                )
+            results[variant] = time.perf_counter() - start
+            close_all_pools()
+
+    print_result("connect() + commit на строку", results['per_call'], topics_count)
+    print_result("пул, commit на строку", results['per_row'], topics_count)
+    print_result("transition_topics, 1 commit", results['bulk'], topics_count)
+    print(f"  Ускорение относительно connect() на строку: x{results['per_call'] / results['bulk']:.0f}")
+
+
+# --- Регрессия планов запросов ---
+
+# "Горячие" запросы этапов конвейера - те же константы, что выполняют сами этапы (database_manager)
+dm = database_manager
+HOT_QUERIES = {
+    'get_generation_tasks': (dm.GENERATION_TASKS_SQL, ()),
+    'get_topics_by_status(needs_title)': (dm.TOPICS_BY_STATUS_SQL, ('needs_title',)),
+    'get_available_topics_by_category': (dm.AVAILABLE_TOPICS_SQL, ()),
+    'get_image_generation_tasks': (dm.IMAGE_GENERATION_TASKS_SQL, ()),
+    'get_token_matching_tasks': (dm.TOKEN_MATCHING_TASKS_SQL, ()),
+    'get_articles_for_delivery': (dm.ARTICLES_FOR_DELIVERY_SQL, ()),
+    'get_articles_by_token': (
+        dm.ARTICLES_BY_TOKEN_SQL.format(period_filter=dm.ARTICLES_BY_TOKEN_PERIOD_FILTER), ('SOL', '-7 days', 100)),
+    'get_tokens_for_articles': (dm.TOKENS_FOR_ARTICLES_SQL.format(placeholders='?, ?, ?'), (1, 2, 3)),
+    'get_last_published_titles': (dm.LAST_PUBLISHED_TITLES_SQL, (3, 10)),
+    'get_user_subscriptions': (dm.USER_SUBSCRIPTIONS_SQL, ()),
+}
+
+# Маленькие справочники, полный просмотр которых допустим
+SMALL_TABLES = {'personas'}
+
+# Строка плана: SCAN/SEARCH, имя (в SQLite >= 3.36 - псевдоним, если он задан), остаток строки
+PLAN_STEP_RE = re.compile(r'^(SCAN|SEARCH) (?:TABLE )?(\w+)(?: AS (\w+))?(.*)$')
+# Таблицы запроса и их псевдонимы: FROM/JOIN <таблица> [[AS] <псевдоним>]
+TABLE_REF_RE = re.compile(r'\b(?:FROM|JOIN)\s+(\w+)(?:\s+(?:AS\s+)?(\w+))?', re.IGNORECASE)
+INDEX_USED_RE = re.compile(r'USING (?:COVERING )?INDEX (\w+)')
+SQL_KEYWORDS = {'WHERE', 'JOIN', 'INNER', 'LEFT', 'RIGHT', 'FULL', 'CROSS', 'NATURAL', 'ON', 'USING',
+                'GROUP', 'ORDER', 'LIMIT', 'HAVING', 'UNION', 'EXCEPT', 'INTERSECT', 'WINDOW'}
+
+
+def build_synthetic_database(db_path: str, rows: int):
+    """
+    Синтетическая БД "после года работы": rows тем и статей, почти все уже обработаны,
+    в работе - только небольшая доля строк.
+    """
+    print(f"     Генерация синтетической БД на {rows} строк...")
+    database_manager.DB_NAME = db_path
+    database_manager.initialize_database()
+    conn = database_manager.get_db_connection()
+    cursor = conn.cursor()
+
+    rng = random.Random(42)
+    active_statuses = ['needs_title', 'ready_for_planning', 'planned_for_generation']
+    cursor.executemany(
+        "INSERT INTO personas (persona_code, persona_name, provider_name) VALUES (?, ?, 'gemini')",
+        ((f"p{i}", f"Persona {i}") for i in range(5))
+    )
+    cursor.executemany(
+        "INSERT INTO users (id, username, subscribed_persona_id) VALUES (?, ?, ?)",
+        ((i, f"user_{i}", (i % 5) + 1 if i % 3 else None) for i in range(1, rows // 100 + 2))
+    )
+    cursor.executemany(
+        "INSERT INTO source_articles (bybit_article_id, title, bybit_category_id) VALUES (?, ?, ?)",
+        ((i, f"Source title {i}", i % 20) for i in range(rows // 10))
+    )
+    cursor.executemany(
+        "INSERT INTO topics (title, category, status, source_news_text, assigned_persona_id, assigned_user_id, "
+        "creation_date) VALUES (?, ?, ?, ?, ?, ?, datetime('now', ?))",
+        ((f"Topic {i}", f"cat_{i % 6}",
+          rng.choice(active_statuses) if rng.random() < 0.01 else 'article_generated',
+          f"News text {i}", (i % 5) + 1, (i % (rows // 100 + 1)) + 1, f"-{rows - i} minutes")
+         for i in range(rows))
+    )
+    cursor.executemany(
+        "INSERT INTO generated_articles (topic_id, user_id, persona_id, title, content, image_path, "
+        "matched_tokens, generation_date) VALUES (?, ?, ?, ?, ?, ?, ?, datetime('now', ?))",
+        ((i + 1, (i % (rows // 100 + 1)) + 1, (i % 5) + 1, f"Article {i}", f"Content {i}",
+          None if rng.random() < 0.01 else f"Gen_Photo/article_id_{i}.png",
+          None if rng.random() < 0.01 else '["BTC"]', f"-{rows - i} minutes")
+         for i in range(rows))
+    )
+    tokens = ['BTC', 'ETH', 'SOL', 'XRP', 'DOGE', 'TON', 'ADA', 'BNB']
+    cursor.executemany(
+        "INSERT INTO article_tokens (article_id, token, position) VALUES (?, ?, ?)",
+        ((i + 1, token, position) for i in range(rows)
+         for position, token in enumerate(rng.sample(tokens, 2)))
+    )
+    conn.commit()
+    conn.close()
+
+
+def table_aliases(sql: str) -> dict:
+    """{псевдоним или имя: таблица} для таблиц из FROM/JOIN запроса."""
+    aliases = {}
+    for table, alias in TABLE_REF_RE.findall(sql):
+        aliases[table] = table
+        if alias and alias.upper() not in SQL_KEYWORDS:
+            aliases[alias] = table
+    return aliases
+
+
+def find_full_scans(conn: sqlite3.Connection, sql: str, params: tuple) -> list[str]:
+    """
+    Возвращает строки плана, в которых большая таблица читается целиком:
+    любой SCAN (в том числе SCAN ... USING COVERING INDEX - полный просмотр индекса)
+    и SEARCH ... USING AUTOMATIC ... INDEX (временный индекс строится полным просмотром на каждый запрос).
+    Исключение - просмотр частичного индекса (CREATE INDEX ... WHERE): в нем только рабочие строки
+    этапа, а не вся таблица. Псевдонимы из плана сводятся к именам таблиц до проверки SMALL_TABLES.
+    """
+    plan = conn.execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall()
+    aliases = table_aliases(sql)
+    full_scans = []
+    for row in plan:
+        match = PLAN_STEP_RE.match(row[3])
+        if not match:
+            continue
+        step, name, old_style_alias, rest = match.groups()
+        if step == 'SEARCH' and 'AUTOMATIC' not in rest:
+            continue
+        if 'VIRTUAL TABLE INDEX' in rest:
+            continue  # FTS5: поиск по своему индексу (MATCH), а не просмотр
+        table = name if old_style_alias else aliases.get(name, name)
+        if table in SMALL_TABLES:
+            continue
+        index = INDEX_USED_RE.search(rest)
+        if step == 'SCAN' and index and index.group(1) in partial_indexes(conn, table):
+            continue
+        full_scans.append(row[3])
+    return full_scans
+
+
+def partial_indexes(conn: sqlite3.Connection, table: str) -> set[str]:
+    """Имена частичных индексов таблицы (PRAGMA index_list: колонка partial)."""
+    return {row[1] for row in conn.execute(f"PRAGMA index_list({table})") if row[4]}
+
+
+def check_query_plans(db_path: str) -> bool:
+    """Прогоняет EXPLAIN QUERY PLAN для каждого горячего запроса. False - есть полный просмотр таблицы."""
+    conn = sqlite3.connect(db_path)
+    all_ok = True
+    try:
+        for name, (sql, params) in HOT_QUERIES.items():
+            full_scans = find_full_scans(conn, sql, params)
+            start = time.perf_counter()
+            conn.execute(sql, params).fetchall()
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            if full_scans:
+                all_ok = False
+                print(f"  [FAIL] {name:<36} {elapsed_ms:8.1f} мс   {'; '.join(full_scans)}")
+            else:
+                print(f"  [OK]   {name:<36} {elapsed_ms:8.1f} мс")
+    finally:
+        conn.close()
+    return all_ok
+
+
+def run_plans_check(rows: int) -> bool:
+    print(f"\n--- Проверка планов горячих запросов на БД из {rows} строк ---")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = os.path.join(tmp_dir, 'plans.db')
+        build_synthetic_database(db_path, rows)
+        all_ok = check_query_plans(db_path)
+    print("  Все запросы используют индексы." if all_ok else "  [ERROR] Обнаружены полные просмотры таблиц.")
+    return all_ok
+
+
+# --- Полнотекстовый поиск ---
+
+def build_vocabulary(rng: random.Random, size: int) -> list[str]:
+    syllables = ['ка', 'ли', 'то', 'ро', 'ба', 'не', 'ми', 'со', 'ду', 'ра', 'ве', 'зо', 'пи', 'гу', 'ле', 'ны']
+    words = set()
+    while len(words) < size:
+        words.add("".join(rng.choice(syllables) for _ in range(rng.randint(2, 4))))
+    return sorted(words)
+
+
+def build_fts_corpus(db_path: str, articles: int, words_per_article: int = 120) -> list[list[str]]:
+    """
+    Заполняет БД синтетическими темами и статьями (~words_per_article слов, частоты слов по закону Ципфа).
+    Возвращает тексты первой сотни статей - из них строятся поисковые запросы.
+    """
+    print(f"     Генерация корпуса из {articles} статей по ~{words_per_article} слов...")
+    database_manager.DB_NAME = db_path
+    database_manager.initialize_database()
+    rng = random.Random(7)
+    vocabulary = build_vocabulary(rng, 30000)
+    cumulative_weights = list(itertools.accumulate(1 / (rank + 1) for rank in range(len(vocabulary))))
+    samples = []
+
+    def texts():
+        for i in range(articles):
+            words = rng.choices(vocabulary, cum_weights=cumulative_weights, k=words_per_article)
+            if i < 100:
+                samples.append(words)
+            yield i, " ".join(words)
+
+    conn = database_manager.get_db_connection()
+    conn.execute("INSERT INTO personas (persona_code, persona_name, provider_name) VALUES ('p1', 'Persona', 'gemini')")
+    conn.execute("INSERT INTO users (id, username) VALUES (1, 'user_1')")
+    for i, text in texts():
+        conn.execute(
+            "INSERT INTO topics (id, title, category, status, source_news_text, creation_date) "
+            "VALUES (?, ?, 'btc', 'article_generated', ?, datetime('now', ?))",
+            (i + 1, " ".join(text.split()[:8]), text, f"-{(articles - i) // 2000} days")
+        )
+        conn.execute(
+            "INSERT INTO generated_articles (topic_id, user_id, persona_id, title, content) VALUES (?, 1, 1, ?, ?)",
+            (i + 1, " ".join(text.split()[:8]), text)
+        )
+    conn.commit()
+    conn.close()
+    return samples
+
+
+def percentiles(latencies_ms: list[float]) -> str:
+    latencies_ms = sorted(latencies_ms)
+    p95 = latencies_ms[int(0.95 * (len(latencies_ms) - 1))]
+    return f"p50 {statistics.median(latencies_ms):7.2f} мс   p95 {p95:7.2f} мс"
+
+
+def run_fts_benchmark(articles: int, queries: int):
+    print(f"\n--- Бенчмарк полнотекстового поиска: {articles} статей ---")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = os.path.join(tmp_dir, 'fts.db')
+        start = time.perf_counter()
+        samples = build_fts_corpus(db_path, articles)
+        print(f"  Вставка корпуса (индексация триггерами): {time.perf_counter() - start:8.1f} сек")
+
+        conn = database_manager.get_db_connection()
+        start = time.perf_counter()
+        conn.execute("INSERT INTO generated_articles_fts (generated_articles_fts) VALUES ('rebuild')")
+        conn.commit()
+        print(f"  Полная перестройка generated_articles_fts:  {time.perf_counter() - start:8.1f} сек")
+        conn.execute("VACUUM")
+        conn.close()
+        print(f"  Размер БД: {os.path.getsize(db_path) / 1024 / 1024:.1f} МБ")
+
+        rng = random.Random(11)
+        scenarios = {
+            'одно слово': lambda words: rng.choice(words),
+            'два слова (AND)': lambda words: " ".join(rng.sample(words, 2)),
+            'фраза из 3 слов': lambda words: '"{}"'.format(" ".join(words[10:13])),
+        }
+        for label, make_query in scenarios.items():
+            latencies = []
+            for _ in range(queries):
+                query = make_query(rng.choice(samples))
+                start = time.perf_counter()
+                database_manager.search_articles(query, page=1, page_size=20, raw=label.startswith('фраза'))
+                latencies.append((time.perf_counter() - start) * 1000)
+            print(f"  search_articles, {label:<20} {percentiles(latencies)}")
+
+        latencies = []
+        found = 0
+        for words in samples[:queries]:
+            start = time.perf_counter()
+            found += bool(database_manager.find_covered_topics(" ".join(words), days=14))
+            latencies.append((time.perf_counter() - start) * 1000)
+        print(f"  find_covered_topics (повтор истории)  {percentiles(latencies)}   найдено {found}/{len(latencies)}")
+        close_all_pools()
+
+
+# --- Сжатие текстов ---
+
+# Типичные для сгенерированных статей связки: тексты одного генератора сильно похожи друг на друга
+ARTICLE_PHRASES = [
+    "In this article, we will explore", "It is important to note that", "As the crypto market continues to evolve,",
+    "investors should carefully consider", "the underlying blockchain technology", "decentralized finance (DeFi)",
+    "effective risk management", "on the Bybit platform", "In conclusion,", "a well-defined trading strategy",
+    "market volatility", "long-term holders", "According to recent data,", "This means that",
+    "For beginners, the key takeaway is that", "Let's break down", "Bitcoin (BTC)", "Ethereum (ETH)",
+    "liquidity providers", "copy trading allows users to", "spot trading", "staking rewards",
+]
+
+
+def load_sample_titles() -> list[str]:
+    """Реальные заголовки статей Bybit из articles_data.json (если файл есть) - источник словаря корпуса."""
+    try:
+        with open('articles_data.json', 'r', encoding='utf-8') as f:
+            return [item['title'] for item in json.load(f)]
+    except (FileNotFoundError, json.JSONDecodeError, KeyError):
+        return ["How Bitcoin Halving Affects Miners", "DeFi Yield Farming Explained", "Spot vs Futures Trading"]
+
+
+def make_article(rng: random.Random, titles: list[str], words: int) -> str:
+    paragraphs, count = [], 0
+    while count < words:
+        sentences = []
+        for _ in range(rng.randint(3, 6)):
+            sentence = f"{rng.choice(ARTICLE_PHRASES)} {rng.choice(titles).lower()} {rng.choice(ARTICLE_PHRASES)}."
+            sentences.append(sentence)
+            count += len(sentence.split())
+        paragraphs.append(" ".join(sentences))
+    return "\n\n".join(paragraphs)
+
+
+def run_compression_variant(db_path: str, settings: dict, articles: list[str], training: list[str]) -> dict:
+    database_manager.DB_NAME = db_path
+    database_manager.initialize_database()
+    pool = get_pool(db_path)
+    pool.codec = TextCodec(db_path, settings)
+    if training:
+        data = train_dictionary(settings['codec'], training, settings['dictionary_size'])
+        with database_manager.db_connection('run_compression_variant', write=True) as conn:
+            conn.execute("INSERT INTO compression_dictionaries (codec, data, sample_count) VALUES (?, ?, ?)",
+                         (settings['codec'], data, len(training)))
+        pool.codec.reload_dictionaries()
+
+    with database_manager.db_connection('run_compression_variant', write=True) as conn:
+        conn.execute("INSERT INTO personas (persona_code, persona_name) VALUES ('p1', 'Persona')")
+        conn.execute("INSERT INTO users (id, username) VALUES (1, 'user_1')")
+        conn.executemany("INSERT INTO topics (id, category, status, source_news_text) "
+                         "VALUES (?, 'btc', 'article_generated', 'news')",
+                         ((i + 1,) for i in range(len(articles))))
+
+    start = time.perf_counter()
+    for chunk_start in range(0, len(articles), 500):
+        with database_manager.db_connection('run_compression_variant', write=True) as conn:
+            conn.executemany(
+                "INSERT INTO generated_articles (topic_id, user_id, persona_id, title, content) VALUES (?, 1, 1, ?, ?)",
+                ((chunk_start + i + 1, f"Article {chunk_start + i}", database_manager.pack_text(text))
+                 for i, text in enumerate(articles[chunk_start:chunk_start + 500]))
+            )
+    write_elapsed = time.perf_counter() - start
+
+    start = time.perf_counter()
+    delivered = sum(len(user_articles) for user_articles in database_manager.get_articles_for_delivery().values())
+    read_elapsed = time.perf_counter() - start
+    assert delivered == len(articles)
+
+    with database_manager.db_connection('run_compression_variant') as conn:
+        content_bytes = conn.execute("SELECT SUM(length(CAST(content AS BLOB))) FROM generated_articles").fetchone()[0]
+    close_all_pools()
+    return {'write': write_elapsed, 'read': read_elapsed, 'content_mb': content_bytes / 1024 / 1024,
+            'db_mb': os.path.getsize(db_path) / 1024 / 1024}
+
+
+def run_compression_benchmark(count: int, words: int):
+    print(f"\n--- Бенчмарк сжатия generated_articles.content: {count} статей по ~{words} слов ---")
+    rng = random.Random(3)
+    titles = load_sample_titles()
+    articles = [make_article(rng, titles, words) for _ in range(count)]
+    training = [make_article(rng, titles, words) for _ in range(500)]
+
+    variants = {'без сжатия': ({'enabled': False, 'codec': 'zlib'}, False),
+                'zlib': ({'codec': 'zlib'}, False),
+                'zlib + словарь': ({'codec': 'zlib'}, True)}
+    if zstandard is not None:
+        variants.update({'zstd': ({'codec': 'zstd'}, False), 'zstd + словарь': ({'codec': 'zstd'}, True)})
+    else:
+        print("  (пакет zstandard не установлен - варианты zstd пропущены)")
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for i, (label, (overrides, with_dictionary)) in enumerate(variants.items()):
+            settings = {**DEFAULT_COMPRESSION_SETTINGS, **overrides}
+            db_path = os.path.join(tmp_dir, f'compress_{i}.db')
+            results[label] = run_compression_variant(db_path, settings, articles,
+                                                     training if with_dictionary else [])
+
+    print(f"  {'Вариант':<18} {'content, МБ':>12} {'файл БД, МБ':>12} {'запись, ст/сек':>15} {'чтение, ст/сек':>15}")
+    for label, r in results.items():
+        print(f"  {label:<18} {r['content_mb']:12.1f} {r['db_mb']:12.1f} "
+              f"{count / r['write']:15.0f} {count / r['read']:15.0f}")
+    baseline = results['без сжатия']
+    for label, r in results.items():
+        if label != 'без сжатия':
+            print(f"  {label}: колонка content меньше в x{baseline['content_mb'] / r['content_mb']:.1f}, "
+                  f"файл БД - в x{baseline['db_mb'] / r['db_mb']:.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарки слоя БД neuro_crypto.")
+    subparsers = parser.add_subparsers(dest='scenario', required=True)
+
+    pool_parser = subparsers.add_parser('pool', help="Соединение на вызов против пула соединений.")
+    pool_parser.add_argument('--updates', type=int, default=10000)
+
+    bulk_parser = subparsers.add_parser('bulk', help="Построчные коммиты против transition_topics.")
+    bulk_parser.add_argument('--topics', type=int, default=1000)
+
+    plans_parser = subparsers.add_parser('plans', help="EXPLAIN QUERY PLAN горячих запросов (код возврата 1 при SCAN).")
+    plans_parser.add_argument('--rows', type=int, default=1000000)
+
+    fts_parser = subparsers.add_parser('fts', help="Индексация и поиск FTS5 на синтетическом корпусе.")
+    fts_parser.add_argument('--articles', type=int, default=500000)
+    fts_parser.add_argument('--queries', type=int, default=100)
+
+    compress_parser = subparsers.add_parser('compress', help="Размер и скорость: обычный текст против zlib/zstd.")
+    compress_parser.add_argument('--articles', type=int, default=20000)
+    compress_parser.add_argument('--words', type=int, default=850)
+
+    args = parser.parse_args()
+    original_db = database_manager.DB_NAME
+    exit_code = 0
+    try:
+        if args.scenario == 'pool':
+            run_pool_benchmark(args.updates)
+        elif args.scenario == 'bulk':
+            run_bulk_benchmark(args.topics)
+        elif args.scenario == 'plans':
+            exit_code = 0 if run_plans_check(args.rows) else 1
+        elif args.scenario == 'fts':
+            run_fts_benchmark(args.articles, args.queries)
+        elif args.scenario == 'compress':
+            run_compression_benchmark(args.articles, args.words)
+    finally:
+        database_manager.DB_NAME = original_db
+    sys.exit(exit_code)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,316 @@
+import json
+import time
+import zlib
+import struct
+import sqlite3
+import argparse
+import threading
+from collections import Counter
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+'''
+Прозрачное сжатие больших текстовых колонок (generated_articles.content, topics.source_news_text).
+Сжатое значение хранится как BLOB с заголовком: магическая последовательность, кодек
+и номер словаря. Несжатые строки (старые данные, короткие тексты) остаются TEXT,
+поэтому unpack() понимает оба формата и сжатие можно включать и выключать в любой момент.
+
+Кодеки: zstd (если установлен пакет zstandard) или zlib из стандартной библиотеки.
+Оба умеют работать со словарем, обученным на прошлых статьях, - он хранится в таблице
+compression_dictionaries (миграция 005) и заметно улучшает сжатие коротких однотипных текстов.
+
+Для SQL (триггеры FTS и представления *_text) на каждом соединении регистрируется функция nc_unpack().
+
+Запуск:
+    python db_compression.py stats                # сколько строк сжато и сколько места занимают колонки
+    python db_compression.py train                # обучить новый словарь на последних статьях
+    python db_compression.py recompress           # пересжать существующие строки активным словарем
+'''
+
+DEFAULT_COMPRESSION_SETTINGS = {
+    "enabled": True,
+    "codec": "auto",           # auto | zstd | zlib
+    "zstd_level": 9,
+    "zlib_level": 6,
+    "min_size": 256,           # более короткие тексты не сжимаются
+    "dictionary_size": 32768,  # zlib использует не больше 32 КБ словаря
+    "dictionary_samples": 2000
+}
+
+# Какие колонки могут храниться сжатыми
+COMPRESSED_COLUMNS = {
+    'generated_articles': ('content',),
+    'topics': ('source_news_text',),
+}
+
+MAGIC = b'\x00NC'
+HEADER = struct.Struct('>3scH')  # магия, кодек, id словаря (0 - без словаря)
+CODEC_ZLIB = b'z'
+CODEC_ZSTD = b's'
+CODEC_NAMES = {'zlib': CODEC_ZLIB, 'zstd': CODEC_ZSTD}
+
+
+def load_compression_settings(config_path: str) -> dict:
+    settings = dict(DEFAULT_COMPRESSION_SETTINGS)
+    try:
+        with open(config_path, 'r', encoding='utf-8') as f:
+            settings.update(json.load(f).get('compression', {}))
+    except (FileNotFoundError, json.JSONDecodeError):
+        pass
+
+    if settings['codec'] == 'auto':
+        settings['codec'] = 'zstd' if zstandard is not None else 'zlib'
+    elif settings['codec'] == 'zstd' and zstandard is None:
+        print("     [WARNING] В конфиге указан кодек zstd, но пакет zstandard не установлен. Используется zlib.")
+        settings['codec'] = 'zlib'
+    if settings['codec'] not in CODEC_NAMES:
+        raise ValueError(f"Недопустимый кодек сжатия: {settings['codec']}")
+    return settings
+
+
+# --- Обучение словарей ---
+
+def train_zlib_dictionary(samples: list[str], size: int) -> bytes:
+    """
+    Словарь для zlib - это просто текст, из которого deflate берет совпадения.
+    Собираем самые "выгодные" повторяющиеся фразы из 2-6 слов; самые частые кладем в конец,
+    так как ближние совпадения кодируются короче.
+    """
+    counts = Counter()
+    for text in samples:
+        words = text.split()
+        for n in range(2, 7):
+            for i in range(len(words) - n + 1):
+                counts[" ".join(words[i:i + n])] += 1
+
+    chosen, total = [], 0
+    for phrase, count in sorted(counts.items(), key=lambda item: item[1] * len(item[0]), reverse=True):
+        if count < 2:
+            break
+        encoded = (phrase + " ").encode('utf-8')
+        if total + len(encoded) > size:
+            continue
+        chosen.append(encoded)
+        total += len(encoded)
+    return b"".join(reversed(chosen))
+
+
+def train_dictionary(codec: str, samples: list[str], size: int) -> bytes:
+    if codec == 'zstd':
+        encoded = [s.encode('utf-8') for s in samples]
+        return zstandard.train_dictionary(size, encoded).as_bytes()
+    return train_zlib_dictionary(samples, size)
+
+
+# --- Кодек ---
+
+class TextCodec:
+    """
+    Сжатие и распаковка текстов одной БД.
+    Словари читаются из compression_dictionaries при первом обращении и кэшируются.
+    Экземпляр безопасно использовать из нескольких потоков.
+    """
+
+    def __init__(self, db_path: str, settings: dict):
+        self.db_path = db_path
+        self.settings = settings
+        self.codec = CODEC_NAMES[settings['codec']]
+        self._dictionaries = None  # {id: (codec, data)}
+        self._active_dictionary_id = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()  # объекты zstd не потокобезопасны
+
+    # --- Словари ---
+
+    def reload_dictionaries(self):
+        """Перечитывает словари из БД (например, после обучения нового)."""
+        dictionaries = {}
+        try:
+            conn = sqlite3.connect(self.db_path)
+            try:
+                rows = conn.execute("SELECT id, codec, data FROM compression_dictionaries ORDER BY id").fetchall()
+            finally:
+                conn.close()
+            dictionaries = {row[0]: (CODEC_NAMES.get(row[1]), row[2]) for row in rows}
+        except sqlite3.OperationalError:
+            pass  # миграция 005 еще не применена - работаем без словарей
+        with self._lock:
+            self._dictionaries = dictionaries
+            self._active_dictionary_id = max(
+                (dict_id for dict_id, (codec, _) in dictionaries.items() if codec == self.codec), default=0
+            )
+            self._local = threading.local()
+
+    def _get_dictionary(self, dict_id: int) -> bytes:
+        if self._dictionaries is None or (dict_id and dict_id not in self._dictionaries):
+            self.reload_dictionaries()
+        if not dict_id:
+            return b""
+        try:
+            return self._dictionaries[dict_id][1]
+        except KeyError:
+            raise ValueError(f"Словарь сжатия #{dict_id} не найден в {self.db_path}") from None
+
+    def _zstd_objects(self, dict_id: int):
+        cache = self._local.__dict__.setdefault('zstd', {})
+        if dict_id not in cache:
+            dictionary = self._get_dictionary(dict_id)
+            dict_data = zstandard.ZstdCompressionDict(dictionary) if dictionary else None
+            cache[dict_id] = (
+                zstandard.ZstdCompressor(level=self.settings['zstd_level'], dict_data=dict_data),
+                zstandard.ZstdDecompressor(dict_data=dict_data),
+            )
+        return cache[dict_id]
+
+    # --- Сжатие ---
+
+    def pack(self, text: str | None):
+        """Возвращает значение для записи в БД: BLOB со сжатым текстом или исходную строку."""
+        if text is None or not self.settings['enabled'] or len(text) < self.settings['min_size']:
+            return text
+        if self._dictionaries is None:
+            self.reload_dictionaries()
+        dict_id = self._active_dictionary_id
+        raw = text.encode('utf-8')
+
+        if self.codec == CODEC_ZSTD:
+            payload = self._zstd_objects(dict_id)[0].compress(raw)
+        else:
+            dictionary = self._get_dictionary(dict_id)
+            compressor = zlib.compressobj(self.settings['zlib_level'], zlib.DEFLATED, -15,
+                                          **({'zdict': dictionary} if dictionary else {}))
+            payload = compressor.compress(raw) + compressor.flush()
+
+        packed = HEADER.pack(MAGIC, self.codec, dict_id) + payload
+        return packed if len(packed) < len(raw) else text
+
+    def unpack(self, value):
+        """Обратное преобразование: понимает и сжатые BLOB, и обычные строки."""
+        if value is None or isinstance(value, str):
+            return value
+        value = bytes(value)
+        if not value.startswith(MAGIC):
+            return value.decode('utf-8')
+
+        _, codec, dict_id = HEADER.unpack_from(value)
+        payload = value[HEADER.size:]
+        if codec == CODEC_ZSTD:
+            if zstandard is None:
+                raise RuntimeError("Текст сжат zstd, но пакет zstandard не установлен (pip install zstandard).")
+            raw = self._zstd_objects(dict_id)[1].decompress(payload)
+        elif codec == CODEC_ZLIB:
+            dictionary = self._get_dictionary(dict_id)
+            decompressor = zlib.decompressobj(-15, **({'zdict': dictionary} if dictionary else {}))
+            raw = decompressor.decompress(payload) + decompressor.flush()
+        else:
+            raise ValueError(f"Неизвестный кодек сжатия: {codec!r}")
+        return raw.decode('utf-8')
+
+    def register_sql_functions(self, conn: sqlite3.Connection):
+        """Регистрирует nc_unpack() для триггеров FTS и представлений *_text."""
+        conn.create_function('nc_unpack', 1, self.unpack, deterministic=True)
+
+
+# --- Обслуживание (CLI) ---
+
+def print_stats():
+    import database_manager
+    with database_manager.db_connection('print_stats') as conn:
+        for table, columns in COMPRESSED_COLUMNS.items():
+            for column in columns:
+                row = conn.execute(f"""
+                    SELECT COUNT(*) AS total,
+                           SUM(typeof({column}) = 'blob') AS packed,
+                           SUM(length(CAST({column} AS BLOB))) AS stored_bytes,
+                           SUM(length(CAST(nc_unpack({column}) AS BLOB))) AS plain_bytes
+                    FROM {table}
+                """).fetchone()
+                stored, plain = row['stored_bytes'] or 0, row['plain_bytes'] or 0
+                ratio = plain / stored if stored else 1
+                print(f"  {table + '.' + column:<30} строк: {row['total']:>8}  сжато: {row['packed'] or 0:>8}  "
+                      f"{plain / 1024 / 1024:8.1f} МБ -> {stored / 1024 / 1024:8.1f} МБ  (x{ratio:.2f})")
+        for row in conn.execute("SELECT id, codec, length(data) AS size, sample_count, created_at "
+                                "FROM compression_dictionaries ORDER BY id"):
+            print(f"  Словарь #{row['id']}: {row['codec']}, {row['size']} байт, "
+                  f"обучен на {row['sample_count']} текстах, {row['created_at']}")
+
+
+def train_and_store_dictionary() -> int | None:
+    """Обучает словарь на последних статьях и новостях и сохраняет его как активный."""
+    import database_manager
+    from db_pool import get_pool
+
+    codec = get_pool(database_manager.DB_NAME).codec
+    settings = codec.settings
+    limit = settings['dictionary_samples']
+    with database_manager.db_connection('train_and_store_dictionary') as conn:
+        samples = [database_manager.unpack_text(row[0]) for row in conn.execute(
+            "SELECT content FROM generated_articles ORDER BY id DESC LIMIT ?", (limit,))]
+        samples += [database_manager.unpack_text(row[0]) for row in conn.execute(
+            "SELECT source_news_text FROM topics WHERE source_news_text IS NOT NULL ORDER BY id DESC LIMIT ?",
+            (limit // 4,))]
+    samples = [s for s in samples if s]
+    if len(samples) < 10:
+        print(f"     [WARNING] Слишком мало текстов для обучения словаря: {len(samples)}.")
+        return None
+
+    start = time.perf_counter()
+    data = train_dictionary(settings['codec'], samples, settings['dictionary_size'])
+    with database_manager.db_connection('train_and_store_dictionary', write=True) as conn:
+        cursor = conn.execute(
+            "INSERT INTO compression_dictionaries (codec, data, sample_count) VALUES (?, ?, ?)",
+            (settings['codec'], data, len(samples))
+        )
+        dict_id = cursor.lastrowid
+    codec.reload_dictionaries()
+    print(f"     [SUCCESS] Словарь #{dict_id} ({settings['codec']}, {len(data)} байт) обучен на "
+          f"{len(samples)} текстах за {time.perf_counter() - start:.1f} сек.")
+    return dict_id
+
+
+def recompress_existing() -> int:
+    """Пересжимает строки активным кодеком и словарем пачками по id (короткие транзакции)."""
+    import database_manager
+    from db_migrations import load_migration_settings
+
+    batch_size = load_migration_settings()['batch_size']
+    total = 0
+    for table, columns in COMPRESSED_COLUMNS.items():
+        with database_manager.db_connection('recompress_existing') as conn:
+            bounds = conn.execute(f"SELECT MIN(id), MAX(id) FROM {table}").fetchone()
+        if bounds[0] is None:
+            continue
+        for column in columns:
+            changed = 0
+            for batch_start in range(bounds[0], bounds[1] + 1, batch_size):
+                with database_manager.db_connection('recompress_existing', write=True) as conn:
+                    rows = conn.execute(
+                        f"SELECT id, {column} FROM {table} WHERE id BETWEEN ? AND ? AND {column} IS NOT NULL",
+                        (batch_start, batch_start + batch_size - 1)
+                    ).fetchall()
+                    updates = []
+                    for row in rows:
+                        packed = database_manager.pack_text(database_manager.unpack_text(row[column]))
+                        if packed != row[column]:
+                            updates.append((packed, row['id']))
+                    conn.executemany(f"UPDATE {table} SET {column} = ? WHERE id = ?", updates)
+                changed += len(updates)
+            print(f"     {table}.{column}: пересжато строк: {changed}")
+            total += changed
+    return total
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Сжатие текстовых колонок БД neuro_crypto.")
+    parser.add_argument('command', choices=['stats', 'train', 'recompress'])
+    args = parser.parse_args()
+
+    if args.command == 'stats':
+        print_stats()
+    elif args.command == 'train':
+        train_and_store_dictionary()
+    elif args.command == 'recompress':
+        recompress_existing()
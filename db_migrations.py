@@ -0,0 +1,499 @@
+import json
+import time
+import sqlite3
+import argparse
+
+import database_manager
+from db_pool import DB_CONFIG_FILE, get_pool, load_db_settings
+from db_compression import COMPRESSED_COLUMNS
+
+'''
+Версионированные миграции схемы БД поверх database_manager.
+Каждая миграция имеет номер, идемпотентна (повторный запуск ничего не ломает)
+и после успешного применения записывается в таблицу schema_version вместе с временем выполнения.
+
+Большие изменения разбиты на короткие транзакции: каждый индекс строится отдельно,
+а заполнение колонок идет пачками по id с паузой между ними. В режиме WAL читатели
+(бот, этапы конвейера) во время миграции не блокируются, а писатели ждут не дольше одной пачки.
+
+Запуск:
+    python db_migrations.py            # применить все новые миграции
+    python db_migrations.py --status   # показать историю примененных миграций
+'''
+
+DEFAULT_MIGRATION_SETTINGS = {
+    "batch_size": 5000,
+    "pause_between_batches_ms": 20
+}
+
+
+# --- Вспомогательные функции ---
+
+def load_migration_settings() -> dict:
+    settings = dict(DEFAULT_MIGRATION_SETTINGS)
+    try:
+        with open(DB_CONFIG_FILE, 'r', encoding='utf-8') as f:
+            settings.update(json.load(f).get('migrations', {}))
+    except (FileNotFoundError, json.JSONDecodeError):
+        pass
+    return settings
+
+
+def open_migration_connection() -> sqlite3.Connection:
+    """Отдельное соединение в режиме autocommit: транзакциями управляют сами миграции."""
+    pool_settings = load_db_settings()
+    conn = sqlite3.connect(
+        database_manager.DB_NAME,
+        timeout=pool_settings['busy_timeout_ms'] / 1000,
+        isolation_level=None
+    )
+    conn.row_factory = sqlite3.Row
+    get_pool(database_manager.DB_NAME).codec.register_sql_functions(conn)
+    conn.execute(f"PRAGMA journal_mode = {pool_settings['journal_mode']}")
+    conn.execute(f"PRAGMA busy_timeout = {pool_settings['busy_timeout_ms']}")
+    return conn
+
+
+def column_exists(conn: sqlite3.Connection, table: str, column: str) -> bool:
+    return any(row['name'] == column for row in conn.execute(f"PRAGMA table_info({table})"))
+
+
+def add_column(conn: sqlite3.Connection, table: str, column: str, declaration: str) -> bool:
+    """Добавляет колонку, если ее еще нет. ALTER TABLE ADD COLUMN в SQLite не переписывает таблицу."""
+    if column_exists(conn, table, column):
+        print(f"     Колонка {table}.{column} уже существует.")
+        return False
+    conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {declaration}")
+    print(f"     Добавлена колонка {table}.{column}.")
+    return True
+
+
+def build_index(conn: sqlite3.Connection, index_name: str, sql: str):
+    """Строит один индекс в собственной транзакции и печатает время построения."""
+    start = time.perf_counter()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute(sql)
+        conn.execute("COMMIT")
+    except sqlite3.Error:
+        conn.execute("ROLLBACK")
+        raise
+    print(f"     Индекс {index_name}: {(time.perf_counter() - start) * 1000:.1f} мс")
+
+
+def backfill_in_batches(conn: sqlite3.Connection, table: str, update_sql: str) -> int:
+    """
+    Выполняет UPDATE (или INSERT ... SELECT) пачками по диапазонам id таблицы table.
+    update_sql должен содержать условие 'id BETWEEN ? AND ?' и сам отсекать уже заполненные строки.
+    Возвращает количество затронутых строк.
+    """
+    settings = load_migration_settings()
+    batch_size = settings['batch_size']
+    pause = settings['pause_between_batches_ms'] / 1000
+
+    bounds = conn.execute(f"SELECT MIN(id), MAX(id) FROM {table}").fetchone()
+    if bounds[0] is None:
+        return 0
+
+    total_updated = 0
+    for batch_start in range(bounds[0], bounds[1] + 1, batch_size):
+        batch_end = batch_start + batch_size - 1
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            cursor = conn.execute(update_sql, (batch_start, batch_end))
+            conn.execute("COMMIT")
+        except sqlite3.Error:
+            conn.execute("ROLLBACK")
+            raise
+        total_updated += cursor.rowcount
+        if pause:
+            time.sleep(pause)  # Даем другим писателям забрать блокировку между пачками
+    return total_updated
+
+
+# --- Миграции ---
+
+def migration_001_matched_tokens(conn: sqlite3.Connection) -> str:
+    """token_matcher и get_articles_for_delivery используют generated_articles.matched_tokens."""
+    added = add_column(conn, 'generated_articles', 'matched_tokens', 'TEXT')
+    return "колонка добавлена" if added else "без изменений"
+
+
+# Индексы под "горячие" запросы этапов конвейера.
+# Частичные индексы содержат только строки, которые еще в работе, поэтому
+# остаются маленькими, сколько бы обработанных тем и статей ни накопилось.
+HOT_INDEXES = {
+    'idx_topics_needs_title':
+        "CREATE INDEX IF NOT EXISTS idx_topics_needs_title "
+        "ON topics (creation_date) WHERE status = 'needs_title'",
+    'idx_topics_ready_for_planning':
+        "CREATE INDEX IF NOT EXISTS idx_topics_ready_for_planning "
+        "ON topics (category, creation_date) WHERE status = 'ready_for_planning'",
+    'idx_topics_planned_for_generation':
+        "CREATE INDEX IF NOT EXISTS idx_topics_planned_for_generation "
+        "ON topics (assigned_persona_id) WHERE status = 'planned_for_generation'",
+    'idx_generated_articles_pending_image':
+        "CREATE INDEX IF NOT EXISTS idx_generated_articles_pending_image "
+        "ON generated_articles (persona_id) WHERE image_path IS NULL",
+    'idx_generated_articles_pending_tokens':
+        "CREATE INDEX IF NOT EXISTS idx_generated_articles_pending_tokens "
+        "ON generated_articles (id) WHERE matched_tokens IS NULL",
+    'idx_generated_articles_generation_date':
+        "CREATE INDEX IF NOT EXISTS idx_generated_articles_generation_date "
+        "ON generated_articles (generation_date)",
+    'idx_generated_articles_topic_id':
+        "CREATE INDEX IF NOT EXISTS idx_generated_articles_topic_id "
+        "ON generated_articles (topic_id)",
+    'idx_source_articles_category':
+        "CREATE INDEX IF NOT EXISTS idx_source_articles_category "
+        "ON source_articles (bybit_category_id)",
+    'idx_users_subscribed_persona':
+        "CREATE INDEX IF NOT EXISTS idx_users_subscribed_persona "
+        "ON users (subscribed_persona_id) WHERE subscribed_persona_id IS NOT NULL",
+}
+
+
+def migration_002_hot_indexes(conn: sqlite3.Connection) -> str:
+    for index_name, sql in HOT_INDEXES.items():
+        build_index(conn, index_name, sql)
+    return f"{len(HOT_INDEXES)} индексов"
+
+
+def migration_003_topics_assigned_user(conn: sqlite3.Connection) -> str:
+    """
+    daily_planner и get_generation_tasks используют topics.assigned_user_id.
+    Для уже сгенерированных статей пользователь восстанавливается из generated_articles.
+    """
+    add_column(conn, 'topics', 'assigned_user_id', 'INTEGER REFERENCES users (id) ON DELETE SET NULL')
+    updated = backfill_in_batches(conn, 'topics', """
+        UPDATE topics
+        SET assigned_user_id = (
+            SELECT ga.user_id FROM generated_articles ga
+            WHERE ga.topic_id = topics.id ORDER BY ga.id LIMIT 1
+        )
+        WHERE id BETWEEN ? AND ?
+          AND assigned_user_id IS NULL
+          AND EXISTS (SELECT 1 FROM generated_articles ga WHERE ga.topic_id = topics.id)
+    """)
+    print(f"     Заполнено assigned_user_id у {updated} тем.")
+    return f"заполнено строк: {updated}"
+
+
+# Полнотекстовые индексы FTS5 поверх topics и generated_articles (external content:
+# текст хранится только в исходных таблицах, FTS держит лишь индекс).
+FTS_TABLES = {
+    'topics_fts': ('topics', ('title', 'source_news_text')),
+    'generated_articles_fts': ('generated_articles', ('title', 'content')),
+}
+
+
+def create_fts_objects(conn: sqlite3.Connection, fts_table: str, source_table: str, columns: tuple,
+                       content_table: str, packed_columns: tuple = ()):
+    """
+    Создает FTS5-таблицу с внешним содержимым content_table и триггеры синхронизации
+    на source_table. Значения колонок из packed_columns перед индексацией распаковываются nc_unpack().
+    Вызывается внутри транзакции миграции.
+    """
+    column_list = ", ".join(columns)
+
+    def values(prefix: str) -> str:
+        return ", ".join(f"nc_unpack({prefix}.{c})" if c in packed_columns else f"{prefix}.{c}" for c in columns)
+
+    conn.execute(f"""
+        CREATE VIRTUAL TABLE IF NOT EXISTS {fts_table} USING fts5(
+            {column_list},
+            content='{content_table}', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2'
+        )""")
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS {fts_table}_ai AFTER INSERT ON {source_table} BEGIN
+            INSERT INTO {fts_table} (rowid, {column_list}) VALUES (new.id, {values('new')});
+        END""")
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS {fts_table}_ad AFTER DELETE ON {source_table} BEGIN
+            INSERT INTO {fts_table} ({fts_table}, rowid, {column_list}) VALUES ('delete', old.id, {values('old')});
+        END""")
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS {fts_table}_au AFTER UPDATE OF {column_list} ON {source_table} BEGIN
+            INSERT INTO {fts_table} ({fts_table}, rowid, {column_list}) VALUES ('delete', old.id, {values('old')});
+            INSERT INTO {fts_table} (rowid, {column_list}) VALUES (new.id, {values('new')});
+        END""")
+
+
+def index_fts_in_batches(conn: sqlite3.Connection, fts_table: str, source_table: str, columns: tuple,
+                         content_table: str, max_id: int) -> int:
+    """Индексирует строки с id <= max_id пачками (более новые строки уже проиндексированы триггерами)."""
+    column_list = ", ".join(columns)
+    start = time.perf_counter()
+    indexed = backfill_in_batches(conn, source_table, f"""
+        INSERT INTO {fts_table} (rowid, {column_list})
+        SELECT id, {column_list} FROM {content_table}
+        WHERE id BETWEEN ? AND ? AND id <= {max_id}
+    """)
+    print(f"     {fts_table}: проиндексировано {indexed} строк за {time.perf_counter() - start:.1f} сек.")
+    return indexed
+
+
+def migration_004_full_text_search(conn: sqlite3.Connection) -> str:
+    """
+    Создает FTS5-таблицы и триггеры синхронизации, затем индексирует уже
+    существующие строки пачками. Строки, появившиеся после создания триггеров,
+    индексируются триггерами, поэтому пачки ограничены max_id на момент их создания.
+    """
+    details = []
+    for fts_table, (source_table, columns) in FTS_TABLES.items():
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            already_exists = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (fts_table,)
+            ).fetchone()
+            create_fts_objects(conn, fts_table, source_table, columns, content_table=source_table)
+            max_id = conn.execute(f"SELECT MAX(id) FROM {source_table}").fetchone()[0] or 0
+            conn.execute("COMMIT")
+        except sqlite3.Error:
+            conn.execute("ROLLBACK")
+            raise
+
+        if already_exists:
+            # Прошлый запуск миграции прервался посреди индексации: перестраиваем индекс целиком
+            start = time.perf_counter()
+            conn.execute(f"INSERT INTO {fts_table} ({fts_table}) VALUES ('rebuild')")
+            print(f"     {fts_table}: индекс перестроен за {time.perf_counter() - start:.1f} сек.")
+            details.append(f"{fts_table}: перестроен")
+            continue
+
+        indexed = index_fts_in_batches(conn, fts_table, source_table, columns, source_table, max_id)
+        details.append(f"{fts_table}: {indexed} строк")
+    return "; ".join(details)
+
+
+def migration_005_text_compression(conn: sqlite3.Connection) -> str:
+    """
+    Подготовка к сжатию текстов (db_compression.py): таблица словарей и перевод FTS
+    на представления *_text, которые отдают распакованный текст. Сами строки здесь
+    не пересжимаются - это делает 'python db_compression.py recompress'.
+    FTS-таблицы пересоздаются (у FTS5 нельзя поменять content=) и индексируются пачками заново.
+    """
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS compression_dictionaries (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        codec TEXT NOT NULL,
+        data BLOB NOT NULL,
+        sample_count INTEGER NOT NULL,
+        created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+    )
+    ''')
+
+    details = []
+    for fts_table, (source_table, columns) in FTS_TABLES.items():
+        content_view = f"{source_table}_text"
+        packed_columns = COMPRESSED_COLUMNS.get(source_table, ())
+        view_columns = ", ".join(f"nc_unpack({c}) AS {c}" if c in packed_columns else c for c in columns)
+
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for suffix in ('ai', 'ad', 'au'):
+                conn.execute(f"DROP TRIGGER IF EXISTS {fts_table}_{suffix}")
+            conn.execute(f"DROP TABLE IF EXISTS {fts_table}")
+            conn.execute(f"CREATE VIEW IF NOT EXISTS {content_view} AS SELECT id, {view_columns} FROM {source_table}")
+            create_fts_objects(conn, fts_table, source_table, columns, content_view, packed_columns)
+            max_id = conn.execute(f"SELECT MAX(id) FROM {source_table}").fetchone()[0] or 0
+            conn.execute("COMMIT")
+        except sqlite3.Error:
+            conn.execute("ROLLBACK")
+            raise
+
+        indexed = index_fts_in_batches(conn, fts_table, source_table, columns, content_view, max_id)
+        details.append(f"{fts_table}: {indexed} строк")
+    return "; ".join(details)
+
+
+def migration_006_article_tokens(conn: sqlite3.Connection) -> str:
+    """
+    Связь статья-токен вместо разбора JSON из generated_articles.matched_tokens.
+    Первичный ключ (article_id, token) обслуживает выборку токенов статьи,
+    индекс (token, article_id) - поиск статей по токену. position сохраняет порядок,
+    в котором токены вернула модель. Существующий JSON переносится пачками.
+    """
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS article_tokens (
+        article_id INTEGER NOT NULL,
+        token TEXT NOT NULL,
+        position INTEGER NOT NULL,
+        PRIMARY KEY (article_id, token),
+        FOREIGN KEY (article_id) REFERENCES generated_articles (id) ON DELETE CASCADE
+    ) WITHOUT ROWID
+    ''')
+    build_index(conn, 'idx_article_tokens_token',
+                "CREATE INDEX IF NOT EXISTS idx_article_tokens_token ON article_tokens (token, article_id)")
+    inserted = backfill_in_batches(conn, 'generated_articles', """
+        INSERT OR IGNORE INTO article_tokens (article_id, token, position)
+        SELECT ga.id, upper(trim(je.value)), je.key
+        FROM generated_articles ga, json_each(ga.matched_tokens) je
+        WHERE ga.id BETWEEN ? AND ?
+          AND ga.matched_tokens IS NOT NULL
+          AND json_valid(ga.matched_tokens)
+          AND json_type(ga.matched_tokens) = 'array'
+          AND je.type = 'text'
+          AND trim(je.value) != ''
+    """)
+    print(f"     Перенесено связей статья-токен: {inserted}.")
+    return f"перенесено связей: {inserted}"
+
+
+def migration_007_pipeline_checkpoints(conn: sqlite3.Connection) -> str:
+    """
+    Чекпоинты ежедневного конвейера (daily_pipeline --resume): прогон на целевую дату
+    и состояние каждого его этапа с результатом. topics.source_key - ключ исходной новости
+    (дата + хеш текста): уникальный индекс не дает повторному запуску topic_rebalancer
+    вставить ту же тему второй раз.
+    """
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS pipeline_runs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        target_date TEXT NOT NULL UNIQUE,
+        status TEXT NOT NULL,
+        attempts INTEGER NOT NULL DEFAULT 1,
+        started_at TIMESTAMP NOT NULL,
+        finished_at TIMESTAMP
+    )
+    ''')
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS stage_runs (
+        run_id INTEGER NOT NULL,
+        stage TEXT NOT NULL,
+        status TEXT NOT NULL,
+        attempt INTEGER NOT NULL,
+        started_at TIMESTAMP NOT NULL,
+        finished_at TIMESTAMP NOT NULL,
+        duration_sec REAL NOT NULL,
+        error TEXT,
+        artifact TEXT,
+        PRIMARY KEY (run_id, stage),
+        FOREIGN KEY (run_id) REFERENCES pipeline_runs (id) ON DELETE CASCADE
+    )
+    ''')
+    if not column_exists(conn, 'topics', 'source_key'):
+        conn.execute("ALTER TABLE topics ADD COLUMN source_key TEXT")
+    build_index(conn, 'idx_topics_source_key',
+                "CREATE UNIQUE INDEX IF NOT EXISTS idx_topics_source_key ON topics (source_key) "
+                "WHERE source_key IS NOT NULL")
+    return "pipeline_runs, stage_runs, topics.source_key"
+
+
+def migration_008_stage_cache(conn: sqlite3.Connection) -> str:
+    """
+    Кэш результатов этапов, зависящих от даты (stage_cache.py): хеш входов этапа ->
+    хеш сохраненного результата. Сами результаты лежат в каталоге кэша под своим хешем.
+    """
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS stage_cache (
+        stage TEXT NOT NULL,
+        input_hash TEXT NOT NULL,
+        target_date TEXT,
+        output_hash TEXT NOT NULL,
+        output_path TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        hits INTEGER NOT NULL DEFAULT 0,
+        last_hit_at TIMESTAMP,
+        PRIMARY KEY (stage, input_hash)
+    )
+    ''')
+    build_index(conn, 'idx_stage_cache_date',
+                "CREATE INDEX IF NOT EXISTS idx_stage_cache_date ON stage_cache (stage, target_date, created_at)")
+    return "stage_cache"
+
+
+MIGRATIONS = [
+    (1, 'generated_articles.matched_tokens', migration_001_matched_tokens),
+    (2, 'hot_query_indexes', migration_002_hot_indexes),
+    (3, 'topics.assigned_user_id', migration_003_topics_assigned_user),
+    (4, 'full_text_search', migration_004_full_text_search),
+    (5, 'text_compression', migration_005_text_compression),
+    (6, 'article_tokens', migration_006_article_tokens),
+    (7, 'pipeline_checkpoints', migration_007_pipeline_checkpoints),
+    (8, 'stage_cache', migration_008_stage_cache),
+]
+
+
+# --- Движок миграций ---
+
+def ensure_schema_version_table(conn: sqlite3.Connection):
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS schema_version (
+        version INTEGER PRIMARY KEY,
+        name TEXT NOT NULL,
+        applied_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        duration_ms REAL NOT NULL,
+        details TEXT
+    )
+    ''')
+
+
+def get_applied_versions(conn: sqlite3.Connection) -> set:
+    return {row['version'] for row in conn.execute("SELECT version FROM schema_version")}
+
+
+def print_report(report: list):
+    if not report:
+        print("     Схема БД актуальна, новых миграций нет.")
+        return
+    print("\n     Отчет по миграциям:")
+    print(f"     {'#':>4}  {'Миграция':<36} {'Время, мс':>10}  Детали")
+    for version, name, duration_ms, details in report:
+        print(f"     {version:>4}  {name:<36} {duration_ms:>10.1f}  {details}")
+
+
+def run_migrations() -> bool:
+    """Применяет все миграции, которых еще нет в schema_version. Возвращает True при успехе."""
+    print(f"  -> Проверка миграций схемы БД '{database_manager.DB_NAME}'...")
+    conn = open_migration_connection()
+    report = []
+    try:
+        ensure_schema_version_table(conn)
+        for version, name, migrate in MIGRATIONS:
+            # Перечитываем на каждом шаге: миграции мог параллельно применить другой процесс
+            if version in get_applied_versions(conn):
+                continue
+            print(f"  -> Миграция {version:03d}: {name}...")
+            start = time.perf_counter()
+            details = migrate(conn) or ""
+            duration_ms = (time.perf_counter() - start) * 1000
+            conn.execute(
+                "INSERT OR IGNORE INTO schema_version (version, name, duration_ms, details) VALUES (?, ?, ?, ?)",
+                (version, name, duration_ms, details)
+            )
+            report.append((version, name, duration_ms, details))
+        print_report(report)
+        return True
+    except sqlite3.Error as e:
+        print(f"     [DB_ERROR] Ошибка при применении миграций: {e}")
+        print_report(report)
+        return False
+    finally:
+        conn.close()
+
+
+def print_status():
+    conn = open_migration_connection()
+    try:
+        ensure_schema_version_table(conn)
+        applied = {row['version']: row for row in conn.execute("SELECT * FROM schema_version")}
+    finally:
+        conn.close()
+    for version, name, _ in MIGRATIONS:
+        row = applied.get(version)
+        if row:
+            print(f"  [APPLIED] {version:03d} {name:<36} {row['applied_at']}  {row['duration_ms']:.1f} мс  {row['details']}")
+        else:
+            print(f"  [PENDING] {version:03d} {name}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Миграции схемы БД neuro_crypto.")
+    parser.add_argument('--status', action='store_true', help="Показать примененные и ожидающие миграции.")
+    args = parser.parse_args()
+    if args.status:
+        print_status()
+    else:
+        run_migrations()
@@ -0,0 +1,218 @@
+import os
+import json
+import queue
+import atexit
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+from db_compression import TextCodec, load_compression_settings
+
+'''
+Пул переиспользуемых соединений SQLite.
+Держит одно соединение-писатель (доступ сериализуется реентерабельной блокировкой:
+вложенный writer() в том же потоке работает внутри уже открытой транзакции через SAVEPOINT)
+и несколько соединений-читателей (ожидание свободного ограничено reader_timeout_ms).
+База переводится в режим WAL, PRAGMA-настройки (synchronous, cache_size, mmap_size,
+temp_store) берутся из database_config.json.
+К пулу привязан кодек сжатия текстов этой БД (см. db_compression.py): его функция
+nc_unpack() регистрируется на каждом соединении.
+'''
+
+# --- Конфигурация ---
+DB_CONFIG_FILE = 'database_config.json'
+
+DEFAULT_SETTINGS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "cache_size": -20000,  # отрицательное значение - размер в KiB
+    "mmap_size": 268435456,
+    "temp_store": "MEMORY",
+    "busy_timeout_ms": 10000,
+    "reader_pool_size": 4,
+    "reader_timeout_ms": 30000
+}
+
+ALLOWED_VALUES = {
+    "journal_mode": {"WAL", "DELETE", "TRUNCATE", "PERSIST", "MEMORY"},
+    "synchronous": {"OFF", "NORMAL", "FULL", "EXTRA"},
+    "temp_store": {"DEFAULT", "FILE", "MEMORY"},
+}
+
+
+def load_db_settings(config_path: str = DB_CONFIG_FILE) -> dict:
+    """Загружает настройки пула из конфига, подставляя значения по умолчанию."""
+    settings = dict(DEFAULT_SETTINGS)
+    try:
+        with open(config_path, 'r', encoding='utf-8') as f:
+            settings.update(json.load(f).get('connection_pool', {}))
+    except FileNotFoundError:
+        pass
+    except json.JSONDecodeError as e:
+        print(f"     [DB_WARNING] Некорректный {config_path}: {e}. Используются настройки по умолчанию.")
+
+    for key, allowed in ALLOWED_VALUES.items():
+        settings[key] = str(settings[key]).upper()
+        if settings[key] not in allowed:
+            raise ValueError(f"Недопустимое значение {key}={settings[key]} в {config_path}")
+    for key in ("cache_size", "mmap_size", "busy_timeout_ms", "reader_pool_size", "reader_timeout_ms"):
+        settings[key] = int(settings[key])
+    return settings
+
+
+class ConnectionPool:
+    """Пул соединений к одному файлу БД: один писатель и до N читателей."""
+
+    def __init__(self, db_path: str, settings: dict | None = None):
+        self.db_path = db_path
+        self.settings = settings or load_db_settings()
+        self.pid = os.getpid()
+        self.codec = TextCodec(db_path, load_compression_settings(DB_CONFIG_FILE))
+
+        self._writer = None
+        self._writer_lock = threading.RLock()
+        self._writer_depth = 0  # глубина вложенных writer() в потоке-владельце блокировки
+        self._readers = queue.LifoQueue()
+        self._readers_created = 0
+        self._readers_lock = threading.Lock()
+        self._closed = False
+
+    def _connect(self, read_only: bool) -> sqlite3.Connection:
+        s = self.settings
+        # isolation_level=None: транзакциями управляем сами (BEGIN IMMEDIATE у писателя)
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=s['busy_timeout_ms'] / 1000,
+            isolation_level=None,
+            check_same_thread=False
+        )
+        conn.row_factory = sqlite3.Row
+        self.codec.register_sql_functions(conn)
+        conn.execute(f"PRAGMA journal_mode = {s['journal_mode']}")
+        conn.execute(f"PRAGMA synchronous = {s['synchronous']}")
+        conn.execute(f"PRAGMA cache_size = {s['cache_size']}")
+        conn.execute(f"PRAGMA mmap_size = {s['mmap_size']}")
+        conn.execute(f"PRAGMA temp_store = {s['temp_store']}")
+        conn.execute(f"PRAGMA busy_timeout = {s['busy_timeout_ms']}")
+        conn.execute("PRAGMA foreign_keys = ON")
+        if read_only:
+            conn.execute("PRAGMA query_only = ON")
+        return conn
+
+    @contextmanager
+    def writer(self):
+        """
+        Выдает единственное соединение-писатель внутри транзакции BEGIN IMMEDIATE.
+        Коммит при успешном выходе из блока, откат при исключении.
+        Вложенный вызов в том же потоке не ждет сам себя: он получает то же соединение
+        внутри открытой транзакции, а его изменения оформляются SAVEPOINT - при исключении
+        откатывается только вложенный блок, коммит делает внешний.
+        """
+        with self._writer_lock:
+            if self._closed:
+                raise sqlite3.ProgrammingError("Пул соединений закрыт.")
+            if self._writer is None:
+                self._writer = self._connect(read_only=False)
+            conn = self._writer
+            self._writer_depth += 1
+            savepoint = f"nested_writer_{self._writer_depth}"
+            try:
+                if self._writer_depth == 1:
+                    conn.execute("BEGIN IMMEDIATE")
+                else:
+                    conn.execute(f"SAVEPOINT {savepoint}")
+                try:
+                    yield conn
+                    if self._writer_depth == 1:
+                        conn.commit()
+                    else:
+                        conn.execute(f"RELEASE SAVEPOINT {savepoint}")
+                except BaseException:
+                    if self._writer_depth == 1:
+                        conn.rollback()
+                    else:
+                        conn.execute(f"ROLLBACK TO SAVEPOINT {savepoint}")
+                        conn.execute(f"RELEASE SAVEPOINT {savepoint}")
+                    raise
+            finally:
+                self._writer_depth -= 1
+
+    @contextmanager
+    def reader(self):
+        """Выдает свободное соединение-читатель (создает новое, если лимит не исчерпан)."""
+        conn = self._acquire_reader()
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            if self._closed:
+                conn.close()
+            else:
+                self._readers.put(conn)
+
+    def _acquire_reader(self) -> sqlite3.Connection:
+        if self._closed:
+            raise sqlite3.ProgrammingError("Пул соединений закрыт.")
+        try:
+            return self._readers.get_nowait()
+        except queue.Empty:
+            pass
+        with self._readers_lock:
+            if self._readers_created < self.settings['reader_pool_size']:
+                self._readers_created += 1
+                return self._connect(read_only=True)
+        timeout = self.settings['reader_timeout_ms'] / 1000
+        try:
+            return self._readers.get(timeout=timeout)
+        except queue.Empty:
+            message = (f"Нет свободного соединения-читателя за {timeout:g} сек "
+                       f"(пул {self.settings['reader_pool_size']}, БД {self.db_path}).")
+            print(f"     [DB_ERROR] {message}")
+            raise sqlite3.OperationalError(message) from None
+
+    def close(self):
+        """Закрывает все соединения пула."""
+        self._closed = True
+        with self._writer_lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+        while True:
+            try:
+                self._readers.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+# --- Реестр пулов (по одному на файл БД и процесс) ---
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(db_path: str) -> ConnectionPool:
+    """
+    Возвращает пул для указанного файла БД, создавая его при первом обращении.
+    После fork (пул процессов) создается новый пул: соединения SQLite
+    нельзя переносить между процессами.
+    """
+    key = os.path.abspath(db_path)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None or pool.pid != os.getpid():
+            pool = ConnectionPool(db_path)
+            _pools[key] = pool
+        return pool
+
+
+def close_all_pools():
+    """Закрывает все пулы текущего процесса."""
+    with _pools_lock:
+        for pool in _pools.values():
+            if pool.pid == os.getpid():
+                pool.close()
+        _pools.clear()
+
+
+atexit.register(close_all_pools)
@@ -1,5 +1,4 @@
 import os
-import json
 import zipfile
 import shutil
 from pathlib import Path
@@ -10,6 +9,7 @@ from docx import Document
 from docx.shared import Inches
 
 from database_manager import get_articles_for_delivery
+from tracing import span, traced
 
 '''
 Модуль финальной сборки.
@@ -27,12 +27,9 @@ def create_docx(article_data: Dict, filepath: Path):
     """Создает и сохраняет DOCX-файл для одной статьи."""
     doc = Document()
 
-    # Форматируем токены из JSON-строки в обычную строку
-    try:
-        tokens_list = json.loads(article_data['matched_tokens'])
-        tokens_str = ", ".join(tokens_list).upper()
-    except (json.JSONDecodeError, TypeError):
-        tokens_str = "N/A"
+    # Форматируем список токенов (из article_tokens) в обычную строку
+    tokens_list = article_data.get('matched_tokens')
+    tokens_str = ", ".join(tokens_list).upper() if tokens_list is not None else "N/A"
 
     # Заполняем документ по шаблону
     doc.add_paragraph(f"TITLE: {article_data['title']}")
@@ -41,7 +38,8 @@ def create_docx(article_data: Dict, filepath: Path):
     doc.add_paragraph("ARTICLE:")
     doc.add_paragraph(article_data['content'])
 
-    doc.save(filepath)
+    with span('file.docx', kind='file', path=str(filepath)):
+        doc.save(filepath)
 
 
 def sanitize_filename(name: str) -> str:
@@ -51,6 +49,7 @@ def sanitize_filename(name: str) -> str:
 
 # --- Основная логика ---
 
+@traced()
 def run_doc_zipper() -> Dict[int, str]:
     """
     Основная функция. Собирает статьи, создает DOCX и ZIP.
@@ -101,7 +100,8 @@ def run_doc_zipper() -> Dict[int, str]:
             zip_filename = f"{username}_digest_{today_str}.zip"
             zip_filepath = Path(OUTPUT_ZIP_DIR) / zip_filename
 
-            with zipfile.ZipFile(zip_filepath, 'w', zipfile.ZIP_DEFLATED) as zf:
+            with span('file.zip', kind='file', path=str(zip_filepath), articles=len(articles)), \
+                    zipfile.ZipFile(zip_filepath, 'w', zipfile.ZIP_DEFLATED) as zf:
                 for file_to_zip in temp_user_dir.glob('*'):
                     zf.write(file_to_zip, arcname=file_to_zip.name)
 
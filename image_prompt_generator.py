@@ -1,12 +1,12 @@
 import os
-import json
 from pathlib import Path
 from typing import List, Dict
-import google.generativeai as genai
 from dotenv import load_dotenv
-from google.generativeai.types import GenerationConfig
 
 from alerter import send_admin_alert
+from llm_gateway import LLMResponseError, generate_sync
+from key_pool import call_with_failover_sync
+from tracing import traced
 from database_manager import get_all_personas, update_persona_image_style
 
 '''
@@ -26,7 +26,7 @@ ENV_FILE = '.env'
 
 def get_image_styles_from_ai(prompt: str) -> List[Dict] | None:
     """
-    Делает запрос к Gemini, перебирая API-ключи, и ожидает JSON-массив.
+    Делает запрос к Gemini, перебирая API-ключи от самого здорового (key_pool), и ожидает JSON-массив.
     """
     load_dotenv(ENV_FILE)
     api_keys = [os.getenv(key) for key in API_KEY_NAMES if os.getenv(key)]
@@ -34,34 +34,24 @@ def get_image_styles_from_ai(prompt: str) -> List[Dict] | None:
         print("     [ERROR] API-ключи для генератора стилей не найдены в .env")
         return None
 
-    generation_config = GenerationConfig(
-        response_mime_type="application/json",
-        temperature=1.0
-    )
+    def request(api_key: str) -> List[Dict]:
+        parsed_response = generate_sync('gemini', MODEL_NAME, prompt, api_key=api_key,
+                                        schema=list, temperature=1.0, stage='image_prompt_generator')
+        # Проверяем, что это список из 5 элементов; иначе - следующий ключ
+        if len(parsed_response) != 5:
+            raise LLMResponseError(f"Ответ API не является списком из 5 элементов. Ответ: {parsed_response}")
+        return parsed_response
 
-    for i, api_key in enumerate(api_keys):
-        print(f"     Попытка {i + 1}/{len(api_keys)} с ключом ...{api_key[-4:]}")
-        try:
-            genai.configure(api_key=api_key)
-            model = genai.GenerativeModel(MODEL_NAME)
-            response = model.generate_content(contents=prompt, generation_config=generation_config)
-
-            parsed_response = json.loads(response.text)
-
-            # Проверяем, что это список из 5 элементов
-            if isinstance(parsed_response, list) and len(parsed_response) == 5:
-                print("     Успешный ответ и валидация JSON-массива получены.")
-                return parsed_response
-            else:
-                print(f"     [WARNING] Ответ API не является списком из 5 элементов. Ответ: {parsed_response}")
-        except Exception as e:
-            print(f"     [ERROR] Ошибка с ключом ...{api_key[-4:]}: {e}")
-            continue
-
-    print("     [CRITICAL] Ни один из API-ключей не сработал или не вернул корректный формат.")
-    return None
+    try:
+        parsed_response = call_with_failover_sync('gemini', MODEL_NAME, api_keys, request)
+    except Exception as e:
+        print(f"     [CRITICAL] Ни один из API-ключей не сработал или не вернул корректный формат: {e}")
+        return None
+    print("     Успешный ответ и валидация JSON-массива получены.")
+    return parsed_response
 
 
+@traced()
 def run_image_prompt_generator() -> bool:
     """
     Основная функция-оркестратор для генерации стилей изображений.
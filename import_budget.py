@@ -0,0 +1,136 @@
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+'''
+Проверка холодного старта: время импорта точек входа по `python -X importtime`
+и отсутствие тяжелых зависимостей (SDK провайдеров, GUI-автоматизация, ML-библиотеки),
+которые должны загружаться только при запуске своего этапа.
+
+Каждый модуль импортируется в отдельном свежем процессе несколько раз, берется лучший результат.
+Бюджеты (мс) задаются ключом "cold_start_budget_ms" в pipeline_config.json.
+Код выхода 1, если бюджет превышен или при импорте загрузилась тяжелая зависимость.
+Детерминированная часть проверки - тяжелые зависимости - выполняется и в pytest
+(tests/test_import_budget.py); бюджеты времени проверяет только этот скрипт: на загруженной
+CI-машине миллисекунды нестабильны.
+
+Запуск:
+    python import_budget.py                      # все точки входа из бюджета
+    python import_budget.py daily_pipeline --runs 5 --top 10
+'''
+
+PIPELINE_CONFIG_FILE = 'pipeline_config.json'
+DEFAULT_RUNS = 3
+DEFAULT_BUDGETS_MS = {
+    'database_manager': 150,
+    'db_migrations': 150,
+    'stage_cache': 150,
+    'tracing': 80,
+    'daily_pipeline': 300,
+    'backfill': 300,
+    'scheduler': 400,
+}
+
+# Зависимости, которые нельзя загружать при импорте точки входа
+HEAVY_MODULES = (
+    'pyautogui', 'cv2', 'telethon', 'sklearn', 'numpy', 'google.generativeai', 'google.ai', 'grpc',
+    'openai', 'huggingface_hub', 'docx', 'PIL', 'telegram', 'pybit', 'requests', 'httpx',
+)
+
+
+def load_budgets() -> dict:
+    try:
+        with open(PIPELINE_CONFIG_FILE, 'r', encoding='utf-8') as f:
+            return json.load(f).get('cold_start_budget_ms', DEFAULT_BUDGETS_MS)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return DEFAULT_BUDGETS_MS
+
+
+def parse_importtime(stderr: str) -> list[tuple[str, int, int, int]]:
+    """Строки отчета -X importtime: (модуль, глубина вложенности, собственное время, накопленное время в мкс)."""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        parts = line[len('import time:'):].split('|')
+        if len(parts) != 3 or not parts[0].strip().isdigit():
+            continue  # заголовок таблицы
+        name = parts[2].rstrip()
+        depth = (len(name) - len(name.lstrip())) // 2
+        rows.append((name.strip(), depth, int(parts[0]), int(parts[1])))
+    return rows
+
+
+def measure_import(module: str, prelude: str = '') -> dict:
+    """
+    Импортирует модуль в свежем интерпретаторе и разбирает отчет importtime.
+    prelude - код, выполняемый перед импортом (например, заглушки неустановленных пакетов в тестах).
+    """
+    completed = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'{prelude}\nimport {module}'],
+                               capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    rows = parse_importtime(completed.stderr)
+    if completed.returncode != 0:
+        error_lines = [line for line in completed.stderr.splitlines() if not line.startswith('import time:')]
+        return {'error': error_lines[-1] if error_lines else f"код выхода {completed.returncode}"}
+
+    target = next((row for row in reversed(rows) if row[0] == module), None)
+    if target is None:
+        return {'error': "модуль не найден в отчете importtime"}
+    # Строки модуля и всех его зависимостей идут в отчете перед его собственной строкой
+    end = len(rows) - 1 - next(i for i, row in enumerate(reversed(rows)) if row[0] == module)
+    start = end
+    while start > 0 and rows[start - 1][1] > target[1]:
+        start -= 1
+    subtree = rows[start:end]
+    heavy = sorted({name for name, *_ in subtree
+                    if any(name == heavy_name or name.startswith(heavy_name + '.') for heavy_name in HEAVY_MODULES)})
+    children = sorted((row for row in subtree if row[1] == target[1] + 1), key=lambda row: -row[3])
+    return {'total_ms': target[3] / 1000, 'modules': len(subtree) + 1, 'heavy': heavy, 'children': children}
+
+
+def best_import(module: str, runs: int = DEFAULT_RUNS) -> dict:
+    """Лучший из runs замеров импорта модуля; при ошибке импорта - словарь с ключом 'error'."""
+    results = [measure_import(module) for _ in range(runs)]
+    failed = next((result for result in results if 'error' in result), None)
+    return failed or min(results, key=lambda result: result['total_ms'])
+
+
+def check_module(module: str, budget_ms: float, runs: int, top: int) -> bool:
+    best = best_import(module, runs)
+    if 'error' in best:
+        print(f"  🔥 {module}: импорт не удался - {best['error']}")
+        return False
+
+    within_budget = best['total_ms'] <= budget_ms
+    icon = '✅' if within_budget and not best['heavy'] else '🔥'
+    print(f"  {icon} {module}: {best['total_ms']:.1f} мс (бюджет {budget_ms} мс), модулей: {best['modules']}")
+    for name, _, _, cumulative in best['children'][:top]:
+        print(f"       {cumulative / 1000:8.1f} мс  {name}")
+    if best['heavy']:
+        print(f"       [ERROR] При импорте загружены тяжелые зависимости: {', '.join(best['heavy'])}")
+    return within_budget and not best['heavy']
+
+
+def main() -> int:
+    budgets = load_budgets()
+    parser = argparse.ArgumentParser(description="Проверка времени холодного старта точек входа.")
+    parser.add_argument('modules', nargs='*', help="модули для проверки (по умолчанию - все из бюджета)")
+    parser.add_argument('--runs', type=int, default=DEFAULT_RUNS, help="запусков на модуль, берется лучший")
+    parser.add_argument('--top', type=int, default=5, help="сколько самых долгих прямых импортов показать")
+    args = parser.parse_args()
+
+    modules = args.modules or list(budgets)
+    print(f"--- Холодный старт (python -X importtime, лучший из {args.runs}) ---")
+    results = [check_module(module, budgets.get(module, max(budgets.values())), args.runs, args.top)
+               for module in modules]
+    if all(results):
+        print("--- Все точки входа укладываются в бюджет ---")
+        return 0
+    print(f"--- Бюджет нарушен: {results.count(False)} из {len(results)} ---")
+    return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,446 @@
+import os
+import json
+import asyncio
+import time
+import atexit
+import hashlib
+import argparse
+import threading
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+
+import pipeline_settings
+import rate_limiter
+from rate_limiter import is_rate_limited, mask_key
+
+'''
+Общий пул API-ключей: здоровье каждого ключа, предохранитель (circuit breaker) и память
+об исчерпанной дневной квоте, которая переживает перезапуски до сброса квоты.
+
+Запись ведется на тройку (провайдер, модель, ключ) - дневные квоты Gemini считаются по модели:
+    - доля успешных ответов и задержка (скользящие средние) - по ним ключи ранжируются:
+      запрос идет на самый здоровый ключ, остальные - запасные по убыванию здоровья;
+    - key_pool_failure_threshold ошибок подряд открывают предохранитель: ключ не выдается
+      key_pool_open_sec секунд, затем снова выдается, но после здоровых ключей (half-open).
+      Успешный пробный запрос закрывает предохранитель, ошибка открывает его снова
+      на удвоенное время (до key_pool_max_open_sec);
+    - 429 с дневной квотой (PerDay в ответе) помечает ключ исчерпанным до ближайшего
+      сброса квоты: key_pool_quota_reset_hour в поясе key_pool_quota_reset_tz (у Gemini - полночь
+      по тихоокеанскому времени). До сброса ключ не выдается ни одному этапу и ни одному запуску.
+
+Исходы запросов записывает llm_gateway (record_success / record_failure) для всех этапов;
+перед каждым запросом шлюз вызывает check(): на исчерпанный или закрытый ключ запрос не уходит,
+а воркер этапа получает NoHealthyKeyError, возвращает задачу в очередь и завершается.
+Воркеры над общей очередью - key_worker() и run_key_workers(): возвращенную задачу подбирает
+воркер живого ключа, даже если очередь уже казалась пустой.
+Файл состояния шлюз пишет в отдельном потоке (save_due() / save()): сразу после открытия
+предохранителя или исчерпания квоты, иначе не чаще раза в SAVE_INTERVAL_SEC; остальное - при выходе.
+Ключи в файле состояния хранятся только отпечатком sha256.
+
+Настройки в pipeline_config.json:
+    "key_pool_state_path": "key_pool_state.json"
+    "key_pool_failure_threshold": 3
+    "key_pool_open_sec": 60
+    "key_pool_max_open_sec": 1800
+    "key_pool_quota_reset_tz": "America/Los_Angeles"
+    "key_pool_quota_reset_hour": 0
+
+Использование:
+    text = await call_with_failover('gemini', model, api_keys,
+                                    lambda api_key: generate('gemini', model, prompt, api_key=api_key))
+    api_keys = available_keys('gemini', model, api_keys)   # этапы с воркерами на ключ
+    left = await run_key_workers(queue, [key_worker(str(i), queue, process) for i in range(workers)])
+
+Запуск:
+    python key_pool.py status
+    python key_pool.py reset [--provider gemini]
+'''
+
+DEFAULT_SETTINGS = {
+    'key_pool_state_path': 'key_pool_state.json',
+    'key_pool_failure_threshold': 3,
+    'key_pool_open_sec': 60,
+    'key_pool_max_open_sec': 1800,
+    'key_pool_quota_reset_tz': 'America/Los_Angeles',
+    'key_pool_quota_reset_hour': 0,
+}
+HEALTH_EWMA_ALPHA = 0.2
+SAVE_INTERVAL_SEC = 30
+DAILY_QUOTA_MARKERS = ('PerDay', 'per day', 'daily')
+
+_entries = None
+_lock = threading.RLock()
+_dirty = False
+_urgent = False
+_last_save = 0.0
+
+
+class NoHealthyKeyError(RuntimeError):
+    """Ключ (или все ключи запроса) исчерпал дневную квоту или закрыт предохранителем."""
+
+
+def load_settings() -> dict:
+    return pipeline_settings.load_settings(DEFAULT_SETTINGS)
+
+
+def fingerprint(api_key: str) -> str:
+    return hashlib.sha256(api_key.encode('utf-8')).hexdigest()[:16]
+
+
+def _entry_id(provider: str, model: str, api_key: str) -> str:
+    return f"{provider}/{model}/{fingerprint(api_key)}"
+
+
+def next_quota_reset(now: float | None = None) -> float:
+    """Момент ближайшего сброса дневной квоты (unix time)."""
+    settings = load_settings()
+    tz = ZoneInfo(settings['key_pool_quota_reset_tz'])
+    local_now = datetime.fromtimestamp(now if now is not None else time.time(), tz)
+    reset = local_now.replace(hour=settings['key_pool_quota_reset_hour'], minute=0, second=0, microsecond=0)
+    if reset <= local_now:
+        reset = datetime.combine(reset.date() + timedelta(days=1), reset.timetz())
+    return reset.timestamp()
+
+
+def is_daily_quota_exhausted(error: BaseException) -> bool:
+    """429, после которого ключ до сброса квоты бесполезен (а не поминутный лимит)."""
+    return is_rate_limited(error) and any(marker in str(error) for marker in DAILY_QUOTA_MARKERS)
+
+
+# --- Состояние ---
+
+def _new_entry(provider: str, model: str, api_key: str) -> dict:
+    return {'provider': provider, 'model': model, 'key': mask_key(api_key), 'success_rate': 1.0,
+            'latency_sec': None, 'requests': 0, 'failures': 0, 'consecutive_failures': 0,
+            'open_until': 0.0, 'open_sec': 0.0, 'exhausted_until': 0.0, 'last_error': None}
+
+
+def _read_state() -> dict:
+    try:
+        with open(load_settings()['key_pool_state_path'], 'r', encoding='utf-8') as f:
+            return json.load(f).get('keys', {})
+    except (FileNotFoundError, json.JSONDecodeError, OSError):
+        return {}
+
+
+def _state() -> dict:
+    global _entries
+    if _entries is None:
+        _entries = _read_state()
+        atexit.register(save)
+    return _entries
+
+
+def save_due() -> bool:
+    """Пора ли писать файл: есть важное изменение или с прошлой записи прошло SAVE_INTERVAL_SEC."""
+    return _dirty and (_urgent or time.time() - _last_save >= SAVE_INTERVAL_SEC)
+
+
+def save():
+    """
+    Сохраняет состояние (блокирующий ввод-вывод: из цикла событий - через asyncio.to_thread).
+    Отметки исчерпания квоты из файла (параллельный backfill) не теряются.
+    """
+    global _dirty, _urgent, _last_save
+    if _entries is None or not _dirty:
+        return
+    stored_entries = _read_state()
+    now = time.time()
+    with _lock:
+        for entry_id, stored in stored_entries.items():
+            entry = _entries.get(entry_id)
+            if entry is None:
+                _entries[entry_id] = stored
+            else:
+                entry['exhausted_until'] = max(entry['exhausted_until'], stored.get('exhausted_until', 0.0))
+        for entry in _entries.values():
+            if entry['exhausted_until'] and entry['exhausted_until'] <= now:
+                entry['exhausted_until'] = 0.0
+        data = json.dumps({'saved_at': datetime.now().isoformat(timespec='seconds'), 'keys': _entries},
+                          ensure_ascii=False, indent=2)
+        _dirty = _urgent = False
+        _last_save = now
+    path = load_settings()['key_pool_state_path']
+    try:
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        with _lock:
+            _dirty = True
+        print(f"     [WARNING] Не удалось сохранить состояние пула ключей: {e}")
+
+
+def _entry(provider: str, model: str, api_key: str) -> dict:
+    state = _state()
+    entry_id = _entry_id(provider, model, api_key)
+    if entry_id not in state:
+        state[entry_id] = _new_entry(provider, model, api_key)
+    return state[entry_id]
+
+
+# --- Исходы запросов ---
+
+def record_success(provider: str, model: str, api_key: str, latency_sec: float):
+    global _dirty, _urgent
+    with _lock:
+        entry = _entry(provider, model, api_key)
+        reopened = entry['open_sec'] > 0
+        entry['requests'] += 1
+        entry['success_rate'] += HEALTH_EWMA_ALPHA * (1.0 - entry['success_rate'])
+        entry['latency_sec'] = latency_sec if entry['latency_sec'] is None else \
+            entry['latency_sec'] + HEALTH_EWMA_ALPHA * (latency_sec - entry['latency_sec'])
+        entry['consecutive_failures'] = 0
+        entry['open_until'] = entry['open_sec'] = 0.0
+        _dirty = True
+        _urgent = _urgent or reopened
+    if reopened:
+        print(f"     [INFO] [{provider} {mask_key(api_key)}] Пробный запрос прошел, предохранитель закрыт.")
+
+
+def record_failure(provider: str, model: str, api_key: str, error: BaseException):
+    """Ошибка запроса с ключом (после повторов шлюза). Дневная квота помечается до сброса."""
+    global _dirty, _urgent
+    settings = load_settings()
+    scale = rate_limiter.load_settings()['rate_limit_time_scale']
+    message = None
+    with _lock:
+        entry = _entry(provider, model, api_key)
+        entry['requests'] += 1
+        entry['failures'] += 1
+        entry['success_rate'] -= HEALTH_EWMA_ALPHA * entry['success_rate']
+        entry['consecutive_failures'] += 1
+        entry['last_error'] = f"{type(error).__name__}: {error}"[:300]
+        now = time.time()
+        if is_daily_quota_exhausted(error):
+            entry['exhausted_until'] = next_quota_reset(now)
+            reset_at = datetime.fromtimestamp(entry['exhausted_until']).strftime('%Y-%m-%d %H:%M')
+            message = f"Дневная квота {model} исчерпана, ключ отключен до {reset_at}"
+        elif entry['consecutive_failures'] >= settings['key_pool_failure_threshold'] and entry['open_until'] <= now:
+            # Первое открытие - на key_pool_open_sec, каждая неудачная проба удваивает срок
+            open_sec = min(settings['key_pool_max_open_sec'] * scale,
+                           entry['open_sec'] * 2 if entry['open_sec'] else settings['key_pool_open_sec'] * scale)
+            entry['open_sec'] = open_sec
+            entry['open_until'] = now + open_sec
+            message = f"{entry['consecutive_failures']} ошибок подряд, предохранитель открыт на {open_sec:.0f} сек"
+        _dirty = True
+        _urgent = _urgent or message is not None
+    if message:
+        print(f"     [WARNING] [{provider} {mask_key(api_key)}] {message}")
+
+
+# --- Выбор ключа ---
+
+def _availability(entry: dict | None, now: float) -> str:
+    if entry is None:
+        return 'ok'
+    if entry['exhausted_until'] > now:
+        return 'exhausted'
+    if entry['open_until'] > now:
+        return 'open'
+    return 'half_open' if entry['open_sec'] else 'ok'
+
+
+def check(provider: str, model: str, api_key: str):
+    """NoHealthyKeyError, если ключ сейчас выдавать нельзя (квота исчерпана или предохранитель открыт)."""
+    now = time.time()
+    with _lock:
+        entry = _state().get(_entry_id(provider, model, api_key))
+        availability = _availability(entry, now)
+    if availability == 'exhausted':
+        reset_at = datetime.fromtimestamp(entry['exhausted_until']).strftime('%Y-%m-%d %H:%M')
+        raise NoHealthyKeyError(f"Ключ {mask_key(api_key)}: дневная квота {model} исчерпана до {reset_at}")
+    if availability == 'open':
+        raise NoHealthyKeyError(f"Ключ {mask_key(api_key)}: предохранитель открыт еще "
+                                f"{entry['open_until'] - now:.0f} сек")
+
+
+def ranked_keys(provider: str, model: str, api_keys: list[str]) -> list[str]:
+    """
+    Доступные ключи от самого здорового к наименее: доля успехов / средняя задержка.
+    Ключи без истории получают лучшую известную задержку, чтобы их тоже пробовали.
+    Ключи с открытым предохранителем после истечения срока (half-open) идут последними.
+    """
+    now = time.time()
+    with _lock:
+        state = _state()
+        entries = {api_key: state.get(_entry_id(provider, model, api_key)) for api_key in api_keys}
+    known_latencies = [entry['latency_sec'] for entry in entries.values() if entry and entry['latency_sec']]
+    default_latency = min(known_latencies) if known_latencies else 1.0
+
+    def score(api_key: str) -> tuple:
+        entry = entries[api_key]
+        if entry is None:
+            return 0, -1.0 / default_latency
+        latency = max(entry['latency_sec'] or default_latency, 0.001)
+        return _availability(entry, now) == 'half_open', -entry['success_rate'] / latency
+
+    usable = [api_key for api_key in dict.fromkeys(api_keys)
+              if _availability(entries[api_key], now) in ('ok', 'half_open')]
+    return sorted(usable, key=score)
+
+
+def available_keys(provider: str, model: str, api_keys: list[str]) -> list[str]:
+    """Ключи для этапов с воркерами на ключ: без исчерпанных и закрытых, в порядке здоровья."""
+    ranked = ranked_keys(provider, model, api_keys)
+    skipped = len(set(api_keys)) - len(ranked)
+    if skipped:
+        print(f"     [INFO] Пул ключей: {skipped} из {len(set(api_keys))} ключей {provider}/{model} "
+              f"недоступны (квота или предохранитель).")
+    return ranked
+
+
+def _no_healthy_key(provider: str, model: str, api_keys: list[str]) -> NoHealthyKeyError:
+    now = time.time()
+    with _lock:
+        state = _state()
+        reasons = [f"{mask_key(api_key)}: {_availability(state.get(_entry_id(provider, model, api_key)), now)}"
+                   for api_key in api_keys]
+    return NoHealthyKeyError(f"Нет доступных ключей {provider}/{model} ({', '.join(reasons) or 'ключи не заданы'})")
+
+
+async def call_with_failover(provider: str, model: str, api_keys: list[str], request):
+    """
+    await request(api_key) на самом здоровом ключе; при ошибке - на следующем по здоровью.
+    Пробрасывает последнюю ошибку или NoHealthyKeyError, если выдать нечего.
+    """
+    ranked = ranked_keys(provider, model, api_keys)
+    if not ranked:
+        raise _no_healthy_key(provider, model, api_keys)
+    last_error = None
+    for i, api_key in enumerate(ranked):
+        print(f"     Попытка {i + 1}/{len(ranked)} с ключом {mask_key(api_key)}")
+        try:
+            return await request(api_key)
+        except Exception as e:
+            print(f"     [ERROR] Ошибка с ключом {mask_key(api_key)}: {e}")
+            last_error = e
+    raise last_error
+
+
+def call_with_failover_sync(provider: str, model: str, api_keys: list[str], request):
+    """call_with_failover() для синхронного request(api_key)."""
+    ranked = ranked_keys(provider, model, api_keys)
+    if not ranked:
+        raise _no_healthy_key(provider, model, api_keys)
+    last_error = None
+    for i, api_key in enumerate(ranked):
+        print(f"     Попытка {i + 1}/{len(ranked)} с ключом {mask_key(api_key)}")
+        try:
+            return request(api_key)
+        except Exception as e:
+            print(f"     [ERROR] Ошибка с ключом {mask_key(api_key)}: {e}")
+            last_error = e
+    raise last_error
+
+
+# --- Воркеры над общей очередью задач ---
+
+STOP_WORKER = None  # маркер остановки воркера в очереди
+
+
+async def key_worker(worker_id: str, task_queue: asyncio.Queue, process):
+    """
+    Воркер одного ключа: ждет задачи в очереди (await get(), а не проверка empty()),
+    пока не получит STOP_WORKER. process(task) - корутина обработки задачи.
+    NoHealthyKeyError возвращает задачу в очередь и завершает воркер - ее возьмет воркер другого ключа.
+    task_done() вызывается на каждую задачу, на нем держится run_key_workers().
+    """
+    while True:
+        task = await task_queue.get()
+        try:
+            if task is STOP_WORKER:
+                return
+            await process(task)
+        except NoHealthyKeyError as e:
+            # put() до task_done(): join() не завершится, пока возвращенная задача не обработана
+            await task_queue.put(task)
+            print(f"     [WARNING] [Worker {worker_id}] Ключ недоступен, воркер остановлен: {e}")
+            return
+        finally:
+            task_queue.task_done()
+
+
+async def run_key_workers(task_queue: asyncio.Queue, workers: list) -> list:
+    """
+    Запускает воркеров (корутины key_worker) и ждет, пока очередь не будет обработана целиком
+    (task_queue.join()) или пока не остановятся все воркеры (у всех ключей кончилась квота).
+    Затем останавливает оставшихся воркеров маркером STOP_WORKER.
+    Возвращает задачи, которые так и не были обработаны.
+    """
+    worker_tasks = [asyncio.ensure_future(worker) for worker in workers]
+    queue_done = asyncio.ensure_future(task_queue.join())
+    workers_done = asyncio.gather(*worker_tasks)
+    try:
+        await asyncio.wait([queue_done, workers_done], return_when=asyncio.FIRST_COMPLETED)
+        for _ in worker_tasks:
+            task_queue.put_nowait(STOP_WORKER)
+        await workers_done
+    finally:
+        queue_done.cancel()
+        for worker_task in worker_tasks:
+            worker_task.cancel()
+
+    left = []
+    while not task_queue.empty():
+        task = task_queue.get_nowait()
+        task_queue.task_done()
+        if task is not STOP_WORKER:
+            left.append(task)
+    return left
+
+
+# --- Обслуживание ---
+
+def print_status():
+    now = time.time()
+    with _lock:
+        entries = sorted(_state().values(), key=lambda entry: (entry['provider'], entry['model'], entry['key']))
+    if not entries:
+        print("     Пул ключей пуст: запросов еще не было.")
+        return
+    print(f"     {'Провайдер/модель':<36} {'Ключ':<8} {'Состояние':<10} {'Успехов':>8} {'Задержка, с':>12} "
+          f"{'Запросов':>9} {'Ошибок':>7}")
+    for entry in entries:
+        latency = f"{entry['latency_sec']:.2f}" if entry['latency_sec'] is not None else '-'
+        print(f"     {entry['provider'] + '/' + entry['model']:<36} {entry['key']:<8} "
+              f"{_availability(entry, now):<10} {entry['success_rate'] * 100:>7.0f}% {latency:>12} "
+              f"{entry['requests']:>9} {entry['failures']:>7}")
+        if entry['exhausted_until'] > now:
+            print(f"       квота до {datetime.fromtimestamp(entry['exhausted_until']).strftime('%Y-%m-%d %H:%M')}")
+        if entry['last_error'] and _availability(entry, now) != 'ok':
+            print(f"       последняя ошибка: {entry['last_error']}")
+
+
+def reset(provider: str | None = None) -> int:
+    """Забывает состояние ключей (например, после пополнения квоты). Возвращает число записей."""
+    global _dirty
+    with _lock:
+        state = _state()
+        removed = [entry_id for entry_id, entry in state.items() if provider in (None, entry['provider'])]
+        for entry_id in removed:
+            del state[entry_id]
+        path = load_settings()['key_pool_state_path']
+        try:
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump({'saved_at': datetime.now().isoformat(timespec='seconds'), 'keys': state},
+                          f, ensure_ascii=False, indent=2)
+        except OSError as e:
+            print(f"     [ERROR] Не удалось сохранить состояние пула ключей: {e}")
+        _dirty = False
+    return len(removed)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Пул API-ключей: здоровье, предохранители, дневные квоты.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('status', help="состояние ключей")
+    reset_parser = subparsers.add_parser('reset', help="забыть состояние ключей")
+    reset_parser.add_argument('--provider')
+    args = parser.parse_args()
+
+    if args.command == 'status':
+        print_status()
+    else:
+        print(f"     Сброшено записей: {reset(args.provider)}.")
@@ -0,0 +1,296 @@
+import json
+import time
+import sqlite3
+import hashlib
+import argparse
+import threading
+from pathlib import Path
+from contextlib import contextmanager
+from collections import Counter, defaultdict
+from datetime import datetime
+
+import pipeline_settings
+from tracing import current_span
+
+'''
+Постоянный кэш ответов LLM под llm_gateway. Ключ - sha256 от (провайдер, модель, параметры
+генерации, sha256 промпта): повторный запуск дня, перезапуск после сбоя или тот же промпт
+в другом этапе получают готовый ответ без запроса и без траты квоты ключа.
+
+Хранение: отдельный SQLite-файл llm_cache_path (WAL, общий для потоков и процессов backfill),
+а не основная БД: тела ответов большие, вытесняются часто и не должны занимать писателя конвейера.
+
+Правила:
+    - срок жизни задается по этапу в llm_cache_ttl_hours ("default" - для остальных), 0 - этап не кэшируется;
+      творческие этапы (article_writer, title_formatter) по умолчанию не кэшируются: повторный запуск
+      должен давать новый текст, а не вчерашний;
+    - при temperature >= llm_cache_bypass_temperature кэш обходится: этапу нужен новый ответ;
+    - сохраняются только ответы, прошедшие проверку формата (см. llm_gateway.parse_response);
+    - при превышении llm_cache_max_mb вытесняются давно не использованные записи (LRU) до 90% лимита;
+      размер файла отслеживается счетчиком в памяти и сверяется с SUM(size) раз в RESYNC_EVERY записей
+      (файл пишут и другие процессы) - а не полным подсчетом на каждую запись.
+
+Счетчики попаданий и промахов по этапам - в session_stats() и в атрибуте cache спанов llm.*;
+число попаданий записи хранится в файле.
+
+Настройки в pipeline_config.json:
+    "llm_cache_enabled": true
+    "llm_cache_path": "llm_cache.db"
+    "llm_cache_max_mb": 256
+    "llm_cache_bypass_temperature": 0.9
+    "llm_cache_ttl_hours": {"default": 72, "article_writer": 0, "title_formatter": 0, "token_matcher": 168}
+
+Запуск:
+    python llm_cache.py stats
+    python llm_cache.py clear [--stage title_formatter] [--expired]
+'''
+
+DEFAULT_SETTINGS = {
+    'llm_cache_enabled': True,
+    'llm_cache_path': 'llm_cache.db',
+    'llm_cache_max_mb': 256,
+    'llm_cache_bypass_temperature': 0.9,
+    'llm_cache_ttl_hours': {'default': 72, 'article_writer': 0, 'title_formatter': 0},
+}
+EVICT_TO_RATIO = 0.9
+RESYNC_EVERY = 100
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS llm_responses (
+    key TEXT PRIMARY KEY,
+    stage TEXT,
+    provider TEXT NOT NULL,
+    model TEXT NOT NULL,
+    response TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    last_used_at REAL NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_llm_responses_last_used ON llm_responses (last_used_at);
+"""
+
+_schema_ready = set()
+_stats = defaultdict(Counter)
+_lock = threading.Lock()
+_total_bytes = {}  # путь файла кэша -> оценка SUM(size)
+_stores_since_resync = Counter()
+
+
+def load_settings() -> dict:
+    # Сроки по этапам дополняют умолчания, а не заменяют их: этап без строки в конфиге не начнет кэшироваться
+    return pipeline_settings.load_settings(DEFAULT_SETTINGS, merge=('llm_cache_ttl_hours',))
+
+
+@contextmanager
+def _connect():
+    """Короткое соединение на одну операцию: коммит при выходе из блока, откат при ошибке."""
+    path = load_settings()['llm_cache_path']
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(path, timeout=30)
+    conn.row_factory = sqlite3.Row
+    try:
+        if path not in _schema_ready:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+            _schema_ready.add(path)
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+
+# --- Ключ и правила ---
+
+def make_key(provider: str, model: str, prompt: str, generation: dict) -> str:
+    """Ключ записи: (провайдер, модель, параметры генерации, хеш промпта)."""
+    prompt_hash = hashlib.sha256(prompt.encode('utf-8')).hexdigest()
+    canonical = json.dumps({'provider': provider, 'model': model, 'generation': generation, 'prompt': prompt_hash},
+                           sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def ttl_for(stage: str | None, temperature: float | None = None) -> float | None:
+    """Срок жизни записей этапа в секундах; None - кэш для этого запроса не используется."""
+    settings = load_settings()
+    if not settings['llm_cache_enabled']:
+        return None
+    if temperature is not None and temperature >= settings['llm_cache_bypass_temperature']:
+        return None
+    ttl_hours = settings['llm_cache_ttl_hours']
+    hours = ttl_hours.get(stage, ttl_hours.get('default', 0)) if stage else ttl_hours.get('default', 0)
+    return hours * 3600 if hours else None
+
+
+def _count(stage: str | None, outcome: str, value: int = 1):
+    with _lock:
+        _stats[stage or '-'][outcome] += value
+
+
+def mark_span(outcome: str):
+    span_ = current_span()
+    if span_ is not None:
+        span_.set(cache=outcome)
+
+
+def bypass(stage: str | None):
+    if load_settings()['llm_cache_enabled']:
+        _count(stage, 'bypass')
+        mark_span('bypass')
+
+
+# --- Чтение и запись ---
+
+def lookup(key: str, stage: str | None, ttl_sec: float) -> str | None:
+    """Ответ из кэша или None. Просроченная запись удаляется."""
+    now = time.time()
+    try:
+        with _connect() as conn:
+            row = conn.execute("SELECT response, created_at FROM llm_responses WHERE key = ?", (key,)).fetchone()
+            if row is not None and now - row['created_at'] > ttl_sec:
+                conn.execute("DELETE FROM llm_responses WHERE key = ?", (key,))
+                row = None
+            if row is not None:
+                conn.execute("UPDATE llm_responses SET last_used_at = ?, hits = hits + 1 WHERE key = ?", (now, key))
+    except sqlite3.Error as e:
+        print(f"     [WARNING] LLM-кэш недоступен: {e}")
+        return None
+    _count(stage, 'hit' if row is not None else 'miss')
+    return row['response'] if row is not None else None
+
+
+def store(key: str, stage: str | None, provider: str, model: str, response: str):
+    """Сохраняет проверенный ответ и при переполнении вытесняет давно не использованные записи."""
+    now = time.time()
+    size = len(response.encode('utf-8'))
+    try:
+        with _connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO llm_responses (key, stage, provider, model, response, size, created_at, "
+                "last_used_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, stage, provider, model, response, size, now, now)
+            )
+            evicted = _account_and_evict(conn, size, load_settings()['llm_cache_max_mb'] * 2 ** 20)
+    except sqlite3.Error as e:
+        print(f"     [WARNING] Не удалось сохранить ответ в LLM-кэш: {e}")
+        return
+    _count(stage, 'stored')
+    if evicted:
+        _count(stage, 'evicted', evicted)
+
+
+def _account_and_evict(conn: sqlite3.Connection, size: int, max_bytes: float) -> int:
+    """
+    Учитывает новую запись в счетчике размера и вытесняет, только когда он превысил лимит.
+    Счетчик завышен (замены и удаленные просроченные записи не вычитаются), поэтому лимит
+    не пропускается: лишнее срабатывание лишь пересчитывает точный размер.
+    """
+    path = load_settings()['llm_cache_path']
+    with _lock:
+        _stores_since_resync[path] += 1
+        resync = path not in _total_bytes or _stores_since_resync[path] >= RESYNC_EVERY
+        if not resync:
+            _total_bytes[path] += size
+    if resync:
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM llm_responses").fetchone()[0]
+        with _lock:
+            _total_bytes[path] = total
+            _stores_since_resync[path] = 0
+    if _total_bytes[path] <= max_bytes:
+        return 0
+    return _evict(conn, path, max_bytes)
+
+
+def _evict(conn: sqlite3.Connection, path: str, max_bytes: float) -> int:
+    total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM llm_responses").fetchone()[0]
+    if total <= max_bytes:
+        with _lock:
+            _total_bytes[path] = total
+        return 0
+    target = max_bytes * EVICT_TO_RATIO
+    victims = []
+    for row in conn.execute("SELECT key, size FROM llm_responses ORDER BY last_used_at"):
+        if total <= target:
+            break
+        victims.append((row['key'],))
+        total -= row['size']
+    conn.executemany("DELETE FROM llm_responses WHERE key = ?", victims)
+    with _lock:
+        _total_bytes[path] = total
+    return len(victims)
+
+
+# --- Статистика и обслуживание ---
+
+def session_stats() -> dict:
+    """Счетчики текущего процесса по этапам: hit, miss, bypass, stored, evicted."""
+    with _lock:
+        return {stage: dict(counter) for stage, counter in _stats.items()}
+
+
+def session_summary() -> str | None:
+    stats = session_stats()
+    totals = Counter()
+    for counter in stats.values():
+        totals.update(counter)
+    if not totals:
+        return None
+    lookups = totals['hit'] + totals['miss']
+    hit_rate = f"{totals['hit'] / lookups * 100:.0f}%" if lookups else '-'
+    return (f"попаданий {totals['hit']}, промахов {totals['miss']} ({hit_rate}), обходов {totals['bypass']}, "
+            f"сохранено {totals['stored']}, вытеснено {totals['evicted']}")
+
+
+def delete_entries(stage: str | None = None, expired_only: bool = False) -> int:
+    conditions, params = [], []
+    if stage:
+        conditions.append("stage = ?")
+        params.append(stage)
+    with _connect() as conn:
+        if not expired_only:
+            where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+            return conn.execute(f"DELETE FROM llm_responses{where}", params).rowcount
+        deleted = 0
+        now = time.time()
+        for row in conn.execute("SELECT DISTINCT stage FROM llm_responses").fetchall():
+            if stage and row['stage'] != stage:
+                continue
+            ttl_sec = ttl_for(row['stage'])
+            if ttl_sec is None:
+                deleted += conn.execute("DELETE FROM llm_responses WHERE stage IS ?", (row['stage'],)).rowcount
+            else:
+                deleted += conn.execute("DELETE FROM llm_responses WHERE stage IS ? AND created_at < ?",
+                                        (row['stage'], now - ttl_sec)).rowcount
+        return deleted
+
+
+def print_stats():
+    with _connect() as conn:
+        rows = conn.execute(
+            "SELECT stage, COUNT(*) AS entries, SUM(size) AS bytes, SUM(hits) AS hits, MAX(last_used_at) AS last_used "
+            "FROM llm_responses GROUP BY stage ORDER BY stage"
+        ).fetchall()
+    if not rows:
+        print("     LLM-кэш пуст.")
+        return
+    print(f"     {'Этап':<24} {'Записей':>8} {'КБ':>10} {'Попаданий':>10}  Последнее использование")
+    for row in rows:
+        last_used = datetime.fromtimestamp(row['last_used']).strftime('%Y-%m-%d %H:%M:%S')
+        print(f"     {row['stage'] or '-':<24} {row['entries']:>8} {row['bytes'] / 1024:>10.1f} {row['hits']:>10}  "
+              f"{last_used}")
+    total_mb = sum(row['bytes'] for row in rows) / 2 ** 20
+    print(f"     Всего: {total_mb:.1f} МБ из {load_settings()['llm_cache_max_mb']} МБ")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Кэш ответов LLM.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('stats', help="записи, размер и попадания по этапам")
+    clear_parser = subparsers.add_parser('clear', help="сбросить кэш (весь, по этапу или только просроченное)")
+    clear_parser.add_argument('--stage')
+    clear_parser.add_argument('--expired', action='store_true', help="только записи старше срока жизни этапа")
+    args = parser.parse_args()
+
+    if args.command == 'stats':
+        print_stats()
+    else:
+        print(f"     Удалено записей: {delete_entries(args.stage, args.expired)}.")
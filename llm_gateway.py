@@ -0,0 +1,261 @@
+import json
+import time
+import asyncio
+
+import llm_cache
+import key_pool
+import rate_limiter
+from adaptive_concurrency import is_overloaded, key_concurrency
+from provider_clients import GROK_BASE_URL, current_clients, provider_session
+from rate_limiter import estimate_tokens, is_rate_limited, key_limiter, mask_key
+from tracing import span
+
+'''
+Единая точка вызова языковых моделей для всех этапов.
+Запрос идет через клиент конкретного ключа из реестра provider_clients, а не через
+process-global genai.configure(): воркеры и этапы с разными ключами больше не перетирают
+ключ друг другу, в том числе когда синхронные этапы идут в потоках параллельно.
+
+Провайдеры: gemini (GenerativeServiceAsyncClient.generate_content ключа, публичный запрос
+GenerateContentRequest), grok и openai (OpenAI-совместимый chat.completions).
+
+Использование:
+    async with provider_session():
+        data = await generate('gemini', 'gemini-2.5-pro', prompt, api_key=key, schema=dict)
+        text = await generate('grok', 'grok-3', prompt, api_key=grok_key)
+        vectors = await embed('models/text-embedding-004', texts, api_key=key, task_type='CLUSTERING')
+
+    # из синхронного кода (свой цикл событий и свои клиенты на один вызов)
+    items = generate_sync('gemini', 'gemini-2.5-flash', prompt, api_key=key, schema=list)
+
+schema - ожидаемый тип JSON-ответа (dict или list). С ним модель просят вернуть JSON
+(response_mime_type / response_format), ответ разбирается и проверяется; без него возвращается текст.
+
+Каждый запрос ждет квоту своего ключа и модели в rate_limiter; на 429 ключ блокируется,
+и запрос повторяется до rate_limit_retries раз. Остальные ошибки пробрасываются сразу.
+429 с исчерпанной дневной квотой не повторяется: key_pool отключает ключ до сброса квоты.
+Исход каждого запроса (успех, задержка, ошибка) записывается в key_pool - по нему этапы
+выбирают самый здоровый ключ. На исчерпанный или закрытый предохранителем ключ запрос
+не уходит: generate()/embed() сразу бросают key_pool.NoHealthyKeyError.
+Одновременных запросов на ключ не больше адаптивного предела adaptive_concurrency: этапы
+запускают до max_in_flight(провайдер) воркеров на ключ, лишние ждут слот здесь.
+
+Ответы кэшируются в llm_cache: stage выбирает срок жизни записей, cache=False (или
+temperature >= llm_cache_bypass_temperature) - всегда новый ответ.
+'''
+
+OPENAI_COMPATIBLE_URLS = {
+    'grok': GROK_BASE_URL,
+    'openai': None,
+}
+PROVIDERS = ('gemini', *OPENAI_COMPATIBLE_URLS)
+
+
+class LLMResponseError(ValueError):
+    """Ответ модели пустой, не JSON или не того типа, что ожидался."""
+
+
+def parse_response(text: str | None, schema: type | None):
+    if not text:
+        raise LLMResponseError("Модель вернула пустой ответ.")
+    if schema is None:
+        return text
+    try:
+        data = json.loads(text)
+    except json.JSONDecodeError as e:
+        raise LLMResponseError(f"Ответ модели не является JSON: {e}") from e
+    if not isinstance(data, schema):
+        raise LLMResponseError(f"Ожидался JSON типа {schema.__name__}, получен {type(data).__name__}.")
+    return data
+
+
+async def _generate_gemini(model: str, prompt: str, api_key: str, schema: type | None,
+                           temperature: float | None) -> str:
+    from google.ai import generativelanguage as glm
+    settings = {}
+    if schema is not None:
+        settings['response_mime_type'] = 'application/json'
+    if temperature is not None:
+        settings['temperature'] = temperature
+    request = glm.GenerateContentRequest(
+        model=model if model.startswith('models/') else f"models/{model}",
+        contents=[glm.Content(role='user', parts=[glm.Part(text=prompt)])],
+        generation_config=glm.GenerationConfig(**settings),
+    )
+    # Запрос уходит через клиент этого ключа явно, без глобального клиента google.generativeai
+    response = await current_clients().gemini_client(api_key).generate_content(request=request)
+    if not response.candidates or not response.candidates[0].content.parts:
+        raise LLMResponseError(f"Gemini не вернул текст: {response.prompt_feedback or 'нет кандидатов'}")
+    return "".join(part.text for part in response.candidates[0].content.parts)
+
+
+async def _generate_openai_compatible(provider: str, model: str, prompt: str, api_key: str,
+                                      schema: type | None, temperature: float | None) -> str:
+    client = current_clients().openai_client(provider, api_key, base_url=OPENAI_COMPATIBLE_URLS[provider])
+    options = {}
+    if schema is not None:
+        # json_object гарантирует только объект: список модель должна обернуть сама по промпту
+        options['response_format'] = {'type': 'json_object'}
+    if temperature is not None:
+        options['temperature'] = temperature
+    completion = await client.chat.completions.create(
+        model=model,
+        messages=[{"role": "user", "content": prompt}],
+        **options
+    )
+    return completion.choices[0].message.content
+
+
+async def _cached(provider: str, model: str, prompt: str, generation: dict, stage: str | None, use_cache: bool,
+                  temperature: float | None, fetch, decode):
+    """decode(ответ) из кэша, иначе decode(await fetch()) с сохранением ответа в кэш."""
+    ttl_sec = llm_cache.ttl_for(stage, temperature) if use_cache else None
+    key = None
+    if ttl_sec is None:
+        llm_cache.bypass(stage)
+    else:
+        key = llm_cache.make_key(provider, model, prompt, generation)
+        cached = await asyncio.to_thread(llm_cache.lookup, key, stage, ttl_sec)
+        if cached is not None:
+            try:
+                value = decode(cached)
+            except ValueError:
+                pass  # запись не подходит под текущую схему - запрашиваем заново и перезаписываем
+            else:
+                llm_cache.mark_span('hit')
+                return value
+        llm_cache.mark_span('miss')
+
+    text = await fetch()
+    value = decode(text)
+    if key:
+        await asyncio.to_thread(llm_cache.store, key, stage, provider, model, text)
+    return value
+
+
+async def generate(provider: str, model: str, prompt: str, *, api_key: str, schema: type | None = None,
+                   temperature: float | None = None, stage: str | None = None, cache: bool = True,
+                   **trace_attrs):
+    """
+    Один запрос к модели в текущей provider_session(). trace_attrs дописываются в спан llm.*.
+    Возвращает текст ответа или разобранный JSON (при schema). Ошибки провайдера пробрасываются.
+    """
+    if provider == 'gemini':
+        def call():
+            return _generate_gemini(model, prompt, api_key, schema, temperature)
+        span_name = 'llm.gemini'
+    elif provider in OPENAI_COMPATIBLE_URLS:
+        def call():
+            return _generate_openai_compatible(provider, model, prompt, api_key, schema, temperature)
+        span_name = 'llm.openai_compatible'
+    else:
+        raise ValueError(f"Неизвестный провайдер: {provider}")
+
+    async def fetch():
+        text = await _call_with_limits(provider, model, api_key, call, estimate_tokens(prompt), llm_span)
+        llm_span.set(response_chars=len(text or ""))
+        return text
+
+    generation = {'json': schema is not None, 'temperature': temperature}
+    with span(span_name, kind='llm', model=model, prompt_chars=len(prompt), **trace_attrs) as llm_span:
+        return await _cached(provider, model, prompt, generation, stage, cache, temperature, fetch,
+                             lambda text: parse_response(text, schema))
+
+
+async def _call_with_limits(provider: str, model: str, api_key: str, call, tokens: int, llm_span):
+    """
+    call() с ожиданием квоты и слота ключа и повторами после 429.
+    В спан пишутся ожидание квоты, число 429 и предел параллельности ключа.
+    """
+    limiter = key_limiter(provider, api_key, model)
+    concurrency = key_concurrency(provider, api_key)
+    retries = rate_limiter.load_settings()['rate_limit_retries']
+    waited = 0.0
+    attempt = 0
+    while True:
+        key_pool.check(provider, model, api_key)
+        waited += await limiter.acquire(tokens)
+        started_at = await concurrency.acquire()
+        try:
+            # Пока запрос ждал квоту и слот, ключ мог исчерпать квоту у соседнего воркера
+            key_pool.check(provider, model, api_key)
+        except key_pool.NoHealthyKeyError:
+            concurrency.release(started_at, 'error')
+            raise
+        llm_span.set(concurrency_limit=int(concurrency.limit), in_flight=concurrency.in_flight)
+        outcome = 'error'
+        try:
+            result = await call()
+            outcome = 'ok'
+        except Exception as e:
+            throttled = is_rate_limited(e)
+            if throttled or is_overloaded(e):
+                outcome = 'overload'
+            if throttled:
+                limiter.throttled(e)
+                attempt += 1
+                llm_span.set(rate_wait_ms=round(waited * 1000), throttled=attempt)
+            if not throttled or attempt > retries or key_pool.is_daily_quota_exhausted(e):
+                key_pool.record_failure(provider, model, api_key, e)
+                failure = e
+            else:
+                continue
+        finally:
+            concurrency.release(started_at, outcome)
+        if outcome != 'ok':
+            await _save_key_pool()
+            if key_pool.is_daily_quota_exhausted(failure):
+                # Запрос не виноват: воркер вернет задачу в очередь для других ключей
+                raise key_pool.NoHealthyKeyError(f"Ключ {mask_key(api_key)}: {failure}") from failure
+            raise failure
+        key_pool.record_success(provider, model, api_key, time.monotonic() - started_at)
+        await _save_key_pool()
+        limiter.succeeded(estimate_tokens(result) if isinstance(result, str) else 0)
+        llm_span.set(rate_wait_ms=round(waited * 1000), throttled=attempt)
+        return result
+
+
+async def _save_key_pool():
+    # Файл состояния пишется вне цикла событий и только когда key_pool считает это нужным
+    if key_pool.save_due():
+        await asyncio.to_thread(key_pool.save)
+
+
+async def embed(model: str, texts: list[str], *, api_key: str, task_type: str | None = None,
+                stage: str | None = None, cache: bool = True, **trace_attrs) -> list:
+    """Эмбеддинги Gemini для списка текстов через клиент ключа. Возвращает список векторов."""
+    import google.generativeai as genai
+
+    def call():
+        return genai.embed_content_async(
+            model=model, content=texts, task_type=task_type,
+            client=current_clients().gemini_client(api_key)
+        )
+
+    async def fetch():
+        tokens = sum(estimate_tokens(text) for text in texts)
+        result = await _call_with_limits('gemini', model, api_key, call, tokens, llm_span)
+        return json.dumps(result['embedding'])
+
+    generation = {'embed': True, 'task_type': task_type}
+    with span('llm.embed_content', kind='llm', model=model, texts=len(texts), **trace_attrs) as llm_span:
+        return await _cached('gemini', model, json.dumps(texts, ensure_ascii=False), generation, stage, cache,
+                             None, fetch, json.loads)
+
+
+# --- Синхронные обертки для этапов без своего цикла событий ---
+
+def generate_sync(provider: str, model: str, prompt: str, **kwargs):
+    """generate() из синхронного кода: отдельный цикл событий и клиенты на время одного вызова."""
+    async def call():
+        async with provider_session():
+            return await generate(provider, model, prompt, **kwargs)
+    return asyncio.run(call())
+
+
+def embed_sync(model: str, texts: list[str], **kwargs) -> list:
+    """embed() из синхронного кода."""
+    async def call():
+        async with provider_session():
+            return await embed(model, texts, **kwargs)
+    return asyncio.run(call())
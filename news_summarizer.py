@@ -1,9 +1,12 @@
 import os
 import json
 from pathlib import Path
-import google.generativeai as genai
 from dotenv import load_dotenv
 
+import stage_cache
+from llm_gateway import generate_sync
+from tracing import span, traced
+
 '''
 Скрипт принимает на вход дату, находит соответствующую сводку новостей,
 с помощью AI объединяет дублирующиеся события и формирует итоговый,
@@ -13,6 +16,7 @@ from dotenv import load_dotenv
 # --- Константы ---
 SUMMARIZER_CONFIG_FILE = 'summarizer_config.json'
 ENV_FILE = '.env'
+CACHE_VERSION = 1  # увеличить при изменении логики этапа: старые результаты в кэше станут недействительны
 
 # --- Вспомогательные функции ---
 
@@ -71,11 +75,10 @@ def create_master_summary(news_text: str, config: dict) -> str | None:
             return None
 
         final_prompt = prompt_template.format(news_text=news_text)
-        genai.configure(api_key=gemini_api_key)
-        model = genai.GenerativeModel(model_name)
-        response = model.generate_content(final_prompt)
+        summary = generate_sync('gemini', model_name, final_prompt, api_key=gemini_api_key,
+                                stage='news_summarizer')
         print("     Мастер-сводка успешно сгенерирована.")
-        return response.text
+        return summary
     except KeyError as e:
         print(f"     [ERROR] В summarizer_config.json отсутствует ключ: {e}")
         return None
@@ -86,15 +89,17 @@ def create_master_summary(news_text: str, config: dict) -> str | None:
         print(f"     [ERROR] при обращении к API Gemini: {e}")
         return None
 
+def get_output_filepath(date_str: str, config: dict) -> Path:
+    return Path(config['output_directory']) / config['output_filename_template'].format(date_str=date_str)
+
+
 def save_master_summary(summary_text: str, date_str: str, config: dict):
     """Сохраняет итоговую мастер-сводку в файл."""
     try:
-        output_dir = Path(config['output_directory'])
-        filename_template = config['output_filename_template']
-        output_dir.mkdir(exist_ok=True)
-        output_filename = filename_template.format(date_str=date_str)
-        output_filepath = output_dir / output_filename
-        output_filepath.write_text(summary_text, encoding='utf-8')
+        output_filepath = get_output_filepath(date_str, config)
+        output_filepath.parent.mkdir(exist_ok=True)
+        with span('file.master_summary', kind='file', path=str(output_filepath)):
+            output_filepath.write_text(summary_text, encoding='utf-8')
         print(f"     Результат сохранен в файл: {output_filepath}")
         return True
     except (KeyError, IOError) as e:
@@ -102,6 +107,7 @@ def save_master_summary(summary_text: str, date_str: str, config: dict):
         return False
 
 # --- Главная функция для вызова извне ---
+@traced()
 def run_news_summarizer(target_date: str) -> bool:
     """
     Основная функция-оркестратор. Принимает дату, выполняет все шаги
@@ -124,6 +130,22 @@ def run_news_summarizer(target_date: str) -> bool:
     input_file = get_input_filepath(target_date, scraper_config)
     if not input_file: return False
 
+    # Те же входной файл, промпт, модель и конфиг - та же сводка: повторный запуск не вызывает Gemini
+    cache_key = stage_cache.compute_input_hash('news_summarizer', {
+        'version': CACHE_VERSION,
+        'input': stage_cache.file_digest(input_file),
+        'prompt': stage_cache.file_digest(summarizer_config.get('prompt_path', '')),
+        'config': summarizer_config,
+    })
+    try:
+        output_file = get_output_filepath(target_date, summarizer_config)
+    except KeyError as e:
+        print(f"     [ERROR] В {SUMMARIZER_CONFIG_FILE} отсутствует ключ: {e}")
+        return False
+    cached = stage_cache.lookup('news_summarizer', cache_key)
+    if cached and stage_cache.restore_file('news_summarizer', cached, output_file):
+        return True
+
     combined_news = parse_daily_summary(input_file)
     if not combined_news:
         print("     Нет новостей для обработки. Пропускаем.")
@@ -132,7 +154,10 @@ def run_news_summarizer(target_date: str) -> bool:
     master_summary = create_master_summary(combined_news, summarizer_config)
     if not master_summary: return False
 
-    return save_master_summary(master_summary, target_date, summarizer_config)
+    if not save_master_summary(master_summary, target_date, summarizer_config):
+        return False
+    stage_cache.store_file('news_summarizer', cache_key, target_date, output_file)
+    return True
 
 
 if __name__ == '__main__':
@@ -2,10 +2,12 @@ import os
 import asyncio
 from typing import Dict, List
 
-from huggingface_hub import InferenceClient
 from dotenv import load_dotenv
 
-from database_manager import get_image_generation_tasks, update_article_image_path
+import async_db
+from provider_clients import current_clients, provider_session
+from rate_limiter import is_rate_limited, key_limiter
+from tracing import span, traced
 
 from alerter import send_admin_alert
 from io import BytesIO
@@ -20,6 +22,7 @@ from pathlib import Path
 OUTPUT_IMAGE_DIR = "Gen_Photo"
 API_KEY_NAMES = ["HF_TOKEN"]
 ENV_FILE = '.env'
+# Паузы между запросами не нужны: темп задает квота "huggingface" в rate_limits (pipeline_config.json)
 
 MODEL_CONFIGS = [
     {
@@ -50,36 +53,40 @@ async def generate_single_image(task: Dict, api_key: str) -> bool:
         model_name = config["model_name"]
         provider = config["provider"]
 
+        # У каждой модели свой провайдер и своя квота: 429 одной не задерживает следующую
+        limiter = key_limiter('huggingface', api_key, model_name)
         try:
             print(f"     [INFO] Попытка генерации для статьи ID {article_id} с использованием модели: {model_name}")
 
-            client = InferenceClient(
-                provider=provider,
-                api_key=api_key
-            )
+            # Клиент на пару (провайдер, ключ) создается один раз: HTTP-сессия переиспользуется
+            client = current_clients().inference_client(provider, api_key)
 
-            image = await asyncio.to_thread(
-                client.text_to_image,
-                prompt=final_prompt,
-                model=model_name,
-            )
+            await limiter.acquire()
+            with span('llm.text_to_image', kind='llm', model=model_name, provider=provider, article_id=article_id):
+                image = await asyncio.to_thread(
+                    client.text_to_image,
+                    prompt=final_prompt,
+                    model=model_name,
+                )
+            limiter.succeeded()
 
             os.makedirs(OUTPUT_IMAGE_DIR, exist_ok=True)
             image_filename = f"article_id_{article_id}.png"
             image_filepath = os.path.join(OUTPUT_IMAGE_DIR, image_filename)
-            image.save(image_filepath)
+            with span('file.image', kind='file', path=image_filepath):
+                image.save(image_filepath)
 
-            update_article_image_path(article_id, image_filepath)
+            await async_db.update_article_image_path(article_id, image_filepath)
             print(f"     [SUCCESS] Изображение для статьи ID {article_id} сгенерировано ({model_name}) и сохранено.")
-            await asyncio.sleep(15) # Пауза 15 секунд для избежания rate limit
             return True
 
         except Exception as e:
+            if is_rate_limited(e):
+                limiter.throttled(e)
             print(f"     [ERROR] Произошла ошибка с моделью {model_name}: {e}")
             is_last_model = (i == len(MODEL_CONFIGS) - 1)
             if not is_last_model:
-                print(f"     [INFO] Пробуем другую модель через 30 секунд...")
-                await asyncio.sleep(30)
+                print("     [INFO] Пробуем другую модель...")
 
     print(f"     [FAILURE] Не удалось сгенерировать изображение для статьи ID {article_id} после всех попыток.")
     return False
@@ -113,22 +120,29 @@ async def async_run_generator(tasks: List[Dict]):
     await asyncio.gather(*workers)
 
 
-def run_picture_generator() -> bool:
+@traced()
+async def run_picture_generator_async() -> bool:
+    """Этап целиком в текущем цикле событий (общий асинхронный режим daily_pipeline)."""
     print("  -> Запуск picture_generator.py...")
 
-    tasks = get_image_generation_tasks()
+    tasks = await async_db.get_image_generation_tasks()
     if not tasks:
         print("     [INFO] Нет задач на генерацию изображений.")
         return True
 
     print(f"     Найдено {len(tasks)} изображений для генерации. Запуск...")
 
-    asyncio.run(async_run_generator(tasks))
+    async with provider_session():
+        await async_run_generator(tasks)
 
     print("     Генерация изображений завершена.")
     return True
 
 
+def run_picture_generator() -> bool:
+    return asyncio.run(run_picture_generator_async())
+
+
 if __name__ == '__main__':
     if run_picture_generator():
         print("\n--- Модуль Picture Generator успешно завершил работу ---")
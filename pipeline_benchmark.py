@@ -0,0 +1,773 @@
+import os
+import re
+import ast
+import sys
+import json
+import time
+import random
+import shutil
+import hashlib
+import argparse
+import tempfile
+import threading
+import statistics
+import subprocess
+import contextlib
+import tracemalloc
+import multiprocessing
+from pathlib import Path
+from datetime import datetime, date, timedelta, timezone
+from concurrent.futures import ProcessPoolExecutor
+
+from stage_profiler import resolve_request
+
+'''
+Офлайн-бенчмарк ежедневного конвейера: полный граф этапов daily_pipeline на синтетическом
+новостном дне, без сети и без расхода квот. Gemini, Grok/OpenAI, Telethon, Telegram-бот,
+Hugging Face и Bybit заменяются локальными заменителями (stand_ins.py) с задержками,
+ошибками и лимитами 429 из раздела "providers" в benchmark_config.json.
+
+Каждый размер дня прогоняется в отдельном свежем процессе и во временном рабочем каталоге
+(своя БД, конфиги, Prompts/, без кэша этапов), поэтому прогоны не влияют на рабочие данные
+и друг на друга. Вывод этапов пишется в benchmark_results/logs/.
+
+По каждому этапу: статус, время, ожидание слота, обработано элементов, элементов в секунду
+и пик памяти Python (tracemalloc) за время работы этапа. Память общая для процесса:
+у параллельных этапов пик тоже общий.
+
+Задержки сервисов и квоты rate_limiter умножаются на time_scale, оставшиеся фиксированные паузы
+модулей - на pause_scale: при 0.05 день, который в продакшене идет час, проходит за несколько минут,
+а соотношение задержек, лимитов и пауз сохраняется.
+
+Результаты дописываются в benchmark_results/pipeline_history.jsonl. Новый прогон сравнивается
+с медианой последних прогонов с теми же параметрами; при замедлении (или росте памяти) больше
+regression_tolerance - код выхода 1.
+
+Запуск:
+    python pipeline_benchmark.py run                                  # размеры дня из benchmark_config.json
+    python pipeline_benchmark.py run --items 100 1000 10000 --async
+    python pipeline_benchmark.py run --items 1000 --streaming --time-scale 0.01 --no-memory
+    python pipeline_benchmark.py run --items 1000 --profile topic_rebalancer   # профили в benchmark_results/profiles
+    python pipeline_benchmark.py history --items 1000 --last 20
+'''
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+BENCHMARK_CONFIG_FILE = os.path.join(REPO_DIR, 'benchmark_config.json')
+LOG_DIR = os.path.join(REPO_DIR, 'benchmark_results', 'logs')
+PROFILE_DIR = os.path.join(REPO_DIR, 'benchmark_results', 'profiles')
+CONCURRENCY_DIR = os.path.join(REPO_DIR, 'benchmark_results', 'concurrency')
+MSK = timezone(timedelta(hours=3))
+
+DEFAULT_SETTINGS = {
+    'items_per_day': [100],
+    'duplicate_ratio': 0.2,
+    'users': 5,
+    'articles_per_user': 4,
+    'bybit_articles': 30,
+    'article_chars': 6000,
+    'image_size': 256,
+    'time_scale': 0.05,
+    'pause_scale': 0.05,
+    'seed': 42,
+    'memory_sample_ms': 20,
+    'history_file': 'benchmark_results/pipeline_history.jsonl',
+    'baseline_runs': 5,
+    'regression_tolerance': 0.2,
+    'regression_min_delta_sec': 0.5,
+    'regression_min_delta_mb': 5,
+    'providers': {},
+}
+
+# Что копируется в рабочий каталог прогона
+WORKSPACE_FILES = (
+    'pipeline_config.json', 'database_config.json', 'scraper_config.json', 'summarizer_config.json',
+    'topic_categorizer_config.json', 'rebalancer_config.json', 'title_formatter_config.json',
+    'base_currencies.txt',
+)
+WORKSPACE_DIRS = ('Prompts',)
+
+FAKE_ENV = {
+    **{f"GEMINI_API_KEY_{i}": f"bench-gemini-{i}" for i in range(1, 14)},
+    'GROK_API_KEY': 'bench-grok',
+    'OPENAI_API_KEY': 'bench-openai',
+    'HF_TOKEN': 'bench-hf',
+    'TELEGRAM_BOT_TOKEN': '100000:bench-bot',
+    'ADMIN_TELEGRAM_ID': '1',
+    'HOME_IP_ADDRESS': '198.51.100.1',
+    'PROXY_LIST': '',
+}
+
+# Фиксированные паузы между запросами внутри модулей этапов (масштабируются pause_scale).
+# Темп запросов к LLM, Hugging Face и Telegram задает rate_limiter, его время масштабирует time_scale.
+PAUSE_CONSTANTS = (
+    ('bybit_parser', 'REQUEST_DELAY_SECONDS'),
+)
+
+# Параметры, от которых зависит результат: по ним подбираются прогоны для сравнения
+COMPARABLE_KEYS = ('duplicate_ratio', 'users', 'articles_per_user', 'bybit_articles', 'article_chars',
+                   'image_size', 'time_scale', 'pause_scale', 'seed', 'providers')
+
+PERSONA_CODES = ('main', 't1', 't2', 't3', 't4')
+SYLLABLES = ('ba', 'ko', 'ri', 'tu', 'me', 'sa', 'lo', 'vi', 'ne', 'da', 'zu', 'pe', 'gi', 'fo', 'ran', 'mut')
+
+# Метки шаблонов из Prompts/, по которым заменитель LLM понимает, какой этап его вызвал
+RAW_POSTS_BEGIN = '--- RAW POSTS BEGIN ---'
+MASTER_SUMMARY_MARKER = 'Here is the text to process:\n---\n'
+REBALANCER_MARKER = 'select the SINGLE most suitable final category'
+TITLE_MARKER = '### NEWS TEXT TO ANALYZE ###'
+TOKENS_MARKER = '**Available Tokens List:**'
+IMAGE_STYLES_MARKER = '"persona_code" must be one of'
+ARTICLE_MARKER = 'Write an in-depth'
+
+
+def load_settings() -> dict:
+    try:
+        with open(BENCHMARK_CONFIG_FILE, 'r', encoding='utf-8') as f:
+            return {**DEFAULT_SETTINGS, **json.load(f)}
+    except (FileNotFoundError, json.JSONDecodeError) as e:
+        print(f"     [WARNING] Не удалось прочитать {BENCHMARK_CONFIG_FILE}: {e}. Используются значения по умолчанию.")
+        return dict(DEFAULT_SETTINGS)
+
+
+def read_json(path: str) -> dict:
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+# --- Синтетический день ---
+
+def make_vocabulary(rng: random.Random, size: int = 3000) -> list[str]:
+    """Псевдослова из трех слогов: тексты новостей почти не пересекаются и не считаются повторами сюжетов."""
+    words = {''.join(rng.choice(SYLLABLES) for _ in range(3)) for _ in range(size * 2)}
+    return sorted(words)[:size]
+
+
+def build_synthetic_day(items: int, settings: dict, target_date: date, categories: list[str],
+                        tokens: list[str]) -> dict:
+    """
+    Новостной день для заменителей: items постов по каналам scraper_config.json за target_date (МСК),
+    duplicate_ratio из них - повторы уже опубликованных сюжетов в других каналах,
+    плюс инструменты Bybit для tokens.py и статьи портала для bybit_parser.
+    """
+    rng = random.Random(settings['seed'])
+    vocabulary = make_vocabulary(rng)
+    channels = [channel['username'] for channel in read_json('scraper_config.json')['channels']]
+    popular_tokens = tokens[:50] or ['BTC']
+
+    unique_count = max(1, round(items * (1 - settings['duplicate_ratio'])))
+    stories = {}
+    for story_id in range(1, unique_count + 1):
+        category = rng.choice(categories)
+        words = rng.sample(vocabulary, 18)
+        stories[story_id] = (f"{category.capitalize()} news: {' '.join(words[:9])} {rng.choice(popular_tokens)} "
+                             f"{' '.join(words[9:])} ({category}).")
+
+    day_start = datetime.combine(target_date, datetime.min.time(), tzinfo=MSK)
+    posts = {channel: [] for channel in channels}
+    story_ids = list(stories) + [rng.randint(1, unique_count) for _ in range(items - unique_count)]
+    for message_id, story_id in enumerate(story_ids, start=1):
+        channel = channels[message_id % len(channels)]
+        posted_at = day_start + timedelta(seconds=rng.randint(300, 86_100))
+        posts[channel].append({
+            'id': message_id,
+            'text': f"{stories[story_id]}\n\n#s{story_id} https://t.me/{channel}/{message_id}",
+            'date': posted_at.astimezone(timezone.utc),
+        })
+    for channel, messages in posts.items():
+        # Как в Telegram: новые сообщения первыми, за ними - пост предыдущего дня (скрапер на нем останавливается)
+        messages.sort(key=lambda message: message['date'], reverse=True)
+        messages.append({'id': 0, 'text': "Вчерашний пост",
+                         'date': (day_start - timedelta(hours=6)).astimezone(timezone.utc)})
+
+    return {
+        'stories': stories,
+        'channels': posts,
+        'instruments': [f"{token}USDT" for token in tokens] + [f"{token}USDC" for token in popular_tokens[:10]],
+        'bybit_articles': [
+            {'id': 900_000 + i, 'title': f"How To {' '.join(word.capitalize() for word in rng.sample(vocabulary, 6))}",
+             'category': {'id': rng.randint(1, 5)}}
+            for i in range(settings['bybit_articles'])
+        ],
+    }
+
+
+def make_responder(day: dict, settings: dict):
+    """Ответы заменителя LLM: этап определяется по метке своего шаблона из Prompts/."""
+    stories = day['stories']
+
+    def significant_words(text: str) -> list[str]:
+        return [word for word in re.findall(r'[A-Za-z]+', text) if len(word) >= 4]
+
+    def respond(prompt: str, provider: str, model: str) -> str:
+        if RAW_POSTS_BEGIN in prompt:
+            story_ids = dict.fromkeys(int(story_id) for story_id in re.findall(r'#s(\d+)', prompt))
+            return "\n\n".join(stories[story_id] for story_id in story_ids if story_id in stories)
+
+        if MASTER_SUMMARY_MARKER in prompt:
+            news_text = prompt.split(MASTER_SUMMARY_MARKER, 1)[1]
+            paragraphs = (paragraph.strip() for paragraph in news_text.split("\n\n"))
+            return "\n\n".join(dict.fromkeys(p for p in paragraphs if p and p != '---'))
+
+        if REBALANCER_MARKER in prompt:
+            category_list = ast.literal_eval(re.search(r"provided list: (\[.*?\])", prompt).group(1))
+            initial = re.search(r'Preliminary Algorithm-based Category: "(.*?)"', prompt)
+            if initial and initial.group(1) in category_list:
+                return json.dumps({'final_category': initial.group(1)})
+            digest = int(hashlib.md5(prompt.encode('utf-8')).hexdigest(), 16)
+            return json.dumps({'final_category': category_list[digest % len(category_list)]})
+
+        if TITLE_MARKER in prompt:
+            news_text = prompt.split(TITLE_MARKER, 1)[1].split('"""')[1]
+            category = re.search(r"belongs to the category: (.+)", prompt).group(1).strip()
+            words = significant_words(news_text)[2:10]
+            return json.dumps({'title': f"{category.title()}: {' '.join(word.capitalize() for word in words)}"})
+
+        if TOKENS_MARKER in prompt:
+            token_block, _, article = prompt.split(TOKENS_MARKER, 1)[1].partition('**Article Text:**')
+            available = set(re.findall(r'[A-Z0-9]{2,}', token_block))
+            found = [word for word in re.findall(r'\b[A-Z0-9]{2,}\b', article) if word in available]
+            return json.dumps(list(dict.fromkeys(found))[:3])
+
+        if IMAGE_STYLES_MARKER in prompt:
+            return json.dumps([{'persona_code': code, 'image_prompt_style': f"Synthetic benchmark style {code}"}
+                               for code in PERSONA_CODES])
+
+        if ARTICLE_MARKER in prompt:
+            title = re.search(r"on a topic: '(.*)'", prompt)
+            title = title.group(1) if title else "Untitled"
+            news_text = prompt.split("news summary:\n", 1)[-1]
+            rng = random.Random(title)
+            words = significant_words(news_text) or ['crypto']
+            body = [f"# {title}", news_text]
+            while sum(len(paragraph) for paragraph in body) < settings['article_chars']:
+                body.append(' '.join(rng.choice(words) for _ in range(60)).capitalize() + '.')
+            return "\n\n".join(body)
+
+        return "OK"
+
+    return respond
+
+
+# --- Рабочий каталог и данные прогона ---
+
+def target_date_msk() -> date:
+    """Целевая дата скрапера: вчера по Москве."""
+    return (datetime.now(MSK) - timedelta(days=1)).date()
+
+
+def prepare_workspace(workspace: str, settings: dict):
+    for name in WORKSPACE_FILES:
+        shutil.copy(os.path.join(REPO_DIR, name), os.path.join(workspace, name))
+    for name in WORKSPACE_DIRS:
+        shutil.copytree(os.path.join(REPO_DIR, name), os.path.join(workspace, name))
+
+    # Профили этапов (--profile) не должны пропасть вместе с рабочим каталогом
+    pipeline_config_path = os.path.join(workspace, 'pipeline_config.json')
+    pipeline_config = read_json(pipeline_config_path)
+    pipeline_config['profiling_dir'] = PROFILE_DIR
+    # Квоты в минуту и паузы после 429 - во времени заменителей, как и задержки сервисов
+    pipeline_config['rate_limit_time_scale'] = settings['time_scale']
+    pipeline_config['concurrency_metrics_dir'] = CONCURRENCY_DIR
+    with open(pipeline_config_path, 'w', encoding='utf-8') as f:
+        json.dump(pipeline_config, f, ensure_ascii=False, indent=2)
+
+    with open(os.path.join(workspace, 'telegram_config.json'), 'w', encoding='utf-8') as f:
+        json.dump({'api_id': 100000, 'api_hash': 'benchmark'}, f)
+    Path(workspace, 'my_minimal_session.session').touch()
+
+
+def seed_benchmark_database(settings: dict, categories: list[str]):
+    """Персоны, подписчики и недельный план на сегодня: daily_planner заказывает users x articles_per_user статей."""
+    import seed
+    from database_manager import initialize_database, db_connection
+
+    initialize_database()
+    seed.seed_personas()
+    today = date.today()
+    week_start = (today - timedelta(days=today.weekday())).strftime('%Y-%m-%d')
+    with db_connection('seed_benchmark_database', write=True) as conn:
+        persona_ids = [row['id'] for row in conn.execute("SELECT id FROM personas ORDER BY id")]
+        users = [(200_000 + i, f"bench_user_{i}", persona_ids[i % len(persona_ids)]) for i in range(settings['users'])]
+        conn.executemany("INSERT INTO users (id, username, subscribed_persona_id) VALUES (?, ?, ?)", users)
+
+        plan = []
+        for index, persona_id in enumerate(sorted({persona_id for _, _, persona_id in users})):
+            counts = {}
+            for article in range(settings['articles_per_user']):
+                category = categories[(index + article) % len(categories)]
+                counts[category] = counts.get(category, 0) + 1
+            plan.extend((week_start, today.strftime('%a'), persona_id, category, count)
+                        for category, count in counts.items())
+        conn.executemany("INSERT INTO weekly_plan (week_start_date, day_of_week, persona_id, category, target_count) "
+                         "VALUES (?, ?, ?, ?, ?)", plan)
+
+
+def scale_module_pauses(pause_scale: float):
+    import importlib
+    for module_name, constant in PAUSE_CONSTANTS:
+        module = importlib.import_module(module_name)
+        setattr(module, constant, getattr(module, constant) * pause_scale)
+
+
+# --- Память по этапам ---
+
+class StageMemoryTracker:
+    """
+    Пик памяти Python (tracemalloc) за время работы каждого этапа.
+    Фоновый поток раз в interval_sec снимает пик и сбрасывает его; пик достается всем этапам,
+    которые в этот момент работают.
+    """
+
+    def __init__(self, interval_sec: float):
+        self.interval_sec = interval_sec
+        self.peaks = {}
+        self.overall_peak = 0
+        self._running = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._loop, name='memory-sampler', daemon=True)
+
+    def start(self):
+        tracemalloc.start()
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        with self._lock:
+            self._sample()
+        tracemalloc.stop()
+
+    def _sample(self):
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        self.overall_peak = max(self.overall_peak, peak)
+        for name in self._running:
+            self.peaks[name] = max(self.peaks.get(name, 0), peak)
+
+    def _loop(self):
+        while not self._stop.wait(self.interval_sec):
+            with self._lock:
+                self._sample()
+
+    def stage_started(self, name: str):
+        with self._lock:
+            self._sample()  # пик до старта этапа ему не принадлежит
+            self._running.add(name)
+            self.peaks[name] = tracemalloc.get_traced_memory()[0]
+
+    def stage_finished(self, name: str):
+        with self._lock:
+            self._sample()
+            self._running.discard(name)
+
+
+def instrument_stage(stage, tracker: StageMemoryTracker | None):
+    """Оборачивает функции этапа отметками старта и завершения для учета памяти."""
+    if tracker is None:
+        return
+    func, async_func = stage.func, stage.async_func
+
+    def run():
+        tracker.stage_started(stage.name)
+        try:
+            return func()
+        finally:
+            tracker.stage_finished(stage.name)
+    stage.func = run
+
+    if async_func:
+        async def run_async():
+            tracker.stage_started(stage.name)
+            try:
+                return await async_func()
+            finally:
+                tracker.stage_finished(stage.name)
+        stage.async_func = run_async
+
+
+# --- Счетчики обработанных элементов ---
+
+def count_rows(sql: str) -> int:
+    from database_manager import db_connection
+    with db_connection('count_rows') as conn:
+        return conn.execute(sql).fetchone()[0]
+
+
+def count_output(config_file: str, target_date: str, counter) -> int:
+    config = read_json(config_file)
+    path = Path(config['output_directory']) / config['output_filename_template'].format(date_str=target_date)
+    return counter(path) if path.exists() else 0
+
+
+def count_stage_items(stage: str, target_date: str, stand_ins_stats: dict) -> int | None:
+    """Сколько элементов этап обработал (по результатам в БД, файлах и вызовам заменителей)."""
+    counters = {
+        'tokens': lambda: len(Path('base_currencies.txt').read_text(encoding='utf-8').split()),
+        'bybit_parser': lambda: count_rows("SELECT COUNT(*) FROM source_articles"),
+        'telegram_scraper': lambda: stand_ins_stats.get('telegram', {}).get('items', 0),
+        'news_summarizer': lambda: count_output(
+            'summarizer_config.json', target_date,
+            lambda path: len([p for p in path.read_text(encoding='utf-8').split('\n\n') if p.strip()])),
+        'topic_categorizer': lambda: count_output(
+            'topic_categorizer_config.json', target_date,
+            lambda path: len(json.loads(path.read_text(encoding='utf-8')))),
+        'topic_rebalancer': lambda: count_rows("SELECT COUNT(*) FROM topics"),
+        'title_formatter': lambda: count_rows("SELECT COUNT(*) FROM topics WHERE title IS NOT NULL"),
+        'image_prompt_generator': lambda: len(PERSONA_CODES),
+        'daily_planner': lambda: count_rows("SELECT COUNT(*) FROM topics WHERE assigned_user_id IS NOT NULL"),
+        'article_writer': lambda: count_rows("SELECT COUNT(*) FROM generated_articles"),
+        'content_factory': lambda: count_rows("SELECT COUNT(*) FROM generated_articles"),
+        'picture_generator': lambda: count_rows("SELECT COUNT(*) FROM generated_articles WHERE image_path IS NOT NULL"),
+        'token_matcher': lambda: count_rows(
+            "SELECT COUNT(*) FROM generated_articles WHERE matched_tokens IS NOT NULL"),
+        'doc_zipper': lambda: len(list(Path('daily_zips').glob('*.zip'))),
+        'delivery': lambda: stand_ins_stats.get('telegram_bot', {}).get('documents', 0),
+    }
+    counter = counters.get(stage)
+    if counter is None:
+        return None
+    try:
+        return int(counter())
+    except Exception as e:
+        print(f"     [WARNING] Не удалось посчитать элементы этапа {stage}: {e}")
+        return None
+
+
+# --- Прогон в отдельном процессе ---
+
+def run_benchmark_day(settings: dict, items: int, async_mode: bool, streaming: bool, log_path: str) -> dict:
+    """Выполняется в свежем процессе: прогон графа этапов на синтетическом дне во временном каталоге."""
+    sys.path.insert(0, REPO_DIR)
+    workspace = tempfile.mkdtemp(prefix='pipeline_benchmark_')
+    try:
+        with open(log_path, 'w', encoding='utf-8') as log, contextlib.redirect_stdout(log):
+            prepare_workspace(workspace, settings)
+            os.chdir(workspace)
+            os.environ.update(FAKE_ENV)
+            record = run_pipeline_on_stand_ins(settings, items, async_mode, streaming)
+        record['workspace'] = workspace if settings.get('keep_workspace') else None
+        return record
+    finally:
+        os.chdir(REPO_DIR)
+        if not settings.get('keep_workspace'):
+            shutil.rmtree(workspace, ignore_errors=True)
+
+
+def run_pipeline_on_stand_ins(settings: dict, items: int, async_mode: bool, streaming: bool) -> dict:
+    tracker = StageMemoryTracker(settings['memory_sample_ms'] / 1000) if settings.get('memory', True) else None
+    if tracker:
+        tracker.start()
+
+    # Заменители ставятся до импорта модулей этапов: те получают их вместо SDK
+    import stand_ins
+    target_date = target_date_msk()
+    categories = list(read_json('rebalancer_config.json')['target_topic_ratio'])
+    tokens = Path('base_currencies.txt').read_text(encoding='utf-8').split()
+    day = build_synthetic_day(items, settings, target_date,
+                              read_json('topic_categorizer_config.json')['categories'], tokens)
+    services = stand_ins.StandIns(settings['providers'], make_responder(day, settings), data=day,
+                                  time_scale=settings['time_scale'], seed=settings['seed'],
+                                  image_size=settings['image_size'])
+    stand_ins.install(services)
+
+    import asyncio
+    import daily_pipeline
+    from alerter import send_admin_alert
+    from db_pool import close_all_pools
+    from pipeline_dag import run_stage_graph, print_run_summary, pipeline_succeeded
+    from stage_profiler import profile_stages
+    from rate_limiter import limiter_summary
+    from llm_cache import session_stats as llm_cache_session_stats
+    from adaptive_concurrency import concurrency_snapshot
+
+    seed_benchmark_database(settings, categories)
+    scale_module_pauses(settings['pause_scale'])
+
+    target_date_str = target_date.strftime('%Y-%m-%d')
+    runs = {}
+    stages = daily_pipeline.build_daily_stages(target_date_str, runs, streaming=streaming)
+    for stage in stages:
+        if stage.name == 'vpn':
+            stage.func = lambda: True  # подключение VPN - GUI-автоматизация, в бенчмарке не нужно
+        instrument_stage(stage, tracker)
+    profiling = resolve_request(settings.get('profile'), settings.get('profile_modes'))
+    if profiling:
+        profile_stages(stages, *profiling, target_date_str)
+    max_parallel = daily_pipeline.load_pipeline_config().get('max_parallel_stages', 3)
+
+    print(f"--- Бенчмарк: {items} сообщений за {target_date_str}, "
+          f"{'async' if async_mode else 'sync'}{', streaming' if streaming else ''} ---")
+    started = time.perf_counter()
+    try:
+        if async_mode:
+            asyncio.run(daily_pipeline.run_stage_graph_shared(stages, max_parallel, runs, {}, None))
+        else:
+            run_stage_graph(stages, max_parallel=max_parallel, alert_func=send_admin_alert, runs=runs)
+        wall_sec = time.perf_counter() - started
+    finally:
+        if tracker:
+            tracker.stop()
+    print_run_summary(runs)
+    rate_limits = limiter_summary()
+    for line in rate_limits:
+        print(f"     [INFO] Квота {line}")
+    llm_cache_stats = llm_cache_session_stats()
+    concurrency = concurrency_snapshot()
+
+    stats = services.summary()
+    stage_records = {}
+    for name, run in runs.items():
+        stage_items = count_stage_items(name, target_date_str, stats)
+        stage_records[name] = {
+            'status': run.status,
+            'duration_sec': round(run.duration, 3),
+            'queue_wait_sec': round(run.queue_wait, 3),
+            'items': stage_items,
+            'per_sec': round(stage_items / run.duration, 2) if stage_items and run.duration > 0 else None,
+            'peak_mb': round(tracker.peaks.get(name, 0) / 2 ** 20, 1) if tracker else None,
+        }
+    close_all_pools()
+
+    return {
+        'items': items,
+        'unique_stories': len(day['stories']),
+        'async_mode': async_mode,
+        'streaming': streaming,
+        'succeeded': pipeline_succeeded(runs),
+        'wall_sec': round(wall_sec, 3),
+        'peak_mb': round(tracker.overall_peak / 2 ** 20, 1) if tracker else None,
+        'stages': stage_records,
+        'stand_ins': stats,
+        'rate_limits': rate_limits,
+        'llm_cache': llm_cache_stats,
+        'concurrency': concurrency,
+    }
+
+
+# --- История и регрессии ---
+
+def git_commit() -> str | None:
+    try:
+        completed = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                   cwd=REPO_DIR, timeout=10)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return completed.stdout.strip() or None
+
+
+def comparable_key(settings: dict, items: int, async_mode: bool, streaming: bool) -> str:
+    params = {key: settings.get(key) for key in COMPARABLE_KEYS}
+    params.update(items=items, async_mode=async_mode, streaming=streaming, memory=settings.get('memory', True),
+                  profile=settings.get('profile'), profile_modes=settings.get('profile_modes'))
+    return hashlib.sha256(json.dumps(params, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+
+
+def history_path(settings: dict) -> Path:
+    return Path(REPO_DIR) / settings['history_file']
+
+
+def load_history(settings: dict) -> list[dict]:
+    path = history_path(settings)
+    if not path.exists():
+        return []
+    records = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue  # недописанная строка прерванного прогона
+    return records
+
+
+def append_history(settings: dict, record: dict):
+    path = history_path(settings)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+def find_regressions(record: dict, history: list[dict], settings: dict) -> tuple[list[str], int]:
+    """Сравнение с медианой последних baseline_runs успешных прогонов с тем же ключом. Возвращает (жалобы, база)."""
+    baseline = [r for r in history if r.get('config_key') == record['config_key'] and r.get('succeeded')]
+    baseline = baseline[-settings['baseline_runs']:]
+    if not baseline:
+        return [], 0
+
+    tolerance = settings['regression_tolerance']
+    checks = [('wall_sec', 'общее время', 'сек', settings['regression_min_delta_sec'],
+               [r['wall_sec'] for r in baseline], record['wall_sec'])]
+    if record.get('peak_mb') is not None:
+        checks.append(('peak_mb', 'пик памяти', 'МБ', settings['regression_min_delta_mb'],
+                       [r['peak_mb'] for r in baseline if r.get('peak_mb') is not None], record['peak_mb']))
+    for name, stage in record['stages'].items():
+        for metric, label, unit, min_delta in (('duration_sec', 'время', 'сек', settings['regression_min_delta_sec']),
+                                               ('peak_mb', 'память', 'МБ', settings['regression_min_delta_mb'])):
+            values = [r['stages'][name][metric] for r in baseline
+                      if r['stages'].get(name, {}).get(metric) is not None]
+            if stage.get(metric) is not None:
+                checks.append((metric, f"{name}: {label}", unit, min_delta, values, stage[metric]))
+
+    regressions = []
+    for _, label, unit, min_delta, values, value in checks:
+        if not values:
+            continue
+        median = statistics.median(values)
+        if value > median * (1 + tolerance) and value - median > min_delta:
+            regressions.append(f"{label} {median:.2f} -> {value:.2f} {unit} (+{(value / median - 1) * 100:.0f}%)"
+                               if median else f"{label} 0 -> {value:.2f} {unit}")
+    return regressions, len(baseline)
+
+
+# --- Отчеты ---
+
+def format_number(value, width: int, precision: int | None = None) -> str:
+    if value is None:
+        return '-'.rjust(width)
+    return f"{value:>{width}.{precision}f}" if precision is not None else f"{value:>{width}}"
+
+
+def print_record(record: dict):
+    mode = 'async' if record['async_mode'] else 'sync'
+    factory = 'потоковая фабрика' if record['streaming'] else 'последовательная фабрика'
+    print(f"\n--- Синтетический день: {record['items']} сообщений ({record['unique_stories']} сюжетов), "
+          f"{mode}, {factory} ---")
+    print(f"     {'Этап':<24} {'Статус':<8} {'Длит., с':>9} {'Ожид., с':>9} {'Элементов':>10} {'Элем./с':>9} "
+          f"{'Пик, МБ':>8}")
+    for name, stage in record['stages'].items():
+        print(f"     {name:<24} {stage['status']:<8} {stage['duration_sec']:9.2f} {stage['queue_wait_sec']:9.2f} "
+              f"{format_number(stage['items'], 10)} {format_number(stage['per_sec'], 9, 1)} "
+              f"{format_number(stage['peak_mb'], 8, 1)}")
+    print(f"     Итого: {record['wall_sec']:.2f} сек, пик памяти: {format_number(record['peak_mb'], 0, 1)} МБ, "
+          f"конвейер {'успешен' if record['succeeded'] else 'ОСТАНОВЛЕН'}")
+    print(f"     {'Сервис':<14} {'Вызовов':>8} {'429':>6} {'Ошибок':>7} {'Время сервиса, с':>17}")
+    for provider, stats in record['stand_ins'].items():
+        print(f"     {provider:<14} {stats.get('calls', 0):>8.0f} {stats.get('rate_limited', 0):>6.0f} "
+              f"{stats.get('errors', 0):>7.0f} {stats.get('busy_ms', 0) / 1000:>17.1f}")
+    if record.get('llm_cache'):
+        print(f"     {'LLM-кэш, этап':<24} {'Попаданий':>10} {'Промахов':>9} {'Обходов':>8}")
+        for stage, counts in record['llm_cache'].items():
+            print(f"     {stage:<24} {counts.get('hit', 0):>10} {counts.get('miss', 0):>9} {counts.get('bypass', 0):>8}")
+    if record.get('concurrency'):
+        print(f"     {'Параллельность, ключ':<24} {'Предел':>7} {'Пик':>5} {'Рост':>5} {'Сброс':>6} {'Задержка, мс':>13}")
+        for name, state in record['concurrency'].items():
+            print(f"     {name:<24} {state['limit']:>7} {state['peak_in_flight']:>5} {state['increases']:>5} "
+                  f"{state['decreases']:>6} {format_number(state['latency_ewma_ms'], 13)}")
+    if record.get('rate_limits'):
+        print("     Ожидание квот (rate_limiter):")
+        for line in record['rate_limits']:
+            print(f"       {line}")
+    print(f"     Лог этапов: {record['log']}")
+    if record.get('workspace'):
+        print(f"     Рабочий каталог сохранен: {record['workspace']}")
+
+
+def print_history(settings: dict, items: int | None, last: int):
+    records = [r for r in load_history(settings) if items is None or r['items'] == items][-last:]
+    if not records:
+        print("     Истории прогонов нет.")
+        return
+    print(f"     {'Время':<20} {'Коммит':<9} {'Сообщ.':>7} {'Режим':<15} {'Итого, с':>9} {'Пик, МБ':>8}  Итог")
+    for r in records:
+        mode = ('async' if r['async_mode'] else 'sync') + (' streaming' if r['streaming'] else '')
+        print(f"     {r['timestamp']:<20} {r.get('commit') or '-':<9} {r['items']:>7} {mode:<15} "
+              f"{r['wall_sec']:9.2f} {format_number(r.get('peak_mb'), 8, 1)}  "
+              f"{'✅' if r['succeeded'] else '🔥'} {r['config_key']}")
+
+
+# --- CLI ---
+
+def run_command(args, settings: dict) -> int:
+    os.makedirs(LOG_DIR, exist_ok=True)
+    history = load_history(settings)
+    commit = git_commit()
+    exit_code = 0
+
+    for items in args.items or settings['items_per_day']:
+        timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        log_path = os.path.join(LOG_DIR, f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{items}.log")
+        print(f"\n>>> Прогон на {items} сообщений (лог: {log_path})...")
+        # Свежий процесс на каждый размер: импорты, пулы соединений и память не переходят между прогонами
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as pool:
+            try:
+                record = pool.submit(run_benchmark_day, settings, items, args.async_mode, args.streaming,
+                                     log_path).result()
+            except Exception as e:
+                print(f"     [ERROR] Прогон на {items} сообщений упал: {e}. Подробности в логе: {log_path}")
+                exit_code = 1
+                continue
+
+        record = {'timestamp': timestamp, 'commit': commit,
+                  'config_key': comparable_key(settings, items, args.async_mode, args.streaming),
+                  'log': log_path, **record}
+        print_record(record)
+
+        regressions, baseline_size = find_regressions(record, history, settings)
+        if not baseline_size:
+            print("     [INFO] Прогонов с такими параметрами в истории нет - этот станет базой для сравнения.")
+        elif regressions:
+            print(f"     [WARNING] Регрессия относительно медианы {baseline_size} прошлых прогонов:")
+            for line in regressions:
+                print(f"       🔥 {line}")
+            exit_code = 1
+        else:
+            print(f"     [SUCCESS] В пределах {settings['regression_tolerance']:.0%} "
+                  f"от медианы {baseline_size} прошлых прогонов.")
+        if not record['succeeded']:
+            exit_code = 1
+
+        if not args.no_history:
+            record.pop('workspace', None)
+            append_history(settings, record)
+            history.append(record)
+    return exit_code
+
+
+def main() -> int:
+    settings = load_settings()
+    parser = argparse.ArgumentParser(description="Офлайн-бенчмарк ежедневного конвейера на заменителях сервисов.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run = subparsers.add_parser('run', help="прогнать конвейер на синтетических днях")
+    run.add_argument('--items', type=int, nargs='+', help="размеры дня, сообщений (по умолчанию items_per_day)")
+    run.add_argument('--async', dest='async_mode', action='store_true', help="весь прогон в одном цикле событий")
+    run.add_argument('--streaming', action='store_true', help="потоковая фабрика контента")
+    run.add_argument('--users', type=int, help="подписчиков")
+    run.add_argument('--articles-per-user', type=int, help="статей на подписчика в день")
+    run.add_argument('--time-scale', type=float, help="множитель задержек и окон лимитов сервисов")
+    run.add_argument('--pause-scale', type=float, help="множитель пауз модулей между запросами")
+    run.add_argument('--seed', type=int)
+    run.add_argument('--no-memory', action='store_true', help="без tracemalloc (он замедляет Python-код)")
+    run.add_argument('--no-history', action='store_true', help="не записывать результат в историю")
+    run.add_argument('--keep-workspace', action='store_true', help="не удалять рабочий каталог прогона")
+    run.add_argument('--profile', nargs='?', const='all', metavar='STAGES',
+                     help="профилировать этапы (stage_profiler.py), через запятую; без значения - все")
+    run.add_argument('--profile-modes', metavar='MODES', help="cpu,stacks,memory (по умолчанию все)")
+
+    history = subparsers.add_parser('history', help="прошлые результаты")
+    history.add_argument('--items', type=int, help="только дни этого размера")
+    history.add_argument('--last', type=int, default=20)
+    args = parser.parse_args()
+
+    if args.command == 'history':
+        print_history(settings, args.items, args.last)
+        return 0
+
+    for option in ('users', 'articles_per_user', 'time_scale', 'pause_scale', 'seed'):
+        if getattr(args, option) is not None:
+            settings[option] = getattr(args, option)
+    settings['memory'] = not args.no_memory
+    settings['keep_workspace'] = args.keep_workspace
+    # Профилирование только явное: PIPELINE_PROFILE из окружения в бенчмарк не попадает
+    settings['profile'] = args.profile or ''
+    settings['profile_modes'] = args.profile_modes
+    try:
+        resolve_request(settings['profile'], settings['profile_modes'])
+    except ValueError as e:
+        parser.error(str(e))
+    return run_command(args, settings)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
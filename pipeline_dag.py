@@ -0,0 +1,360 @@
+import time
+import asyncio
+import importlib
+from typing import Any, Awaitable, Callable
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from tracing import span, run_in_context
+
+'''
+Исполнитель конвейера, описанного графом зависимостей этапов.
+Этап запускается, как только завершились все этапы, от которых он зависит;
+независимые этапы выполняются параллельно (не больше max_parallel одновременно).
+
+Что делать при сбое этапа, задает его политика:
+    FATAL - конвейер останавливается: новые этапы не запускаются, уже запущенные дорабатывают;
+    WARN  - сбой записывается как предупреждение, зависимые этапы продолжают работу.
+Для обеих политик можно указать текст алерта администратору ({error} - текст ошибки).
+
+Два исполнителя с одинаковой логикой:
+    run_stage_graph       - этапы в пуле потоков, асинхронные модули крутят свой asyncio.run();
+    run_stage_graph_async - все этапы в одном цикле событий: у этапа вызывается async_func,
+                            а этапы без нее выполняются в потоке через asyncio.to_thread.
+
+После прогона печатается сводка по этапам и критический путь - цепочка этапов,
+которая определила общее время работы. Каждый этап пишет спан вида stage (см. tracing.py).
+
+Продолжение после сбоя: completed - этапы, завершенные в прошлой попытке, с их результатами.
+Они не запускаются (статус DONE), а on_finish вызывается после каждого выполненного этапа,
+чтобы вызывающий код мог сохранить чекпоинт.
+'''
+
+FATAL = 'fatal'
+WARN = 'warn'
+
+# Статусы этапов
+OK = 'ok'
+WARNING = 'warning'
+FAILED = 'failed'
+SKIPPED = 'skipped'
+DONE = 'done'  # завершен в прошлой попытке, результат взят из чекпоинта
+
+SUCCESS_STATUSES = (OK, WARNING, DONE)
+STATUS_ICONS = {OK: '✅', WARNING: '⚠️', FAILED: '🔥', SKIPPED: '⏭', DONE: '↩'}
+
+
+def default_is_success(result: Any) -> tuple[bool, str]:
+    """
+    Трактовка результата этапа по соглашениям модулей проекта:
+    bool - флаг успеха, (bool, сообщение) - флаг и текст ошибки, любое другое значение - успех.
+    """
+    if isinstance(result, tuple) and result and isinstance(result[0], bool):
+        return result[0], str(result[1]) if len(result) > 1 else ""
+    if isinstance(result, bool):
+        return result, "" if result else "этап вернул False"
+    return True, ""
+
+
+class Stage:
+    """
+    Описание одного этапа: функция без аргументов, зависимости и политика при сбое.
+    async_func - необязательная корутинная версия func для run_stage_graph_async.
+    checkpoint=False - результат этапа не переживает процесс (например, VPN-подключение):
+    при продолжении такой этап запускается снова, если после него остались незавершенные этапы.
+    """
+
+    def __init__(self, name: str, func: Callable[[], Any], depends_on: tuple = (), policy: str = FATAL,
+                 alert: str | None = None, is_success: Callable[[Any], tuple[bool, str]] = default_is_success,
+                 async_func: Callable[[], Awaitable[Any]] | None = None, checkpoint: bool = True):
+        if policy not in (FATAL, WARN):
+            raise ValueError(f"Неизвестная политика этапа {name}: {policy}")
+        self.name = name
+        self.func = func
+        self.async_func = async_func
+        self.checkpoint = checkpoint
+        self.depends_on = tuple(depends_on)
+        self.policy = policy
+        self.alert = alert
+        self.is_success = is_success
+
+
+class StageRun:
+    """Результат выполнения этапа."""
+
+    def __init__(self, stage: Stage):
+        self.stage = stage
+        self.status = SKIPPED
+        self.result = None
+        self.error = ""
+        self.ready_at = None  # момент, когда все зависимости завершились
+        self.started_at = None
+        self.finished_at = None
+
+    @property
+    def duration(self) -> float:
+        return (self.finished_at - self.started_at) if self.started_at is not None else 0.0
+
+    @property
+    def queue_wait(self) -> float:
+        """Сколько этап ждал свободного слота после готовности зависимостей."""
+        return (self.started_at - self.ready_at) if self.started_at is not None else 0.0
+
+
+def lazy_func(module_name: str, func_name: str, *args, **kwargs) -> Callable[[], Any]:
+    """
+    Функция этапа, модуль которой импортируется при запуске этапа, а не при описании графа:
+    SDK провайдеров, GUI-автоматизация и т.п. загружаются только если этап действительно выполняется.
+    """
+    def call():
+        return getattr(importlib.import_module(module_name), func_name)(*args, **kwargs)
+    call.__name__ = func_name
+    return call
+
+
+def lazy_async_func(module_name: str, func_name: str, *args, **kwargs) -> Callable[[], Awaitable[Any]]:
+    """То же для корутинной функции; импорт идет в потоке, чтобы не останавливать цикл событий."""
+    async def call():
+        module = await asyncio.to_thread(importlib.import_module, module_name)
+        return await getattr(module, func_name)(*args, **kwargs)
+    call.__name__ = func_name
+    return call
+
+
+def validate_graph(stages: list[Stage]):
+    """Проверяет уникальность имен, существование зависимостей и отсутствие циклов."""
+    by_name = {}
+    for stage in stages:
+        if stage.name in by_name:
+            raise ValueError(f"Этап {stage.name} описан дважды.")
+        by_name[stage.name] = stage
+    for stage in stages:
+        for dependency in stage.depends_on:
+            if dependency not in by_name:
+                raise ValueError(f"Этап {stage.name} зависит от неизвестного этапа {dependency}.")
+
+    visiting, done = set(), set()
+
+    def visit(name: str, path: list):
+        if name in done:
+            return
+        if name in visiting:
+            raise ValueError(f"Цикл в графе этапов: {' -> '.join(path + [name])}")
+        visiting.add(name)
+        for dependency in by_name[name].depends_on:
+            visit(dependency, path + [name])
+        visiting.discard(name)
+        done.add(name)
+
+    for stage in stages:
+        visit(stage.name, [])
+
+
+def resolve_completed(stages: list[Stage], completed: dict) -> dict:
+    """
+    Отбирает из completed ({этап: результат} прошлой попытки) этапы, которые можно не запускать.
+    Этап без чекпоинта пропускается, только если завершены все этапы, которые от него зависят.
+    """
+    dependents = {stage.name: set() for stage in stages}
+    for stage in stages:
+        for dependency in stage.depends_on:
+            dependents[dependency].add(stage.name)
+
+    def all_dependents_done(name: str) -> bool:
+        return all(dep in completed and all_dependents_done(dep) for dep in dependents[name])
+
+    by_name = {stage.name: stage for stage in stages}
+    return {
+        name: result for name, result in completed.items()
+        if name in by_name and (by_name[name].checkpoint or all_dependents_done(name))
+    }
+
+
+def _execute(stage: Stage) -> tuple:
+    with span(stage.name, kind='stage', policy=stage.policy) as stage_span:
+        try:
+            result = stage.func()
+            success, error = stage.is_success(result)
+        except Exception as e:
+            result, success, error = None, False, f"{type(e).__name__}: {e}"
+        if not success:
+            stage_span.fail(error)
+    return result, success, error
+
+
+async def _execute_async(stage: Stage) -> tuple:
+    with span(stage.name, kind='stage', policy=stage.policy) as stage_span:
+        try:
+            if stage.async_func is not None:
+                result = await stage.async_func()
+            else:
+                result = await asyncio.to_thread(stage.func)
+            success, error = stage.is_success(result)
+        except Exception as e:
+            result, success, error = None, False, f"{type(e).__name__}: {e}"
+        if not success:
+            stage_span.fail(error)
+    return result, success, error
+
+
+def _take_ready(runs: dict, pending: list, running_count: int, max_parallel: int, now: float) -> list[Stage]:
+    """Снимает с очереди этапы, у которых завершились все зависимости, пока есть свободные слоты."""
+    def finished_ok(name: str) -> bool:
+        return runs[name].status in SUCCESS_STATUSES and runs[name].finished_at is not None
+
+    started = []
+    for name in list(pending):
+        run = runs[name]
+        if not all(finished_ok(dep) for dep in run.stage.depends_on):
+            continue
+        if run.ready_at is None:
+            run.ready_at = max((runs[dep].finished_at for dep in run.stage.depends_on), default=0.0)
+        if running_count + len(started) >= max_parallel:
+            continue
+        pending.remove(name)
+        run.started_at = now
+        print(f"\n  ▶ [{name}] старт (+{now:.1f} сек)")
+        started.append(run.stage)
+    return started
+
+
+def _record_outcome(run: StageRun, outcome: tuple, now: float, alert_func: Callable[[str], Any] | None) -> bool:
+    """Записывает результат этапа. Возвращает True, если сбой должен остановить конвейер."""
+    run.finished_at = now
+    run.result, success, run.error = outcome
+    if success:
+        run.status = OK
+        print(f"  {STATUS_ICONS[OK]} [{run.stage.name}] готово за {run.duration:.1f} сек")
+        return False
+
+    run.status = WARNING if run.stage.policy == WARN else FAILED
+    print(f"  {STATUS_ICONS[run.status]} [{run.stage.name}] сбой за {run.duration:.1f} сек: {run.error}")
+    if run.stage.alert and alert_func:
+        alert_func(run.stage.alert.format(error=run.error))
+    return run.status == FAILED
+
+
+def _prepare_runs(stages: list[Stage], runs: dict | None, completed: dict | None) -> tuple[dict, list]:
+    """Создает StageRun для всех этапов и возвращает (runs, очередь этапов к запуску)."""
+    validate_graph(stages)
+    runs = runs if runs is not None else {}
+    runs.update({stage.name: StageRun(stage) for stage in stages})
+    completed = resolve_completed(stages, completed or {})
+    for name, result in completed.items():
+        run = runs[name]
+        run.status, run.result, run.finished_at = DONE, result, 0.0
+        print(f"  {STATUS_ICONS[DONE]} [{name}] завершен в прошлой попытке - пропускаем")
+    return runs, [stage.name for stage in stages if stage.name not in completed]
+
+
+def run_stage_graph(stages: list[Stage], max_parallel: int = 3,
+                    alert_func: Callable[[str], Any] | None = None,
+                    runs: dict | None = None, completed: dict | None = None,
+                    on_finish: Callable[[StageRun], Any] | None = None) -> dict[str, StageRun]:
+    """
+    Выполняет этапы с учетом зависимостей. Возвращает {имя: StageRun}.
+    runs - необязательный словарь, который заполняется по ходу прогона: через него этап
+    может прочитать результат (run.result) своих завершившихся зависимостей.
+    completed и on_finish - продолжение после сбоя (см. описание модуля).
+    Остановка по FATAL не прерывает уже запущенные этапы - они дорабатывают до конца.
+    """
+    runs, pending = _prepare_runs(stages, runs, completed)
+    running = {}
+    aborted_by = None
+    origin = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=max_parallel, thread_name_prefix='stage') as executor:
+        while pending or running:
+            if aborted_by is None:
+                for stage in _take_ready(runs, pending, len(running), max_parallel, time.perf_counter() - origin):
+                    # Контекст копируется, чтобы спан этапа стал дочерним спаном прогона
+                    running[executor.submit(run_in_context(_execute), stage)] = stage.name
+
+            if not running:
+                break  # нечего ждать: оставшиеся этапы пропущены из-за остановки
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                fatal = _record_outcome(runs[name], future.result(), time.perf_counter() - origin, alert_func)
+                if on_finish:
+                    on_finish(runs[name])
+                if fatal and aborted_by is None:
+                    aborted_by = name
+                    print(f"     [ERROR] Этап {name} критичен - новые этапы не запускаются.")
+
+    return runs
+
+
+async def run_stage_graph_async(stages: list[Stage], max_parallel: int = 3,
+                                alert_func: Callable[[str], Any] | None = None,
+                                runs: dict | None = None, completed: dict | None = None,
+                                on_finish: Callable[[StageRun], Any] | None = None) -> dict[str, StageRun]:
+    """
+    То же, что run_stage_graph, но в текущем цикле событий: асинхронные этапы делят
+    один цикл (и открытые в нем клиенты), синхронные уходят в поток.
+    Алерт и on_finish выполняются в потоке, чтобы не останавливать работающие этапы.
+    """
+    runs, pending = _prepare_runs(stages, runs, completed)
+    running = {}
+    aborted_by = None
+    origin = time.perf_counter()
+
+    while pending or running:
+        if aborted_by is None:
+            for stage in _take_ready(runs, pending, len(running), max_parallel, time.perf_counter() - origin):
+                running[asyncio.create_task(_execute_async(stage), name=f"stage-{stage.name}")] = stage.name
+
+        if not running:
+            break
+
+        done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            name = running.pop(task)
+            run = runs[name]
+            fatal = _record_outcome(run, task.result(), time.perf_counter() - origin, None)
+            if run.status != OK and run.stage.alert and alert_func:
+                await asyncio.to_thread(alert_func, run.stage.alert.format(error=run.error))
+            if on_finish:
+                await asyncio.to_thread(on_finish, run)
+            if fatal and aborted_by is None:
+                aborted_by = name
+                print(f"     [ERROR] Этап {name} критичен - новые этапы не запускаются.")
+
+    return runs
+
+
+def find_critical_path(runs: dict[str, StageRun]) -> list[StageRun]:
+    """
+    Цепочка, определившая время завершения: от последнего завершившегося этапа
+    назад через зависимость, завершившуюся позже остальных.
+    """
+    finished = [run for run in runs.values() if run.finished_at is not None]
+    if not finished:
+        return []
+    path = [max(finished, key=lambda run: run.finished_at)]
+    # Этапы из прошлой попытки (DONE) времени этого прогона не занимали - на них цепочка обрывается
+    while path[-1].status != DONE and path[-1].stage.depends_on:
+        path.append(max((runs[dep] for dep in path[-1].stage.depends_on), key=lambda run: run.finished_at))
+    return [run for run in reversed(path) if run.status != DONE]
+
+
+def print_run_summary(runs: dict[str, StageRun]):
+    width = max([26] + [len(name) for name in runs])
+    print("\n  Сводка по этапам:")
+    print(f"     {'Этап':<{width}} {'Статус':<9} {'Старт, с':>9} {'Длит., с':>9} {'Очередь, с':>11}")
+    ordered = sorted(runs.values(), key=lambda run: (run.started_at is None, run.started_at or 0))
+    for run in ordered:
+        started = f"{run.started_at:9.1f}" if run.started_at is not None else f"{'-':>9}"
+        print(f"     {run.stage.name:<{width}} {run.status:<9} {started} {run.duration:9.1f} {run.queue_wait:11.1f}")
+
+    path = find_critical_path(runs)
+    if path:
+        chain = " → ".join(f"{run.stage.name} ({run.duration:.1f} с)" for run in path)
+        waits = sum(run.queue_wait for run in path)
+        print(f"\n  Критический путь ({path[-1].finished_at:.1f} сек): {chain}")
+        if waits > 0.1:
+            print(f"     Из них ожидание свободного слота: {waits:.1f} сек (можно увеличить max_parallel_stages).")
+
+
+def pipeline_succeeded(runs: dict[str, StageRun]) -> bool:
+    return all(run.status in SUCCESS_STATUSES for run in runs.values())
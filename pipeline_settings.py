@@ -0,0 +1,46 @@
+import json
+
+'''
+Общие настройки инфраструктуры пайплайна из pipeline_config.json.
+Файл читается один раз на процесс; каждый модуль (rate_limiter, key_pool, llm_cache,
+adaptive_concurrency, stage_profiler) передает свой словарь умолчаний и получает только свои ключи.
+
+Использование:
+    DEFAULT_SETTINGS = {'rate_limit_retries': 3, 'rate_limits': {}}
+
+    def load_settings() -> dict:
+        return pipeline_settings.load_settings(DEFAULT_SETTINGS)
+'''
+
+PIPELINE_CONFIG_FILE = 'pipeline_config.json'
+
+_config = None
+_sections = {}  # id(словаря умолчаний) -> настройки модуля
+
+
+def load_pipeline_config() -> dict:
+    """Содержимое pipeline_config.json; нет файла или он не JSON - пустой словарь."""
+    global _config
+    if _config is None:
+        try:
+            with open(PIPELINE_CONFIG_FILE, 'r', encoding='utf-8') as f:
+                _config = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            _config = {}
+    return _config
+
+
+def load_settings(defaults: dict, merge: tuple = ()) -> dict:
+    """
+    Значения ключей defaults из pipeline_config.json, отсутствующие - из defaults.
+    Для ключей из merge словарь конфига дополняет словарь умолчаний, а не заменяет его.
+    Результат кэшируется на словарь умолчаний: повторные вызовы не собирают его заново.
+    """
+    settings = _sections.get(id(defaults))
+    if settings is None:
+        config = load_pipeline_config()
+        settings = {key: config.get(key, default) for key, default in defaults.items()}
+        for key in merge:
+            settings[key] = {**defaults[key], **settings[key]}
+        _sections[id(defaults)] = settings
+    return settings
@@ -0,0 +1,157 @@
+import asyncio
+import inspect
+import contextvars
+from collections import Counter
+from contextlib import asynccontextmanager
+from typing import Any, Callable
+
+'''
+Реестр долгоживущих клиентов AI-провайдеров и Telegram-бота.
+Клиент создается один раз на пару (провайдер, ключ) и переиспользуется всеми этапами,
+работающими в том же цикле событий: пул HTTP/gRPC-соединений и TLS-сессии не строятся
+заново для каждой статьи и каждого этапа.
+
+Асинхронные клиенты (gRPC Gemini, httpx внутри AsyncOpenAI и python-telegram-bot) привязаны
+к циклу событий, в котором созданы, поэтому реестр живет ровно столько, сколько
+provider_session(): в общем асинхронном режиме daily_pipeline - весь прогон,
+при отдельном запуске модуля - один asyncio.run() этапа.
+
+Использование (запросы к LLM идут через llm_gateway поверх этого реестра):
+    async with provider_session():
+        client = current_clients().gemini_client(api_key)
+        response = await client.generate_content(request=request)
+'''
+
+GROK_BASE_URL = "https://api.x.ai/v1"
+
+_current_clients = contextvars.ContextVar('provider_clients', default=None)
+
+
+# --- Фабрики клиентов (SDK импортируется при первом обращении к провайдеру) ---
+
+def _make_gemini_async_client(api_key: str):
+    from google.ai import generativelanguage as glm
+    from google.api_core.client_options import ClientOptions
+    return glm.GenerativeServiceAsyncClient(client_options=ClientOptions(api_key=api_key))
+
+
+def _make_openai_client(api_key: str, base_url: str | None):
+    from openai import AsyncOpenAI
+    return AsyncOpenAI(api_key=api_key, base_url=base_url)
+
+
+def _make_inference_client(provider: str, api_key: str):
+    from huggingface_hub import InferenceClient
+    return InferenceClient(provider=provider, api_key=api_key)
+
+
+def _make_telegram_application(bot_token: str):
+    from telegram.ext import Application
+    return Application.builder().token(bot_token).build()
+
+
+class ProviderClients:
+    """Клиенты, созданные в одном цикле событий: по одному на (провайдер, ключ)."""
+
+    def __init__(self):
+        self.loop = asyncio.get_running_loop()
+        self._clients = {}
+        self._closers = []
+        self.created = Counter()
+        self.reused = Counter()
+
+    def _get_or_create(self, key: tuple, factory: Callable[[], Any], closer: Callable[[Any], Any] | None = None):
+        client = self._clients.get(key)
+        if client is not None:
+            self.reused[key[0]] += 1
+            return client
+        client = factory()
+        self._clients[key] = client
+        self.created[key[0]] += 1
+        if closer:
+            self._closers.append((key[0], client, closer))
+        return client
+
+    def gemini_client(self, api_key: str):
+        """
+        Асинхронный gRPC-клиент Gemini этого ключа (для генерации и эмбеддингов).
+        В отличие от genai.configure() ключ не глобальный: воркеры с разными ключами
+        не перетирают настройки друг друга.
+        """
+        return self._get_or_create(
+            ('gemini', api_key), lambda: _make_gemini_async_client(api_key),
+            closer=lambda client: client.transport.close()
+        )
+
+    def openai_client(self, provider: str, api_key: str, base_url: str | None = None):
+        """AsyncOpenAI для OpenAI-совместимых API (OpenAI, Grok)."""
+        return self._get_or_create(
+            (provider, api_key, base_url), lambda: _make_openai_client(api_key, base_url),
+            closer=lambda client: client.close()
+        )
+
+    def inference_client(self, provider: str, api_key: str):
+        """Синхронный InferenceClient Hugging Face (вызывается через asyncio.to_thread)."""
+        return self._get_or_create(('huggingface', provider, api_key),
+                                   lambda: _make_inference_client(provider, api_key))
+
+    async def telegram_application(self, bot_token: str):
+        """Инициализированное приложение python-telegram-bot для отправки сообщений."""
+        key = ('telegram', bot_token)
+        if key not in self._clients:
+            application = _make_telegram_application(bot_token)
+            await application.initialize()
+            self._clients[key] = application
+            self.created['telegram'] += 1
+            self._closers.append(('telegram', application, lambda app: app.shutdown()))
+            return application
+        self.reused['telegram'] += 1
+        return self._clients[key]
+
+    async def aclose(self):
+        """Закрывает клиентов в порядке, обратном созданию. Ошибки закрытия не прерывают остальных."""
+        while self._closers:
+            provider, client, closer = self._closers.pop()
+            try:
+                result = closer(client)
+                if inspect.isawaitable(result):
+                    await result
+            except Exception as e:
+                print(f"     [WARNING] Не удалось закрыть клиент {provider}: {e}")
+        self._clients.clear()
+
+    def summary(self) -> str:
+        providers = sorted(set(self.created) | set(self.reused))
+        return ", ".join(f"{p}: создано {self.created[p]}, переиспользовано {self.reused[p]}" for p in providers)
+
+
+def current_clients() -> ProviderClients:
+    """Реестр текущей provider_session(). Вне сессии - ошибка: клиента некому было бы закрыть."""
+    clients = _current_clients.get()
+    if clients is None:
+        raise RuntimeError("Клиенты провайдеров запрошены вне provider_session().")
+    return clients
+
+
+@asynccontextmanager
+async def provider_session():
+    """
+    Открывает реестр клиентов на время блока. Если реестр уже открыт выше по стеку
+    (общий цикл событий daily_pipeline), используется он, и закрывает его тот, кто открыл.
+    Реестр другого цикла событий (синхронный этап в потоке получает копию контекста) не подходит:
+    его клиенты привязаны к чужому циклу, поэтому открывается свой.
+    """
+    clients = _current_clients.get()
+    if clients is not None and clients.loop is asyncio.get_running_loop():
+        yield clients
+        return
+
+    clients = ProviderClients()
+    token = _current_clients.set(clients)
+    try:
+        yield clients
+    finally:
+        _current_clients.reset(token)
+        await clients.aclose()
+        if clients.created:
+            print(f"     [INFO] Клиенты провайдеров закрыты ({clients.summary()}).")
@@ -0,0 +1,246 @@
+import time
+import asyncio
+import threading
+
+import pipeline_settings
+
+'''
+Общий ограничитель частоты запросов к внешним API вместо фиксированных пауз в модулях.
+На каждую тройку (провайдер, модель, ключ) заводятся корзины токенов:
+    rpm - запросов в минуту (емкость burst, по умолчанию 1: запросы идут равномерно);
+    tpm - токенов в минуту (емкость - минутный лимит; токены оцениваются как символы / 4).
+Воркер ждет ровно столько, сколько требует квота своего ключа, и не больше.
+
+Ответ 429 (или FloodWait/RetryAfter) блокирует корзины ключа: на retry-after из ответа,
+если он есть, иначе на rate_limit_backoff_sec с удвоением на каждый 429 подряд
+(до rate_limit_max_backoff_sec). Первый успешный запрос сбрасывает удвоение.
+
+Корзины общие для процесса: этапы в общем цикле событий, в потоках и в своих asyncio.run()
+делят квоту одного ключа. Между процессами (backfill) квота не делится.
+
+Настройки в pipeline_config.json:
+    "rate_limits": {"gemini": {"rpm": 150, "tpm": 2000000},
+                    "gemini/gemini-embedding-exp-03-07": {"rpm": 100}}   - "провайдер/модель" важнее "провайдер";
+                                                                          без записи запросы не ограничиваются
+    "rate_limit_retries": 3              - повторов после 429 в llm_gateway
+    "rate_limit_backoff_sec": 5
+    "rate_limit_max_backoff_sec": 120
+    "rate_limit_time_scale": 1.0         - множитель всех длительностей (pipeline_benchmark ускоряет время)
+
+Использование:
+    limiter = key_limiter('gemini', api_key, model='gemini-2.5-pro')
+    await limiter.acquire(tokens=estimate_tokens(prompt))
+    try:
+        response = await call()
+    except Exception as e:
+        if is_rate_limited(e):
+            limiter.throttled(e)
+        raise
+    limiter.succeeded(tokens=estimate_tokens(response))
+'''
+
+DEFAULT_SETTINGS = {
+    'rate_limits': {},
+    'rate_limit_retries': 3,
+    'rate_limit_backoff_sec': 5,
+    'rate_limit_max_backoff_sec': 120,
+    'rate_limit_time_scale': 1.0,
+}
+CHARS_PER_TOKEN = 4
+RATE_LIMIT_ERRORS = ('ResourceExhausted', 'RateLimitError', 'TooManyRequests', 'FloodWaitError', 'RetryAfter')
+
+_limiters = {}
+_registry_lock = threading.Lock()
+
+
+def load_settings() -> dict:
+    return pipeline_settings.load_settings(DEFAULT_SETTINGS)
+
+
+def estimate_tokens(text: str | None) -> int:
+    return len(text or '') // CHARS_PER_TOKEN
+
+
+# --- Распознавание 429 ---
+
+def is_rate_limited(error: BaseException) -> bool:
+    """Ошибка - отказ по квоте (429 у HTTP/gRPC SDK, FloodWait у Telegram)."""
+    if type(error).__name__ in RATE_LIMIT_ERRORS:
+        return True
+    response = getattr(error, 'response', None)
+    for status in (getattr(error, 'code', None), getattr(error, 'status_code', None),
+                   getattr(response, 'status_code', None)):
+        if status == 429:
+            return True
+    return False
+
+
+def retry_after_of(error: BaseException) -> float | None:
+    """Сколько секунд сервис просит подождать, если он это сообщил."""
+    for attr in ('retry_after', 'seconds'):  # telegram.error.RetryAfter, telethon FloodWaitError
+        value = getattr(error, attr, None)
+        if isinstance(value, (int, float)) and value > 0:
+            return float(value)
+    headers = getattr(getattr(error, 'response', None), 'headers', None) or {}
+    try:
+        value = float(headers.get('retry-after'))
+    except (TypeError, ValueError, AttributeError):
+        return None
+    return value if value > 0 else None
+
+
+# --- Корзина токенов ---
+
+class TokenBucket:
+    """
+    Корзина с пополнением rate единиц в секунду и емкостью capacity. Ожидание резервируется заранее
+    (запас уходит в минус), поэтому конкурирующие воркеры получают разные моменты старта, а не гонку.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def reserve(self, amount: float) -> float:
+        """Списывает amount и возвращает, сколько секунд ждать до его использования."""
+        amount = min(amount, self.capacity)
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.tokens -= amount
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+            return max(wait, self.blocked_until - now)
+
+    def spend(self, amount: float):
+        """Списывает без ожидания (фактический расход оказался больше оценки)."""
+        with self._lock:
+            self._refill(time.monotonic())
+            self.tokens -= amount
+
+    def block(self, seconds: float):
+        """Запрет на seconds: запас обнуляется, пополнение начнется после блокировки."""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.blocked_until = max(self.blocked_until, now + seconds)
+            self.tokens = min(self.tokens, 0.0)
+            self.updated = max(self.updated, self.blocked_until)
+
+    def blocked_for(self) -> float:
+        with self._lock:
+            return max(0.0, self.blocked_until - time.monotonic())
+
+
+# --- Ограничитель одного ключа ---
+
+class KeyLimiter:
+    """Корзины rpm/tpm одной тройки (провайдер, модель, ключ) и статистика ожиданий."""
+
+    def __init__(self, name: str, limits: dict, settings: dict):
+        self.name = name
+        scale = settings['rate_limit_time_scale']
+        self.backoff_sec = settings['rate_limit_backoff_sec'] * scale
+        self.max_backoff_sec = settings['rate_limit_max_backoff_sec'] * scale
+        self.time_scale = scale
+        self.buckets = []
+        self.requests = self.tokens = None
+        if limits.get('rpm'):
+            self.requests = TokenBucket(limits['rpm'] / 60 / scale, limits.get('burst', 1))
+            self.buckets.append(self.requests)
+        if limits.get('tpm'):
+            self.tokens = TokenBucket(limits['tpm'] / 60 / scale, limits['tpm'])
+            self.buckets.append(self.tokens)
+        self.strikes = 0
+        self.calls = 0
+        self.throttles = 0
+        self.waited_sec = 0.0
+        self._lock = threading.Lock()
+
+    async def acquire(self, tokens: int = 0) -> float:
+        """Ждет своей очереди в квоте. Возвращает время ожидания в секундах."""
+        if not self.buckets:
+            return 0.0
+        wait = self.requests.reserve(1) if self.requests else 0.0
+        if self.tokens and tokens:
+            wait = max(wait, self.tokens.reserve(tokens))
+        wait = max(wait, *(bucket.blocked_for() for bucket in self.buckets))
+        started = time.monotonic()
+        while wait > 0:
+            await asyncio.sleep(wait)
+            # Пока ждали, мог прийти 429 у соседнего воркера этого ключа
+            wait = max(bucket.blocked_for() for bucket in self.buckets)
+        waited = time.monotonic() - started
+        with self._lock:
+            self.calls += 1
+            self.waited_sec += waited
+        return waited
+
+    def succeeded(self, tokens: int = 0):
+        """Запрос прошел: сброс удвоения паузы и учет токенов ответа."""
+        with self._lock:
+            self.strikes = 0
+        if self.tokens and tokens:
+            self.tokens.spend(min(tokens, self.tokens.capacity))
+
+    def throttled(self, error: BaseException | None = None) -> float:
+        """Сервис ответил 429: блокирует корзины ключа. Возвращает длительность блокировки."""
+        retry_after = retry_after_of(error) if error is not None else None
+        blocked = max((bucket.blocked_for() for bucket in self.buckets), default=0.0)
+        with self._lock:
+            self.throttles += 1
+            if retry_after is not None:
+                delay = retry_after * self.time_scale
+            elif blocked > 0:
+                # 429 запросов, ушедших до блокировки: пауза уже назначена, удваивать ее не за что
+                return blocked
+            else:
+                self.strikes += 1
+                delay = min(self.max_backoff_sec, self.backoff_sec * 2 ** (self.strikes - 1))
+        for bucket in self.buckets or [self._fallback_bucket()]:
+            bucket.block(delay)
+        print(f"     [WARNING] [{self.name}] Лимит запросов (429): пауза {delay:.1f} сек.")
+        return delay
+
+    def _fallback_bucket(self) -> TokenBucket:
+        # Лимиты не заданы, но сервис ответил 429: дальше ключ ходит через корзину-блокировку
+        bucket = TokenBucket(rate=1e9, capacity=1e9)
+        self.buckets.append(bucket)
+        return bucket
+
+    def summary(self) -> str:
+        return f"{self.name}: запросов {self.calls}, ожидание {self.waited_sec:.1f} сек, 429: {self.throttles}"
+
+
+def mask_key(api_key: str | None) -> str:
+    return f"...{api_key[-4:]}" if api_key else "-"
+
+
+def key_limiter(provider: str, api_key: str | None, model: str | None = None) -> KeyLimiter:
+    """Ограничитель ключа (один на процесс). Лимиты: запись "провайдер/модель", иначе "провайдер"."""
+    settings = load_settings()
+    registry_key = (provider, model, api_key)
+    with _registry_lock:
+        limiter = _limiters.get(registry_key)
+        if limiter is None:
+            limits_config = settings['rate_limits']
+            limits = limits_config.get(f"{provider}/{model}") or limits_config.get(provider) or {}
+            name = f"{provider}/{model} {mask_key(api_key)}" if model else f"{provider} {mask_key(api_key)}"
+            limiter = KeyLimiter(name, limits, settings)
+            _limiters[registry_key] = limiter
+        return limiter
+
+
+def limiter_summary() -> list[str]:
+    """Строки статистики по ключам, которые ждали квоту или получали 429."""
+    with _registry_lock:
+        limiters = list(_limiters.values())
+    return [limiter.summary() for limiter in limiters if limiter.waited_sec >= 0.05 or limiter.throttles]
@@ -1,15 +1,28 @@
 import time
 from apscheduler.schedulers.blocking import BlockingScheduler
 
-# Импортируем ОБЕ наши главные функции
-from daily_pipeline import run_daily_tasks
-from strategic_planner import run_strategic_planner
-
 '''
 Этот скрипт - "сердце" проекта, работающее 24/7.
 Он запускает ежедневные и еженедельные задачи по расписанию.
+Модули задач импортируются при срабатывании задачи, а не при старте планировщика.
 '''
 
+
+def run_daily_tasks():
+    from daily_pipeline import run_daily_tasks as run_daily_pipeline
+    run_daily_pipeline()
+
+
+def run_strategic_planner():
+    from strategic_planner import run_strategic_planner as run_planner
+    run_planner()
+
+
+def run_archival():
+    from db_archive import run_archival as run_db_archival
+    run_db_archival()
+
+
 def main_scheduler():
     scheduler = BlockingScheduler(timezone="Europe/Moscow")
 
@@ -34,10 +47,22 @@ def main_scheduler():
         replace_existing=True
     )
 
+    # --- РАСПИСАНИЕ №3: Еженедельная архивация старых статей и тем ---
+    scheduler.add_job(
+        run_archival,
+        'cron',
+        day_of_week='sun',
+        hour=3,
+        minute=0,
+        id='weekly_archival_job',
+        replace_existing=True
+    )
+
     print("="*50)
     print("✅ Планировщик запущен в боевом режиме.")
     print("   - Ежедневный запуск запланирован на 07:00 (Europe/Moscow).")
     print("   - Еженедельное планирование запланировано на 01:00 каждого понедельника.")
+    print("   - Еженедельная архивация старых данных запланирована на 03:00 каждого воскресенья.")
     print("   - Ожидание запланированного времени...")
     print("="*50)
     print("Чтобы остановить планировщик, нажмите Ctrl+C")
@@ -0,0 +1,214 @@
+import os
+import json
+import hashlib
+import argparse
+from pathlib import Path
+from typing import Any
+
+from tracing import current_span
+from database_manager import (get_stage_cache_entry, get_latest_stage_cache_entry, save_stage_cache_entry,
+                              mark_stage_cache_hit, delete_stage_cache_entries, get_stage_cache_stats,
+                              get_stage_cache_output_hashes)
+
+'''
+Кэш результатов этапов, зависящих от даты (news_summarizer, topic_categorizer, topic_rebalancer),
+с адресацией по содержимому. Этап считает хеш своих входов: содержимое входного файла, шаблон
+промпта, имя модели и конфиг. Если результат с таким хешем уже сохранен, этап не обращается
+к LLM, а восстанавливает результат из кэша.
+
+Инвалидация вниз по цепочке получается сама: входной файл следующего этапа - результат
+предыдущего, поэтому новый результат выше по цепочке меняет хеши всех этапов ниже.
+
+Хранение: таблица stage_cache (хеш входов -> хеш результата, см. миграцию 008) и каталог
+stage_cache/blobs, где результат лежит под своим sha256. Одинаковые результаты хранятся один раз.
+
+Настройки в pipeline_config.json: "stage_cache_enabled" (true), "stage_cache_dir" ("stage_cache").
+
+Запуск:
+    python stage_cache.py stats
+    python stage_cache.py clear [--stage news_summarizer] [--date 2025-07-01]
+'''
+
+PIPELINE_CONFIG_FILE = 'pipeline_config.json'
+DEFAULT_CACHE_DIR = 'stage_cache'
+
+_settings = None
+
+
+def load_cache_settings() -> dict:
+    global _settings
+    if _settings is None:
+        try:
+            with open(PIPELINE_CONFIG_FILE, 'r', encoding='utf-8') as f:
+                config = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            config = {}
+        _settings = {
+            'enabled': config.get('stage_cache_enabled', True),
+            'dir': config.get('stage_cache_dir', DEFAULT_CACHE_DIR),
+        }
+    return _settings
+
+
+# --- Хеши ---
+
+def file_digest(path) -> str | None:
+    """sha256 содержимого файла; None, если файла нет (такой вход просто не совпадет с прошлым)."""
+    digest = hashlib.sha256()
+    try:
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+    except FileNotFoundError:
+        return None
+    return digest.hexdigest()
+
+
+def compute_input_hash(stage: str, inputs: dict) -> str:
+    """Хеш входов этапа. inputs - JSON-сериализуемый словарь: хеши файлов, модель, конфиг и т.д."""
+    canonical = json.dumps({'stage': stage, 'inputs': inputs}, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+# --- Хранилище результатов ---
+
+def _blob_path(output_hash: str) -> Path:
+    return Path(load_cache_settings()['dir']) / 'blobs' / output_hash[:2] / output_hash
+
+
+def _put_blob(data: bytes) -> str:
+    output_hash = hashlib.sha256(data).hexdigest()
+    path = _blob_path(output_hash)
+    if not path.exists():
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Запись через временный файл: параллельный backfill не увидит недописанный результат
+        temp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        temp_path.write_bytes(data)
+        os.replace(temp_path, path)
+    return output_hash
+
+
+def _mark_span(outcome: str):
+    span_ = current_span()
+    if span_ is not None:
+        span_.set(cache=outcome)
+
+
+def lookup(stage: str, input_hash: str) -> dict | None:
+    """Запись кэша для этих входов или None (кэш выключен, записи нет или файл результата пропал)."""
+    if not load_cache_settings()['enabled']:
+        return None
+    entry = get_stage_cache_entry(stage, input_hash)
+    if entry is None or not _blob_path(entry['output_hash']).exists():
+        _mark_span('miss')
+        return None
+    return entry
+
+
+def previous_entry(stage: str, target_date: str) -> dict | None:
+    """Последний результат этапа за дату - чтобы убрать то, что устарело после изменения входов."""
+    return get_latest_stage_cache_entry(stage, target_date)
+
+
+def restore_file(stage: str, entry: dict, output_path) -> bool:
+    """Кладет результат из кэша в output_path. Если там уже лежит тот же результат, файл не переписывается."""
+    output_path = Path(output_path)
+    try:
+        if file_digest(output_path) != entry['output_hash']:
+            output_path.parent.mkdir(parents=True, exist_ok=True)
+            temp_path = output_path.with_name(f"{output_path.name}.tmp")
+            temp_path.write_bytes(_blob_path(entry['output_hash']).read_bytes())
+            os.replace(temp_path, output_path)
+    except OSError as e:
+        print(f"     [WARNING] Не удалось восстановить результат {stage} из кэша: {e}")
+        return False
+    mark_stage_cache_hit(stage, entry['input_hash'])
+    _mark_span('hit')
+    print(f"     [CACHE] Входы {stage} не изменились - результат взят из кэша: {output_path}")
+    return True
+
+
+def store_file(stage: str, input_hash: str, target_date: str | None, output_path):
+    """Запоминает файл-результат этапа для этих входов."""
+    if not load_cache_settings()['enabled']:
+        return
+    try:
+        output_hash = _put_blob(Path(output_path).read_bytes())
+    except OSError as e:
+        print(f"     [WARNING] Не удалось сохранить результат {stage} в кэш: {e}")
+        return
+    save_stage_cache_entry(stage, input_hash, target_date, output_hash, str(output_path))
+
+
+def load_value(stage: str, entry: dict) -> Any:
+    """Результат-значение (см. store_value) из записи кэша; None, если прочитать не удалось."""
+    try:
+        return json.loads(_blob_path(entry['output_hash']).read_text(encoding='utf-8'))
+    except (OSError, json.JSONDecodeError) as e:
+        print(f"     [WARNING] Не удалось прочитать результат {stage} из кэша: {e}")
+        return None
+
+
+def mark_hit(stage: str, entry: dict):
+    mark_stage_cache_hit(stage, entry['input_hash'])
+    _mark_span('hit')
+    print(f"     [CACHE] Входы {stage} не изменились - этап пропущен, результат из кэша.")
+
+
+def store_value(stage: str, input_hash: str, target_date: str | None, value: Any):
+    """Запоминает результат этапа, который живет не в файле (например, ключи сохраненных тем)."""
+    if not load_cache_settings()['enabled']:
+        return
+    data = json.dumps(value, ensure_ascii=False, sort_keys=True).encode('utf-8')
+    try:
+        output_hash = _put_blob(data)
+    except OSError as e:
+        print(f"     [WARNING] Не удалось сохранить результат {stage} в кэш: {e}")
+        return
+    save_stage_cache_entry(stage, input_hash, target_date, output_hash, None)
+
+
+# --- Обслуживание ---
+
+def remove_orphan_blobs() -> int:
+    """Удаляет файлы результатов, на которые больше не ссылается ни одна запись."""
+    blobs_dir = Path(load_cache_settings()['dir']) / 'blobs'
+    if not blobs_dir.exists():
+        return 0
+    referenced = get_stage_cache_output_hashes()
+    removed = 0
+    for path in blobs_dir.glob('*/*'):
+        if path.name not in referenced:
+            path.unlink(missing_ok=True)
+            removed += 1
+    return removed
+
+
+def print_stats():
+    stats = get_stage_cache_stats()
+    if not stats:
+        print("     Кэш этапов пуст.")
+        return
+    print(f"     {'Этап':<20} {'Записей':>8} {'Попаданий':>10}  {'Последнее сохранение':<20}  Последнее попадание")
+    for row in stats:
+        print(f"     {row['stage']:<20} {row['entries']:>8} {row['hits'] or 0:>10}  {row['last_saved'] or '-':<20}  "
+              f"{row['last_hit'] or '-'}")
+    blobs_dir = Path(load_cache_settings()['dir']) / 'blobs'
+    sizes = [path.stat().st_size for path in blobs_dir.glob('*/*')] if blobs_dir.exists() else []
+    print(f"     Файлов результатов: {len(sizes)}, {sum(sizes) / 1024:.1f} КБ")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Кэш результатов этапов конвейера.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('stats', help="записи и попадания по этапам")
+    clear_parser = subparsers.add_parser('clear', help="сбросить кэш (весь или по этапу/дате)")
+    clear_parser.add_argument('--stage')
+    clear_parser.add_argument('--date')
+    args = parser.parse_args()
+
+    if args.command == 'stats':
+        print_stats()
+    else:
+        deleted = delete_stage_cache_entries(args.stage, args.date)
+        print(f"     Удалено записей: {len(deleted)}, файлов результатов: {remove_orphan_blobs()}.")
@@ -0,0 +1,245 @@
+import os
+import sys
+import time
+import threading
+from pathlib import Path
+from datetime import datetime
+from collections import Counter
+
+import pipeline_settings
+
+'''
+Профилирование отдельных этапов конвейера по запросу.
+Включается флагом daily_pipeline.py --profile или переменной окружения PIPELINE_PROFILE
+("all" или имена этапов через запятую). Без них этапы не оборачиваются, и накладных расходов нет.
+
+Для каждого выбранного этапа пишутся (в profiling_dir/<дата>/<этап>_<время>.*):
+    cpu     - .pstats cProfile (python -m pstats, snakeviz);
+    stacks  - .collapsed: стеки потока этапа, снятые сэмплированием раз в profiling_sample_interval_ms,
+              в формате "кадр;кадр;кадр N" для flamegraph.pl, speedscope, inferno;
+    memory  - _memory.txt: пик и profiling_top_allocations строк кода, которые выделили больше всего
+              памяти за время этапа (tracemalloc), и .tracemalloc - снимок для сравнения вручную.
+Набор задается --profile-modes или PIPELINE_PROFILE_MODES (по умолчанию все три).
+
+cProfile и сэмплер видят только поток этапа. В асинхронном режиме этапы делят поток цикла событий:
+в профиль попадает и работа соседних этапов, а два CPU-профиля одновременно в одном потоке
+невозможны - второй этап получит только стеки и память. Вызовы в asyncio.to_thread не видны.
+'''
+
+PROFILE_ENV = 'PIPELINE_PROFILE'
+PROFILE_MODES_ENV = 'PIPELINE_PROFILE_MODES'
+MODES = ('cpu', 'stacks', 'memory')
+DEFAULT_SETTINGS = {
+    'profiling_dir': 'profiles',
+    'profiling_sample_interval_ms': 5,
+    'profiling_top_allocations': 25,
+}
+
+_memory_lock = threading.Lock()
+_memory_users = 0  # этапы, которым сейчас нужен tracemalloc
+_memory_owned = False  # трассировку запустили мы, а не вызывающий код (например, pipeline_benchmark)
+
+
+def load_settings() -> dict:
+    return pipeline_settings.load_settings(DEFAULT_SETTINGS)
+
+
+def parse_names(value: str | None) -> list[str]:
+    return [name.strip() for name in (value or '').split(',') if name.strip()]
+
+
+def resolve_request(stages_arg: str | None, modes_arg: str | None) -> tuple[list[str], tuple] | None:
+    """(этапы, режимы) из аргументов CLI, иначе из окружения; None - профилирование выключено."""
+    selection = parse_names(stages_arg if stages_arg is not None else os.getenv(PROFILE_ENV))
+    if not selection:
+        return None
+    modes = parse_names(modes_arg if modes_arg is not None else os.getenv(PROFILE_MODES_ENV)) or list(MODES)
+    unknown = [mode for mode in modes if mode not in MODES]
+    if unknown:
+        raise ValueError(f"Неизвестные режимы профилирования: {', '.join(unknown)} (доступны: {', '.join(MODES)})")
+    return selection, tuple(modes)
+
+
+# --- Сэмплер стеков ---
+
+def frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class StackSampler:
+    """Фоновый поток, который раз в interval_sec снимает стек потока этапа и считает одинаковые стеки."""
+
+    def __init__(self, thread_id: int, interval_sec: float):
+        self.thread_id = thread_id
+        self.interval_sec = interval_sec
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._loop, name='stack-sampler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _loop(self):
+        while not self._stop.wait(self.interval_sec):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(frame_label(frame))
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def write(self, path: Path):
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+# --- tracemalloc (один на процесс, общий для этапов) ---
+
+def _memory_acquire():
+    global _memory_users, _memory_owned
+    import tracemalloc
+    with _memory_lock:
+        if _memory_users == 0:
+            _memory_owned = not tracemalloc.is_tracing()
+            if _memory_owned:
+                tracemalloc.start(25)
+        _memory_users += 1
+
+
+def _memory_release():
+    global _memory_users
+    import tracemalloc
+    with _memory_lock:
+        _memory_users -= 1
+        if _memory_users == 0 and _memory_owned:
+            tracemalloc.stop()
+
+
+def write_memory_report(path: Path, stage: str, before, after, peak: int, top: int):
+    import tracemalloc
+    # Собственные выделения профилировщиков в отчет не попадают
+    filters = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, __file__),
+               tracemalloc.Filter(False, '*cProfile.py')]
+    diff = after.filter_traces(filters).compare_to(before.filter_traces(filters), 'lineno')
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(f"Этап: {stage}\n")
+        f.write(f"Пик выделенной памяти за этап (процесс целиком): {peak / 2 ** 20:.1f} МБ\n")
+        f.write(f"Прирост за этап: {sum(stat.size_diff for stat in diff) / 2 ** 20:+.1f} МБ\n\n")
+        f.write(f"Топ-{top} строк по приросту памяти:\n")
+        for stat in diff[:top]:
+            f.write(f"{stat}\n")
+
+
+# --- Профиль одного этапа ---
+
+class StageProfile:
+    """Контекстный менеджер: профилирует код внутри блока и пишет результаты при выходе."""
+
+    def __init__(self, stage: str, modes: tuple, output_dir: Path, settings: dict):
+        self.stage = stage
+        self.modes = modes
+        self.settings = settings
+        stamp = datetime.now().strftime('%H%M%S')
+        self.base_path = output_dir / f"{stage}_{stamp}"
+        self.profiler = None
+        self.sampler = None
+        self.snapshot_before = None
+
+    def __enter__(self):
+        self.base_path.parent.mkdir(parents=True, exist_ok=True)
+        if 'memory' in self.modes:
+            import tracemalloc
+            _memory_acquire()
+            tracemalloc.reset_peak()
+            self.snapshot_before = tracemalloc.take_snapshot()
+        if 'stacks' in self.modes:
+            self.sampler = StackSampler(threading.get_ident(), self.settings['profiling_sample_interval_ms'] / 1000)
+            self.sampler.start()
+        if 'cpu' in self.modes:
+            import cProfile
+            self.profiler = cProfile.Profile()
+            try:
+                self.profiler.enable()
+            except ValueError as e:
+                print(f"     [WARNING] [{self.stage}] CPU-профиль недоступен: {e}")
+                self.profiler = None
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.started
+        written = []
+        if self.profiler:
+            self.profiler.disable()
+            path = self.base_path.with_suffix('.pstats')
+            self.profiler.dump_stats(path)
+            written.append(path)
+        if self.sampler:
+            self.sampler.stop()
+            path = self.base_path.with_suffix('.collapsed')
+            self.sampler.write(path)
+            written.append(path)
+        if self.snapshot_before is not None:
+            import tracemalloc
+            try:
+                _, peak = tracemalloc.get_traced_memory()
+                snapshot = tracemalloc.take_snapshot()
+                snapshot.dump(str(self.base_path.with_suffix('.tracemalloc')))
+                path = self.base_path.parent / f"{self.base_path.name}_memory.txt"
+                write_memory_report(path, self.stage, self.snapshot_before, snapshot, peak,
+                                    self.settings['profiling_top_allocations'])
+                written.append(path)
+            finally:
+                _memory_release()
+        print(f"     [INFO] [{self.stage}] Профиль этапа ({elapsed:.1f} сек): "
+              f"{', '.join(str(path) for path in written) or 'нет данных'}")
+        return False
+
+
+def profile_stages(stages: list, selection: list[str], modes: tuple, target_date: str) -> list[str]:
+    """
+    Оборачивает функции выбранных этапов профилированием (selection - имена или ["all"]).
+    Возвращает имена обернутых этапов. Невыбранные этапы не меняются.
+    """
+    settings = load_settings()
+    output_dir = Path(settings['profiling_dir']) / target_date
+    names = {stage.name for stage in stages}
+    wanted = names if 'all' in selection else set(selection)
+    unknown = sorted(wanted - names)
+    if unknown:
+        print(f"     [WARNING] Профилирование: нет этапов {', '.join(unknown)}")
+
+    profiled = []
+    for stage in stages:
+        if stage.name not in wanted:
+            continue
+        stage.func = _profiled(stage.name, stage.func, modes, output_dir, settings)
+        if stage.async_func:
+            stage.async_func = _profiled_async(stage.name, stage.async_func, modes, output_dir, settings)
+        profiled.append(stage.name)
+    if profiled:
+        print(f"🔬 Профилирование ({', '.join(modes)}): {', '.join(profiled)} -> {output_dir}")
+    return profiled
+
+
+def _profiled(name: str, func, modes: tuple, output_dir: Path, settings: dict):
+    def run():
+        with StageProfile(name, modes, output_dir, settings):
+            return func()
+    run.__name__ = getattr(func, '__name__', name)
+    return run
+
+
+def _profiled_async(name: str, func, modes: tuple, output_dir: Path, settings: dict):
+    async def run():
+        with StageProfile(name, modes, output_dir, settings):
+            return await func()
+    run.__name__ = getattr(func, '__name__', name)
+    return run
@@ -0,0 +1,679 @@
+import sys
+import json
+import math
+import time
+import types
+import random
+import asyncio
+import hashlib
+import threading
+from types import SimpleNamespace
+from collections import Counter, defaultdict, deque
+from typing import Callable
+
+'''
+Локальные заменители внешних сервисов для офлайн-бенчмарка конвейера (pipeline_benchmark.py):
+Gemini (google.generativeai), OpenAI и Grok (openai.AsyncOpenAI), Telegram (telethon и
+python-telegram-bot), Hugging Face (huggingface_hub.InferenceClient) и Bybit (pybit и HTTP через requests).
+
+install() подменяет модули SDK в sys.modules до того, как их импортируют модули этапов,
+поэтому этапы работают без изменений: те же вызовы и те же исключения, но без сети и без расхода квот.
+Подмена действует только в процессе бенчмарка.
+
+У каждого сервиса свой профиль (раздел "providers" в benchmark_config.json):
+    "latency_ms"           - распределение задержки ответа:
+                             {"dist": "fixed", "value": 100}, {"dist": "uniform", "min": 50, "max": 200},
+                             {"dist": "normal", "mean": 300, "stddev": 50}, {"dist": "lognormal", "median": 800, "sigma": 0.5},
+                             {"dist": "exponential", "mean": 150};
+    "per_item_ms"          - добавка за элемент пакетного запроса (эмбеддинги, страница сообщений);
+    "error_rate"           - доля ответов с ошибкой сервера (500);
+    "rpm"                  - лимит запросов в минуту на один ключ: сверх него сервис отвечает 429,
+                             а заменитель бросает то же исключение, что и настоящий SDK;
+    "retry_after_sec"      - сколько сервис просит подождать после 429;
+    "rate_limit_latency_ms"- задержка ответа 429.
+Все задержки и окна лимитов умножаются на time_scale: прогон идет в сжатом времени,
+а соотношения между задержками и лимитами сохраняются.
+
+Содержимое ответов задает вызывающий код: responder(prompt, provider, model) -> str и data -
+синтетический день (сообщения каналов, инструменты и статьи Bybit).
+'''
+
+DEFAULT_PROFILE = {
+    'latency_ms': {'dist': 'fixed', 'value': 0},
+    'per_item_ms': 0,
+    'error_rate': 0.0,
+    'rpm': None,
+    'retry_after_sec': 60,
+    'rate_limit_latency_ms': 50,
+}
+EMBEDDING_DIM = 64
+TELEGRAM_PAGE_SIZE = 100
+
+_active = None
+
+
+def sample_latency_ms(spec: dict, rng: random.Random) -> float:
+    dist = spec.get('dist', 'fixed')
+    if dist == 'fixed':
+        value = spec.get('value', 0)
+    elif dist == 'uniform':
+        value = rng.uniform(spec['min'], spec['max'])
+    elif dist == 'normal':
+        value = rng.gauss(spec['mean'], spec.get('stddev', 0))
+    elif dist == 'lognormal':
+        value = rng.lognormvariate(math.log(spec['median']), spec.get('sigma', 0.5))
+    elif dist == 'exponential':
+        value = rng.expovariate(1 / spec['mean'])
+    else:
+        raise ValueError(f"Неизвестное распределение задержки: {dist}")
+    return max(0.0, value)
+
+
+def embed_text(text: str, dim: int = EMBEDDING_DIM) -> list[float]:
+    """Детерминированный "эмбеддинг": слова раскладываются по корзинам хеша, вектор нормирован."""
+    vector = [0.0] * dim
+    for word in text.lower().split():
+        bucket = int.from_bytes(hashlib.blake2b(word.encode('utf-8'), digest_size=4).digest(), 'little')
+        vector[bucket % dim] += 1.0
+    norm = math.sqrt(sum(value * value for value in vector)) or 1.0
+    return [value / norm for value in vector]
+
+
+class StandIns:
+    """Общее состояние заменителей: профили сервисов, окна лимитов по ключам и статистика вызовов."""
+
+    def __init__(self, profiles: dict, responder: Callable[[str, str, str], str], data: dict | None = None,
+                 time_scale: float = 1.0, seed: int = 0, image_size: int = 256):
+        self.profiles = {name: {**DEFAULT_PROFILE, **profile} for name, profile in profiles.items()}
+        for name, profile in self.profiles.items():
+            try:
+                sample_latency_ms(profile['latency_ms'], random.Random(0))
+            except (KeyError, ValueError) as e:
+                raise ValueError(f"Неверный профиль задержки сервиса {name}: {e}") from e
+        self.responder = responder
+        self.data = dict(data or {})
+        self.data['channels'] = {
+            channel: [SimpleNamespace(**message) for message in messages]
+            for channel, messages in self.data.get('channels', {}).items()
+        }
+        self.time_scale = time_scale
+        self.image_size = image_size
+        self.stats = defaultdict(Counter)
+        self._windows = defaultdict(deque)
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _decide(self, provider: str, key, items: int) -> tuple[float, int, float]:
+        """Исход запроса: (задержка в секундах реального времени, HTTP-статус, retry-after в секундах сервиса)."""
+        profile = self.profiles.get(provider, DEFAULT_PROFILE)
+        with self._lock:
+            stats = self.stats[provider]
+            stats['calls'] += 1
+            if profile['rpm']:
+                now = time.perf_counter()
+                window = self._windows[(provider, key)]
+                while window and now - window[0] >= 60 * self.time_scale:
+                    window.popleft()
+                if len(window) >= profile['rpm']:
+                    stats['rate_limited'] += 1
+                    return profile['rate_limit_latency_ms'] / 1000 * self.time_scale, 429, profile['retry_after_sec']
+                window.append(now)
+            latency_ms = sample_latency_ms(profile['latency_ms'], self._rng) + profile['per_item_ms'] * items
+            failed = self._rng.random() < profile['error_rate']
+            stats['errors' if failed else 'ok'] += 1
+            if not failed:
+                stats['items'] += items
+            stats['busy_ms'] += latency_ms
+        return latency_ms / 1000 * self.time_scale, 500 if failed else 200, 0
+
+    def call(self, provider: str, key, items: int = 1) -> tuple[int, float]:
+        """Синхронный запрос: ждет задержку сервиса и возвращает (статус, retry-after)."""
+        delay, status, retry_after = self._decide(provider, key, items)
+        if delay:
+            time.sleep(delay)
+        return status, retry_after
+
+    async def acall(self, provider: str, key, items: int = 1) -> tuple[int, float]:
+        delay, status, retry_after = self._decide(provider, key, items)
+        if delay:
+            await asyncio.sleep(delay)
+        return status, retry_after
+
+    def count(self, provider: str, counter: str, value: int = 1):
+        with self._lock:
+            self.stats[provider][counter] += value
+
+    def respond(self, prompt: str, provider: str, model: str) -> str:
+        return self.responder(prompt, provider, model)
+
+    def summary(self) -> dict:
+        with self._lock:
+            return {provider: {name: round(value, 1) for name, value in stats.items()}
+                    for provider, stats in sorted(self.stats.items())}
+
+
+def active() -> StandIns:
+    if _active is None:
+        raise RuntimeError("Заменители сервисов не установлены: вызовите stand_ins.install().")
+    return _active
+
+
+# --- Gemini: google.generativeai, google.ai.generativelanguage, google.api_core ---
+
+class GoogleAPICallError(Exception):
+    code = None
+
+    def __init__(self, message: str = ''):
+        super().__init__(f"{self.code} {message}".strip())
+        self.message = message
+
+
+class ResourceExhausted(GoogleAPICallError):
+    code = 429
+
+
+class InternalServerError(GoogleAPICallError):
+    code = 500
+
+
+def _raise_for_gemini(status: int):
+    if status == 429:
+        raise ResourceExhausted("Resource has been exhausted (e.g. check quota).")
+    if status >= 500:
+        raise InternalServerError("An internal error has occurred. Please retry or report.")
+
+
+_gemini_state = {'api_key': None}  # genai.configure() - глобальная настройка, как в SDK
+
+
+def _genai_configure(api_key: str | None = None, **kwargs):
+    _gemini_state['api_key'] = api_key
+
+
+def _prompt_text(contents) -> str:
+    if isinstance(contents, str):
+        return contents
+    if isinstance(contents, (list, tuple)):
+        return "\n".join(_prompt_text(part) for part in contents)
+    if isinstance(contents, dict):
+        return _prompt_text(contents.get('parts') or contents.get('text', ''))
+    return str(contents)
+
+
+class GenerationConfig:
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+class ClientOptions:
+    def __init__(self, api_key: str | None = None, **kwargs):
+        self.api_key = api_key
+
+
+class _GrpcTransport:
+    async def close(self):
+        pass
+
+
+class _Message:
+    """Сообщения запроса google.ai.generativelanguage (GenerateContentRequest, Content, Part, ...)."""
+
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+class GenerativeServiceAsyncClient:
+    def __init__(self, client_options: ClientOptions | None = None, **kwargs):
+        self.api_key = getattr(client_options, 'api_key', None)
+        self.transport = _GrpcTransport()
+
+    async def generate_content(self, request=None, **kwargs):
+        status, _ = await active().acall('gemini', self.api_key)
+        _raise_for_gemini(status)
+        prompt = "\n".join(part.text for content in request.contents for part in content.parts)
+        text = active().respond(prompt, 'gemini', request.model.removeprefix('models/'))
+        return SimpleNamespace(candidates=[SimpleNamespace(content=SimpleNamespace(parts=[SimpleNamespace(text=text)]))],
+                               prompt_feedback=None)
+
+
+class GenerativeModel:
+    def __init__(self, model_name: str = 'gemini-pro', generation_config=None, **kwargs):
+        self.model_name = model_name
+        self._generation_config = generation_config
+        self._async_client = None
+
+    def _response(self, contents, status: int):
+        _raise_for_gemini(status)
+        return SimpleNamespace(text=active().respond(_prompt_text(contents), 'gemini', self.model_name))
+
+    def generate_content(self, contents=None, generation_config=None, **kwargs):
+        status, _ = active().call('gemini', _gemini_state['api_key'])
+        return self._response(contents, status)
+
+    async def generate_content_async(self, contents=None, generation_config=None, **kwargs):
+        api_key = self._async_client.api_key if self._async_client else _gemini_state['api_key']
+        status, _ = await active().acall('gemini', api_key)
+        return self._response(contents, status)
+
+
+def _genai_embed_content(model: str, content, task_type: str | None = None, **kwargs) -> dict:
+    texts = [content] if isinstance(content, str) else list(content)
+    status, _ = active().call('gemini_embed', _gemini_state['api_key'], items=len(texts))
+    _raise_for_gemini(status)
+    vectors = [embed_text(text) for text in texts]
+    return {'embedding': vectors[0] if isinstance(content, str) else vectors}
+
+
+async def _genai_embed_content_async(model: str, content, task_type: str | None = None, client=None,
+                                     **kwargs) -> dict:
+    texts = [content] if isinstance(content, str) else list(content)
+    api_key = client.api_key if client else _gemini_state['api_key']
+    status, _ = await active().acall('gemini_embed', api_key, items=len(texts))
+    _raise_for_gemini(status)
+    vectors = [embed_text(text) for text in texts]
+    return {'embedding': vectors[0] if isinstance(content, str) else vectors}
+
+
+# --- OpenAI и Grok: openai.AsyncOpenAI ---
+
+class OpenAIError(Exception):
+    pass
+
+
+class APIStatusError(OpenAIError):
+    def __init__(self, message: str, status_code: int):
+        super().__init__(f"Error code: {status_code} - {message}")
+        self.status_code = status_code
+
+
+class RateLimitError(APIStatusError):
+    pass
+
+
+class OpenAIInternalServerError(APIStatusError):
+    pass
+
+
+class _ChatCompletions:
+    def __init__(self, client: 'AsyncOpenAI'):
+        self._client = client
+
+    async def create(self, model: str, messages: list, **kwargs):
+        status, _ = await active().acall(self._client.provider, self._client.api_key)
+        if status == 429:
+            raise RateLimitError("Rate limit reached for requests", 429)
+        if status >= 500:
+            raise OpenAIInternalServerError("The server had an error while processing your request.", status)
+        prompt = "\n".join(str(message.get('content', '')) for message in messages if message.get('role') == 'user')
+        text = active().respond(prompt, self._client.provider, model)
+        message = SimpleNamespace(role='assistant', content=text)
+        return SimpleNamespace(model=model, choices=[SimpleNamespace(index=0, message=message, finish_reason='stop')])
+
+
+class AsyncOpenAI:
+    def __init__(self, api_key: str | None = None, base_url: str | None = None, **kwargs):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.provider = 'grok' if base_url and 'x.ai' in base_url else 'openai'
+        self.chat = SimpleNamespace(completions=_ChatCompletions(self))
+
+    async def close(self):
+        pass
+
+
+# --- Hugging Face: huggingface_hub.InferenceClient ---
+
+class HfHubHTTPError(Exception):
+    def __init__(self, message: str, status_code: int | None = None):
+        super().__init__(message)
+        self.response = SimpleNamespace(status_code=status_code)
+
+
+class InferenceClient:
+    def __init__(self, model: str | None = None, provider: str | None = None, api_key: str | None = None,
+                 token: str | None = None, **kwargs):
+        self.provider = provider
+        self.api_key = api_key or token
+
+    def text_to_image(self, prompt: str, model: str | None = None, **kwargs):
+        status, _ = active().call('huggingface', f"{self.provider}:{self.api_key}")
+        if status == 429:
+            raise HfHubHTTPError(f"429 Client Error: Too Many Requests for model {model}", 429)
+        if status >= 500:
+            raise HfHubHTTPError(f"500 Server Error: Internal Server Error for model {model}", 500)
+        from PIL import Image
+        digest = hashlib.sha256(prompt.encode('utf-8')).digest()
+        size = active().image_size
+        return Image.new('RGB', (size, size), tuple(digest[:3]))
+
+
+# --- Telegram (клиентский API): telethon ---
+
+class RPCError(Exception):
+    code = None
+
+
+class FloodWaitError(RPCError):
+    code = 420
+
+    def __init__(self, request=None, capture: int = 0):
+        super().__init__(f"A wait of {capture} seconds is required")
+        self.seconds = capture
+
+
+class TelegramClient:
+    """Клиент с синтетическими каналами. Как и Telethon, сам ждет FLOOD_WAIT не длиннее flood_sleep_threshold."""
+
+    def __init__(self, session, api_id, api_hash, flood_sleep_threshold: int = 60, request_retries: int = 5,
+                 **kwargs):
+        self.session = session
+        self.api_key = str(api_id)
+        self.flood_sleep_threshold = flood_sleep_threshold
+        self.request_retries = request_retries
+        self._connected = False
+
+    async def _request(self, items: int = 1):
+        server_errors = 0
+        while True:
+            status, retry_after = await active().acall('telegram', self.api_key, items)
+            if status == 429:
+                if retry_after > self.flood_sleep_threshold:
+                    raise FloodWaitError(capture=int(retry_after))
+                await asyncio.sleep(retry_after * active().time_scale)
+                continue
+            if status >= 500:
+                server_errors += 1
+                if server_errors > self.request_retries:
+                    raise RPCError("500 INTERNAL: request failed after retries")
+                continue
+            return
+
+    async def start(self, *args, **kwargs):
+        await self._request()
+        self._connected = True
+        return self
+
+    async def connect(self):
+        await self.start()
+
+    def is_connected(self) -> bool:
+        return self._connected
+
+    async def disconnect(self):
+        self._connected = False
+
+    async def iter_messages(self, entity, limit: int | None = None, **kwargs):
+        messages = active().data['channels'].get(entity, [])
+        if limit:
+            messages = messages[:limit]
+        # Сообщения приходят страницами, как у GetHistoryRequest: один запрос на страницу
+        for offset in range(0, max(len(messages), 1), TELEGRAM_PAGE_SIZE):
+            page = messages[offset:offset + TELEGRAM_PAGE_SIZE]
+            await self._request(items=len(page))
+            for message in page:
+                yield message
+
+
+# --- Telegram-бот: python-telegram-bot ---
+
+class TelegramError(Exception):
+    pass
+
+
+class NetworkError(TelegramError):
+    pass
+
+
+class RetryAfter(TelegramError):
+    def __init__(self, retry_after: float):
+        super().__init__(f"Flood control exceeded. Retry in {retry_after} seconds")
+        self.retry_after = retry_after
+
+
+class Bot:
+    def __init__(self, token: str):
+        self.token = token
+        self._message_id = 0
+
+    async def _send(self, items_counter: str, size: int = 0):
+        status, retry_after = await active().acall('telegram_bot', self.token)
+        if status == 429:
+            raise RetryAfter(retry_after)
+        if status >= 500:
+            raise NetworkError("Bad Gateway")
+        active().count('telegram_bot', items_counter)
+        if size:
+            active().count('telegram_bot', 'bytes', size)
+        self._message_id += 1
+        return SimpleNamespace(message_id=self._message_id)
+
+    async def send_document(self, chat_id, document, filename: str | None = None, caption: str | None = None,
+                            **kwargs):
+        data = document.read() if hasattr(document, 'read') else document
+        return await self._send('documents', len(data or b''))
+
+    async def send_message(self, chat_id, text: str, **kwargs):
+        return await self._send('messages')
+
+
+class Application:
+    def __init__(self, token: str):
+        self.bot = Bot(token)
+        self.handlers = []
+
+    @staticmethod
+    def builder() -> 'ApplicationBuilder':
+        return ApplicationBuilder()
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def add_handler(self, handler):
+        self.handlers.append(handler)
+
+    def run_polling(self, *args, **kwargs):
+        raise RuntimeError("Long polling в бенчмарке не запускается.")
+
+
+class ApplicationBuilder:
+    def __init__(self):
+        self._token = None
+
+    def token(self, token: str) -> 'ApplicationBuilder':
+        self._token = token
+        return self
+
+    def build(self) -> Application:
+        return Application(self._token)
+
+
+class _Handler:
+    def __init__(self, *args, **kwargs):
+        self.args = args
+
+
+class InlineKeyboardButton:
+    def __init__(self, text: str, callback_data: str | None = None, **kwargs):
+        self.text = text
+        self.callback_data = callback_data
+
+
+class InlineKeyboardMarkup:
+    def __init__(self, inline_keyboard):
+        self.inline_keyboard = inline_keyboard
+
+
+# --- Bybit: pybit (список инструментов) и HTTP через requests (статьи портала) ---
+
+class FailedRequestError(Exception):
+    def __init__(self, request: str = '', message: str = '', status_code: int | None = None, time=None,
+                 resp_headers=None):
+        super().__init__(f"{message} (ErrCode: {status_code}) (ErrTime: {time}).\nRequest → {request}.")
+        self.status_code = status_code
+
+
+class BybitHTTP:
+    def __init__(self, testnet: bool = False, api_key: str | None = None, api_secret: str | None = None, **kwargs):
+        self.api_key = api_key or 'public'
+
+    def get_instruments_info(self, category: str = 'spot', **kwargs) -> dict:
+        status, _ = active().call('bybit', self.api_key)
+        if status != 200:
+            message = "Too many visits!" if status == 429 else "Internal server error"
+            raise FailedRequestError(f"GET /v5/market/instruments-info category={category}", message, status,
+                                     time.strftime('%H:%M:%S'))
+        instruments = [{'symbol': symbol, 'status': 'Trading'} for symbol in active().data.get('instruments', [])]
+        return {'retCode': 0, 'retMsg': 'OK', 'result': {'category': category, 'list': instruments}}
+
+
+class RequestException(IOError):
+    def __init__(self, *args, response=None, **kwargs):
+        super().__init__(*args)
+        self.response = response
+
+
+class HTTPError(RequestException):
+    pass
+
+
+class RequestsConnectionError(RequestException):
+    pass
+
+
+class Timeout(RequestException):
+    pass
+
+
+class Response:
+    def __init__(self, url: str, status_code: int, payload):
+        self.url = url
+        self.status_code = status_code
+        self._payload = payload
+
+    @property
+    def ok(self) -> bool:
+        return self.status_code < 400
+
+    @property
+    def text(self) -> str:
+        return self._payload if isinstance(self._payload, str) else json.dumps(self._payload)
+
+    def json(self):
+        return json.loads(self._payload) if isinstance(self._payload, str) else self._payload
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise HTTPError(f"{self.status_code} Error for url: {self.url}", response=self)
+
+
+def _http_request(method: str, url: str, params: dict | None = None) -> Response:
+    """Маршрутизация HTTP-запросов: портал Bybit, Bot API Telegram (алерты), остальное - проверка IP."""
+    if 'bybit' in url:
+        provider = 'bybit'
+    elif 'api.telegram.org' in url:
+        provider = 'telegram_bot'
+    else:
+        provider = 'http'
+    status, _ = active().call(provider, url.split('/')[2] if '//' in url else url)
+    if status != 200:
+        return Response(url, status, {'ret_code': 10006 if status == 429 else 10016, 'ret_msg': 'error'})
+
+    if provider == 'bybit':
+        params = params or {}
+        page_size = int(params.get('pageSize', 10))
+        page = int(params.get('pageNum', 1))
+        articles = active().data.get('bybit_articles', [])[(page - 1) * page_size:page * page_size]
+        return Response(url, 200, {'ret_code': 0, 'ret_msg': 'OK', 'result': {'data': articles}})
+    if provider == 'telegram_bot':
+        active().count('telegram_bot', 'alerts')
+        return Response(url, 200, {'ok': True, 'result': {}})
+    return Response(url, 200, '203.0.113.10')
+
+
+class Session:
+    def get(self, url: str, params: dict | None = None, **kwargs) -> Response:
+        return _http_request('GET', url, params)
+
+    def post(self, url: str, data=None, json=None, **kwargs) -> Response:
+        return _http_request('POST', url)
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _requests_get(url: str, params: dict | None = None, **kwargs) -> Response:
+    return _http_request('GET', url, params)
+
+
+def _requests_post(url: str, data=None, json=None, **kwargs) -> Response:
+    return _http_request('POST', url)
+
+
+# --- Установка ---
+
+def _register(name: str, **attrs) -> types.ModuleType:
+    """Кладет модуль-заменитель в sys.modules и делает его атрибутом родительского пакета."""
+    parent_name, _, child_name = name.rpartition('.')
+    module = types.ModuleType(name)
+    module.__path__ = []
+    module.__dict__.update(attrs)
+    sys.modules[name] = module
+    if parent_name:
+        parent = sys.modules.get(parent_name)
+        if parent is None or not getattr(parent, '__stand_in__', False):
+            parent = _register(parent_name)
+        setattr(parent, child_name, module)
+    module.__stand_in__ = True
+    return module
+
+
+def install(stand_ins: StandIns):
+    """Подменяет SDK внешних сервисов заменителями. Вызывать до импорта модулей этапов."""
+    global _active
+    _active = stand_ins
+
+    _register('google')
+    _register('google.api_core')
+    _register('google.api_core.exceptions', GoogleAPICallError=GoogleAPICallError,
+              ResourceExhausted=ResourceExhausted, InternalServerError=InternalServerError)
+    _register('google.api_core.client_options', ClientOptions=ClientOptions)
+    _register('google.ai')
+    _register('google.ai.generativelanguage', GenerativeServiceAsyncClient=GenerativeServiceAsyncClient,
+              GenerateContentRequest=_Message, Content=_Message, Part=_Message, GenerationConfig=_Message)
+    genai = _register('google.generativeai', configure=_genai_configure, GenerativeModel=GenerativeModel,
+                      embed_content=_genai_embed_content, embed_content_async=_genai_embed_content_async)
+    _register('google.generativeai.types', GenerationConfig=GenerationConfig)
+    genai.types = sys.modules['google.generativeai.types']
+
+    _register('openai', AsyncOpenAI=AsyncOpenAI, OpenAIError=OpenAIError, APIStatusError=APIStatusError,
+              RateLimitError=RateLimitError, InternalServerError=OpenAIInternalServerError)
+
+    _register('huggingface_hub', InferenceClient=InferenceClient)
+    _register('huggingface_hub.errors', HfHubHTTPError=HfHubHTTPError)
+
+    _register('telethon', TelegramClient=TelegramClient)
+    _register('telethon.errors', RPCError=RPCError, FloodWaitError=FloodWaitError)
+
+    _register('telegram', Update=SimpleNamespace, InlineKeyboardButton=InlineKeyboardButton,
+              InlineKeyboardMarkup=InlineKeyboardMarkup, Bot=Bot)
+    _register('telegram.error', TelegramError=TelegramError, NetworkError=NetworkError, RetryAfter=RetryAfter)
+    _register('telegram.ext', Application=Application, ApplicationBuilder=ApplicationBuilder,
+              CommandHandler=_Handler, CallbackQueryHandler=_Handler,
+              ContextTypes=SimpleNamespace(DEFAULT_TYPE=object))
+
+    _register('pybit')
+    _register('pybit.unified_trading', HTTP=BybitHTTP)
+    _register('pybit.exceptions', FailedRequestError=FailedRequestError)
+
+    _register('requests', Session=Session, get=_requests_get, post=_requests_post, Response=Response,
+              RequestException=RequestException, HTTPError=HTTPError, ConnectionError=RequestsConnectionError,
+              Timeout=Timeout)
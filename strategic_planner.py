@@ -4,12 +4,13 @@ import sqlite3
 from pathlib import Path
 from datetime import date, timedelta
 from collections import defaultdict
-import google.generativeai as genai
 from dotenv import load_dotenv
-from google.generativeai.types import GenerationConfig
 
 from alerter import send_admin_alert
 from database_manager import get_db_connection
+from llm_gateway import generate_sync
+from key_pool import call_with_failover_sync
+from tracing import span, traced
 
 '''
 Модуль еженедельного стратегического планирования.
@@ -36,7 +37,7 @@ def load_config(config_path: str) -> dict | None:
 
 def save_json_file(data: dict, filepath: str) -> bool:
     try:
-        with open(filepath, 'w', encoding='utf-8') as f:
+        with span('file.json', kind='file', path=str(filepath)), open(filepath, 'w', encoding='utf-8') as f:
             json.dump(data, f, ensure_ascii=False, indent=2)
         return True
     except IOError as e:
@@ -52,26 +53,19 @@ def get_strategic_plan(prompt: str, config: dict) -> dict | None:
         return None
 
     model_name = config.get('gemini_model', 'gemini-2.5-pro')
-    generation_config = GenerationConfig(
-        response_mime_type="application/json",
-        temperature=0.9
-    )
-
-    for i, api_key in enumerate(api_keys):
-        print(f"     Попытка {i + 1}/{len(api_keys)} с ключом ...{api_key[-4:]}")
-        try:
-            genai.configure(api_key=api_key)
-            model = genai.GenerativeModel(model_name)
-            response = model.generate_content(contents=prompt, generation_config=generation_config)
-            parsed_response = json.loads(response.text)
-            print("     Успешный ответ и парсинг JSON получен.")
-            return parsed_response
-        except Exception as e:
-            print(f"     [ERROR] Ошибка с ключом ...{api_key[-4:]}: {e}")
-            continue
-
-    print("     [CRITICAL] Ни один из API-ключей не сработал.")
-    return None
+
+    # Первым идет самый здоровый ключ, ключи без дневной квоты пропускаются (key_pool)
+    try:
+        parsed_response = call_with_failover_sync(
+            'gemini', model_name, api_keys,
+            lambda api_key: generate_sync('gemini', model_name, prompt, api_key=api_key,
+                                          schema=dict, temperature=0.9, stage='strategic_planner')
+        )
+    except Exception as e:
+        print(f"     [CRITICAL] Ни один из API-ключей не сработал: {e}")
+        return None
+    print("     Успешный ответ и парсинг JSON получен.")
+    return parsed_response
 
 
 def save_plan_to_db(plan_json: dict, personas_map: dict) -> bool:
@@ -145,6 +139,7 @@ def get_personas_map() -> dict:
             conn.close()
 
 
+@traced()
 def run_strategic_planner() -> bool:
     print("\n--- Запуск модуля Strategic Planner ---")
     load_dotenv(ENV_FILE)
@@ -2,12 +2,16 @@ import asyncio
 import json
 import os
 import re
-import time
 from datetime import datetime, timedelta, date
 import pytz
 from telethon import TelegramClient
 from dotenv import load_dotenv
-import google.generativeai as genai
+
+from provider_clients import provider_session
+from llm_gateway import generate
+from key_pool import call_with_failover
+from rate_limiter import is_rate_limited, key_limiter
+from tracing import span, traced
 
 """
 Автоматически собирает новостные сводки из заданных Telegram-каналов.
@@ -21,6 +25,7 @@ APP_CONFIG_FILENAME = 'telegram_config.json'
 SCRAPER_CONFIG_FILENAME = 'scraper_config.json'
 PROMPT_FILENAME = os.path.join('Prompts', 'summarize_raw_posts_prompt.txt')
 GEMINI_API_KEYS = ['GEMINI_API_KEY_13', 'GEMINI_API_KEY_12']
+GEMINI_MODEL = "gemini-2.5-pro"  # PRO
 MOSCOW_TZ = pytz.timezone('Europe/Moscow')
 
 
@@ -92,44 +97,32 @@ FILTER_MAPPING = {
 
 # --- Основная логика парсера ---
 
-def _blocking_gemini_call(api_key: str, prompt: str) -> str:
-    genai.configure(api_key=api_key)
-    generation_config = genai.types.GenerationConfig(
-        temperature=0.3,
-    )
-    model = genai.GenerativeModel("gemini-2.5-pro", # PRO
-        generation_config=generation_config)
-    response = model.generate_content(contents=prompt)
-    return response.text
-
-
 async def generate_summary_with_gemini(raw_text: str, prompt_template: str) -> str:
     print(f"Собрано {len(raw_text)} символов. Отправка запроса в Gemini...")
     load_dotenv()
 
-    last_error = None
+    api_keys = []
     for key_name in GEMINI_API_KEYS:
         api_key = os.getenv(key_name)
         if not api_key:
             print(f"Предупреждение: API-ключ '{key_name}' не найден в .env файле.")
             continue
+        api_keys.append(api_key)
 
-        try:
-            print(f"Попытка с ключом: ...{key_name[-4:]}")
-            full_prompt = prompt_template.format(raw_posts_text=raw_text)
-            loop = asyncio.get_running_loop()
-            response_text = await loop.run_in_executor(
-                None, _blocking_gemini_call, api_key, full_prompt
+    full_prompt = prompt_template.format(raw_posts_text=raw_text)
+    try:
+        # Ключи - по здоровью из key_pool; в общем цикле daily_pipeline сессия уже открыта и переиспользуется
+        async with provider_session():
+            response_text = await call_with_failover(
+                'gemini', GEMINI_MODEL, api_keys,
+                lambda api_key: generate('gemini', GEMINI_MODEL, full_prompt, api_key=api_key,
+                                         temperature=0.3, stage='telegram_scraper')
             )
-            print("Сводка от Gemini успешно получена.")
-            return response_text
-        except Exception as e:
-            print(f"Ошибка с ключом ...{key_name[-4:]}: {e}")
-            last_error = e
-            continue  # Пробуем следующий ключ
-
-    print("Все API-ключи Gemini не сработали.")
-    return f"Ошибка генерации сводки: {last_error}"
+        print("Сводка от Gemini успешно получена.")
+        return response_text
+    except Exception as e:
+        print("Все API-ключи Gemini не сработали.")
+        return f"Ошибка генерации сводки: {e}"
 
 
 async def process_channel(client: TelegramClient, channel_config: dict, target_date: date, prompt_template: str):
@@ -186,6 +179,7 @@ async def process_channel(client: TelegramClient, channel_config: dict, target_d
     return {'channel_name': channel_name, 'text': generated_summary, 'source': 'generated'}
 
 
+@traced('telegram_channel_scraper')
 async def main():
     if not os.path.exists(SESSION_NAME + '.session'):
         print(f"Ошибка: Файл сессии '{SESSION_NAME}.session' не найден.")
@@ -210,33 +204,31 @@ async def main():
         print(f"Целевая дата для поиска сводок: {target_date_for_summaries.strftime('%Y-%m-%d')}")
 
         channels = scraper_config['channels']
-        pause_duration = scraper_config.get('pause_between_channels', 120)
-
-        for i, channel_conf in enumerate(channels):
-            start_time = time.monotonic()
+        # Темп обхода каналов задает квота "telegram" в rate_limits (pipeline_config.json),
+        # FloodWait от Telegram откладывает следующие каналы
+        channel_limiter = key_limiter('telegram', str(app_config['api_id']))
 
+        for channel_conf in channels:
+            await channel_limiter.acquire()
             try:
                 summary_data = await process_channel(client, channel_conf, target_date_for_summaries, prompt_template)
                 all_summaries.append(summary_data)
+                channel_limiter.succeeded()
             except Exception as e:
+                if is_rate_limited(e):
+                    channel_limiter.throttled(e)
                 print(f"Критическая ошибка при обработке канала {channel_conf['name']}: {e}")
                 all_summaries.append({'channel_name': channel_conf['name'], 'text': f"Ошибка обработки: {e}",
                                       'source': 'critical_error'})
 
-            if i < len(channels) - 1:
-                elapsed_time = time.monotonic() - start_time
-                wait_time = max(0, pause_duration - elapsed_time)
-                if wait_time > 0:
-                    print(f"\n--- Пауза на {wait_time:.1f} секунд ---")
-                    await asyncio.sleep(wait_time)
-
         output_dir = scraper_config['output_directory']
         os.makedirs(output_dir, exist_ok=True)
         filename = scraper_config['output_filename_template'].format(
             date_str=target_date_for_summaries.strftime('%Y-%m-%d'))
         output_filepath = os.path.join(output_dir, filename)
 
-        with open(output_filepath, 'w', encoding='utf-8') as f:
+        with span('file.daily_summary', kind='file', path=output_filepath), \
+                open(output_filepath, 'w', encoding='utf-8') as f:
             f.write(f"Итоговая сводка новостей за {target_date_for_summaries.strftime('%d.%m.%Y')}\n")
             f.write("=" * 40 + "\n\n")
             for summary in all_summaries:
@@ -246,6 +238,7 @@ async def main():
                 f.write("=" * 40 + "\n\n")
 
         print(f"\nВсе каналы обработаны. Результат сохранен в файл: {output_filepath}")
+        return output_filepath
 
     except Exception as e:
         print(f"\nПроизошла глобальная ошибка: {e}")
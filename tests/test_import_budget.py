@@ -0,0 +1,83 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import import_budget
+
+'''
+Регрессия холодного старта: ни одна точка входа из cold_start_budget_ms (pipeline_config.json)
+не загружает при импорте тяжелые SDK (см. import_budget.HEAVY_MODULES).
+Проверка детерминирована: бюджеты времени в миллисекундах проверяет только
+python import_budget.py, в тестах они были бы нестабильны.
+
+Неустановленные сторонние пакеты (dotenv, apscheduler, ...) в подпроцессе заменяются заглушками,
+чтобы точки входа проверялись в любом окружении. Тяжелые модули заглушками не заменяются:
+попытка импортировать отсутствующий тяжелый SDK - такая же ошибка, как загрузка установленного.
+'''
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Выполняется в подпроцессе до импорта точки входа: последний в sys.meta_path искатель
+# срабатывает, только если модуль не нашли обычные, и отдает пустой модуль-заглушку
+STUB_MISSING_PACKAGES = f'''
+import os, sys, types, importlib.abc, importlib.machinery
+
+HEAVY_MODULES = {import_budget.HEAVY_MODULES!r}
+REPO_DIR = {REPO_DIR!r}
+
+
+class _Dummy:
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def __call__(self, *args, **kwargs):
+        return _Dummy()
+
+    def __getattr__(self, name):
+        return _Dummy()
+
+
+class _StubModule(types.ModuleType):
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return _Dummy
+
+
+class _StubFinder(importlib.abc.MetaPathFinder, importlib.abc.Loader):
+    def find_spec(self, fullname, path, target=None):
+        if any(fullname == heavy or fullname.startswith(heavy + '.') for heavy in HEAVY_MODULES):
+            return None
+        if os.path.exists(os.path.join(REPO_DIR, fullname.split('.')[0] + '.py')):
+            return None
+        return importlib.machinery.ModuleSpec(fullname, self, is_package=True)
+
+    def create_module(self, spec):
+        return _StubModule(spec.name)
+
+    def exec_module(self, module):
+        pass
+
+
+sys.meta_path.append(_StubFinder())
+'''
+
+
+def load_budgets() -> dict:
+    cwd = os.getcwd()
+    os.chdir(REPO_DIR)
+    try:
+        return import_budget.load_budgets()
+    finally:
+        os.chdir(cwd)
+
+
+@pytest.mark.parametrize('module', list(load_budgets()))
+def test_entry_point_imports_no_heavy_modules(module):
+    result = import_budget.measure_import(module, prelude=STUB_MISSING_PACKAGES)
+    assert 'error' not in result, f"импорт {module} не удался (в т.ч. попытка загрузить тяжелый SDK): {result.get('error')}"
+    assert not result['heavy'], f"{module} при импорте загружает тяжелые зависимости: {result['heavy']}"
+
@@ -0,0 +1,58 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database_manager
+import db_benchmark
+from db_pool import close_all_pools
+
+'''
+Регрессия планов горячих запросов: ни один запрос ежедневного пайплайна
+не должен читать большую таблицу целиком (SCAN в EXPLAIN QUERY PLAN).
+Запросы берутся из констант database_manager - тех же, что выполняют этапы.
+'''
+
+ROWS = 20000
+
+
+@pytest.fixture(scope='module')
+def synthetic_db(tmp_path_factory):
+    db_path = str(tmp_path_factory.mktemp('plans') / 'plans.db')
+    original_db = database_manager.DB_NAME
+    try:
+        db_benchmark.build_synthetic_database(db_path, ROWS)
+        conn = database_manager.get_db_connection()
+        yield conn
+        conn.close()
+    finally:
+        close_all_pools()
+        database_manager.DB_NAME = original_db
+
+
+@pytest.mark.parametrize('name', list(db_benchmark.HOT_QUERIES))
+def test_hot_query_has_no_full_scan(synthetic_db, name):
+    sql, params = db_benchmark.HOT_QUERIES[name]
+    assert db_benchmark.find_full_scans(synthetic_db, sql, params) == []
+
+
+def test_full_scan_is_detected(synthetic_db):
+    assert db_benchmark.find_full_scans(synthetic_db, "SELECT * FROM topics WHERE title = ?", ('x',))
+
+
+def test_covering_index_scan_is_detected(synthetic_db):
+    # Индекс покрывает запрос, но читается целиком - это тот же полный просмотр
+    plans = db_benchmark.find_full_scans(synthetic_db, "SELECT bybit_category_id FROM source_articles", ())
+    assert plans and 'COVERING INDEX' in plans[0]
+
+
+def test_automatic_index_is_detected(synthetic_db):
+    sql = "SELECT t.id FROM topics t JOIN source_articles s ON s.title = t.title"
+    plans = db_benchmark.find_full_scans(synthetic_db, sql, ())
+    assert any('AUTOMATIC' in plan for plan in plans)
+
+
+def test_small_table_alias_is_exempt(synthetic_db):
+    assert db_benchmark.find_full_scans(synthetic_db, "SELECT p.id FROM personas p", ()) == []
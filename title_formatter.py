@@ -4,16 +4,16 @@ import asyncio
 from pathlib import Path
 from typing import Dict, Any, List
 
-import google.generativeai as genai
-from google.generativeai.types import GenerationConfig
 from dotenv import load_dotenv
 
-from database_manager import (
-    get_topics_by_status,
-    get_last_published_titles,
-    update_topic_with_title,
-    update_topic_status
-)
+import async_db
+from database_manager import transition_topics
+from write_buffer import WriteBehindBuffer, WriteBufferError
+from provider_clients import provider_session
+from llm_gateway import generate
+from adaptive_concurrency import max_in_flight
+from key_pool import NoHealthyKeyError, available_keys, key_worker, run_key_workers
+from tracing import traced
 
 '''
 Модуль-редактор, который асинхронно генерирует заголовки для тем.
@@ -54,13 +54,19 @@ def format_titles_for_prompt(titles: list) -> str:
 
 # --- Асинхронная логика ---
 
-async def generate_single_title(topic: Dict, config: Dict, prompt_template: str, api_key: str) -> None:
-    """Асинхронно генерирует и обновляет заголовок для одной темы."""
+def save_titles_batch(batch: List[tuple]):
+    """Сбрасывает пачку результатов из буфера: темы, которые еще 'needs_title', получают новый статус."""
+    transition_topics(batch, expected_status='needs_title', raise_errors=True)
+
+
+async def generate_single_title(topic: Dict, config: Dict, prompt_template: str, api_key: str,
+                                buffer: WriteBehindBuffer) -> None:
+    """Асинхронно генерирует заголовок для одной темы и отправляет результат в буфер записи."""
     topic_id = topic['id']
 
     try:
         # 1. Получаем примеры для промпта
-        few_shot_examples = get_last_published_titles(
+        few_shot_examples = await async_db.get_last_published_titles(
             topic['category'],
             limit=config.get('few_shot_limit', 10)
         )
@@ -73,26 +79,25 @@ async def generate_single_title(topic: Dict, config: Dict, prompt_template: str,
             example_titles=formatted_examples
         )
 
-        # 3. Вызов Gemini API
-        genai.configure(api_key=api_key)
-        model = genai.GenerativeModel(config['gemini_model'])
-        generation_config = GenerationConfig(response_mime_type="application/json")
-
-        response = await model.generate_content_async(contents=final_prompt, generation_config=generation_config)
+        # 3. Вызов Gemini API (клиент ключа берется из реестра)
+        response_data = await generate('gemini', config['gemini_model'], final_prompt,
+                                       api_key=api_key, schema=dict, stage='title_formatter',
+                                       topic_id=topic_id)
 
         # 4. Обработка и обновление в БД
-        response_data = json.loads(response.text)
         new_title = response_data.get('title')
 
         if new_title and isinstance(new_title, str):
-            update_topic_with_title(topic_id, new_title)
+            await buffer.put((topic_id, 'ready_for_planning', {'title': new_title}))
             print(f"     [SUCCESS] Тема ID {topic_id}: сгенерирован заголовок.")
         else:
             raise ValueError("Ответ API не содержит валидного ключа 'title'.")
 
+    except NoHealthyKeyError:
+        raise  # ключ исчерпал квоту - тема не провалена, ее возьмет воркер другого ключа
     except Exception as e:
         print(f"     [ERROR] Тема ID {topic_id}: {e}")
-        update_topic_status(topic_id, 'title_generation_failed')
+        await buffer.put((topic_id, 'title_generation_failed', None))
 
 
 # --- Главная функция для вызова извне ---
@@ -100,6 +105,7 @@ async def async_run_formatter(tasks: List[Dict], config: Dict, prompt_template:
     """Управляет асинхронным выполнением задач."""
     api_key_names = config.get('api_key_names', [])
     api_keys = [os.getenv(key) for key in api_key_names if os.getenv(key)]
+    api_keys = available_keys('gemini', config['gemini_model'], api_keys)  # без исчерпанных за день
     if not api_keys:
         print("     [ERROR] API-ключи не найдены в .env")
         return
@@ -108,25 +114,33 @@ async def async_run_formatter(tasks: List[Dict], config: Dict, prompt_template:
     for task in tasks:
         await task_queue.put(task)
 
-    async def worker(worker_id: int, api_key: str):
-        while not task_queue.empty():
+    def worker(worker_id: str, api_key: str, buffer: WriteBehindBuffer):
+        async def process(topic_task: Dict):
             try:
-                topic_task = task_queue.get_nowait()
                 print(f"     [Worker {worker_id}] Взял в работу тему ID: {topic_task['id']}...")
-                await generate_single_title(topic_task, config, prompt_template, api_key)
-                print(f"     [Worker {worker_id}] Завершил тему ID: {topic_task['id']}. Пауза 2 сек.")
-                await asyncio.sleep(2)  # Пауза для соблюдения лимитов
-            except asyncio.QueueEmpty:
-                break
+                await generate_single_title(topic_task, config, prompt_template, api_key, buffer)
+                # Темп запросов задает квота ключа в rate_limiter (llm_gateway)
+                print(f"     [Worker {worker_id}] Завершил тему ID: {topic_task['id']}.")
+            except NoHealthyKeyError:
+                raise  # тему вернет в очередь key_worker
             except Exception as e:
                 print(f"     [CRITICAL_WORKER_ERROR] Worker {worker_id} упал: {e}")
-
-    workers = [worker(i + 1, api_key) for i, api_key in enumerate(api_keys)]
-    await asyncio.gather(*workers)
-
-
-def run_title_formatter() -> bool:
-    """Основная синхронная обертка для запуска модуля."""
+        return key_worker(worker_id, task_queue, process)
+
+    # На ключ - до max_in_flight воркеров; одновременных запросов - по адаптивному пределу ключа
+    async with WriteBehindBuffer('title_formatter', save_titles_batch) as buffer:
+        left = await run_key_workers(task_queue, [
+            worker(f"{i + 1}.{slot + 1}", api_key, buffer)
+            for i, api_key in enumerate(api_keys) for slot in range(max_in_flight('gemini'))
+        ])
+    if left:
+        print(f"     [WARNING] Нет доступных ключей: {len(left)} тем остались в 'needs_title' "
+              f"до следующего запуска.")
+
+
+@traced()
+async def run_title_formatter_async() -> bool:
+    """Этап целиком в текущем цикле событий (общий асинхронный режим daily_pipeline)."""
     print("  -> Запуск title_formatter.py...")
     load_dotenv(ENV_FILE)
 
@@ -136,19 +150,29 @@ def run_title_formatter() -> bool:
     prompt_template = load_prompt(config['prompt_path'])
     if not prompt_template: return False
 
-    tasks_to_process = get_topics_by_status('needs_title')
+    tasks_to_process = await async_db.get_topics_by_status('needs_title')
     if not tasks_to_process:
         print("     Нет новых тем для генерации заголовков. Пропускаем.")
         return True
 
     print(f"     Найдено {len(tasks_to_process)} тем для обработки. Запуск асинхронной генерации...")
 
-    asyncio.run(async_run_formatter(tasks_to_process, config, prompt_template))
+    try:
+        async with provider_session():
+            await async_run_formatter(tasks_to_process, config, prompt_template)
+    except WriteBufferError as e:
+        print(f"     [DB_ERROR] Заголовки не сохранены: {e}")
+        return False
 
     print("     Генерация заголовков завершена.")
     return True
 
 
+def run_title_formatter() -> bool:
+    """Основная синхронная обертка для запуска модуля: свой цикл событий и свои клиенты."""
+    return asyncio.run(run_title_formatter_async())
+
+
 if __name__ == '__main__':
     print(f"--- Тестовый запуск title_formatter ---")
     if run_title_formatter():
@@ -1,14 +1,17 @@
 import os
-import json
 import asyncio
 from pathlib import Path
 from typing import Dict, List
 
-import google.generativeai as genai
 from dotenv import load_dotenv
-from google.generativeai.types import GenerationConfig
 
-from database_manager import get_db_connection
+import async_db
+from database_manager import TOKEN_MATCHING_TASKS_SQL, db_connection, set_article_tokens_many, unpack_text
+from write_buffer import WriteBehindBuffer, WriteBufferError
+from provider_clients import provider_session
+from llm_gateway import generate
+from key_pool import NoHealthyKeyError
+from tracing import traced
 from alerter import send_admin_alert
 
 # --- Конфигурация ---
@@ -28,71 +31,71 @@ ENV_FILE = '.env'
 
 def get_token_matching_tasks() -> List[Dict]:
     """Возвращает статьи, для которых нужно подобрать токены."""
-    conn = get_db_connection()
-    try:
-        sql = "SELECT id, content FROM generated_articles WHERE matched_tokens IS NULL"
-        cursor = conn.execute(sql)
-        return [dict(row) for row in cursor.fetchall()]
-    finally:
-        if conn:
-            conn.close()
-
-
-def update_article_tokens(article_id: int, tokens: List[str]):
-    """Обновляет список токенов для статьи."""
-    conn = get_db_connection()
-    try:
-        # Сохраняем список как JSON-строку
-        tokens_json = json.dumps(tokens)
-        sql = "UPDATE generated_articles SET matched_tokens = ? WHERE id = ?"
-        conn.execute(sql, (tokens_json, article_id))
-        conn.commit()
-    finally:
-        if conn:
-            conn.close()
+    with db_connection('get_token_matching_tasks') as conn:
+        cursor = conn.execute(TOKEN_MATCHING_TASKS_SQL)
+        return [{'id': row['id'], 'content': unpack_text(row['content'])} for row in cursor.fetchall()]
 
 
 async def match_tokens_for_article(task: Dict, prompt_template: str, token_list_str: str, api_key: str) -> List[str]:
-    """Делает один запрос к AI для подбора токенов."""
+    """
+    Делает один запрос к AI для подбора токенов.
+    NoHealthyKeyError (ключ исчерпал квоту) пробрасывается: статья не получает запасной BTC
+    и остается с matched_tokens IS NULL до следующего запуска.
+    """
     final_prompt = prompt_template.format(
         token_list=token_list_str,
         article_content=task['content']
     )
     try:
-        genai.configure(api_key=api_key)
-        model = genai.GenerativeModel(MODEL_NAME)
-        config = GenerationConfig(response_mime_type="application/json")
-        response = await model.generate_content_async(contents=final_prompt, generation_config=config)
-
-        matched_tokens = json.loads(response.text)
-        if isinstance(matched_tokens, list):
-            return matched_tokens
-        return ["BTC"]  # Возвращаем BTC, если формат ответа некорректный
+        return await generate('gemini', MODEL_NAME, final_prompt, api_key=api_key,
+                              schema=list, stage='token_matcher', article_id=task['id'])
+    except NoHealthyKeyError:
+        raise
     except Exception as e:
-        print(f"     [ERROR] Ошибка API при подборе токенов для статьи ID {task['id']}: {e}. Используем BTC.")
+        print(f"     [ERROR] Ошибка API/JSON при подборе токенов для статьи ID {task['id']}: {e}. Используем BTC.")
         return ["BTC"]  # Запасной вариант при любой ошибке
 
 
+def save_tokens_batch(batch: List[tuple]) -> int:
+    """Сбрасывает пачку (article_id, [токены]) из буфера; ошибка БД уходит буферу на повтор."""
+    return set_article_tokens_many(batch, raise_errors=True)
+
+
 # --- Главная функция ---
 
-async def async_run_matcher(tasks: List[Dict], prompt_template: str, token_list_str: str):
+async def async_run_matcher(tasks: List[Dict], prompt_template: str, token_list_str: str) -> int:
+    """Подбирает токены для статей. Возвращает число статей, отложенных из-за недоступного ключа."""
     load_dotenv(ENV_FILE)
     api_key = os.getenv(API_KEY_NAME)
     if not api_key:
         print(f"     [ERROR] API-ключ {API_KEY_NAME} не найден.")
-        return
-
-    # Асинхронно обрабатываем все задачи
-    async_tasks = [match_tokens_for_article(task, prompt_template, token_list_str, api_key) for task in tasks]
-    results = await asyncio.gather(*async_tasks)
-
-    # Обновляем БД с результатами
-    for task, tokens in zip(tasks, results):
-        update_article_tokens(task['id'], tokens)
+        return 0
+
+    deferred = 0
+
+    async def match_and_buffer(task: Dict, buffer: WriteBehindBuffer):
+        nonlocal deferred
+        try:
+            tokens = await match_tokens_for_article(task, prompt_template, token_list_str, api_key)
+        except NoHealthyKeyError:
+            deferred += 1  # статья остается без токенов до следующего запуска
+            return
+        await buffer.put((task['id'], tokens))
         print(f"     [SUCCESS] Для статьи ID {task['id']} подобраны токены: {tokens}")
 
+    # Асинхронно обрабатываем все задачи, результаты пишутся в БД пачками
+    async with WriteBehindBuffer('token_matcher', save_tokens_batch) as buffer:
+        await asyncio.gather(*(match_and_buffer(task, buffer) for task in tasks))
+    return deferred
+
 
-def run_token_matcher() -> bool:
+@traced()
+async def run_token_matcher_async():
+    """
+    Этап целиком в текущем цикле событий (общий асинхронный режим daily_pipeline).
+    Если ключ исчерпал квоту, возвращает (False, сообщение): этап с политикой WARN,
+    необработанные статьи подберет следующий запуск.
+    """
     print("  -> Запуск token_matcher.py...")
 
     try:
@@ -102,21 +105,35 @@ def run_token_matcher() -> bool:
         print(f"     [ERROR] Не найден необходимый файл: {e}")
         return False
 
-    tasks = get_token_matching_tasks()
+    tasks = await async_db.run_in_db_thread(get_token_matching_tasks)
     if not tasks:
         print("     [INFO] Нет статей для подбора токенов.")
         return True
 
     print(f"     Найдено {len(tasks)} статей для обработки. Запуск...")
 
-    asyncio.run(async_run_matcher(tasks, prompt_template, token_list_str))
+    try:
+        async with provider_session():
+            deferred = await async_run_matcher(tasks, prompt_template, token_list_str)
+    except WriteBufferError as e:
+        print(f"     [DB_ERROR] Токены не сохранены: {e}")
+        return False
+
+    if deferred:
+        message = f"ключ {API_KEY_NAME} недоступен: {deferred} статей ждут подбора токенов до следующего запуска"
+        print(f"     [WARNING] {message[0].upper()}{message[1:]}.")
+        return False, message
 
     print("     Подбор токенов завершен.")
     return True
 
 
+def run_token_matcher():
+    return asyncio.run(run_token_matcher_async())
+
+
 if __name__ == '__main__':
-    if run_token_matcher():
+    if run_token_matcher() is True:
         print("\n--- Модуль Token Matcher успешно завершил работу ---")
     else:
         print("\n--- Работа модуля Token Matcher завершилась с ошибкой ---")
\ No newline at end of file
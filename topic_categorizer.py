@@ -3,21 +3,25 @@ import json
 from pathlib import Path
 from typing import List, Dict, Any
 
-import google.generativeai as genai
-import numpy as np
 from dotenv import load_dotenv
-from sklearn.metrics.pairwise import cosine_similarity
+
+import stage_cache
+from llm_gateway import embed_sync
+from tracing import span, traced
 
 '''
 Модуль анализирует мастер-сводку новостей. Используя векторные представления (эмбеддинги), 
 он определяет и присваивает каждой новости наиболее подходящую техническую категорию, 
 сохраняя результат в JSON-файл для дальнейшей редакционной перебалансировки.
+google.generativeai, numpy и scikit-learn импортируются только при расчете: при попадании
+в кэш этапа (stage_cache.py) они не загружаются.
 '''
 
 # --- КОНФИГУРАЦИЯ ---
 CATEGORIZER_CONFIG_FILE = 'topic_categorizer_config.json'
 SUMMARIZER_CONFIG_FILE = 'summarizer_config.json'
 ENV_FILE = '.env'
+CACHE_VERSION = 1  # увеличить при изменении логики этапа: старые результаты в кэше станут недействительны
 
 
 # --- Вспомогательные функции ---
@@ -58,13 +62,15 @@ def parse_master_summary(filepath: Path) -> List[str]:
     return cleaned_news
 
 
-def get_embeddings(texts: List[str], model_name: str, api_key: str) -> np.ndarray | None:
+def get_embeddings(texts: List[str], model_name: str, api_key: str) -> 'np.ndarray | None':
+    import numpy as np
+
     print(f"     Получение эмбеддингов для {len(texts)} текстов ({model_name})...")
     try:
-        genai.configure(api_key=api_key)
-        result = genai.embed_content(model=model_name, content=texts, task_type="CLUSTERING")
+        embeddings = embed_sync(model_name, texts, api_key=api_key, task_type="CLUSTERING",
+                                stage='topic_categorizer')
         print("     Эмбеддинги успешно получены.")
-        return np.array(result['embedding'])
+        return np.array(embeddings)
     except Exception as e:
         print(f"     [ERROR] при получении эмбеддингов: {e}")
         return None
@@ -90,6 +96,9 @@ def categorize_news(news_items: List[str], config: Dict[str, Any]) -> List[Dict[
     if news_embeddings is None or category_embeddings is None:
         return None
 
+    import numpy as np
+    from sklearn.metrics.pairwise import cosine_similarity
+
     print("     Расчет сходства и присвоение категорий...")
     similarity_matrix = cosine_similarity(news_embeddings, category_embeddings)
     best_category_indices = np.argmax(similarity_matrix, axis=1)
@@ -103,16 +112,17 @@ def categorize_news(news_items: List[str], config: Dict[str, Any]) -> List[Dict[
 
 
 # ---  ФУНКЦИЯ для сохранения результата ---
+def get_output_filepath(date_str: str, config: dict) -> Path:
+    return Path(config['output_directory']) / config['output_filename_template'].format(date_str=date_str)
+
+
 def save_results_to_json(data: List[Dict[str, str]], date_str: str, config: dict) -> bool:
     """Сохраняет категоризированные новости в JSON-файл."""
     try:
-        output_dir = Path(config['output_directory'])
-        filename_template = config['output_filename_template']
-        output_dir.mkdir(parents=True, exist_ok=True)
-        filename = filename_template.format(date_str=date_str)
-        output_filepath = output_dir / filename
+        output_filepath = get_output_filepath(date_str, config)
+        output_filepath.parent.mkdir(parents=True, exist_ok=True)
 
-        with open(output_filepath, 'w', encoding='utf-8') as f:
+        with span('file.json', kind='file', path=str(output_filepath)), open(output_filepath, 'w', encoding='utf-8') as f:
             json.dump(data, f, ensure_ascii=False, indent=2)
 
         print(f"     Результат сохранен в файл: {output_filepath}")
@@ -123,6 +133,7 @@ def save_results_to_json(data: List[Dict[str, str]], date_str: str, config: dict
 
 
 # --- Главная функция для вызова извне ---
+@traced()
 def run_topic_categorizer(target_date: str) -> bool:
     """
     Основная функция-оркестратор.
@@ -139,6 +150,21 @@ def run_topic_categorizer(target_date: str) -> bool:
     input_file = get_input_filepath(target_date, summarizer_config)
     if not input_file: return False
 
+    # Мастер-сводка, категории и модель эмбеддингов не изменились - эмбеддинги не запрашиваем
+    cache_key = stage_cache.compute_input_hash('topic_categorizer', {
+        'version': CACHE_VERSION,
+        'input': stage_cache.file_digest(input_file),
+        'config': categorizer_config,
+    })
+    try:
+        output_file = get_output_filepath(target_date, categorizer_config)
+    except KeyError as e:
+        print(f"     [ERROR] В {CATEGORIZER_CONFIG_FILE} отсутствует ключ: {e}")
+        return False
+    cached = stage_cache.lookup('topic_categorizer', cache_key)
+    if cached and stage_cache.restore_file('topic_categorizer', cached, output_file):
+        return True
+
     news_list = parse_master_summary(input_file)
     if not news_list:
         print("     Нет новостей для категоризации. Пропускаем.")
@@ -147,7 +173,10 @@ def run_topic_categorizer(target_date: str) -> bool:
     categorized_news = categorize_news(news_list, categorizer_config)
     if categorized_news is None: return False
 
-    return save_results_to_json(categorized_news, target_date, categorizer_config)
+    if not save_results_to_json(categorized_news, target_date, categorizer_config):
+        return False
+    stage_cache.store_file('topic_categorizer', cache_key, target_date, output_file)
+    return True
 
 
 if __name__ == '__main__':
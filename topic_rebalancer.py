@@ -1,28 +1,41 @@
 import os
+import re
 import json
 import time
+import hashlib
 import itertools
 import asyncio
 from pathlib import Path
 from typing import List, Dict, Any
-import sqlite3
 
-import google.generativeai as genai
 from dotenv import load_dotenv
-from google.generativeai.types import GenerationConfig
 
-from database_manager import get_db_connection
+import async_db
+import stage_cache
+from database_manager import db_connection, pack_text, get_existing_source_keys, delete_unprocessed_topics
+from write_buffer import WriteBehindBuffer, WriteBufferError
+from provider_clients import provider_session
+from llm_gateway import generate
+from adaptive_concurrency import max_in_flight
+from key_pool import NoHealthyKeyError, available_keys, key_worker, run_key_workers
+from tracing import traced
+from alerter import send_admin_alert
 
 '''
 Модуль выполняет финальную, редакционную категоризацию новостей.
 Использует асинхронный подход для параллельной обработки с помощью 
 нескольких API-ключей Gemini.
+
+Необязательный отсев уже освещенных историй (covered_story_lookup в rebalancer_config.json,
+по умолчанию выключен): новость, похожая на тему последних days дней не меньше чем на
+min_similarity, не попадает в ребалансировку. О каждом отсеве сообщается администратору.
 '''
 
 # --- КОНФИГУРАЦИЯ ---
 REBALANCER_CONFIG_FILE = 'rebalancer_config.json'
 CATEGORIZER_CONFIG_FILE = 'topic_categorizer_config.json'
 ENV_FILE = '.env'
+CACHE_VERSION = 1  # увеличить при изменении логики этапа: старые результаты в кэше станут недействительны
 
 
 # --- Вспомогательные функции (без изменений) ---
@@ -36,13 +49,14 @@ def load_config(config_path: str) -> dict | None:
         return None
 
 
+def get_input_filepath(date_str: str, categorizer_config: dict) -> Path:
+    return Path(categorizer_config['output_directory']) / categorizer_config['output_filename_template'].format(
+        date_str=date_str)
+
+
 def get_input_data(date_str: str, categorizer_config: dict) -> List[Dict[str, str]] | None:
-    # ... (код без изменений)
     try:
-        input_dir = Path(categorizer_config['output_directory'])
-        filename_template = categorizer_config['output_filename_template']
-        filename = filename_template.format(date_str=date_str)
-        filepath = input_dir / filename
+        filepath = get_input_filepath(date_str, categorizer_config)
 
         if not filepath.exists():
             print(f"     [ERROR] Входной файл не найден: {filepath}")
@@ -57,11 +71,42 @@ def get_input_data(date_str: str, categorizer_config: dict) -> List[Dict[str, st
         return None
 
 
+def make_source_key(date_str: str, news_text: str) -> str:
+    """Ключ исходной новости: целевая дата и хеш текста без учета пробелов и регистра."""
+    normalized = re.sub(r'\s+', ' ', news_text).strip().lower()
+    return f"{date_str}:{hashlib.sha1(normalized.encode('utf-8')).hexdigest()[:20]}"
+
+
 def format_stats_to_string(stats_dict: dict) -> str:
     # ... (код без изменений)
     return "\n".join([f"- {key}: {value}" for key, value in stats_dict.items()])
 
 
+# --- ОТСЕВ УЖЕ ОСВЕЩЕННЫХ ИСТОРИЙ ---
+async def drop_covered_stories(initial_data: List[Dict[str, str]], covered_lookup: Dict[str, Any]) -> List[Dict[str, str]]:
+    """
+    Убирает новости, которые уже освещались (см. database_manager.find_covered_topics).
+    Выполняется до расчета дневной цели, чтобы она считалась от оставшихся новостей.
+    Отсеянные новости печатаются и уходят администратору одним алертом.
+    """
+    days = covered_lookup.get('days', 14)
+    min_similarity = covered_lookup.get('min_similarity', 0.6)
+    kept, skipped = [], []
+    for index, news_item in enumerate(initial_data):
+        covered = await async_db.find_covered_topics(news_item['news_text'], days=days, min_similarity=min_similarity)
+        if covered:
+            skipped.append(f"#{index + 1} ~ тема ID {covered[0]['id']} (сходство {covered[0]['similarity']})")
+        else:
+            kept.append(news_item)
+    if skipped:
+        print(f"     Пропущено уже освещенных историй: {len(skipped)} из {len(initial_data)}")
+        for line in skipped:
+            print(f"       {line}")
+        send_admin_alert(f"ℹ️ *Topic Rebalancer:* {len(skipped)} из {len(initial_data)} новостей отсеяны как уже "
+                         f"освещенные (сходство >= {min_similarity} за {days} дн.):\n" + "\n".join(skipped[:20]))
+    return kept
+
+
 # --- НОВАЯ АСИНХРОННАЯ ЛОГИКА РЕБАЛАНСИРОВКИ ---
 async def rebalance_topics(initial_data: List[Dict[str, str]], config: Dict[str, Any]) -> List[Dict[str, str]] | None:
     try:
@@ -69,17 +114,22 @@ async def rebalance_topics(initial_data: List[Dict[str, str]], config: Dict[str,
         model_name = config['gemini_model']
         api_key_names = config['api_key_names']
         target_ratio = config['target_topic_ratio']
+        covered_lookup = config.get('covered_story_lookup', {})
     except KeyError as e:
         print(f"     [ERROR] В {REBALANCER_CONFIG_FILE} отсутствует ключ: {e}")
         return None
 
     prompt_template = prompt_path.read_text(encoding='utf-8')
     api_keys = [os.getenv(key_name) for key_name in api_key_names if os.getenv(key_name)]
+    api_keys = available_keys('gemini', model_name, api_keys)  # без исчерпанных за день
     if not api_keys:
         print(f"     [ERROR] API-ключи не найдены в .env")
         return None
     print(f"     Найдено {len(api_keys)} API-ключей. Запуск асинхронной перебалансировки...")
 
+    if covered_lookup.get('enabled'):
+        initial_data = await drop_covered_stories(initial_data, covered_lookup)
+
     total_news = len(initial_data)
     total_ratio_points = sum(target_ratio.values())
     daily_target_dist = {k: round((v / total_ratio_points) * total_news) for k, v in target_ratio.items()}
@@ -90,21 +140,12 @@ async def rebalance_topics(initial_data: List[Dict[str, str]], config: Dict[str,
     for index, item in enumerate(initial_data):
         await task_queue.put((index, item))
 
-    async def worker(worker_id: int, api_key: str):
-        genai.configure(api_key=api_key)
-        model = genai.GenerativeModel(model_name)
-        generation_config = GenerationConfig(response_mime_type="application/json")
-
-        session_tally = {key: 0 for key in target_ratio.keys()}
-        target_dist_str = format_stats_to_string(daily_target_dist)
-        category_list_str = str(list(target_ratio.keys()))
-
-        while not task_queue.empty():
-            try:
-                index, news_item = task_queue.get_nowait()
-            except asyncio.QueueEmpty:
-                break
+    target_dist_str = format_stats_to_string(daily_target_dist)
+    category_list_str = str(list(target_ratio.keys()))
 
+    def worker(worker_id: str, api_key: str, session_tally: dict, buffer: WriteBehindBuffer):
+        async def process(task: tuple):
+            index, news_item = task
             print(f"     [Worker {worker_id}] Взял в работу новость #{index + 1}...")
 
             session_tally_str = format_stats_to_string(session_tally)
@@ -117,59 +158,82 @@ async def rebalance_topics(initial_data: List[Dict[str, str]], config: Dict[str,
             final_category = news_item['initial_category']
 
             try:
-                response = await model.generate_content_async(contents=final_prompt,
-                                                              generation_config=generation_config)
-                parsed_json = json.loads(response.text)
+                parsed_json = await generate('gemini', model_name, final_prompt, api_key=api_key,
+                                             schema=dict, stage='topic_rebalancer', worker=worker_id,
+                                             item=index)
                 candidate_category = parsed_json.get("final_category")
                 if candidate_category in target_ratio:
                     final_category = candidate_category
+            except NoHealthyKeyError:
+                raise  # ключ исчерпал квоту: key_worker вернет новость в очередь для другого ключа
             except Exception as e:
                 print(
                     f"       [Worker {worker_id}] Ошибка API/JSON для новости #{index + 1}: {e}. Используем исходную категорию.")
 
-            results.append({'news_text': news_item['news_text'], 'category': final_category, 'original_index': index})
-            session_tally[final_category] += 1
+            result = {'news_text': news_item['news_text'], 'category': final_category, 'original_index': index,
+                      'source_key': news_item.get('source_key')}
+            results.append(result)
+            await buffer.put(result)
+            # Исходная категория категоризатора может не входить в target_ratio (например, 'copy trading')
+            session_tally[final_category] = session_tally.get(final_category, 0) + 1
 
-            print(f"     [Worker {worker_id}] Завершил новость #{index + 1}. Пауза 2 сек...")
-            await asyncio.sleep(2)  # <--- НАШ ПРЕДОХРАНИТЕЛЬ
+            # Темп запросов задает квота ключа в rate_limiter (llm_gateway), а не пауза воркера
+            print(f"     [Worker {worker_id}] Завершил новость #{index + 1}.")
 
-    workers = [worker(i + 1, api_key) for i, api_key in enumerate(api_keys)]
-    await asyncio.gather(*workers)
+        return key_worker(worker_id, task_queue, process)
+
+    # Темы пишутся в БД пачками по мере готовности, а не одним INSERT в конце:
+    # при падении теряется не больше одной пачки
+    # На ключ - до max_in_flight воркеров, сколько из них работает одновременно, решает
+    # адаптивный предел ключа в llm_gateway. Счетчик сессии по-прежнему один на ключ.
+    try:
+        async with WriteBehindBuffer('topic_rebalancer', save_topics_batch) as buffer:
+            workers = []
+            for i, api_key in enumerate(api_keys):
+                session_tally = {key: 0 for key in target_ratio.keys()}
+                workers.extend(worker(f"{i + 1}.{slot + 1}", api_key, session_tally, buffer)
+                               for slot in range(max_in_flight('gemini')))
+            left = await run_key_workers(task_queue, workers)
+
+            # Все ключи недоступны: оставшиеся новости сохраняются с исходной категорией, как при ошибке API
+            if left:
+                print(f"     [WARNING] Нет доступных ключей: {len(left)} новостей сохраняются "
+                      f"с исходной категорией.")
+            for index, news_item in left:
+                result = {'news_text': news_item['news_text'], 'category': news_item['initial_category'],
+                          'original_index': index, 'source_key': news_item.get('source_key')}
+                results.append(result)
+                await buffer.put(result)
+    except WriteBufferError as e:
+        print(f"     [DB_ERROR] Не удалось сохранить темы в БД: {e}")
+        return None
 
     # Сортируем результаты, чтобы они были в исходном порядке
     results.sort(key=lambda x: x['original_index'])
-    print("     Асинхронная перебалансировка завершена.")
+    print(f"     Асинхронная перебалансировка завершена. Добавлено {len(results)} тем со статусом 'needs_title'.")
     return results
 
 
 # --- Функция сохранения в БД  ---
-def save_topics_to_db(rebalanced_data: List[Dict[str, str]]) -> bool:
-
-    if not rebalanced_data:
-        print("     Нет данных для сохранения в БД.")
-        return True
+def save_topics_batch(batch: List[Dict[str, str]]):
+    """
+    Сбрасывает пачку тем из буфера записи одной транзакцией.
+    Тема с уже сохраненным source_key пропускается (повторный запуск после сбоя).
+    Ошибки БД не перехватываются: буфер повторяет пачку и при неудаче завершает этап ошибкой.
+    """
     to_insert = [
-        (item['category'], 'needs_title', item['news_text'])
-        for item in rebalanced_data
+        (item['category'], 'needs_title', pack_text(item['news_text']), item.get('source_key'))
+        for item in batch
     ]
-    try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        sql = "INSERT INTO topics (category, status, source_news_text) VALUES (?, ?, ?)"
-        cursor.executemany(sql, to_insert)
-        conn.commit()
-        print(f"     Успешно добавлено {cursor.rowcount} тем в базу данных со статусом 'needs_title'.")
-        return True
-    except sqlite3.Error as e:
-        print(f"     [DB_ERROR] Ошибка при сохранении тем в БД: {e}")
-        return False
-    finally:
-        if conn:
-            conn.close()
+    sql = "INSERT OR IGNORE INTO topics (category, status, source_news_text, source_key) VALUES (?, ?, ?, ?)"
+    with db_connection('save_topics_batch', write=True) as conn:
+        conn.executemany(sql, to_insert)
 
 
 # --- Главная функция, адаптированная для вызова async ---
-def run_topic_rebalancer(target_date: str) -> bool:
+@traced()
+async def run_topic_rebalancer_async(target_date: str) -> bool:
+    """Этап целиком в текущем цикле событий (общий асинхронный режим daily_pipeline)."""
     print("  -> Запуск topic_rebalancer.py...")
     load_dotenv(ENV_FILE)
 
@@ -177,18 +241,77 @@ def run_topic_rebalancer(target_date: str) -> bool:
     categorizer_config = load_config(CATEGORIZER_CONFIG_FILE)
     if not rebalancer_config or not categorizer_config: return False
 
+    # Результат этапа - темы в БД; в кэше хранятся их source_key
+    try:
+        input_file = get_input_filepath(target_date, categorizer_config)
+    except KeyError as e:
+        print(f"     [ERROR] В {CATEGORIZER_CONFIG_FILE} отсутствует ключ: {e}")
+        return False
+    cache_key = stage_cache.compute_input_hash('topic_rebalancer', {
+        'version': CACHE_VERSION,
+        'date': target_date,
+        'input': stage_cache.file_digest(input_file),
+        'prompt': stage_cache.file_digest(rebalancer_config.get('prompt_path', '')),
+        'config': rebalancer_config,
+    })
+    if await reuse_cached_topics(target_date, cache_key):
+        return True
+
     initial_news_data = get_input_data(target_date, categorizer_config)
     if initial_news_data is None: return False
     if not initial_news_data:
         print("     Нет данных для ребалансировки. Пропускаем.")
         return True
 
-    # Запускаем асинхронную функцию
-    rebalanced_news = asyncio.run(rebalance_topics(initial_news_data, rebalancer_config))
+    # Новости, темы которых сохранены прошлым (прерванным) запуском, повторно не обрабатываем
+    for item in initial_news_data:
+        item['source_key'] = make_source_key(target_date, item['news_text'])
+    saved_keys = await async_db.run_in_db_thread(
+        get_existing_source_keys, [item['source_key'] for item in initial_news_data])
+    rebalanced_news = []
+    if saved_keys:
+        initial_news_data = [item for item in initial_news_data if item['source_key'] not in saved_keys]
+        print(f"     Уже сохранено прошлым запуском: {len(saved_keys)}, осталось обработать: {len(initial_news_data)}.")
+
+    if initial_news_data:
+        # Темы сохраняются в БД по ходу работы
+        async with provider_session():
+            rebalanced_news = await rebalance_topics(initial_news_data, rebalancer_config)
+        if rebalanced_news is None:
+            return False
+
+    topic_keys = sorted(saved_keys | {item['source_key'] for item in rebalanced_news})
+    await async_db.run_in_db_thread(stage_cache.store_value, 'topic_rebalancer', cache_key, target_date, topic_keys)
+    return True
+
+
+async def reuse_cached_topics(target_date: str, cache_key: str) -> bool:
+    """
+    True, если с этими входами этап уже выполнялся и его темы на месте.
+    Если входы за дату изменились, темы прошлого результата, еще не получившие заголовок,
+    удаляются - этап создаст их заново. Темы, ушедшие дальше по конвейеру, остаются.
+    """
+    cached = await async_db.run_in_db_thread(stage_cache.lookup, 'topic_rebalancer', cache_key)
+    if cached:
+        topic_keys = stage_cache.load_value('topic_rebalancer', cached)
+        if topic_keys is not None:
+            existing = await async_db.run_in_db_thread(get_existing_source_keys, topic_keys)
+            if len(existing) == len(topic_keys):
+                await async_db.run_in_db_thread(stage_cache.mark_hit, 'topic_rebalancer', cached)
+                return True
+        return False
+
+    previous = await async_db.run_in_db_thread(stage_cache.previous_entry, 'topic_rebalancer', target_date)
+    if previous and previous['input_hash'] != cache_key:
+        old_keys = stage_cache.load_value('topic_rebalancer', previous) or []
+        deleted = await async_db.run_in_db_thread(delete_unprocessed_topics, old_keys)
+        print(f"     [CACHE] Входы этапа за {target_date} изменились: удалено {deleted} из {len(old_keys)} "
+              f"тем прошлого результата, еще не получивших заголовок.")
+    return False
 
-    if rebalanced_news is None: return False
 
-    return save_topics_to_db(rebalanced_news)
+def run_topic_rebalancer(target_date: str) -> bool:
+    return asyncio.run(run_topic_rebalancer_async(target_date))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,401 @@
+import json
+import time
+import uuid
+import atexit
+import inspect
+import argparse
+import functools
+import threading
+import contextvars
+from pathlib import Path
+from contextlib import contextmanager
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+
+'''
+Легковесная трассировка конвейера: спаны с началом, длительностью, атрибутами и вложенностью.
+Текущий спан хранится в contextvar, поэтому вложенность сохраняется и в asyncio-задачах,
+и в потоках, запущенных через asyncio.to_thread / copy_context().run.
+В дочерний процесс трасса передается явно: current_trace_context() -> continue_trace().
+
+Виды спанов (kind): run - прогон daily_pipeline, stage - этап графа, func - точка входа run_*,
+llm - один запрос к модели, db - одно обращение к БД, file - запись файла.
+
+Законченные спаны дописываются в traces/YYYY-MM-DD.jsonl (дата старта корня трассы), одна строка на спан.
+Настройки в pipeline_config.json:
+    "tracing_enabled": true      - выключение делает span() пустым блоком
+    "tracing_dir": "traces"      - каталог файлов
+    "trace_db_queries": true     - спаны на каждое соединение с БД (самые частые); пишутся только
+                                   внутри трассы: разовые вызовы из CLI и бенчмарков трасс не создают
+
+Использование:
+    with span('llm.gemini', kind='llm', model=model_name) as s:
+        response = await model.generate_content_async(prompt)
+        s.set(chars=len(response.text))
+
+    @traced(kind='func')
+    def run_news_summarizer(target_date): ...
+
+Отчеты:
+    python tracing.py runs [--date D]                 # прогоны за день
+    python tracing.py waterfall [--trace ID] [--date D] [--min-ms 50]
+    python tracing.py compare [--days 7] [--kind stage]
+'''
+
+PIPELINE_CONFIG_FILE = 'pipeline_config.json'
+DEFAULT_TRACE_DIR = 'traces'
+
+_current_span = contextvars.ContextVar('trace_span', default=None)
+_settings = None
+_writer_lock = threading.Lock()
+_open_files = {}
+
+
+def _load_settings() -> dict:
+    global _settings
+    if _settings is None:
+        try:
+            with open(PIPELINE_CONFIG_FILE, 'r', encoding='utf-8') as f:
+                config = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            config = {}
+        _settings = {
+            'enabled': config.get('tracing_enabled', True),
+            'dir': config.get('tracing_dir', DEFAULT_TRACE_DIR),
+            'db': config.get('trace_db_queries', True),
+        }
+    return _settings
+
+
+def tracing_enabled(kind: str | None = None) -> bool:
+    settings = _load_settings()
+    if kind == 'db':
+        return settings['enabled'] and settings['db']
+    return settings['enabled']
+
+
+class Span:
+    """Открытый спан. Атрибуты можно дополнять до выхода из блока через set()."""
+
+    __slots__ = ('trace_id', 'span_id', 'parent_id', 'name', 'kind', 'attrs', 'status', 'error',
+                 'started_at', 'day', '_t0')
+
+    def __init__(self, name: str, kind: str, attrs: dict, parent: 'Span | None'):
+        self.trace_id = parent.trace_id if parent else uuid.uuid4().hex[:16]
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent.span_id if parent else None
+        self.name = name
+        self.kind = kind
+        self.attrs = attrs
+        self.status = 'ok'
+        self.error = None
+        self.started_at = time.time()
+        # Вся трасса пишется в файл дня своего корня, даже если прогон перешел через полночь
+        self.day = parent.day if parent else datetime.fromtimestamp(self.started_at).strftime('%Y-%m-%d')
+        self._t0 = time.perf_counter()
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def fail(self, error: str):
+        """Помечает спан ошибочным без исключения (например, этап вернул False)."""
+        self.status = 'error'
+        self.error = error
+
+    def to_record(self, duration_ms: float) -> dict:
+        return {
+            'trace': self.trace_id, 'id': self.span_id, 'parent': self.parent_id,
+            'name': self.name, 'kind': self.kind,
+            'start': round(self.started_at, 6), 'ms': round(duration_ms, 3),
+            'status': self.status, 'error': self.error, 'attrs': self.attrs,
+        }
+
+
+class _NoopSpan:
+    trace_id = span_id = day = None
+
+    def set(self, **attrs):
+        pass
+
+    def fail(self, error: str):
+        pass
+
+
+_NOOP = _NoopSpan()
+
+
+def current_span() -> Span | None:
+    return _current_span.get()
+
+
+def current_trace_id() -> str | None:
+    span_ = _current_span.get()
+    return span_.trace_id if span_ else None
+
+
+def _trace_file(day: str):
+    handle = _open_files.get(day)
+    if handle is None:
+        directory = Path(_load_settings()['dir'])
+        directory.mkdir(parents=True, exist_ok=True)
+        # Построчная буферизация: при падении процесса теряется не больше одного спана
+        handle = open(directory / f"{day}.jsonl", 'a', encoding='utf-8', buffering=1)
+        _open_files[day] = handle
+    return handle
+
+
+def _write(day: str, record: dict):
+    line = json.dumps(record, ensure_ascii=False, default=str)
+    try:
+        with _writer_lock:
+            _trace_file(day).write(line + "\n")
+    except OSError as e:
+        print(f"     [WARNING] Не удалось записать спан {record['name']}: {e}")
+
+
+@atexit.register
+def _close_files():
+    with _writer_lock:
+        for handle in _open_files.values():
+            handle.close()
+        _open_files.clear()
+
+
+@contextmanager
+def span(name: str, kind: str = 'func', **attrs):
+    """
+    Открывает дочерний спан текущего (или корневой, если трассы нет).
+    Исключение из блока помечает спан ошибочным и пробрасывается дальше.
+    """
+    # Корневой спан БД - разовый вызов вне прогона (CLI, db_benchmark): в трассы его не пишем
+    if not tracing_enabled(kind) or (kind == 'db' and _current_span.get() is None):
+        yield _NOOP
+        return
+
+    current = Span(name, kind, attrs, _current_span.get())
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.fail(f"{type(e).__name__}: {e}")
+        raise
+    finally:
+        _current_span.reset(token)
+        _write(current.day, current.to_record((time.perf_counter() - current._t0) * 1000))
+
+
+def traced(name: str | None = None, kind: str = 'func'):
+    """Декоратор: вызов функции (обычной или корутинной) целиком оборачивается в спан."""
+    def decorator(func):
+        span_name = name or func.__name__
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(span_name, kind) as current:
+                    result = await func(*args, **kwargs)
+                    if result is False:
+                        current.fail("вернула False")
+                    return result
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(span_name, kind) as current:
+                result = func(*args, **kwargs)
+                if result is False:
+                    current.fail("вернула False")
+                return result
+        return wrapper
+    return decorator
+
+
+def current_trace_context() -> dict | None:
+    """Ссылка на текущий спан, которую можно передать в другой процесс (см. continue_trace)."""
+    current = _current_span.get()
+    if current is None:
+        return None
+    return {'trace': current.trace_id, 'span': current.span_id, 'day': current.day}
+
+
+class _RemoteParent:
+    """Спан другого процесса: только идентификаторы, чтобы новые спаны стали его потомками."""
+
+    def __init__(self, context: dict):
+        self.trace_id = context['trace']
+        self.span_id = context['span']
+        self.day = context['day']
+
+
+@contextmanager
+def continue_trace(context: dict | None):
+    """Продолжает в дочернем процессе трассу, открытую в родительском."""
+    if context is None:
+        yield
+        return
+    token = _current_span.set(_RemoteParent(context))
+    try:
+        yield
+    finally:
+        _current_span.reset(token)
+
+
+def run_in_context(func):
+    """Оборачивает func для запуска в пуле потоков с текущим контекстом (и текущим спаном)."""
+    context = contextvars.copy_context()
+    return functools.partial(context.run, func)
+
+
+# --- Отчеты ---
+
+def load_spans(days: list[str]) -> list[dict]:
+    directory = Path(_load_settings()['dir'])
+    spans = []
+    for day in days:
+        path = directory / f"{day}.jsonl"
+        if not path.exists():
+            continue
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    spans.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue  # строка, оборванная при аварийном завершении
+    return spans
+
+
+def list_runs(spans: list[dict]) -> list[dict]:
+    return sorted((s for s in spans if s['kind'] == 'run'), key=lambda s: s['start'])
+
+
+def print_runs(day: str):
+    runs = list_runs(load_spans([day]))
+    if not runs:
+        print(f"     [INFO] За {day} прогонов в трассах нет.")
+        return
+    print(f"\n  Прогоны за {day}:")
+    for run in runs:
+        started = datetime.fromtimestamp(run['start']).strftime('%H:%M:%S')
+        target = run['attrs'].get('target_date', '-')
+        print(f"     {run['trace']}  {started}  {run['ms'] / 1000:8.1f} с  {run['status']:<6} цель: {target}")
+
+
+def print_waterfall(spans: list[dict], trace_id: str, min_ms: float = 0.0, width: int = 40):
+    """Дерево спанов трассы с полосами относительно начала корня. Короткие спаны сворачиваются в счетчик."""
+    trace = [s for s in spans if s['trace'] == trace_id]
+    if not trace:
+        print(f"     [ERROR] Трасса {trace_id} не найдена.")
+        return
+    ids = {s['id'] for s in trace}
+    children = defaultdict(list)
+    for s in trace:
+        # Родитель мог не записаться (процесс упал) - такие спаны показываем на верхнем уровне
+        children[s['parent'] if s['parent'] in ids else None].append(s)
+    for group in children.values():
+        group.sort(key=lambda s: s['start'])
+
+    roots = children[None]
+    origin = min(s['start'] for s in roots)
+    total_ms = max(max(s['start'] + s['ms'] / 1000 for s in roots) - origin, 1e-6) * 1000
+    print(f"\n  Трасса {trace_id}: {total_ms / 1000:.1f} с, спанов: {len(trace)}")
+
+    def bar(s: dict) -> str:
+        offset = int((s['start'] - origin) * 1000 / total_ms * width)
+        length = max(1, int(s['ms'] / total_ms * width))
+        return (' ' * offset + '█' * length)[:width].ljust(width)
+
+    def show(s: dict, depth: int):
+        label = ('  ' * depth + s['name'])[:44]
+        mark = '' if s['status'] == 'ok' else f"  ✗ {s['error'] or ''}"[:80]
+        print(f"     {label:<44} {(s['start'] - origin):8.2f} {s['ms'] / 1000:8.2f}  |{bar(s)}|{mark}")
+        hidden = defaultdict(lambda: [0, 0.0])
+        for child in children[s['id']]:
+            if child['ms'] < min_ms and not children[child['id']] and child['status'] == 'ok':
+                hidden[child['name']][0] += 1
+                hidden[child['name']][1] += child['ms']
+                continue
+            show(child, depth + 1)
+        for child_name, (count, spent) in sorted(hidden.items(), key=lambda item: -item[1][1]):
+            print(f"     {'  ' * (depth + 1)}· {child_name} ×{count} (суммарно {spent / 1000:.2f} с)")
+
+    print(f"     {'Спан':<44} {'Старт, с':>8} {'Длит., с':>8}")
+    for root in roots:
+        show(root, 0)
+
+
+def percentile(values: list[float], share: float) -> float:
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, max(0, round(share * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def print_comparison(days: list[str], kind: str = 'stage'):
+    """
+    Длительности спанов вида kind по дням: медиана за каждый день, p50/p95 за весь период
+    и пометка, если последний день вышел за p95 периода.
+    """
+    by_name = defaultdict(lambda: defaultdict(list))
+    for day in days:
+        for s in load_spans([day]):
+            if s['kind'] == kind:
+                by_name[s['name']][day].append(s['ms'] / 1000)
+    if not by_name:
+        print(f"     [INFO] Спанов вида {kind} за период нет.")
+        return
+
+    shown_days = [day for day in days if any(day in per_day for per_day in by_name.values())]
+    header = " ".join(f"{day[5:]:>8}" for day in shown_days)
+    print(f"\n  Длительность спанов '{kind}' по дням (медиана за день, сек):")
+    print(f"     {'Спан':<30} {header} {'p50':>8} {'p95':>8} {'n':>5}")
+    for name in sorted(by_name):
+        per_day = by_name[name]
+        values = [value for day_values in per_day.values() for value in day_values]
+        p50, p95 = percentile(values, 0.5), percentile(values, 0.95)
+        cells = " ".join(f"{percentile(per_day[day], 0.5):8.2f}" if per_day.get(day) else f"{'-':>8}"
+                         for day in shown_days)
+        last = per_day.get(shown_days[-1])
+        flag = "  ⚠ медленнее p95" if last and len(values) > len(last) and percentile(last, 0.5) > p95 else ""
+        print(f"     {name[:30]:<30} {cells} {p50:8.2f} {p95:8.2f} {len(values):5d}{flag}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Отчеты по трассам конвейера.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    runs_parser = subparsers.add_parser('runs', help="список прогонов за день")
+    runs_parser.add_argument('--date', default=date.today().strftime('%Y-%m-%d'))
+
+    waterfall_parser = subparsers.add_parser('waterfall', help="дерево спанов одного прогона")
+    waterfall_parser.add_argument('--date', default=date.today().strftime('%Y-%m-%d'),
+                                  help="день файла трассы (по умолчанию - сегодня)")
+    waterfall_parser.add_argument('--trace', help="id трассы (по умолчанию - последний прогон дня)")
+    waterfall_parser.add_argument('--min-ms', type=float, default=50.0,
+                                  help="спаны короче сворачиваются в счетчик (по умолчанию 50 мс)")
+
+    compare_parser = subparsers.add_parser('compare', help="p50/p95 длительностей по дням")
+    compare_parser.add_argument('--days', type=int, default=7)
+    compare_parser.add_argument('--kind', default='stage', choices=['run', 'stage', 'func', 'llm', 'db', 'file'])
+    args = parser.parse_args()
+
+    if args.command == 'runs':
+        print_runs(args.date)
+    elif args.command == 'waterfall':
+        spans = load_spans([args.date])
+        trace_id = args.trace
+        if trace_id is None:
+            runs = list_runs(spans)
+            if not runs:
+                print(f"     [ERROR] За {args.date} прогонов в трассах нет. Укажите --trace.")
+                return
+            trace_id = runs[-1]['trace']
+        print_waterfall(spans, trace_id, min_ms=args.min_ms)
+    else:
+        today = date.today()
+        days = [(today - timedelta(days=offset)).strftime('%Y-%m-%d') for offset in range(args.days - 1, -1, -1)]
+        print_comparison(days, kind=args.kind)
+
+
+if __name__ == '__main__':
+    main()
@@ -2,7 +2,6 @@ import os
 import subprocess
 import time
 import requests
-import pyautogui
 from dotenv import load_dotenv
 
 from alerter import send_admin_alert
@@ -11,14 +10,15 @@ from alerter import send_admin_alert
 Модуль для управления VPN-соединением через ProtonVPN.
 Использует команды CLI для запуска/остановки и pyautogui для взаимодействия с GUI.
 Включает проверку IP для подтверждения статуса соединения.
+
+pyautogui (вместе с OpenCV) импортируется внутри функций подключения и отключения:
+без графической сессии он падает уже при импорте, а модуль импортируется и там, где GUI не нужен.
 '''
 
 # --- Конфигурация ---
-load_dotenv()
 PROTON_VPN_PATH = r"C:\Program Files\Proton\VPN\ProtonVPN.Launcher.exe"
 CONNECT_BUTTON_IMG = 'connect_button.png'
 DISCONNECT_BUTTON_IMG = 'disconnect_button.png'
-HOME_IP = os.getenv("HOME_IP_ADDRESS")
 IP_CHECK_SERVICES = [
     "https://api.ipify.org",
     "https://ipinfo.io/ip",
@@ -28,6 +28,12 @@ IP_CHECK_SERVICES = [
 
 # --- Вспомогательные функции ---
 
+def get_home_ip() -> str | None:
+    """Домашний IP из .env (читается при вызове, а не при импорте модуля)."""
+    load_dotenv()
+    return os.getenv("HOME_IP_ADDRESS")
+
+
 def get_current_ip() -> str | None:
     """Пытается получить текущий IP, перебирая несколько сервисов."""
     for service in IP_CHECK_SERVICES:
@@ -43,6 +49,8 @@ def get_current_ip() -> str | None:
 # --- Основные функции ---
 
 def connect_vpn() -> bool:
+    import pyautogui
+
     print("  -> Запуск vpn_manager.py (подключение)...")
 
     # 1. Запуск приложения
@@ -96,7 +104,7 @@ def connect_vpn() -> bool:
         send_admin_alert(f"🔥 *Критический сбой VPN:*\n{message}")
         return False
 
-    if current_ip == HOME_IP:
+    if current_ip == get_home_ip():
         message = f"VPN не подключился. Текущий IP ({current_ip}) совпадает с домашним."
         print(f"     [ERROR] {message}")
         send_admin_alert(f"🔥 *Критический сбой VPN:*\n{message}")
@@ -107,6 +115,8 @@ def connect_vpn() -> bool:
 
 
 def disconnect_vpn():
+    import pyautogui
+
     print("  -> Запуск vpn_manager.py (отключение)...")
 
     # --- Попытка №1: Отключение через GUI (pyautogui) ---
@@ -124,8 +134,9 @@ def disconnect_vpn():
 
     # --- Шаг 2: Проверка IP после первой попытки ---
     print("     Шаг 2/4: Проверка IP-адреса...")
+    home_ip = get_home_ip()
     current_ip = get_current_ip()
-    if current_ip == HOME_IP:
+    if current_ip == home_ip:
         print(f"     [SUCCESS] VPN успешно отключен (метод GUI). Текущий IP: {current_ip}")
         # Принудительно закроем приложение для чистоты
         subprocess.run(["taskkill", "/F", "/IM", "ProtonVPN.exe"], check=False, capture_output=True)
@@ -142,7 +153,7 @@ def disconnect_vpn():
         time.sleep(30)
 
         final_ip = get_current_ip()
-        if final_ip == HOME_IP:
+        if final_ip == home_ip:
             print(f"     [SUCCESS] VPN успешно отключен (метод CLI). Текущий IP: {final_ip}")
         else:
             print(f"     [WARNING] VPN отключен, но IP ({final_ip}) все еще не совпадает с домашним.")
@@ -154,7 +165,7 @@ def disconnect_vpn():
 if __name__ == '__main__':
     # --- Тестовый блок ТОЛЬКО для отключения ---
     print("--- Тестовый запуск ТОЛЬКО функции отключения VPN ---")
-    if not HOME_IP:
+    if not get_home_ip():
         print("!!! ВНИМАНИЕ: Для теста необходимо добавить HOME_IP_ADDRESS в ваш .env файл !!!")
     else:
         disconnect_vpn()
\ No newline at end of file
@@ -0,0 +1,183 @@
+import json
+import time
+import asyncio
+import statistics
+from typing import Any, Awaitable, Callable
+
+from async_db import run_in_db_thread
+from db_pool import DB_CONFIG_FILE
+
+'''
+Буфер отложенной записи для асинхронных воркеров.
+Воркеры кладут результаты в буфер, а он сбрасывает их в БД пачкой (одной транзакцией
+через пакетные хелперы database_manager), как только накопится max_items записей
+или пройдет max_delay_ms с первой записи в пачке - что наступит раньше.
+При закрытии буфер сбрасывает остаток, поэтому при падении теряется не больше одной пачки.
+Пачка, которую не удалось записать, повторяется до retries раз (пауза retry_delay_ms, удваивается);
+если записать ее так и не вышло, выход из async with бросает WriteBufferError - этап
+должен завершиться ошибкой, а не молча потерять результаты.
+
+Использование:
+    async with WriteBehindBuffer('title_formatter', flush_titles) as buffer:
+        await buffer.put(item)
+
+flush_func должна бросать исключение при ошибке записи (хелперы database_manager - с raise_errors=True).
+'''
+
+DEFAULT_BUFFER_SETTINGS = {
+    "max_items": 20,
+    "max_delay_ms": 500,
+    "retries": 3,
+    "retry_delay_ms": 200
+}
+
+
+def load_buffer_settings() -> dict:
+    settings = dict(DEFAULT_BUFFER_SETTINGS)
+    try:
+        with open(DB_CONFIG_FILE, 'r', encoding='utf-8') as f:
+            settings.update(json.load(f).get('write_buffer', {}))
+    except (FileNotFoundError, json.JSONDecodeError):
+        pass
+    return settings
+
+
+class WriteBufferError(RuntimeError):
+    """Пачки не удалось записать и после повторов: записи из них потеряны."""
+
+
+class WriteBehindBuffer:
+    """
+    Накопитель записей с фоновым сбросом.
+    flush_func - синхронная функция, принимающая список записей (выполняется в потоке БД).
+    on_flushed - необязательная корутина (пачка, результат flush_func), вызывается после
+    успешного коммита пачки в порядке сброса - например, чтобы передать записи следующему этапу.
+    """
+
+    def __init__(self, name: str, flush_func: Callable[[list], Any],
+                 max_items: int | None = None, max_delay_ms: int | None = None,
+                 on_flushed: Callable[[list, Any], Awaitable[Any]] | None = None):
+        settings = load_buffer_settings()
+        self.name = name
+        self.flush_func = flush_func
+        self.on_flushed = on_flushed
+        self.max_items = max_items or settings['max_items']
+        self.max_delay = (max_delay_ms or settings['max_delay_ms']) / 1000
+        self.retries = settings['retries']
+        self.retry_delay = settings['retry_delay_ms'] / 1000
+
+        self._items = []
+        self._has_items = asyncio.Event()
+        self._is_full = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._flusher = None
+        self._closed = False
+
+        # --- Метрики ---
+        self.batch_sizes = []
+        self.flush_latencies_ms = []
+        self.failed_batches = 0
+        self.failed_items = 0
+
+    async def __aenter__(self):
+        self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+        if self.failed_batches and exc_type is None:
+            raise WriteBufferError(f"{self.name}: не записано {self.failed_items} записей "
+                                   f"в {self.failed_batches} пачках")
+
+    def start(self):
+        if self._flusher is None:
+            self._flusher = asyncio.create_task(self._flush_loop())
+
+    async def put(self, item):
+        """Добавляет запись в буфер. Сам сброс выполняется в фоне."""
+        if self._closed:
+            raise RuntimeError(f"Буфер {self.name} уже закрыт.")
+        self._items.append(item)
+        self._has_items.set()
+        if len(self._items) >= self.max_items:
+            self._is_full.set()
+
+    async def _flush_loop(self):
+        while not self._closed:
+            await self._has_items.wait()
+            if self._closed:
+                break
+            try:
+                await asyncio.wait_for(self._is_full.wait(), timeout=self.max_delay)
+            except asyncio.TimeoutError:
+                pass
+            await self.flush()
+
+    async def flush(self):
+        """Сбрасывает накопленные записи одной пачкой."""
+        async with self._flush_lock:
+            batch, self._items = self._items, []
+            self._has_items.clear()
+            self._is_full.clear()
+            if not batch:
+                return
+
+            start = time.perf_counter()
+            try:
+                for attempt in range(self.retries + 1):
+                    try:
+                        result = await run_in_db_thread(self.flush_func, batch)
+                        break
+                    except Exception as e:
+                        if attempt == self.retries:
+                            self.failed_batches += 1
+                            self.failed_items += len(batch)
+                            print(f"     [WRITE_BUFFER_ERROR] {self.name}: не удалось записать пачку из "
+                                  f"{len(batch)} записей после {self.retries + 1} попыток: {e}")
+                            return
+                        print(f"     [WARNING] {self.name}: ошибка записи пачки ({e}), повтор {attempt + 1}/{self.retries}")
+                        await asyncio.sleep(self.retry_delay * 2 ** attempt)
+            finally:
+                self.flush_latencies_ms.append((time.perf_counter() - start) * 1000)
+                self.batch_sizes.append(len(batch))
+
+            if self.on_flushed is not None:
+                try:
+                    await self.on_flushed(batch, result)
+                except Exception as e:
+                    print(f"     [WRITE_BUFFER_ERROR] {self.name}: ошибка обработчика после записи пачки: {e}")
+
+    async def close(self):
+        """Финальный сброс и остановка фоновой задачи."""
+        if self._closed:
+            return
+        self._closed = True
+        if self._flusher is not None:
+            # Будим цикл, где бы он ни ждал, чтобы он завершился
+            self._has_items.set()
+            self._is_full.set()
+            await self._flusher
+        await self.flush()
+        self.print_metrics()
+
+    def get_metrics(self) -> dict:
+        latencies = sorted(self.flush_latencies_ms)
+        return {
+            'batches': len(self.batch_sizes),
+            'items': sum(self.batch_sizes),
+            'avg_batch_size': statistics.mean(self.batch_sizes) if self.batch_sizes else 0,
+            'max_batch_size': max(self.batch_sizes, default=0),
+            'flush_p50_ms': statistics.median(latencies) if latencies else 0,
+            'flush_p95_ms': latencies[int(0.95 * (len(latencies) - 1))] if latencies else 0,
+            'flush_max_ms': latencies[-1] if latencies else 0,
+            'failed_batches': self.failed_batches,
+        }
+
+    def print_metrics(self):
+        m = self.get_metrics()
+        if not m['batches']:
+            return
+        print(f"     [WRITE_BUFFER] {self.name}: {m['items']} записей в {m['batches']} пачках "
+              f"(средняя {m['avg_batch_size']:.1f}, макс. {m['max_batch_size']}), "
+              f"сброс p50 {m['flush_p50_ms']:.1f} мс / p95 {m['flush_p95_ms']:.1f} мс / макс. {m['flush_max_ms']:.1f} мс, "
+              f"ошибок: {m['failed_batches']}")